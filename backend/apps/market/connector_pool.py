@@ -0,0 +1,252 @@
+"""
+交易所连接器池
+
+每个Celery任务都新建 ExchangeConnector 时，需要重新创建ccxt实例、解密API密钥、
+首次调用时再执行 load_markets，启动开销以秒计。连接器池在进程内按账户缓存
+预热好的连接器：
+
+- ccxt实例复用，HTTP会话保持长连接（requests.Session + 加大的连接池）；
+- 市场信息按 (交易所, 是否测试网) 在账户间共享，过期后才重新加载；
+- 同一交易所的请求共用一个节流器，多个账户不会各自按满额速率请求；
+- 空闲超时的连接器自动关闭，账户更新后自动重建。
+
+池是进程级的，fork 出的子进程（Celery prefork）会清空继承来的连接器，
+避免多个进程共用同一个socket。
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class SharedRateLimiter:
+    """
+    进程内共享的请求节流器
+
+    替换ccxt实例的 throttle 方法：按 rateLimit * cost 预约下一个可用时间点，
+    多个实例（多个线程）共享同一条时间线。
+    """
+
+    def __init__(self, interval_ms: float):
+        self.interval_ms = interval_ms
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def throttle(self, cost=None):
+        cost = 1 if cost is None else cost
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_at)
+            self._next_at = start + self.interval_ms * cost / 1000
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+@dataclass
+class PooledConnector:
+    """池中的连接器及其使用信息"""
+    connector: object
+    version: Tuple
+    created_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+    hits: int = 0
+
+
+class ExchangeConnectorPool:
+    """按交易所账户缓存的连接器池"""
+
+    def __init__(self, idle_timeout: Optional[float] = None, markets_ttl: Optional[float] = None,
+                 http_pool_size: Optional[int] = None):
+        self.idle_timeout = idle_timeout if idle_timeout is not None else getattr(
+            settings, 'EXCHANGE_CONNECTOR_IDLE_TIMEOUT', 600)
+        self.markets_ttl = markets_ttl if markets_ttl is not None else getattr(
+            settings, 'EXCHANGE_MARKETS_TTL', 3600)
+        self.http_pool_size = http_pool_size or getattr(settings, 'EXCHANGE_HTTP_POOL_SIZE', 10)
+
+        self._lock = threading.Lock()
+        self._build_locks = defaultdict(threading.Lock)
+        self._entries: Dict[int, PooledConnector] = {}
+        self._limiters: Dict[Tuple[str, bool], SharedRateLimiter] = {}
+        self._markets: Dict[Tuple[str, bool], Tuple[float, dict, Optional[dict]]] = {}
+        self._last_sweep = time.monotonic()
+        self._misses = 0
+
+    @staticmethod
+    def _version(account) -> Tuple:
+        """账户版本：配置或凭证变化后需要重建连接器"""
+        fingerprint = hashlib.sha256(
+            f"{account.api_key}:{account.secret_key}:{account.passphrase}".encode('utf-8')
+        ).hexdigest()
+        return account.exchange, account.is_testnet, fingerprint
+
+    def get(self, account):
+        """
+        获取账户对应的连接器，不存在或已过期时新建
+
+        Args:
+            account: ExchangeAccount 实例
+        """
+        self._maybe_sweep()
+        version = self._version(account)
+
+        entry = self._entries.get(account.pk)
+        if entry is None or entry.version != version:
+            with self._build_locks[account.pk]:
+                entry = self._entries.get(account.pk)
+                if entry is None or entry.version != version:
+                    if entry is not None:
+                        self._close(entry)
+                    entry = PooledConnector(connector=self._build(account), version=version)
+                    with self._lock:
+                        self._entries[account.pk] = entry
+                        self._misses += 1
+
+        # 连接器持有账户对象，更新为调用方传入的最新实例
+        entry.connector.exchange_account = account
+        entry.last_used = time.monotonic()
+        entry.hits += 1
+        return entry.connector
+
+    def _build(self, account):
+        """创建并预热连接器"""
+        from .services import ExchangeConnector
+
+        started = time.perf_counter()
+        connector = ExchangeConnector(account)
+        exchange = connector.exchange
+        key = (account.exchange, account.is_testnet)
+
+        # HTTP长连接：加大连接池，供多线程共用一个会话
+        session = getattr(exchange, 'session', None)
+        if session is not None:
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.http_pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+
+        # 同一交易所共用节流器
+        if getattr(exchange, 'enableRateLimit', False):
+            with self._lock:
+                limiter = self._limiters.get(key)
+                if limiter is None:
+                    limiter = self._limiters[key] = SharedRateLimiter(exchange.rateLimit)
+            exchange.throttle = limiter.throttle
+
+        self._warm_markets(exchange, key)
+        logger.info(
+            f"创建交易所连接器 {account.exchange}#{account.pk}: "
+            f"{(time.perf_counter() - started) * 1000:.1f}ms"
+        )
+        return connector
+
+    def _warm_markets(self, exchange, key: Tuple[str, bool]):
+        """加载市场信息，优先复用其他账户已加载的结果"""
+        cached = self._markets.get(key)
+        if cached and time.monotonic() - cached[0] < self.markets_ttl:
+            exchange.set_markets(list(cached[1].values()), cached[2])
+            return
+        try:
+            markets = exchange.load_markets()
+        except Exception as e:
+            # 预热失败不影响使用，ccxt会在首次调用时再次加载
+            logger.warning(f"预加载市场信息失败 {key[0]}: {e}")
+            return
+        with self._lock:
+            self._markets[key] = (time.monotonic(), markets, getattr(exchange, 'currencies', None))
+
+    def invalidate(self, account_id: int):
+        """移除指定账户的连接器（账户删除或停用时调用）"""
+        with self._lock:
+            entry = self._entries.pop(account_id, None)
+        if entry is not None:
+            self._close(entry)
+
+    def expire_idle(self) -> int:
+        """关闭空闲超时的连接器，返回关闭数量"""
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            expired = [pk for pk, entry in self._entries.items() if entry.last_used < deadline]
+            entries = [self._entries.pop(pk) for pk in expired]
+            self._last_sweep = time.monotonic()
+        for entry in entries:
+            self._close(entry)
+        if entries:
+            logger.info(f"关闭空闲交易所连接器: {expired}")
+        return len(entries)
+
+    def _maybe_sweep(self):
+        if time.monotonic() - self._last_sweep >= self.idle_timeout / 2:
+            self.expire_idle()
+
+    @staticmethod
+    def _close(entry: PooledConnector):
+        session = getattr(entry.connector.exchange, 'session', None)
+        if session is not None:
+            try:
+                session.close()
+            except Exception as e:
+                logger.warning(f"关闭HTTP会话失败: {e}")
+
+    def clear(self):
+        """关闭全部连接器并清空缓存"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._markets.clear()
+            self._limiters.clear()
+        for entry in entries:
+            self._close(entry)
+
+    def stats(self) -> Dict:
+        """连接池状态"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'misses': self._misses,
+                'hits': sum(entry.hits for entry in self._entries.values()),
+                'markets_cached': sorted(f"{code}{':testnet' if testnet else ''}" for code, testnet in self._markets),
+                'connectors': {
+                    pk: {
+                        'exchange': entry.version[0],
+                        'hits': entry.hits,
+                        'age': round(now - entry.created_at, 1),
+                        'idle': round(now - entry.last_used, 1),
+                    }
+                    for pk, entry in self._entries.items()
+                },
+            }
+
+
+_pool: Optional[ExchangeConnectorPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_connector_pool() -> ExchangeConnectorPool:
+    """获取进程内共享的连接器池"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ExchangeConnectorPool()
+    return _pool
+
+
+def _reset_after_fork():
+    """子进程不能复用父进程的socket，丢弃继承来的连接池"""
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,55 +1,336 @@
+import asyncio
 import json
 import logging
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 
+from .groups import (
+    get_symbol_group_name, get_exchange_group_name,
+    group_add_many, group_discard_many,
+)
+from .event_log import MarketEventLog, parse_event_id
+from apps.monitoring.latency import MARKET_PIPELINE, get_latency_recorder, now_ms
+
 logger = logging.getLogger(__name__)
 
+# 通配符订阅后缀，例如 "binance:*" 表示订阅binance的全部行情
+WILDCARD_SUFFIX = ':*'
+
 
 class MarketDataConsumer(AsyncWebsocketConsumer):
     """市场数据WebSocket消费者"""
-    
+
+    # 单个连接最多订阅的交易对数量
+    MAX_SUBSCRIPTIONS = getattr(settings, 'MARKET_WS_MAX_SUBSCRIPTIONS', 500)
+    # 聚合频道的推送间隔（秒）
+    AGGREGATE_INTERVAL = getattr(settings, 'MARKET_WS_AGGREGATE_INTERVAL', 1.0)
+    # 断线重连时单次补发的最大事件数
+    REPLAY_LIMIT = getattr(settings, 'MARKET_WS_REPLAY_LIMIT', 1000)
+
     async def connect(self):
         """连接处理"""
         # 验证用户认证
         if self.scope["user"] == AnonymousUser():
             await self.close()
             return
-        
+
         # 获取用户和租户信息
         self.user = self.scope["user"]
         self.tenant = self.user.tenant
-        
+
         # 初始化订阅列表
         self.subscribed_symbols = set()
-        
+        self.subscribed_exchanges = set()
+
+        # 聚合频道缓冲区: {exchange: {symbol: ticker}}，按间隔合并推送
+        self._aggregate_buffer = {}
+        self._aggregate_task = None
+
         await self.accept()
-        
+
         # 发送连接成功消息
         await self.send(text_data=json.dumps({
             'type': 'connection_established',
             'message': '市场数据连接已建立'
         }))
-    
+
     async def disconnect(self, close_code):
         """断开连接处理"""
-        # 离开所有订阅的组
-        for symbol in self.subscribed_symbols:
-            await self.channel_layer.group_discard(
-                f"market_{symbol}",
-                self.channel_name
-            )
-    
+        if self._aggregate_task:
+            self._aggregate_task.cancel()
+            self._aggregate_task = None
+
+        # 批量离开所有订阅的组
+        groups = [get_symbol_group_name(symbol) for symbol in getattr(self, 'subscribed_symbols', ())]
+        groups += [get_exchange_group_name(code) for code in getattr(self, 'subscribed_exchanges', ())]
+        await group_discard_many(self.channel_layer, groups, self.channel_name)
+
     async def receive(self, text_data):
         """接收消息处理"""
         try:
             data = json.loads(text_data)
             action = data.get('action')
-            
+
             if action == 'subscribe':
                 await self.handle_subscribe(data)
             elif action == 'unsubscribe':
                 await self.handle_unsubscribe(data)
+            elif action == 'subscribe_exchange':
+                await self.handle_subscribe({'symbols': [f"{data.get('exchange')}{WILDCARD_SUFFIX}"]})
+            elif action == 'unsubscribe_exchange':
+                await self.handle_unsubscribe({'symbols': [f"{data.get('exchange')}{WILDCARD_SUFFIX}"]})
             elif action == 'get_ticker':
-                await self.
\ No newline at end of file
+                await self.handle_get_ticker(data)
+            elif action == 'resume':
+                await self.handle_resume(data)
+            else:
+                await self.send_error(f'不支持的操作: {action}')
+
+        except json.JSONDecodeError:
+            await self.send_error('消息格式错误')
+        except Exception as e:
+            logger.error(f"处理WebSocket消息失败: {e}")
+            await self.send_error('处理消息失败')
+
+    def _parse_subscription(self, data):
+        """
+        解析订阅请求中的交易对和聚合频道
+
+        兼容单个 ``symbol`` 字段和批量 ``symbols`` 列表，
+        形如 ``binance:*`` 的条目视为交易所聚合频道。
+
+        Returns:
+            (交易对集合, 交易所代码集合)
+        """
+        items = data.get('symbols') or []
+        if isinstance(items, str):
+            items = [items]
+        if data.get('symbol'):
+            items = list(items) + [data['symbol']]
+
+        symbols, exchanges = set(), set()
+        for item in items:
+            if not isinstance(item, str) or not item:
+                continue
+            if item.endswith(WILDCARD_SUFFIX):
+                exchange = item[:-len(WILDCARD_SUFFIX)]
+                if exchange:
+                    exchanges.add(exchange)
+            else:
+                symbols.add(item)
+        return symbols, exchanges
+
+    async def handle_subscribe(self, data):
+        """处理订阅请求（支持批量和通配符）"""
+        symbols, exchanges = self._parse_subscription(data)
+        if not symbols and not exchanges:
+            await self.send_error('缺少订阅的交易对')
+            return
+
+        new_symbols = symbols - self.subscribed_symbols
+        available = self.MAX_SUBSCRIPTIONS - len(self.subscribed_symbols)
+        rejected = []
+        if len(new_symbols) > available:
+            # 超出上限的部分拒绝订阅，保证结果可预期
+            ordered = sorted(new_symbols)
+            new_symbols, rejected = set(ordered[:max(available, 0)]), ordered[max(available, 0):]
+        new_exchanges = exchanges - self.subscribed_exchanges
+
+        groups = [get_symbol_group_name(symbol) for symbol in new_symbols]
+        groups += [get_exchange_group_name(code) for code in new_exchanges]
+        await group_add_many(self.channel_layer, groups, self.channel_name)
+
+        self.subscribed_symbols |= new_symbols
+        self.subscribed_exchanges |= new_exchanges
+        if self.subscribed_exchanges:
+            self._ensure_aggregate_task()
+
+        response = {
+            'type': 'subscribed',
+            'symbols': sorted(symbols - set(rejected)),
+            'exchanges': sorted(exchanges),
+        }
+        if rejected:
+            response['rejected'] = rejected
+            response['message'] = f'订阅数量超过上限 {self.MAX_SUBSCRIPTIONS}'
+        await self.send(text_data=json.dumps(response))
+
+    async def handle_unsubscribe(self, data):
+        """处理取消订阅请求（支持批量和通配符）"""
+        symbols, exchanges = self._parse_subscription(data)
+        symbols &= self.subscribed_symbols
+        exchanges &= self.subscribed_exchanges
+
+        groups = [get_symbol_group_name(symbol) for symbol in symbols]
+        groups += [get_exchange_group_name(code) for code in exchanges]
+        await group_discard_many(self.channel_layer, groups, self.channel_name)
+
+        self.subscribed_symbols -= symbols
+        self.subscribed_exchanges -= exchanges
+        for code in exchanges:
+            self._aggregate_buffer.pop(code, None)
+        if not self.subscribed_exchanges and self._aggregate_task:
+            self._aggregate_task.cancel()
+            self._aggregate_task = None
+
+        await self.send(text_data=json.dumps({
+            'type': 'unsubscribed',
+            'symbols': sorted(symbols),
+            'exchanges': sorted(exchanges),
+        }))
+
+    async def handle_get_ticker(self, data):
+        """处理获取最新行情请求"""
+        symbol = data.get('symbol')
+        if not symbol:
+            await self.send_error('缺少交易对参数')
+            return
+
+        ticker = await self._load_ticker(symbol)
+        await self.send(text_data=json.dumps({
+            'type': 'ticker',
+            'symbol': symbol,
+            'data': ticker,
+        }))
+
+    async def handle_resume(self, data):
+        """
+        处理断线重连后的补发请求
+
+        客户端提交最后收到的 event_id，从市场事件日志中读取之后的事件，
+        按当前订阅过滤后一次性补发。complete 为 False 时客户端应以返回的
+        last_event_id 继续请求。
+        """
+        exchange = data.get('exchange')
+        last_event_id = data.get('last_event_id')
+        if not exchange or not last_event_id:
+            await self.send_error('缺少交易所或事件偏移参数')
+            return
+        try:
+            parse_event_id(last_event_id)
+        except ValueError:
+            await self.send_error('事件偏移格式错误')
+            return
+
+        events, last_event_id, complete = await sync_to_async(self._read_missed_events)(
+            exchange, last_event_id
+        )
+        await self.send(text_data=json.dumps({
+            'type': 'replay',
+            'exchange': exchange,
+            'events': events,
+            'last_event_id': last_event_id,
+            'complete': complete,
+        }))
+
+    def _read_missed_events(self, exchange, last_event_id):
+        """读取错过的事件并按订阅过滤"""
+        events = MarketEventLog().read_after(exchange, last_event_id, count=self.REPLAY_LIMIT)
+        if not events:
+            return [], last_event_id, True
+
+        subscribed_all = exchange in self.subscribed_exchanges
+        missed = [
+            event.to_dict() for event in events
+            if subscribed_all or event.symbol in self.subscribed_symbols
+        ]
+        return missed, events[-1].event_id, len(events) < self.REPLAY_LIMIT
+
+    @database_sync_to_async
+    def _load_ticker(self, symbol):
+        """从缓存或数据库加载最新行情"""
+        from .models import Symbol
+        from .services import MarketDataCache, MarketDataProcessor
+
+        cached = MarketDataCache.get_ticker_cache(symbol)
+        if cached:
+            return cached
+
+        symbol_obj = Symbol.objects.filter(tenant=self.tenant, symbol=symbol).first()
+        if not symbol_obj:
+            return None
+        return MarketDataProcessor.get_latest_ticker(symbol_obj)
+
+    def _ensure_aggregate_task(self):
+        """确保聚合推送任务在运行"""
+        if self._aggregate_task is None or self._aggregate_task.done():
+            self._aggregate_task = asyncio.ensure_future(self._aggregate_flush_loop())
+
+    async def _aggregate_flush_loop(self):
+        """按固定间隔将聚合缓冲区合并为一帧推送"""
+        try:
+            while True:
+                await asyncio.sleep(self.AGGREGATE_INTERVAL)
+                await self.flush_aggregates()
+        except asyncio.CancelledError:
+            pass
+
+    async def flush_aggregates(self):
+        """推送并清空聚合缓冲区，每个交易所一帧"""
+        if not self._aggregate_buffer:
+            return
+        buffer, self._aggregate_buffer = self._aggregate_buffer, {}
+        for exchange, tickers in buffer.items():
+            if not tickers:
+                continue
+            await self.send(text_data=json.dumps({
+                'type': 'tickers_batch',
+                'exchange': exchange,
+                'data': list(tickers.values()),
+            }))
+
+    async def send_error(self, message):
+        """发送错误消息"""
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'message': message,
+        }))
+
+    async def ticker_update(self, event):
+        """行情更新推送"""
+        await self.send(text_data=json.dumps({
+            'type': 'ticker_update',
+            'data': event['data'],
+        }))
+        self._observe_delivery(event, 'ticker')
+
+    async def orderbook_update(self, event):
+        """订单簿更新推送"""
+        await self.send(text_data=json.dumps({
+            'type': 'orderbook_update',
+            'data': event['data'],
+        }))
+        self._observe_delivery(event, 'orderbook')
+
+    def _observe_delivery(self, event, label):
+        """
+        记录通道层投递耗时和端到端延迟
+
+        trace 由收集器在 group_send 前写入事件，只在服务端之间传递，不下发给客户端。
+        """
+        trace = event.get('trace')
+        if not trace:
+            return
+        delivered = now_ms()
+        recorder = get_latency_recorder(MARKET_PIPELINE)
+        if trace.get('dispatched'):
+            recorder.observe('delivered', delivered - trace['dispatched'], label)
+        if trace.get('exchange'):
+            recorder.observe('end_to_end', delivered - trace['exchange'], label)
+
+    async def exchange_tickers(self, event):
+        """
+        交易所聚合行情
+
+        只保留每个交易对的最新一条，由聚合任务按间隔统一推送，
+        高频行情下客户端每个间隔只收到一帧。
+        """
+        exchange = event['exchange']
+        if exchange not in self.subscribed_exchanges:
+            return
+        bucket = self._aggregate_buffer.setdefault(exchange, {})
+        for item in event['data']:
+            bucket[item['symbol']] = item
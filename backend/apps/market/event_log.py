@@ -0,0 +1,403 @@
+"""
+市场事件日志
+
+通道层广播是"发后即忘"的：客户端或内部组件断线期间的更新会全部丢失。
+本模块基于 Redis Streams 提供只追加的市场事件日志：
+
+- 收集器把行情、订单簿、K线、成交写入按交易所划分的流；
+- 策略运行器、K线构建器、WebSocket网关通过消费者组各自消费，
+  偏移量由 Redis 保存，重启后从未确认的位置继续；
+- 已归档的事件以 gzip 压缩的 JSONL 分段文件保存在磁盘上，
+  回放时先读归档分段，再读流中剩余的部分。
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# 流键前缀：market:stream:{exchange}
+STREAM_PREFIX = 'market:stream'
+# 元数据键：归档游标与独立读取者的偏移量
+ARCHIVE_CURSOR_KEY = 'market:stream-meta:archived'
+OFFSETS_KEY_PREFIX = 'market:stream-meta:offsets'
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_event_log_client():
+    """获取事件日志使用的Redis客户端（进程内单例）"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = redis.from_url(
+                    getattr(settings, 'MARKET_EVENT_LOG_REDIS_URL', 'redis://localhost:6379/0'),
+                    decode_responses=True,
+                )
+    return _client
+
+
+def parse_event_id(event_id: str) -> Tuple[int, int]:
+    """将流ID（毫秒-序号）解析为可比较的元组"""
+    ms, _, seq = str(event_id).partition('-')
+    return int(ms), int(seq or 0)
+
+
+def next_event_id(event_id: str) -> str:
+    """返回紧随给定ID之后的最小ID，用于"从某个偏移之后"读取"""
+    ms, seq = parse_event_id(event_id)
+    return f"{ms}-{seq + 1}"
+
+
+@dataclass
+class MarketEvent:
+    """市场事件"""
+    event_id: str
+    exchange: str
+    event_type: str  # ticker / orderbook / kline / trade
+    symbol: str
+    timestamp: Optional[int]  # 交易所时间戳（毫秒）
+    data: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'event_id': self.event_id,
+            'exchange': self.exchange,
+            'type': self.event_type,
+            'symbol': self.symbol,
+            'timestamp': self.timestamp,
+            'data': self.data,
+        }
+
+    def to_record(self) -> List[Any]:
+        """归档分段中使用的紧凑格式"""
+        return [self.event_id, self.event_type, self.symbol, self.timestamp, self.data]
+
+    @classmethod
+    def from_record(cls, exchange: str, record: List[Any]) -> 'MarketEvent':
+        event_id, event_type, symbol, timestamp, data = record
+        return cls(event_id, exchange, event_type, symbol, timestamp, data)
+
+    @classmethod
+    def from_stream(cls, exchange: str, event_id: str, fields: Dict[str, str]) -> 'MarketEvent':
+        timestamp = fields.get('ts')
+        return cls(
+            event_id=event_id,
+            exchange=exchange,
+            event_type=fields.get('t', ''),
+            symbol=fields.get('s', ''),
+            timestamp=int(timestamp) if timestamp else None,
+            data=json.loads(fields.get('d') or '{}'),
+        )
+
+
+class MarketEventLog:
+    """基于Redis Streams的市场事件日志"""
+
+    def __init__(self, client=None, maxlen: Optional[int] = None):
+        self.client = client or get_event_log_client()
+        self.maxlen = maxlen if maxlen is not None else getattr(settings, 'MARKET_EVENT_LOG_MAXLEN', 1000000)
+        # 已处理完自身待确认消息的消费者，之后只读取新消息
+        self._pending_drained = set()
+        # 已确认存在的消费者组，避免每次读取都执行 XGROUP CREATE
+        self._known_groups = set()
+
+    @staticmethod
+    def stream_key(exchange: str) -> str:
+        return f"{STREAM_PREFIX}:{exchange}"
+
+    @staticmethod
+    def _encode(event_type: str, symbol: str, data: Dict[str, Any],
+                timestamp: Optional[int]) -> Dict[str, str]:
+        fields = {
+            't': event_type,
+            's': symbol,
+            'd': json.dumps(data, separators=(',', ':'), default=str),
+        }
+        if timestamp is not None:
+            fields['ts'] = str(int(timestamp))
+        return fields
+
+    def append(self, exchange: str, event_type: str, symbol: str,
+               data: Dict[str, Any], timestamp: Optional[int] = None) -> str:
+        """
+        追加单个事件
+
+        Returns:
+            事件ID（流ID），可作为客户端的偏移量
+        """
+        return self.client.xadd(
+            self.stream_key(exchange),
+            self._encode(event_type, symbol, data, timestamp),
+            maxlen=self.maxlen,
+            approximate=True,
+        )
+
+    def append_many(self, exchange: str,
+                    events: Iterable[Tuple[str, str, Dict[str, Any], Optional[int]]]) -> List[str]:
+        """
+        批量追加事件，使用管道一次往返写入
+
+        Args:
+            events: (事件类型, 交易对, 数据, 交易所时间戳) 的序列
+        """
+        key = self.stream_key(exchange)
+        pipe = self.client.pipeline(transaction=False)
+        count = 0
+        for event_type, symbol, data, timestamp in events:
+            pipe.xadd(key, self._encode(event_type, symbol, data, timestamp),
+                      maxlen=self.maxlen, approximate=True)
+            count += 1
+        return pipe.execute() if count else []
+
+    def read_range(self, exchange: str, start: str = '-', end: str = '+',
+                   count: Optional[int] = None) -> List[MarketEvent]:
+        """按ID范围读取事件（包含两端）"""
+        entries = self.client.xrange(self.stream_key(exchange), min=start, max=end, count=count)
+        return [MarketEvent.from_stream(exchange, event_id, fields) for event_id, fields in entries]
+
+    def read_after(self, exchange: str, last_event_id: Optional[str],
+                   count: int = 1000) -> List[MarketEvent]:
+        """读取指定偏移之后的事件，用于断线重连后追赶"""
+        start = next_event_id(last_event_id) if last_event_id else '-'
+        return self.read_range(exchange, start=start, count=count)
+
+    def latest_event_id(self, exchange: str) -> Optional[str]:
+        """流中最新事件的ID"""
+        entries = self.client.xrevrange(self.stream_key(exchange), count=1)
+        return entries[0][0] if entries else None
+
+    def ensure_group(self, exchange: str, group: str, start_id: str = '0'):
+        """
+        创建消费者组（已存在时忽略）
+
+        Args:
+            start_id: 新组的起始位置，'0' 表示从头消费，'$' 表示只消费新事件
+        """
+        try:
+            self.client.xgroup_create(self.stream_key(exchange), group, id=start_id, mkstream=True)
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def consume(self, group: str, consumer: str, exchanges: Iterable[str],
+                count: int = 100, block: Optional[int] = None) -> List[MarketEvent]:
+        """
+        以消费者组方式读取事件
+
+        首次调用时先取回该消费者已投递但未确认的事件（崩溃前没来得及ACK的部分），
+        处理完之后才开始读取新事件，保证重启后不丢数据。
+        """
+        exchanges = list(exchanges)
+        for exchange in exchanges:
+            if (exchange, group) not in self._known_groups:
+                self.ensure_group(exchange, group)
+                self._known_groups.add((exchange, group))
+
+        drained_key = (group, consumer)
+        if drained_key not in self._pending_drained:
+            response = self.client.xreadgroup(
+                group, consumer, {self.stream_key(e): '0' for e in exchanges}, count=count
+            )
+            events = self._parse_read_response(response)
+            if events:
+                return events
+            self._pending_drained.add(drained_key)
+
+        response = self.client.xreadgroup(
+            group, consumer, {self.stream_key(e): '>' for e in exchanges}, count=count, block=block
+        )
+        return self._parse_read_response(response)
+
+    def ack(self, group: str, events: Iterable[MarketEvent]) -> int:
+        """确认事件已处理，按交易所分组提交"""
+        by_exchange: Dict[str, List[str]] = {}
+        for event in events:
+            by_exchange.setdefault(event.exchange, []).append(event.event_id)
+        acked = 0
+        for exchange, ids in by_exchange.items():
+            acked += self.client.xack(self.stream_key(exchange), group, *ids)
+        return acked
+
+    def get_offset(self, reader: str, exchange: str) -> Optional[str]:
+        """获取独立读取者（不使用消费者组）保存的偏移量"""
+        return self.client.hget(f"{OFFSETS_KEY_PREFIX}:{reader}", exchange)
+
+    def set_offset(self, reader: str, exchange: str, event_id: str):
+        """保存独立读取者的偏移量"""
+        self.client.hset(f"{OFFSETS_KEY_PREFIX}:{reader}", exchange, event_id)
+
+    def trim(self, exchange: str, min_event_id: str) -> int:
+        """删除早于指定ID的事件（通常在归档之后调用）"""
+        return self.client.xtrim(self.stream_key(exchange), minid=min_event_id, approximate=False)
+
+    def list_exchanges(self) -> List[str]:
+        """列出已有事件流的交易所"""
+        prefix = f"{STREAM_PREFIX}:"
+        return sorted(key[len(prefix):] for key in self.client.scan_iter(match=f"{prefix}*"))
+
+    def _parse_read_response(self, response) -> List[MarketEvent]:
+        prefix = f"{STREAM_PREFIX}:"
+        events = []
+        for stream, entries in response or []:
+            exchange = stream[len(prefix):]
+            for event_id, fields in entries:
+                if fields:  # 已被裁剪的待确认事件只剩ID
+                    events.append(MarketEvent.from_stream(exchange, event_id, fields))
+        return events
+
+
+class MarketEventArchive:
+    """
+    市场事件归档
+
+    将流中的事件按段写入 ``{归档目录}/{交易所}/{日期}/{首ID}_{末ID}.jsonl.gz``，
+    归档游标保存在Redis中，重复执行是幂等的。
+    """
+
+    def __init__(self, event_log: Optional[MarketEventLog] = None,
+                 base_dir: Optional[str] = None, segment_size: Optional[int] = None):
+        self.event_log = event_log or MarketEventLog()
+        self.base_dir = Path(base_dir or getattr(settings, 'MARKET_EVENT_ARCHIVE_DIR', 'market_events'))
+        self.segment_size = segment_size or getattr(settings, 'MARKET_EVENT_SEGMENT_SIZE', 50000)
+        # 归档后流中仍保留的时长（秒），给落后的消费者组留出追赶时间
+        self.retention = getattr(settings, 'MARKET_EVENT_STREAM_RETENTION', 86400)
+
+    @property
+    def client(self):
+        return self.event_log.client
+
+    def get_cursor(self, exchange: str) -> Optional[str]:
+        """已归档的最后一个事件ID"""
+        return self.client.hget(ARCHIVE_CURSOR_KEY, exchange)
+
+    def _segment_path(self, exchange: str, first_id: str, last_id: str) -> Path:
+        first_ms, _ = parse_event_id(first_id)
+        day = datetime.fromtimestamp(first_ms / 1000, tz=timezone.utc).strftime('%Y%m%d')
+        return self.base_dir / exchange / day / f"{first_id}_{last_id}.jsonl.gz"
+
+    def _write_segment(self, exchange: str, events: List[MarketEvent]) -> Path:
+        """原子写入一个分段文件"""
+        path = self._segment_path(exchange, events[0].event_id, events[-1].event_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + '.tmp')
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            for event in events:
+                f.write(json.dumps(event.to_record(), separators=(',', ':'), default=str))
+                f.write('\n')
+        os.replace(tmp_path, path)
+        return path
+
+    def archive(self, exchange: str, trim: bool = False) -> int:
+        """
+        归档指定交易所流中尚未归档的事件
+
+        Args:
+            trim: 归档后是否从流中删除已归档且超过保留时长的事件
+
+        Returns:
+            本次归档的事件数量
+        """
+        archived = 0
+        cursor = self.get_cursor(exchange)
+        while True:
+            events = self.event_log.read_after(exchange, cursor, count=self.segment_size)
+            if not events:
+                break
+            path = self._write_segment(exchange, events)
+            cursor = events[-1].event_id
+            self.client.hset(ARCHIVE_CURSOR_KEY, exchange, cursor)
+            archived += len(events)
+            logger.info(f"归档市场事件 {exchange}: {len(events)}条 -> {path}")
+            if len(events) < self.segment_size:
+                break
+
+        if trim and cursor:
+            # 截止毫秒内的事件同样视为过期（MINID 保留大于等于该ID的事件）
+            retention_id = f"{int((time.time() - self.retention) * 1000) + 1}-0"
+            min_id = min(next_event_id(cursor), retention_id, key=parse_event_id)
+            self.event_log.trim(exchange, min_id)
+        return archived
+
+    def list_segments(self, exchange: str) -> List[Tuple[str, str, Path]]:
+        """列出归档分段 (首ID, 末ID, 路径)，按ID排序"""
+        segments = []
+        root = self.base_dir / exchange
+        if not root.exists():
+            return segments
+        for path in root.glob('*/*.jsonl.gz'):
+            first_id, _, last_id = path.name[:-len('.jsonl.gz')].partition('_')
+            segments.append((first_id, last_id, path))
+        segments.sort(key=lambda item: parse_event_id(item[0]))
+        return segments
+
+    def read_segment(self, exchange: str, path: Path) -> Iterator[MarketEvent]:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield MarketEvent.from_record(exchange, json.loads(line))
+
+    def replay(self, exchange: str, start_id: str = '0-0', end_id: Optional[str] = None,
+               symbols: Optional[Iterable[str]] = None,
+               event_types: Optional[Iterable[str]] = None,
+               batch_size: int = 10000) -> Iterator[MarketEvent]:
+        """
+        按时间顺序回放事件：先读归档分段，再读流中归档游标之后的部分
+
+        Args:
+            start_id / end_id: 回放的ID范围（包含两端），ID的毫秒部分即时间戳
+            symbols / event_types: 可选过滤条件
+        """
+        start_key = parse_event_id(start_id)
+        end_key = parse_event_id(end_id) if end_id else None
+        symbols = set(symbols) if symbols else None
+        event_types = set(event_types) if event_types else None
+        last_key = None
+
+        def accept(event: MarketEvent) -> bool:
+            key = parse_event_id(event.event_id)
+            if key < start_key or (end_key and key > end_key):
+                return False
+            if symbols and event.symbol not in symbols:
+                return False
+            if event_types and event.event_type not in event_types:
+                return False
+            return True
+
+        for first_id, last_id, path in self.list_segments(exchange):
+            if parse_event_id(last_id) < start_key:
+                continue
+            if end_key and parse_event_id(first_id) > end_key:
+                break
+            for event in self.read_segment(exchange, path):
+                last_key = parse_event_id(event.event_id)
+                if accept(event):
+                    yield event
+
+        # 流中的数据可能与归档重叠（未裁剪），从归档末尾之后继续
+        if last_key is not None and last_key >= start_key:
+            start = next_event_id(f"{last_key[0]}-{last_key[1]}")
+        else:
+            start = start_id if start_key > (0, 0) else '-'
+        while True:
+            events = self.event_log.read_range(exchange, start=start, count=batch_size)
+            if not events:
+                return
+            for event in events:
+                if end_key and parse_event_id(event.event_id) > end_key:
+                    return
+                if accept(event):
+                    yield event
+            start = next_event_id(events[-1].event_id)
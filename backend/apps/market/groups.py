@@ -0,0 +1,130 @@
+"""
+市场数据频道组工具
+
+统一生成WebSocket广播使用的组名，并提供批量加入/离开组的操作。
+Channels要求组名只包含ASCII字母、数字、连字符、下划线和点，
+而交易对符号形如 ``BTC/USDT``，因此所有组名都必须经过这里规范化。
+"""
+import asyncio
+import re
+import time
+from collections import defaultdict
+from typing import Iterable, List
+
+# 单个符号组的前缀，保持与原有 market_{symbol} 命名一致
+SYMBOL_GROUP_PREFIX = 'market'
+# 交易所聚合组的前缀，例如 market_exchange_binance_tickers
+EXCHANGE_GROUP_PREFIX = 'market_exchange'
+
+_INVALID_GROUP_CHARS = re.compile(r'[^a-zA-Z0-9_.\-]')
+# Channels组名长度上限为100
+_MAX_GROUP_NAME_LENGTH = 99
+
+
+def _normalize(value: str) -> str:
+    """将任意字符串转换为合法的组名片段"""
+    return _INVALID_GROUP_CHARS.sub('_', str(value))
+
+
+def get_symbol_group_name(symbol: str) -> str:
+    """
+    获取单个交易对的广播组名
+
+    Args:
+        symbol: 交易对符号，如 BTC/USDT
+
+    Returns:
+        合法的组名，如 market_BTC_USDT
+    """
+    return f"{SYMBOL_GROUP_PREFIX}_{_normalize(symbol)}"[:_MAX_GROUP_NAME_LENGTH]
+
+
+def get_exchange_group_name(exchange_code: str, data_type: str = 'tickers') -> str:
+    """
+    获取交易所聚合频道的组名
+
+    聚合频道用于概览页面：订阅一次即可收到该交易所所有交易对的数据，
+    由消费者按固定间隔合并为一帧推送。
+
+    Args:
+        exchange_code: 交易所代码，如 binance
+        data_type: 聚合的数据类型，目前支持 tickers
+    """
+    return f"{EXCHANGE_GROUP_PREFIX}_{_normalize(exchange_code)}_{_normalize(data_type)}"[:_MAX_GROUP_NAME_LENGTH]
+
+
+def _is_redis_layer(channel_layer) -> bool:
+    """判断是否为channels_redis的核心通道层（可以直接使用管道）"""
+    return all(
+        hasattr(channel_layer, attr)
+        for attr in ('_group_key', 'consistent_hash', 'connection', 'group_expiry')
+    )
+
+
+async def _pipeline_group_add(channel_layer, groups: List[str], channel_name: str):
+    """
+    使用Redis管道批量加入组
+
+    按分片聚合后每个分片只发起一次网络往返，
+    替代逐个 group_add 时每组两次（ZADD + EXPIRE）的往返。
+    """
+    shards = defaultdict(list)
+    for group in groups:
+        shards[channel_layer.consistent_hash(group)].append(group)
+
+    now = time.time()
+    for index, shard_groups in shards.items():
+        connection = channel_layer.connection(index)
+        pipe = connection.pipeline(transaction=False)
+        for group in shard_groups:
+            group_key = channel_layer._group_key(group)
+            pipe.zadd(group_key, {channel_name: now})
+            pipe.expire(group_key, channel_layer.group_expiry)
+        await pipe.execute()
+
+
+async def _pipeline_group_discard(channel_layer, groups: List[str], channel_name: str):
+    """使用Redis管道批量离开组"""
+    shards = defaultdict(list)
+    for group in groups:
+        shards[channel_layer.consistent_hash(group)].append(group)
+
+    for index, shard_groups in shards.items():
+        connection = channel_layer.connection(index)
+        pipe = connection.pipeline(transaction=False)
+        for group in shard_groups:
+            pipe.zrem(channel_layer._group_key(group), channel_name)
+        await pipe.execute()
+
+
+async def group_add_many(channel_layer, groups: Iterable[str], channel_name: str):
+    """
+    批量将频道加入多个组
+
+    Redis通道层走管道批量写入，其他通道层（如InMemoryChannelLayer）
+    退化为并发调用 group_add。
+    """
+    groups = list(dict.fromkeys(groups))
+    if not groups or channel_layer is None:
+        return
+
+    if _is_redis_layer(channel_layer):
+        await _pipeline_group_add(channel_layer, groups, channel_name)
+    else:
+        await asyncio.gather(*(
+            channel_layer.group_add(group, channel_name) for group in groups
+        ))
+
+
+async def group_discard_many(channel_layer, groups: Iterable[str], channel_name: str):
+    """批量将频道从多个组中移除"""
+    groups = list(dict.fromkeys(groups))
+    if not groups or channel_layer is None:
+        return
+
+    if _is_redis_layer(channel_layer):
+        await _pipeline_group_discard(channel_layer, groups, channel_name)
+    else:
+        await asyncio.gather(*(
+            channel_layer.group_discard(group, channel_name) for group in groups
+        ))
@@ -0,0 +1,10 @@
+"""
+市场数据WebSocket路由配置
+"""
+from django.urls import re_path
+
+from . import consumers
+
+websocket_urlpatterns = [
+    re_path(r'^ws/market/$', consumers.MarketDataConsumer.as_asgi()),
+]
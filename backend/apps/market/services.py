@@ -11,10 +11,17 @@ from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 
 from .models import Exchange, Symbol, Kline, Ticker, OrderBook, Trade
+from .groups import get_symbol_group_name, get_exchange_group_name
+from .event_log import MarketEventLog
+from .connector_pool import get_connector_pool
 from apps.trading.models import ExchangeAccount
+from apps.monitoring.latency import MARKET_PIPELINE, LatencyTrace, get_latency_recorder
 
 logger = logging.getLogger(__name__)
 
+# 行情流水线各阶段的延迟直方图
+pipeline_latency = get_latency_recorder(MARKET_PIPELINE)
+
 
 class ExchangeConnector:
     """交易所连接器"""
@@ -63,16 +70,27 @@ class ExchangeConnector:
     def fetch_ticker(self, symbol: str) -> Dict[str, Any]:
         """获取实时行情"""
         try:
-            return self.exchange.fetch_ticker(symbol)
+            with pipeline_latency.timer('fetch_request', 'ticker'):
+                return self.exchange.fetch_ticker(symbol)
         except Exception as e:
             logger.error(f"获取行情失败 {symbol}: {e}")
             raise
     
+    def fetch_tickers(self, symbols: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """批量获取实时行情（一次请求返回多个交易对）"""
+        try:
+            with pipeline_latency.timer('fetch_request', 'tickers'):
+                return self.exchange.fetch_tickers(symbols)
+        except Exception as e:
+            logger.error(f"批量获取行情失败: {e}")
+            raise
+    
     def fetch_ohlcv(self, symbol: str, timeframe: str = '1m', 
                    since: Optional[int] = None, limit: int = 100) -> List[List]:
         """获取K线数据"""
         try:
-            return self.exchange.fetch_ohlcv(symbol, timeframe, since, limit)
+            with pipeline_latency.timer('fetch_request', 'kline'):
+                return self.exchange.fetch_ohlcv(symbol, timeframe, since, limit)
         except Exception as e:
             logger.error(f"获取K线数据失败 {symbol}: {e}")
             raise
@@ -80,7 +98,8 @@ class ExchangeConnector:
     def fetch_order_book(self, symbol: str, limit: int = 20) -> Dict[str, Any]:
         """获取订单簿"""
         try:
-            return self.exchange.fetch_order_book(symbol, limit)
+            with pipeline_latency.timer('fetch_request', 'orderbook'):
+                return self.exchange.fetch_order_book(symbol, limit)
         except Exception as e:
             logger.error(f"获取订单簿失败 {symbol}: {e}")
             raise
@@ -89,7 +108,8 @@ class ExchangeConnector:
                     limit: int = 50) -> List[Dict[str, Any]]:
         """获取成交记录"""
         try:
-            return self.exchange.fetch_trades(symbol, since, limit)
+            with pipeline_latency.timer('fetch_request', 'trade'):
+                return self.exchange.fetch_trades(symbol, since, limit)
         except Exception as e:
             logger.error(f"获取成交记录失败 {symbol}: {e}")
             raise
@@ -100,8 +120,10 @@ class MarketDataCollector:
     
     def __init__(self, exchange_account: ExchangeAccount):
         self.exchange_account = exchange_account
-        self.connector = ExchangeConnector(exchange_account)
+        # 复用进程内预热好的连接器，避免每个任务重建ccxt实例和重新加载市场
+        self.connector = get_connector_pool().get(exchange_account)
         self.channel_layer = get_channel_layer()
+        self.event_log = MarketEventLog()
     
     def sync_symbols(self) -> int:
         """同步交易对信息"""
@@ -143,28 +165,26 @@ class MarketDataCollector:
         """收集实时行情数据"""
         try:
             ticker_data = self.connector.fetch_ticker(symbol)
+            trace = LatencyTrace(ticker_data.get('timestamp'))
+            trace.mark('fetched')
             symbol_obj = Symbol.objects.get(
                 tenant=self.exchange_account.tenant,
                 exchange__code=self.exchange_account.exchange,
                 symbol=symbol
             )
             
-            ticker, created = Ticker.objects.update_or_create(
-                symbol=symbol_obj,
-                defaults={
-                    'last_price': Decimal(str(ticker_data['last'])),
-                    'bid_price': Decimal(str(ticker_data['bid'])) if ticker_data['bid'] else None,
-                    'ask_price': Decimal(str(ticker_data['ask'])) if ticker_data['ask'] else None,
-                    'high_24h': Decimal(str(ticker_data['high'])) if ticker_data['high'] else None,
-                    'low_24h': Decimal(str(ticker_data['low'])) if ticker_data['low'] else None,
-                    'volume_24h': Decimal(str(ticker_data['baseVolume'])) if ticker_data['baseVolume'] else None,
-                    'change_24h': Decimal(str(ticker_data['percentage'])) if ticker_data['percentage'] else None,
-                    'timestamp': django_timezone.now(),
-                }
-            )
+            ticker = self._save_ticker(symbol_obj, ticker_data)
+            trace.mark('persisted')
             
-            # 发送WebSocket消息
-            self._broadcast_ticker_update(symbol, ticker_data)
+            message = self._build_ticker_message(symbol, ticker_data)
+            MarketDataCache.set_ticker_cache(symbol, message)
+            trace.mark('cached')
+            
+            # 写入事件日志并发送WebSocket消息
+            message['event_id'] = self._record_event('ticker', symbol, message, ticker_data.get('timestamp'))
+            trace.mark('logged')
+            self._broadcast_ticker_update(symbol, message, trace)
+            self._broadcast_exchange_tickers([message])
             
             return ticker
         
@@ -172,6 +192,79 @@ class MarketDataCollector:
             logger.error(f"收集行情数据失败 {symbol}: {e}")
             return None
     
+    def collect_tickers_data(self, symbols: List[str]) -> int:
+        """
+        批量收集实时行情数据
+        
+        一次 fetch_tickers 请求获取全部交易对，逐个广播到交易对频道，
+        并向交易所聚合频道只发送一条合并消息。
+        
+        Returns:
+            成功保存的行情数量
+        """
+        try:
+            tickers_data = self.connector.fetch_tickers(symbols)
+            fetched_at = LatencyTrace().mark('fetched')
+            symbol_objs = {
+                obj.symbol: obj
+                for obj in Symbol.objects.filter(
+                    tenant=self.exchange_account.tenant,
+                    exchange__code=self.exchange_account.exchange,
+                    symbol__in=symbols
+                )
+            }
+            
+            batch = []
+            traces = []
+            for symbol in symbols:
+                ticker_data = tickers_data.get(symbol)
+                symbol_obj = symbol_objs.get(symbol)
+                if not ticker_data or not symbol_obj or ticker_data.get('last') is None:
+                    continue
+                
+                trace = LatencyTrace(ticker_data.get('timestamp'), {'fetched': fetched_at})
+                self._save_ticker(symbol_obj, ticker_data)
+                trace.mark('persisted')
+                message = self._build_ticker_message(symbol, ticker_data)
+                MarketDataCache.set_ticker_cache(symbol, message)
+                trace.mark('cached')
+                batch.append(message)
+                traces.append(trace)
+            
+            # 一次管道写入全部事件，再逐个广播
+            event_ids = self._record_events(
+                ('ticker', message['symbol'], message, trace.marks.get('exchange'))
+                for message, trace in zip(batch, traces)
+            )
+            for message, trace, event_id in zip(batch, traces, event_ids):
+                message['event_id'] = event_id
+                trace.mark('logged')
+                self._broadcast_ticker_update(message['symbol'], message, trace)
+            
+            self._broadcast_exchange_tickers(batch)
+            return len(batch)
+        
+        except Exception as e:
+            logger.error(f"批量收集行情数据失败: {e}")
+            return 0
+    
+    def _save_ticker(self, symbol_obj: Symbol, ticker_data: Dict[str, Any]) -> Ticker:
+        """保存行情数据"""
+        ticker, created = Ticker.objects.update_or_create(
+            symbol=symbol_obj,
+            defaults={
+                'last_price': Decimal(str(ticker_data['last'])),
+                'bid_price': Decimal(str(ticker_data['bid'])) if ticker_data['bid'] else None,
+                'ask_price': Decimal(str(ticker_data['ask'])) if ticker_data['ask'] else None,
+                'high_24h': Decimal(str(ticker_data['high'])) if ticker_data['high'] else None,
+                'low_24h': Decimal(str(ticker_data['low'])) if ticker_data['low'] else None,
+                'volume_24h': Decimal(str(ticker_data['baseVolume'])) if ticker_data['baseVolume'] else None,
+                'change_24h': Decimal(str(ticker_data['percentage'])) if ticker_data['percentage'] else None,
+                'timestamp': django_timezone.now(),
+            }
+        )
+        return ticker
+    
     def collect_kline_data(self, symbol: str, timeframe: str = '1m', 
                           limit: int = 100) -> int:
         """收集K线数据"""
@@ -183,26 +276,43 @@ class MarketDataCollector:
                 symbol=symbol
             )
             
+            # 已保存的K线，未变化的不再写入；未收盘K线的更新也写入事件日志，
+            # 否则策略引擎只能看到刚开盘时的部分数据
+            timestamps = [datetime.fromtimestamp(ohlcv[0] / 1000, tz=timezone.utc) for ohlcv in ohlcv_data]
+            existing = {
+                row[0]: row[1:]
+                for row in Kline.objects.filter(
+                    symbol=symbol_obj, timeframe=timeframe, timestamp__in=timestamps,
+                ).values_list('timestamp', 'open_price', 'high_price', 'low_price', 'close_price', 'volume')
+            }
+            
             saved_count = 0
-            for ohlcv in ohlcv_data:
-                timestamp = datetime.fromtimestamp(ohlcv[0] / 1000, tz=timezone.utc)
+            events = []
+            for timestamp, ohlcv in zip(timestamps, ohlcv_data):
+                # 按字段精度（8位小数）比较
+                values = tuple(Decimal(str(value)).quantize(Decimal('1e-8')) for value in ohlcv[1:6])
+                if existing.get(timestamp) == values:
+                    continue
                 
                 kline, created = Kline.objects.update_or_create(
                     symbol=symbol_obj,
                     timeframe=timeframe,
                     timestamp=timestamp,
-                    defaults={
-                        'open_price': Decimal(str(ohlcv[1])),
-                        'high_price': Decimal(str(ohlcv[2])),
-                        'low_price': Decimal(str(ohlcv[3])),
-                        'close_price': Decimal(str(ohlcv[4])),
-                        'volume': Decimal(str(ohlcv[5])),
-                    }
+                    defaults=dict(zip(('open_price', 'high_price', 'low_price', 'close_price', 'volume'), values))
                 )
                 
                 if created:
                     saved_count += 1
+                events.append(('kline', symbol, {
+                    'timeframe': timeframe,
+                    'open': ohlcv[1],
+                    'high': ohlcv[2],
+                    'low': ohlcv[3],
+                    'close': ohlcv[4],
+                    'volume': ohlcv[5],
+                }, ohlcv[0]))
             
+            self._record_events(events)
             logger.info(f"收集K线数据 {symbol} {timeframe}: {saved_count}条新数据")
             return saved_count
         
@@ -214,6 +324,8 @@ class MarketDataCollector:
         """收集订单簿数据"""
         try:
             orderbook_data = self.connector.fetch_order_book(symbol, limit)
+            trace = LatencyTrace(orderbook_data.get('timestamp'))
+            trace.mark('fetched')
             symbol_obj = Symbol.objects.get(
                 tenant=self.exchange_account.tenant,
                 exchange__code=self.exchange_account.exchange,
@@ -229,9 +341,23 @@ class MarketDataCollector:
                 asks=orderbook_data['asks'],
                 timestamp=django_timezone.now(),
             )
+            trace.mark('persisted')
+            
+            MarketDataCache.set_orderbook_cache(symbol, {
+                'symbol': symbol,
+                'bids': orderbook_data['bids'],
+                'asks': orderbook_data['asks'],
+                'timestamp': orderbook.timestamp.isoformat(),
+            })
+            trace.mark('cached')
             
-            # 发送WebSocket消息
-            self._broadcast_orderbook_update(symbol, orderbook_data)
+            # 写入事件日志并发送WebSocket消息
+            event_id = self._record_event('orderbook', symbol, {
+                'bids': orderbook_data['bids'],
+                'asks': orderbook_data['asks'],
+            }, orderbook_data.get('timestamp'))
+            trace.mark('logged')
+            self._broadcast_orderbook_update(symbol, orderbook_data, event_id, trace)
             
             return orderbook
         
@@ -250,6 +376,7 @@ class MarketDataCollector:
             )
             
             saved_count = 0
+            events = []
             for trade_data in trades_data:
                 timestamp = datetime.fromtimestamp(trade_data['timestamp'] / 1000, tz=timezone.utc)
                 
@@ -266,7 +393,14 @@ class MarketDataCollector:
                 
                 if created:
                     saved_count += 1
+                    events.append(('trade', symbol, {
+                        'id': str(trade_data['id']),
+                        'price': trade_data['price'],
+                        'amount': trade_data['amount'],
+                        'side': trade_data['side'],
+                    }, trade_data['timestamp']))
             
+            self._record_events(events)
             logger.info(f"收集成交记录 {symbol}: {saved_count}条新数据")
             return saved_count
         
@@ -274,39 +408,93 @@ class MarketDataCollector:
             logger.error(f"收集成交记录失败 {symbol}: {e}")
             return 0
     
-    def _broadcast_ticker_update(self, symbol: str, ticker_data: Dict[str, Any]):
+    def _record_event(self, event_type: str, symbol: str, data: Dict[str, Any],
+                      timestamp: Optional[int] = None) -> Optional[str]:
+        """写入市场事件日志，失败时不影响数据收集"""
+        try:
+            return self.event_log.append(self.exchange_account.exchange, event_type, symbol, data, timestamp)
+        except Exception as e:
+            logger.warning(f"写入市场事件日志失败 {symbol}: {e}")
+            return None
+    
+    def _record_events(self, events) -> List[Optional[str]]:
+        """批量写入市场事件日志"""
+        events = list(events)
+        if not events:
+            return []
+        try:
+            return self.event_log.append_many(self.exchange_account.exchange, events)
+        except Exception as e:
+            logger.warning(f"批量写入市场事件日志失败: {e}")
+            return [None] * len(events)
+    
+    def _build_ticker_message(self, symbol: str, ticker_data: Dict[str, Any]) -> Dict[str, Any]:
+        """构建行情推送消息体"""
+        return {
+            "symbol": symbol,
+            "last": ticker_data['last'],
+            "bid": ticker_data['bid'],
+            "ask": ticker_data['ask'],
+            "change": ticker_data.get('percentage'),
+            "timestamp": django_timezone.now().isoformat(),
+        }
+    
+    def _broadcast_ticker_update(self, symbol: str, message: Dict[str, Any],
+                                 trace: Optional[LatencyTrace] = None):
         """广播行情更新"""
         if self.channel_layer:
+            self._group_send_traced(get_symbol_group_name(symbol), {
+                "type": "ticker_update",
+                "data": message,
+            }, trace, 'ticker')
+    
+    def _group_send_traced(self, group: str, event: Dict[str, Any],
+                           trace: Optional[LatencyTrace], label: str):
+        """
+        发送到通道层并记录各阶段延迟
+        
+        dispatched 打点随消息一起发送，消费者据此统计通道层投递耗时；
+        group_send 本身的耗时在这里统计。
+        """
+        if trace is None:
+            async_to_sync(self.channel_layer.group_send)(group, event)
+            return
+        
+        event['trace'] = {
+            'exchange': trace.marks.get('exchange'),
+            'dispatched': trace.mark('dispatched'),
+        }
+        async_to_sync(self.channel_layer.group_send)(group, event)
+        trace.mark('group_send')
+        trace.observe(pipeline_latency, label)
+    
+    def _broadcast_exchange_tickers(self, tickers: List[Dict[str, Any]]):
+        """向交易所聚合频道广播一批行情"""
+        if self.channel_layer and tickers:
             async_to_sync(self.channel_layer.group_send)(
-                f"market_{symbol}",
+                get_exchange_group_name(self.exchange_account.exchange),
                 {
-                    "type": "ticker_update",
-                    "data": {
-                        "symbol": symbol,
-                        "last": ticker_data['last'],
-                        "bid": ticker_data['bid'],
-                        "ask": ticker_data['ask'],
-                        "change": ticker_data.get('percentage'),
-                        "timestamp": django_timezone.now().isoformat(),
-                    }
+                    "type": "exchange_tickers",
+                    "exchange": self.exchange_account.exchange,
+                    "data": tickers,
                 }
             )
     
-    def _broadcast_orderbook_update(self, symbol: str, orderbook_data: Dict[str, Any]):
+    def _broadcast_orderbook_update(self, symbol: str, orderbook_data: Dict[str, Any],
+                                    event_id: Optional[str] = None,
+                                    trace: Optional[LatencyTrace] = None):
         """广播订单簿更新"""
         if self.channel_layer:
-            async_to_sync(self.channel_layer.group_send)(
-                f"market_{symbol}",
-                {
-                    "type": "orderbook_update",
-                    "data": {
-                        "symbol": symbol,
-                        "bids": orderbook_data['bids'][:10],  # 只发送前10档
-                        "asks": orderbook_data['asks'][:10],
-                        "timestamp": django_timezone.now().isoformat(),
-                    }
+            self._group_send_traced(get_symbol_group_name(symbol), {
+                "type": "orderbook_update",
+                "data": {
+                    "symbol": symbol,
+                    "bids": orderbook_data['bids'][:10],  # 只发送前10档
+                    "asks": orderbook_data['asks'][:10],
+                    "timestamp": django_timezone.now().isoformat(),
+                    "event_id": event_id,
                 }
-            )
+            }, trace, 'orderbook')
 
 
 class MarketDataProcessor:
@@ -426,6 +614,18 @@ class MarketDataCache:
         cache_key = cls.get_cache_key('ticker', symbol)
         return cache.get(cache_key)
     
+    @classmethod
+    def set_orderbook_cache(cls, symbol: str, data: Dict[str, Any]):
+        """设置订单簿缓存"""
+        cache_key = cls.get_cache_key('orderbook', symbol)
+        cache.set(cache_key, data, cls.CACHE_TIMEOUT['orderbook'])
+    
+    @classmethod
+    def get_orderbook_cache(cls, symbol: str) -> Optional[Dict[str, Any]]:
+        """获取订单簿缓存"""
+        cache_key = cls.get_cache_key('orderbook', symbol)
+        return cache.get(cache_key)
+    
     @classmethod
     def set_kline_cache(cls, symbol: str, timeframe: str, data: List[Dict[str, Any]]):
         """设置K线缓存"""
@@ -0,0 +1,29 @@
+"""
+市场数据相关任务
+"""
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def archive_market_events(trim=True):
+    """
+    归档市场事件日志任务
+
+    将各交易所事件流中未归档的部分写入磁盘分段，并裁剪已归档的事件
+    """
+    from apps.market.event_log import MarketEventArchive
+
+    try:
+        archive = MarketEventArchive()
+        result = {}
+        for exchange in archive.event_log.list_exchanges():
+            result[exchange] = archive.archive(exchange, trim=trim)
+
+        logger.info(f"市场事件归档完成: {result}")
+        return result
+    except Exception as e:
+        logger.error(f"市场事件归档失败: {e}")
+        return False
@@ -0,0 +1,341 @@
+"""
+市场数据模块测试
+"""
+import asyncio
+import json
+import tempfile
+import time
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+import ccxt
+import fakeredis
+
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+
+from apps.core.models import Tenant
+from apps.trading.models import ExchangeAccount
+from .connector_pool import ExchangeConnectorPool, SharedRateLimiter
+from .consumers import MarketDataConsumer
+from .event_log import MarketEventLog, MarketEventArchive, next_event_id
+from .models import Exchange, Kline, Symbol
+from .services import MarketDataCollector
+from .groups import (
+    get_symbol_group_name, get_exchange_group_name,
+    group_add_many, group_discard_many,
+)
+
+User = get_user_model()
+
+
+class GroupNameTest(SimpleTestCase):
+    """频道组名测试"""
+
+    def test_symbol_group_name_is_valid(self):
+        """测试交易对组名规范化"""
+        self.assertEqual(get_symbol_group_name('BTC/USDT'), 'market_BTC_USDT')
+        self.assertEqual(get_symbol_group_name('ETH/USDT:USDT'), 'market_ETH_USDT_USDT')
+
+    def test_exchange_group_name(self):
+        """测试交易所聚合组名"""
+        self.assertEqual(get_exchange_group_name('binance'), 'market_exchange_binance_tickers')
+
+    def test_group_add_many_with_in_memory_layer(self):
+        """测试内存通道层下的批量加入和离开"""
+        layer = get_channel_layer()
+
+        async def run():
+            channel = await layer.new_channel()
+            groups = [get_symbol_group_name(s) for s in ('BTC/USDT', 'ETH/USDT')]
+            await group_add_many(layer, groups, channel)
+            await layer.group_send(groups[1], {'type': 'ping'})
+            message = await layer.receive(channel)
+            await group_discard_many(layer, groups, channel)
+            return message, layer.groups
+
+        message, groups = asyncio.run(run())
+        self.assertEqual(message['type'], 'ping')
+        self.assertFalse(any(groups.values()))
+
+
+class MarketDataConsumerTest(TestCase):
+    """市场数据WebSocket消费者测试"""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name='测试租户', schema_name='test_tenant')
+        self.user = User.objects.create_user(
+            username='trader', password='testpass123', tenant=self.tenant
+        )
+
+    async def _connect(self):
+        communicator = WebsocketCommunicator(MarketDataConsumer.as_asgi(), '/ws/market/')
+        communicator.scope['user'] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()  # connection_established
+        return communicator
+
+    async def test_batch_subscribe_and_broadcast(self):
+        """测试批量订阅后可以收到各交易对广播"""
+        communicator = await self._connect()
+        await communicator.send_json_to({
+            'action': 'subscribe',
+            'symbols': ['BTC/USDT', 'ETH/USDT', 'BTC/USDT'],
+        })
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['type'], 'subscribed')
+        self.assertEqual(response['symbols'], ['BTC/USDT', 'ETH/USDT'])
+
+        layer = get_channel_layer()
+        await layer.group_send(get_symbol_group_name('ETH/USDT'), {
+            'type': 'ticker_update',
+            'data': {'symbol': 'ETH/USDT', 'last': 3000},
+        })
+        update = await communicator.receive_json_from()
+        self.assertEqual(update['data']['symbol'], 'ETH/USDT')
+
+        await communicator.send_json_to({'action': 'unsubscribe', 'symbols': ['ETH/USDT']})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['symbols'], ['ETH/USDT'])
+        await communicator.disconnect()
+
+    async def test_subscription_limit(self):
+        """测试超过订阅上限的交易对会被拒绝"""
+        communicator = await self._connect()
+        symbols = [f'C{i}/USDT' for i in range(MarketDataConsumer.MAX_SUBSCRIPTIONS + 2)]
+        await communicator.send_json_to({'action': 'subscribe', 'symbols': symbols})
+        response = await communicator.receive_json_from()
+        self.assertEqual(len(response['rejected']), 2)
+        self.assertEqual(len(response['symbols']), MarketDataConsumer.MAX_SUBSCRIPTIONS)
+        await communicator.disconnect()
+
+    async def test_exchange_wildcard_batches_frames(self):
+        """测试通配符聚合频道按间隔合并为一帧推送"""
+        communicator = await self._connect()
+        await communicator.send_json_to({'action': 'subscribe', 'symbols': ['binance:*']})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['exchanges'], ['binance'])
+
+        layer = get_channel_layer()
+        group = get_exchange_group_name('binance')
+        for price in (100, 101, 102):
+            await layer.group_send(group, {
+                'type': 'exchange_tickers',
+                'exchange': 'binance',
+                'data': [
+                    {'symbol': 'BTC/USDT', 'last': price},
+                    {'symbol': 'ETH/USDT', 'last': price / 10},
+                ],
+            })
+
+        frame = await communicator.receive_json_from(timeout=MarketDataConsumer.AGGREGATE_INTERVAL + 2)
+        self.assertEqual(frame['type'], 'tickers_batch')
+        self.assertEqual(frame['exchange'], 'binance')
+        latest = {item['symbol']: item['last'] for item in frame['data']}
+        self.assertEqual(latest, {'BTC/USDT': 102, 'ETH/USDT': 10.2})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_resume_replays_missed_events(self):
+        """测试断线重连后按偏移补发已订阅交易对的事件"""
+        log = MarketEventLog(client=fakeredis.FakeRedis(decode_responses=True))
+        ids = log.append_many('binance', [
+            ('ticker', 'BTC/USDT', {'last': 1}, None),
+            ('ticker', 'ETH/USDT', {'last': 2}, None),
+            ('ticker', 'BTC/USDT', {'last': 3}, None),
+        ])
+        communicator = await self._connect()
+        await communicator.send_json_to({'action': 'subscribe', 'symbols': ['BTC/USDT']})
+        await communicator.receive_json_from()
+
+        with patch('apps.market.consumers.MarketEventLog', return_value=log):
+            await communicator.send_json_to({
+                'action': 'resume', 'exchange': 'binance', 'last_event_id': ids[0],
+            })
+            response = await communicator.receive_json_from()
+
+        self.assertEqual(response['type'], 'replay')
+        self.assertEqual([e['event_id'] for e in response['events']], [ids[2]])
+        self.assertEqual(response['last_event_id'], ids[2])
+        self.assertTrue(response['complete'])
+        await communicator.disconnect()
+
+
+class MarketEventLogTest(SimpleTestCase):
+    """市场事件日志测试"""
+
+    def setUp(self):
+        self.client = fakeredis.FakeRedis(decode_responses=True)
+        self.log = MarketEventLog(client=self.client, maxlen=10000)
+
+    def _append(self, count, symbol='BTC/USDT'):
+        return self.log.append_many('binance', [
+            ('ticker', symbol, {'last': 100 + i}, 1700000000000 + i) for i in range(count)
+        ])
+
+    def test_read_after_offset(self):
+        """测试按偏移读取之后的事件"""
+        ids = self._append(5)
+        events = self.log.read_after('binance', ids[1])
+        self.assertEqual([e.event_id for e in events], ids[2:])
+        self.assertEqual(events[0].data, {'last': 102})
+        self.assertEqual(events[0].timestamp, 1700000000002)
+        self.assertEqual(next_event_id('5-0'), '5-1')
+
+    def test_consumer_group_resumes_pending_after_restart(self):
+        """测试消费者重启后先取回未确认的事件"""
+        self._append(3)
+        first = self.log.consume('candles', 'worker-1', ['binance'], count=2)
+        self.assertEqual(len(first), 2)
+
+        # 模拟进程重启：新实例应先拿到未ACK的两条
+        restarted = MarketEventLog(client=self.client)
+        pending = restarted.consume('candles', 'worker-1', ['binance'], count=10)
+        self.assertEqual([e.event_id for e in pending], [e.event_id for e in first])
+        self.assertEqual(restarted.ack('candles', pending), 2)
+
+        remaining = restarted.consume('candles', 'worker-1', ['binance'], count=10)
+        self.assertEqual(len(remaining), 1)
+
+    def test_independent_groups(self):
+        """测试不同消费者组互不影响"""
+        self._append(2)
+        self.assertEqual(len(self.log.consume('strategies', 'a', ['binance'])), 2)
+        self.assertEqual(len(self.log.consume('gateway', 'b', ['binance'])), 2)
+
+    def test_archive_and_replay(self):
+        """测试归档分段与流尾部的无缝回放"""
+        ids = self._append(7)
+        with tempfile.TemporaryDirectory() as base_dir:
+            archive = MarketEventArchive(self.log, base_dir=base_dir, segment_size=3)
+            self.assertEqual(archive.archive('binance'), 7)
+            self.assertEqual(len(archive.list_segments('binance')), 3)
+            self.assertEqual(archive.get_cursor('binance'), ids[-1])
+
+            # 归档并裁剪后流中的旧事件已删除，回放仍能得到完整序列
+            archive.retention = 0
+            self.log.append('binance', 'ticker', 'ETH/USDT', {'last': 1}, 1700000000100)
+            archive.archive('binance', trim=True)
+            self.assertEqual(self.client.xlen(self.log.stream_key('binance')), 0)
+            self.log.append('binance', 'ticker', 'BTC/USDT', {'last': 2}, 1700000000200)
+
+            replayed = list(archive.replay('binance', symbols=['BTC/USDT']))
+            self.assertEqual(len(replayed), 8)
+            self.assertEqual(replayed[-1].data, {'last': 2})
+
+            partial = list(archive.replay('binance', start_id=ids[4], end_id=ids[5]))
+            self.assertEqual([e.event_id for e in partial], ids[4:6])
+
+
+class ExchangeConnectorPoolTest(TestCase):
+    """交易所连接器池测试"""
+
+    MARKETS = {'BTC/USDT': {'id': 'BTCUSDT', 'symbol': 'BTC/USDT', 'base': 'BTC', 'quote': 'USDT',
+                            'type': 'spot', 'spot': True, 'active': True}}
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name='测试租户', schema_name='test_tenant')
+        self.user = User.objects.create_user(
+            username='trader', password='testpass123', tenant=self.tenant
+        )
+        self.account = self._create_account('主账户', 'key-1')
+        self.pool = ExchangeConnectorPool(idle_timeout=60, markets_ttl=3600)
+        patcher = patch.object(ccxt.binance, 'load_markets', autospec=True, side_effect=self._load_markets)
+        self.load_markets = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.pool.clear)
+
+    def _create_account(self, name, api_key):
+        account = ExchangeAccount(tenant=self.tenant, user=self.user, name=name, exchange='binance')
+        account.set_api_credentials(api_key, 'secret')
+        account.save()
+        return account
+
+    def _load_markets(self, exchange, *args, **kwargs):
+        return exchange.set_markets(list(self.MARKETS.values()))
+
+    def test_reuses_connector_per_account(self):
+        """测试同一账户复用连接器且只加载一次市场"""
+        first = self.pool.get(self.account)
+        second = self.pool.get(ExchangeAccount.all_objects.get(pk=self.account.pk))
+        self.assertIs(first, second)
+        self.assertEqual(self.load_markets.call_count, 1)
+        self.assertIn('BTC/USDT', first.exchange.markets)
+        self.assertEqual(self.pool.stats()['misses'], 1)
+
+    def test_shares_markets_and_rate_limiter(self):
+        """测试同一交易所的账户共享市场信息和节流器"""
+        other = self._create_account('副账户', 'key-2')
+        first = self.pool.get(self.account)
+        second = self.pool.get(other)
+        self.assertIsNot(first, second)
+        self.assertEqual(self.load_markets.call_count, 1)
+        self.assertIn('BTC/USDT', second.exchange.markets)
+        self.assertEqual(first.exchange.throttle, second.exchange.throttle)
+
+    def test_rebuilds_when_credentials_change(self):
+        """测试账户凭证变更后重建连接器"""
+        first = self.pool.get(self.account)
+        self.account.set_api_credentials('key-new', 'secret')
+        self.account.save()
+        second = self.pool.get(self.account)
+        self.assertIsNot(first, second)
+        self.assertEqual(second.exchange.apiKey, 'key-new')
+
+    def test_expire_idle(self):
+        """测试空闲连接器过期"""
+        self.pool.get(self.account)
+        self.pool.idle_timeout = 0
+        self.assertEqual(self.pool.expire_idle(), 1)
+        self.assertEqual(self.pool.stats()['size'], 0)
+
+    def test_shared_rate_limiter_spaces_requests(self):
+        """测试共享节流器按间隔排队"""
+        limiter = SharedRateLimiter(interval_ms=20)
+        started = time.monotonic()
+        for _ in range(3):
+            limiter.throttle()
+        self.assertGreaterEqual(time.monotonic() - started, 0.035)
+
+
+class KlineCollectionTest(TestCase):
+    """K线收集测试"""
+
+    def setUp(self):
+        tenant = Tenant.objects.create(name='测试租户', schema_name='test_tenant')
+        user = User.objects.create_user(username='trader', password='testpass123', tenant=tenant)
+        account = ExchangeAccount(tenant=tenant, user=user, name='主账户', exchange='binance')
+        account.set_api_credentials('key', 'secret')
+        account.save()
+        exchange = Exchange.objects.create(name='Binance', code='binance', api_url='https://api.binance.com')
+        self.symbol = Symbol.objects.create(
+            tenant=tenant, exchange=exchange, symbol='BTC/USDT', base_asset='BTC', quote_asset='USDT',
+            min_order_size=Decimal('0.0001'), max_order_size=Decimal('1000'), price_precision=2, amount_precision=6,
+        )
+        with patch('apps.market.services.get_connector_pool'), patch('apps.market.services.get_channel_layer'):
+            self.collector = MarketDataCollector(account)
+        self.collector.connector = MagicMock()
+        self.collector.event_log = MarketEventLog(client=fakeredis.FakeRedis(decode_responses=True))
+
+    def _collect(self, *candles):
+        self.collector.connector.fetch_ohlcv.return_value = [list(candle) for candle in candles]
+        return self.collector.collect_kline_data('BTC/USDT', '1m')
+
+    def _events(self):
+        return [(e.timestamp, e.data['close'], e.data['volume']) for e in self.collector.event_log.read_after('binance', None)]
+
+    def test_open_candle_updates_are_published(self):
+        """测试未收盘K线的更新写入事件日志，未变化的K线不重复写入"""
+        start = 1700000000000 - 1700000000000 % 60000
+        closed = (start, 1.0, 2.0, 0.5, 1.5, 10.0)
+        self.assertEqual(self._collect(closed, (start + 60000, 1.5, 1.6, 1.4, 1.5, 1.0)), 2)
+        self.assertEqual(self._collect(closed, (start + 60000, 1.5, 1.8, 1.4, 1.7, 3.0)), 0)
+        self.assertEqual(self._collect(closed, (start + 60000, 1.5, 1.8, 1.4, 1.7, 3.0)), 0)
+        self.assertEqual(self._events(), [
+            (start, 1.5, 10.0), (start + 60000, 1.5, 1.0), (start + 60000, 1.7, 3.0),
+        ])
+        kline = Kline.objects.filter(symbol=self.symbol).order_by('-timestamp').first()
+        self.assertEqual((kline.close_price, kline.volume), (Decimal('1.7'), Decimal('3')))
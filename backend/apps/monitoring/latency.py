@@ -0,0 +1,319 @@
+"""
+延迟直方图
+
+用于统计跨进程流水线（Celery收集器 -> 通道层 -> WebSocket消费者）各阶段的耗时。
+各进程在内存中累积观测值，按间隔通过Redis管道合并到共享的直方图哈希中，
+监控接口和 Prometheus 指标端点读取的是所有进程合并后的结果。
+"""
+import atexit
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# 直方图桶上界（毫秒），最后一个桶为 +Inf
+LATENCY_BUCKETS_MS = (
+    0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000,
+)
+KEY_PREFIX = 'latency'
+
+# 行情流水线：交易所 -> 收集器 -> 数据库/缓存 -> 通道层 -> WebSocket消费者
+MARKET_PIPELINE = 'market_pipeline'
+# 策略引擎：K线收盘 -> 策略回调 -> 订单发出
+STRATEGY_ENGINE = 'strategy_engine'
+# 订单网关：订单发出 -> 网关取出 -> 交易所确认 -> 回报推送
+ORDER_GATEWAY = 'order_gateway'
+
+_recorders: Dict[str, 'LatencyRecorder'] = {}
+_recorders_lock = threading.Lock()
+_client = None
+
+
+def get_latency_client():
+    """获取存放直方图的Redis客户端"""
+    global _client
+    if _client is None:
+        _client = redis.from_url(
+            getattr(settings, 'LATENCY_METRICS_REDIS_URL', 'redis://localhost:6379/0'),
+            decode_responses=True,
+        )
+    return _client
+
+
+def now_ms() -> float:
+    """当前时间（毫秒级Unix时间戳），跨进程可比较"""
+    return time.time() * 1000
+
+
+class LatencyRecorder:
+    """
+    延迟记录器
+
+    observe() 只更新进程内计数，开销为一次二分查找，不做网络I/O，可以在事件循环中调用；
+    后台线程每 flush_interval 秒把计数写入Redis。
+    """
+
+    def __init__(self, namespace: str, client=None, flush_interval: Optional[float] = None):
+        self.namespace = namespace
+        self._client = client
+        self.flush_interval = (
+            flush_interval if flush_interval is not None
+            else getattr(settings, 'LATENCY_METRICS_FLUSH_INTERVAL', 1.0)
+        )
+        self._lock = threading.Lock()
+        self._pending = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+        self._pending_sum = defaultdict(float)
+        self._last_flush = time.monotonic()
+        self._flusher_pid = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_latency_client()
+        return self._client
+
+    def _key(self, series: str) -> str:
+        return f"{KEY_PREFIX}:{self.namespace}:{series}"
+
+    @staticmethod
+    def series_name(stage: str, label: Optional[str] = None) -> str:
+        return f"{stage}|{label}" if label else stage
+
+    def observe(self, stage: str, value_ms: float, label: Optional[str] = None):
+        """记录一次观测值（毫秒）"""
+        if value_ms is None:
+            return
+        value_ms = max(float(value_ms), 0.0)
+        series = self.series_name(stage, label)
+        index = bisect.bisect_left(LATENCY_BUCKETS_MS, value_ms)
+        with self._lock:
+            self._pending[series][index] += 1
+            self._pending_sum[series] += value_ms
+        if self._flusher_pid != os.getpid():
+            self._start_flusher()
+
+    def _start_flusher(self):
+        """
+        启动后台刷新线程
+
+        按进程启动：预派生的 Celery 子进程不继承父进程的线程，首次观测时各自启动。
+        """
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        if not math.isfinite(self.flush_interval):
+            return
+        threading.Thread(target=self._flush_loop, name=f'latency-flush-{self.namespace}', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(max(self.flush_interval, 0.1))
+            self.flush()
+
+    def timer(self, stage: str, label: Optional[str] = None) -> '_Timer':
+        """上下文管理器：统计代码块耗时"""
+        return _Timer(self, stage, label)
+
+    def flush(self):
+        """将进程内累积的计数合并到Redis"""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+            sums, self._pending_sum = self._pending_sum, defaultdict(float)
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for series, counts in pending.items():
+                key = self._key(series)
+                for index, count in enumerate(counts):
+                    if count:
+                        pipe.hincrby(key, f"b{index}", count)
+                pipe.hincrby(key, 'count', sum(counts))
+                pipe.hincrbyfloat(key, 'sum', sums[series])
+            pipe.execute()
+        except Exception as e:
+            # 指标写入失败不能影响业务流程
+            logger.warning(f"写入延迟指标失败 {self.namespace}: {e}")
+
+    def series(self) -> List[str]:
+        """已记录的序列名"""
+        prefix = self._key('')
+        return sorted(key[len(prefix):] for key in self.client.scan_iter(match=f"{prefix}*"))
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """
+        读取所有序列的直方图
+
+        Returns:
+            {序列名: {stage, label, count, sum_ms, avg_ms, p50, p90, p99, buckets}}
+        """
+        names = self.series()
+        if not names:
+            return {}
+        pipe = self.client.pipeline(transaction=False)
+        for name in names:
+            pipe.hgetall(self._key(name))
+
+        result = {}
+        for name, raw in zip(names, pipe.execute()):
+            counts = [int(raw.get(f"b{i}", 0)) for i in range(len(LATENCY_BUCKETS_MS) + 1)]
+            total = int(raw.get('count', 0))
+            total_sum = float(raw.get('sum', 0))
+            stage, _, label = name.partition('|')
+            result[name] = {
+                'stage': stage,
+                'label': label or None,
+                'count': total,
+                'sum_ms': round(total_sum, 3),
+                'avg_ms': round(total_sum / total, 3) if total else 0.0,
+                'p50': estimate_percentile(counts, 50),
+                'p90': estimate_percentile(counts, 90),
+                'p99': estimate_percentile(counts, 99),
+                'buckets': counts,
+            }
+        return result
+
+    def reset(self):
+        """清空该命名空间下的所有直方图"""
+        keys = [self._key(name) for name in self.series()]
+        if keys:
+            self.client.delete(*keys)
+
+
+class _Timer:
+    """耗时统计上下文"""
+    __slots__ = ('recorder', 'stage', 'label', 'start')
+
+    def __init__(self, recorder: LatencyRecorder, stage: str, label: Optional[str]):
+        self.recorder = recorder
+        self.stage = stage
+        self.label = label
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.recorder.observe(self.stage, (time.perf_counter() - self.start) * 1000, self.label)
+        return False
+
+
+def estimate_percentile(counts: List[int], pct: float, buckets: Sequence[float] = LATENCY_BUCKETS_MS) -> Optional[float]:
+    """根据分桶计数线性插值估算分位数（毫秒），buckets 为各桶上界"""
+    total = sum(counts)
+    if not total:
+        return None
+    target = total * pct / 100
+    cumulative = 0
+    for index, count in enumerate(counts):
+        if cumulative + count >= target and count:
+            lower = buckets[index - 1] if index > 0 else 0.0
+            if index >= len(buckets):
+                return float(buckets[-1])
+            upper = buckets[index]
+            return round(lower + (upper - lower) * (target - cumulative) / count, 3)
+        cumulative += count
+    return float(buckets[-1])
+
+
+def get_latency_recorder(namespace: str) -> LatencyRecorder:
+    """获取进程内共享的延迟记录器"""
+    recorder = _recorders.get(namespace)
+    if recorder is None:
+        with _recorders_lock:
+            recorder = _recorders.get(namespace)
+            if recorder is None:
+                recorder = _recorders[namespace] = LatencyRecorder(namespace)
+    return recorder
+
+
+def list_namespaces(client=None) -> List[str]:
+    """列出Redis中已有直方图的命名空间"""
+    client = client or get_latency_client()
+    namespaces = set()
+    for key in client.scan_iter(match=f"{KEY_PREFIX}:*"):
+        parts = key.split(':', 2)
+        if len(parts) == 3:
+            namespaces.add(parts[1])
+    return sorted(namespaces)
+
+
+def flush_all_recorders():
+    """刷新进程内所有记录器（进程退出时调用）"""
+    for recorder in list(_recorders.values()):
+        recorder.flush()
+
+
+atexit.register(flush_all_recorders)
+
+
+def render_prometheus(snapshots: Dict[str, Dict[str, Dict]]) -> str:
+    """
+    将直方图渲染为 Prometheus 文本格式
+
+    Args:
+        snapshots: {命名空间: LatencyRecorder.snapshot() 的结果}
+    """
+    lines = []
+    for namespace, series in sorted(snapshots.items()):
+        metric = f"quanttrade_{namespace}_latency_ms"
+        lines.append(f"# HELP {metric} {namespace} stage latency in milliseconds")
+        lines.append(f"# TYPE {metric} histogram")
+        for item in series.values():
+            labels = f'stage="{item["stage"]}"'
+            if item['label']:
+                labels += f',label="{item["label"]}"'
+            cumulative = 0
+            for bound, count in zip(list(LATENCY_BUCKETS_MS) + ['+Inf'], item['buckets']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{{labels}}} {item["sum_ms"]}')
+            lines.append(f'{metric}_count{{{labels}}} {item["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+class LatencyTrace:
+    """
+    单条数据在流水线中的时间戳追踪
+
+    按顺序打点，相邻两个点的差值即该阶段耗时；打点以毫秒Unix时间戳保存，
+    可以随消息跨进程传递（例如通过通道层传给WebSocket消费者）。
+    """
+    __slots__ = ('marks',)
+
+    def __init__(self, exchange_ts: Optional[float] = None, marks: Optional[Dict[str, float]] = None):
+        # 交易所时间戳总是第一个打点
+        self.marks = {'exchange': float(exchange_ts)} if exchange_ts else {}
+        if marks:
+            self.marks.update(marks)
+
+    def mark(self, stage: str) -> float:
+        value = now_ms()
+        self.marks[stage] = value
+        return value
+
+    def observe(self, recorder: LatencyRecorder, label: Optional[str] = None,
+                stages: Optional[Iterable[str]] = None):
+        """将相邻打点之间的耗时记录到直方图"""
+        stages = set(stages) if stages else None
+        previous = None
+        for stage, value in self.marks.items():
+            if previous is not None and (stages is None or stage in stages):
+                recorder.observe(stage, value - previous, label)
+            previous = value
+
+    def to_dict(self) -> Dict[str, float]:
+        return dict(self.marks)
@@ -6,6 +6,10 @@ from decimal import Decimal
 from unittest.mock import patch, Mock
 from .models import SystemMetrics, ProcessMetrics, AlertRule, Alert
 from .services import SystemMonitorService, ProcessMonitorService, AlertService, MetricsCleanupService
+from .latency import (
+    LATENCY_BUCKETS_MS, LatencyRecorder, LatencyTrace,
+    estimate_percentile, list_namespaces, render_prometheus,
+)
 from apps.users.models import Tenant
 
 User = get_user_model()
@@ -419,4 +423,111 @@ class MonitoringModelsTest(TestCase):
         self.assertEqual(alert.tenant, self.tenant)
         self.assertEqual(alert.rule, rule)
         self.assertEqual(alert.status, 'firing')
-        self.assertIsNotNone(alert.fired_at)
\ No newline at end of file
+        self.assertIsNotNone(alert.fired_at)
+
+class LatencyRecorderTest(TestCase):
+    """延迟直方图测试"""
+    
+    def setUp(self):
+        import fakeredis
+        self.client = fakeredis.FakeRedis(decode_responses=True)
+        self.recorder = LatencyRecorder('test_pipeline', client=self.client, flush_interval=3600)
+    
+    def test_observe_buffers_until_flush(self):
+        """观测值在刷新前只保存在进程内"""
+        self.recorder.observe('fetched', 3.0, 'ticker')
+        self.assertEqual(self.recorder.snapshot(), {})
+        
+        self.recorder.flush()
+        snapshot = self.recorder.snapshot()
+        self.assertEqual(snapshot['fetched|ticker']['count'], 1)
+        self.assertEqual(snapshot['fetched|ticker']['label'], 'ticker')
+    
+    def test_snapshot_merges_processes(self):
+        """多个记录器写入同一命名空间时结果合并"""
+        other = LatencyRecorder('test_pipeline', client=self.client, flush_interval=3600)
+        for value in (1, 2, 3, 4):
+            self.recorder.observe('group_send', value)
+            other.observe('group_send', value * 10)
+        self.recorder.flush()
+        other.flush()
+        
+        item = self.recorder.snapshot()['group_send']
+        self.assertEqual(item['count'], 8)
+        self.assertAlmostEqual(item['sum_ms'], 110.0)
+        self.assertLessEqual(item['p50'], 5)
+        self.assertGreater(item['p99'], 20)
+    
+    def test_observe_does_not_write_inline(self):
+        """观测不在调用方写入Redis，由后台线程刷新"""
+        import time
+        recorder = LatencyRecorder('test_pipeline', client=self.client, flush_interval=0.1)
+        with patch.object(recorder, 'flush', wraps=recorder.flush) as flush:
+            recorder.observe('delivered', 3.0, 'ticker')
+            self.assertEqual(flush.call_count, 0)
+            deadline = time.monotonic() + 5
+            while not recorder.snapshot() and time.monotonic() < deadline:
+                time.sleep(0.05)
+        self.assertEqual(recorder.snapshot()['delivered|ticker']['count'], 1)
+
+    def test_reset_requires_admin(self):
+        """直方图为全局数据，普通租户用户不能重置"""
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from .views import LatencyMetricsViewSet
+        tenant = Tenant.objects.create(name='Test Tenant')
+        user = User.objects.create_user(username='viewer', password='testpass', tenant=tenant)
+        view = LatencyMetricsViewSet.as_view({'post': 'reset'}, **LatencyMetricsViewSet.reset.kwargs)
+
+        def reset():
+            request = APIRequestFactory().post('/latency/reset/', {'namespace': 'test_pipeline'})
+            force_authenticate(request, user=user)
+            return view(request)
+
+        with patch('apps.monitoring.views.LatencyRecorder') as recorder:
+            self.assertEqual(reset().status_code, 403)
+            user.is_staff = True
+            self.assertEqual(reset().status_code, 200)
+            recorder.return_value.reset.assert_called_once()
+
+    def test_reset(self):
+        """重置清空命名空间"""
+        self.recorder.observe('cached', 1)
+        self.recorder.flush()
+        self.assertEqual(list_namespaces(self.client), ['test_pipeline'])
+        
+        self.recorder.reset()
+        self.assertEqual(self.recorder.snapshot(), {})
+    
+    def test_estimate_percentile(self):
+        """分位数估算"""
+        counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.assertIsNone(estimate_percentile(counts, 50))
+        
+        counts[LATENCY_BUCKETS_MS.index(10)] = 100
+        self.assertEqual(estimate_percentile(counts, 50), 7.5)
+        counts[-1] = 1
+        self.assertEqual(estimate_percentile(counts, 100), float(LATENCY_BUCKETS_MS[-1]))
+    
+    def test_trace_observes_consecutive_stages(self):
+        """追踪按相邻打点计算阶段耗时"""
+        trace = LatencyTrace(1000.0, {'fetched': 1050.0, 'persisted': 1052.0})
+        self.assertEqual(list(trace.to_dict()), ['exchange', 'fetched', 'persisted'])
+        
+        trace.observe(self.recorder, 'ticker')
+        self.recorder.flush()
+        snapshot = self.recorder.snapshot()
+        self.assertEqual(snapshot['fetched|ticker']['sum_ms'], 50.0)
+        self.assertEqual(snapshot['persisted|ticker']['sum_ms'], 2.0)
+        self.assertNotIn('exchange|ticker', snapshot)
+    
+    def test_render_prometheus(self):
+        """Prometheus 文本格式"""
+        self.recorder.observe('delivered', 0.3, 'ticker')
+        self.recorder.observe('delivered', 40, 'ticker')
+        self.recorder.flush()
+        
+        text = render_prometheus({'test_pipeline': self.recorder.snapshot()})
+        self.assertIn('# TYPE quanttrade_test_pipeline_latency_ms histogram', text)
+        self.assertIn('quanttrade_test_pipeline_latency_ms_bucket{stage="delivered",label="ticker",le="0.5"} 1', text)
+        self.assertIn('quanttrade_test_pipeline_latency_ms_bucket{stage="delivered",label="ticker",le="+Inf"} 2', text)
+        self.assertIn('quanttrade_test_pipeline_latency_ms_count{stage="delivered",label="ticker"} 2', text)
@@ -14,12 +14,16 @@ router.register(r'celery-workers', views.CeleryWorkerViewSet, basename='celery-w
 router.register(r'celery-tasks', views.CeleryTaskViewSet, basename='celery-tasks')
 router.register(r'celery-queues', views.CeleryQueueViewSet, basename='celery-queues')
 router.register(r'celery-management', views.CeleryManagementViewSet, basename='celery-management')
+router.register(r'latency', views.LatencyMetricsViewSet, basename='latency')
 router.register(r'management', views.MonitoringManagementViewSet, basename='monitoring-management')
 
 urlpatterns = [
     # 健康检查
     path('health/', views.health_check, name='health_check'),
     
+    # Prometheus 延迟指标
+    path('metrics/', views.latency_metrics, name='latency_metrics'),
+    
     # API路由
     path('api/', include(router.urls)),
 ]
\ No newline at end of file
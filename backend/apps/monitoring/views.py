@@ -1,7 +1,7 @@
 """
 系统监控视图
 """
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse
 from django.db import connection
 from django.core.cache import cache
 from rest_framework import viewsets, status
@@ -13,12 +13,13 @@ from datetime import timedelta
 from .models import SystemMetrics, ProcessMetrics, AlertRule, Alert
 from .services import SystemMonitorService, ProcessMonitorService, AlertService, MetricsCleanupService
 from .celery_services import CeleryMonitorService
+from .latency import LatencyRecorder, list_namespaces, render_prometheus
 from .serializers import (
     SystemMetricsSerializer, ProcessMetricsSerializer, 
     AlertRuleSerializer, AlertSerializer, CeleryWorkerSerializer,
     CeleryTaskSerializer, CeleryQueueSerializer
 )
-from apps.core.permissions import TenantPermission
+from apps.core.permissions import AdminPermission, TenantPermission
 import time
 import logging
 
@@ -56,6 +57,54 @@ def health_check(request):
     return JsonResponse(status)
 
 
+def latency_metrics(request):
+    """
+    延迟直方图的 Prometheus 指标端点
+    """
+    try:
+        snapshots = {
+            namespace: LatencyRecorder(namespace).snapshot()
+            for namespace in list_namespaces()
+        }
+    except Exception as e:
+        logger.error(f"读取延迟指标失败: {e}")
+        return HttpResponse('', status=503, content_type='text/plain; version=0.0.4')
+    return HttpResponse(render_prometheus(snapshots), content_type='text/plain; version=0.0.4')
+
+
+class LatencyMetricsViewSet(viewsets.ViewSet):
+    """流水线延迟指标视图集"""
+    
+    permission_classes = [IsAuthenticated, TenantPermission]
+    
+    def list(self, request):
+        """获取各命名空间的延迟分位数"""
+        try:
+            namespace = request.query_params.get('namespace')
+            namespaces = [namespace] if namespace else list_namespaces()
+            data = {
+                name: list(LatencyRecorder(name).snapshot().values())
+                for name in namespaces
+            }
+            return Response(data)
+        except Exception as e:
+            logger.error(f"获取延迟指标失败: {e}")
+            return Response({'error': '获取延迟指标失败'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated, AdminPermission])
+    def reset(self, request):
+        """清空延迟直方图（直方图为全局数据，只允许管理员操作）"""
+        namespace = request.data.get('namespace')
+        if not namespace:
+            return Response({'error': '缺少命名空间参数'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            LatencyRecorder(namespace).reset()
+            return Response({'message': '已重置', 'namespace': namespace})
+        except Exception as e:
+            logger.error(f"重置延迟指标失败: {e}")
+            return Response({'error': '重置失败'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class SystemMetricsViewSet(viewsets.ReadOnlyModelViewSet):
     """系统指标视图集"""
     
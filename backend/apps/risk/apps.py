@@ -4,4 +4,8 @@ from django.apps import AppConfig
 class RiskConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.risk'
-    verbose_name = '风险控制'
\ No newline at end of file
+    verbose_name = '风险控制'
+
+    def ready(self):
+        # 注册规则变化时的失效处理
+        from . import pretrade  # noqa: F401
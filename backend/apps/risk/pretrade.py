@@ -0,0 +1,448 @@
+"""
+下单前风控检查
+
+订单到达交易所之前按租户启用的风险预警规则（RiskAlert）检查，不在每笔订单上查询数据库：
+
+- 每个租户的启用规则编译为内存中的规则集。指标类规则（VaR、最大回撤、夏普比率、波动率）
+  在编译时与最新的账户级 RiskMetrics 比较，结果随规则集缓存；
+- RiskAlert、RiskMetrics 变化时本进程立即丢弃该租户的规则集，并在 Redis 中递增租户的版本号，
+  其他进程每 PRETRADE_VERSION_CHECK_INTERVAL 秒读取一次版本号，发现变化后重新编译；
+- 持仓和盈亏来自持仓引擎的 Redis 快照（每 PRETRADE_STATE_TTL 秒刷新一次），
+  余额来自 AccountBalance（每 PRETRADE_BALANCE_TTL 秒刷新一次）；
+- 缓存有效时检查只做内存计算。通过的订单立即计入缓存的持仓，同一批订单不会各自按旧持仓通过。
+
+只检查增加风险的订单：减少持仓或 reduce_only 的订单总是放行。
+重度预警或启用了自动操作的规则拒绝订单，其他规则只给出警告。
+"""
+import json
+import logging
+import operator
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.trading.gateway import get_gateway_client
+from apps.trading.positions import PNL_KEY, positions_key
+
+from .models import RiskAlert, RiskMetrics
+
+logger = logging.getLogger(__name__)
+
+# 规则版本号：哈希 租户ID -> 版本号
+RULE_VERSION_KEY = 'risk:pretrade:versions'
+
+# 按下单后持仓计算的规则
+POSITION_RULES = ('position_ratio',)
+# 按账户当前盈亏计算的规则
+LOSS_RULES = ('loss_ratio',)
+# 与最新风险指标比较的规则
+METRIC_RULES = ('var', 'drawdown', 'sharpe', 'volatility')
+
+# 拒绝原因代码（规则类的原因代码为预警类型）
+REASON_ACCOUNT_UNKNOWN = 'account_unknown'
+REASON_PRICE_UNAVAILABLE = 'price_unavailable'
+REASON_EQUITY_UNAVAILABLE = 'equity_unavailable'
+
+OPERATORS = {
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+}
+
+EPS = 1e-12
+
+
+def quote_asset(symbol: str) -> str:
+    """交易对的计价资产，BTC/USDT:USDT -> USDT"""
+    return symbol.split('/')[-1].split(':')[0]
+
+
+@dataclass
+class RiskRule:
+    """编译后的预警规则"""
+    alert_id: int
+    name: str
+    alert_type: str
+    level: str
+    operator: str
+    threshold: float
+    blocking: bool
+
+    def __post_init__(self):
+        self._compare = OPERATORS.get(self.operator, operator.gt)
+
+    def breached(self, value: float) -> bool:
+        return self._compare(value, self.threshold)
+
+    def reason(self, value: float) -> 'RejectReason':
+        return RejectReason(
+            code=self.alert_type, message=f"{self.name}: {value:.6g} {self.operator} {self.threshold:.6g}",
+            alert_id=self.alert_id, level=self.level, value=value, threshold=self.threshold,
+        )
+
+
+@dataclass
+class RejectReason:
+    """拒绝（或警告）原因"""
+    code: str
+    message: str
+    alert_id: Optional[int] = None
+    level: Optional[str] = None
+    value: Optional[float] = None
+    threshold: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'code': self.code, 'message': self.message, 'alert_id': self.alert_id, 'level': self.level,
+            'value': self.value, 'threshold': self.threshold,
+        }
+
+
+@dataclass
+class CheckResult:
+    """检查结果"""
+    accepted: bool = True
+    reasons: List[RejectReason] = field(default_factory=list)
+    warnings: List[RejectReason] = field(default_factory=list)
+
+    @property
+    def error(self) -> str:
+        return '风控拒绝: ' + '; '.join(reason.message for reason in self.reasons)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'accepted': self.accepted,
+            'reasons': [reason.to_dict() for reason in self.reasons],
+            'warnings': [reason.to_dict() for reason in self.warnings],
+        }
+
+
+ACCEPTED = CheckResult()
+
+
+class TenantRules:
+    """租户的规则集"""
+    __slots__ = ('position_rules', 'loss_rules', 'tripped')
+
+    def __init__(self, position_rules: List[RiskRule], loss_rules: List[RiskRule],
+                 tripped: List[Tuple[RejectReason, bool, Optional[float]]]):
+        self.position_rules = position_rules
+        self.loss_rules = loss_rules
+        # 已经被最新指标触发的规则：(原因, 是否拒绝, 指标有效期时间戳)
+        self.tripped = tripped
+
+    @property
+    def empty(self) -> bool:
+        return not (self.position_rules or self.loss_rules or self.tripped)
+
+    @property
+    def needs_account(self) -> bool:
+        return bool(self.position_rules or self.loss_rules)
+
+
+def is_blocking(alert: RiskAlert) -> bool:
+    return alert.alert_level == 'high' or alert.auto_action_enabled
+
+
+def compile_rules(tenant_id) -> TenantRules:
+    """读取租户启用的预警规则和最新的账户级风险指标，编译为规则集"""
+    position_rules, loss_rules, metric_rules = [], [], []
+    for alert in RiskAlert.all_objects.filter(tenant_id=tenant_id, is_active=True).order_by('id'):
+        rule = RiskRule(
+            alert_id=alert.pk, name=alert.name, alert_type=alert.alert_type, level=alert.alert_level,
+            operator=alert.comparison_operator, threshold=float(alert.threshold_value), blocking=is_blocking(alert),
+        )
+        if rule.alert_type in POSITION_RULES:
+            position_rules.append(rule)
+        elif rule.alert_type in LOSS_RULES:
+            loss_rules.append(rule)
+        elif rule.alert_type in METRIC_RULES:
+            metric_rules.append(rule)
+
+    tripped = []
+    metrics: Dict[str, Tuple[float, Optional[float]]] = {}
+    for rule in metric_rules:
+        if rule.alert_type not in metrics:
+            latest = RiskMetrics.all_objects.filter(
+                tenant_id=tenant_id, metric_type=rule.alert_type, symbol='', strategy_id__isnull=True,
+            ).order_by('-calculation_time').values_list('metric_value', 'valid_until').first()
+            if latest is None:
+                continue
+            value, valid_until = latest
+            metrics[rule.alert_type] = (float(value), valid_until.timestamp() if valid_until else None)
+        value, expires = metrics[rule.alert_type]
+        if rule.breached(value):
+            tripped.append((rule.reason(value), rule.blocking, expires))
+    return TenantRules(position_rules, loss_rules, tripped)
+
+
+class AccountState:
+    """交易账户的缓存状态"""
+    __slots__ = ('tenant_id', 'positions', 'net_pnl', 'balances', 'equity', 'positions_at', 'balances_at')
+
+    def __init__(self, tenant_id: str):
+        self.tenant_id = tenant_id
+        self.positions: Dict[str, Tuple[float, Optional[float]]] = {}  # 交易对 -> (数量, 标记价格)
+        self.net_pnl = 0.0
+        self.balances: Dict[str, float] = {}
+        self.equity: Dict[str, Optional[float]] = {}  # 计价资产 -> 权益
+        self.positions_at = float('-inf')
+        self.balances_at = float('-inf')
+
+    def account_equity(self, quote: str) -> Optional[float]:
+        """计价资产的余额加上以它计价的持仓市值，账户同步没有写入过该资产时为 None"""
+        if quote not in self.equity:
+            cash = self.balances.get(quote)
+            if cash is not None:
+                for symbol, (amount, mark) in self.positions.items():
+                    if mark and quote_asset(symbol) == quote:
+                        cash += amount * mark
+            self.equity[quote] = cash
+        return self.equity[quote]
+
+
+class PreTradeChecker:
+    """
+    下单前风控检查
+
+    用法：
+        result = get_pretrade_checker().check(request)
+        if not result.accepted:
+            ...  # result.reasons
+
+    异步调用方先在线程池中执行 refresh（needs_refresh 为真时），再调用 check，检查本身不做IO。
+    """
+
+    def __init__(self, client=None, state_ttl: Optional[float] = None, balance_ttl: Optional[float] = None,
+                 version_interval: Optional[float] = None, clock=time.monotonic):
+        self._client = client
+        self.state_ttl = state_ttl if state_ttl is not None else getattr(settings, 'PRETRADE_STATE_TTL', 0.5)
+        self.balance_ttl = balance_ttl if balance_ttl is not None else getattr(settings, 'PRETRADE_BALANCE_TTL', 30.0)
+        self.version_interval = version_interval if version_interval is not None else getattr(
+            settings, 'PRETRADE_VERSION_CHECK_INTERVAL', 1.0)
+        self.clock = clock
+        self._rules: Dict[str, TenantRules] = {}
+        self._accounts: Dict[int, Optional[AccountState]] = {}
+        self._versions: Dict[str, str] = {}
+        self._versions_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.rejected = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_gateway_client()
+        return self._client
+
+    def invalidate(self, tenant_id=None):
+        """丢弃租户（默认全部）的规则集"""
+        if tenant_id is None:
+            self._rules.clear()
+        else:
+            self._rules.pop(str(tenant_id), None)
+
+    # -- 刷新（可能访问Redis和数据库）--------------------------------------
+
+    def needs_refresh(self, request: Dict[str, Any]) -> bool:
+        now = self.clock()
+        if self._versions_at is None or now - self._versions_at >= self.version_interval:
+            return True
+        account_id = int(request['exchange_account_id'])
+        if account_id not in self._accounts:
+            return True
+        account = self._accounts[account_id]
+        if account is None:
+            return False
+        rules = self._rules.get(account.tenant_id)
+        if rules is None:
+            return True
+        if not rules.needs_account:
+            return False
+        return now - account.positions_at >= self.state_ttl or now - account.balances_at >= self.balance_ttl
+
+    def refresh(self, request: Dict[str, Any]):
+        """按需读取规则版本、规则集和账户状态"""
+        with self._lock:
+            now = self.clock()
+            if self._versions_at is None or now - self._versions_at >= self.version_interval:
+                self._poll_versions()
+                self._versions_at = now
+                # 之前不存在的账户可能已经创建
+                for pk in [pk for pk, state in self._accounts.items() if state is None]:
+                    del self._accounts[pk]
+            account_id = int(request['exchange_account_id'])
+            if account_id not in self._accounts:
+                self._accounts[account_id] = self._load_account(account_id)
+            account = self._accounts[account_id]
+            if account is None:
+                return
+            rules = self._rules.get(account.tenant_id)
+            if rules is None:
+                rules = self._rules[account.tenant_id] = compile_rules(account.tenant_id)
+            if not rules.needs_account:
+                return
+            if now - account.positions_at >= self.state_ttl:
+                self._load_positions(account_id, account)
+                account.positions_at = now
+            if now - account.balances_at >= self.balance_ttl:
+                self._load_balances(account_id, account)
+                account.balances_at = now
+
+    def _poll_versions(self):
+        try:
+            versions = self.client.hgetall(RULE_VERSION_KEY)
+        except redis.RedisError as e:
+            logger.warning(f"读取风控规则版本失败: {e}")
+            return
+        for tenant_id, version in versions.items():
+            if self._versions.get(tenant_id) != version:
+                self.invalidate(tenant_id)
+        self._versions = versions
+
+    @staticmethod
+    def _load_account(account_id: int) -> Optional[AccountState]:
+        from apps.trading.models import ExchangeAccount
+        tenant_id = ExchangeAccount.all_objects.filter(pk=account_id).values_list('tenant_id', flat=True).first()
+        return AccountState(str(tenant_id)) if tenant_id is not None else None
+
+    def _load_positions(self, account_id: int, account: AccountState):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hgetall(positions_key(account_id))
+        pipe.hget(PNL_KEY, str(account_id))
+        try:
+            positions, pnl = pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"读取账户持仓失败 {account_id}: {e}")
+            return
+        account.positions = {}
+        for symbol, value in positions.items():
+            position = json.loads(value)
+            account.positions[symbol] = (float(position.get('amount') or 0.0), position.get('mark_price'))
+        account.net_pnl = float(json.loads(pnl).get('net_pnl') or 0.0) if pnl else 0.0
+        account.equity = {}
+
+    @staticmethod
+    def _load_balances(account_id: int, account: AccountState):
+        from apps.trading.models import AccountBalance
+        account.balances = {
+            asset: float(total)
+            for asset, total in AccountBalance.all_objects.filter(exchange_account_id=account_id).values_list(
+                'asset', 'total')
+        }
+        account.equity = {}
+
+    # -- 检查（只做内存计算）----------------------------------------------
+
+    def check(self, request: Dict[str, Any]) -> CheckResult:
+        """检查订单请求，缓存过期时先刷新"""
+        if self.needs_refresh(request):
+            self.refresh(request)
+        result = self.evaluate(request)
+        self.checked += 1
+        if not result.accepted:
+            self.rejected += 1
+        return result
+
+    def evaluate(self, request: Dict[str, Any]) -> CheckResult:
+        """按已缓存的规则集和账户状态检查，通过时把订单计入缓存的持仓"""
+        account = self._accounts.get(int(request['exchange_account_id']))
+        if account is None:
+            return CheckResult(False, [RejectReason(REASON_ACCOUNT_UNKNOWN, '交易账户不存在')])
+        rules = self._rules.get(account.tenant_id)
+        if rules is None or rules.empty:
+            return ACCEPTED
+
+        symbol = request['symbol']
+        amount = float(request['amount'])
+        signed = amount if request['side'] == 'buy' else -amount
+        current, mark = account.positions.get(symbol, (0.0, None))
+        projected = current + signed
+        if request.get('reduce_only') or abs(projected) <= abs(current) + EPS:
+            return ACCEPTED
+
+        result = CheckResult()
+        if rules.tripped:
+            now = time.time()
+            for reason, blocking, expires in rules.tripped:
+                if expires is None or expires > now:
+                    (result.reasons if blocking else result.warnings).append(reason)
+
+        if rules.needs_account:
+            quote = quote_asset(symbol)
+            equity = account.account_equity(quote)
+            if equity is None or equity <= EPS:
+                result.reasons.append(RejectReason(REASON_EQUITY_UNAVAILABLE, f'没有 {quote} 余额，无法计算风险比例'))
+            else:
+                if rules.position_rules:
+                    price = request.get('price') or mark
+                    if not price:
+                        result.reasons.append(RejectReason(REASON_PRICE_UNAVAILABLE, f'{symbol} 没有价格，无法计算持仓比例'))
+                    else:
+                        ratio = abs(projected) * float(price) / equity
+                        self._apply(rules.position_rules, ratio, result)
+                if rules.loss_rules:
+                    self._apply(rules.loss_rules, max(-account.net_pnl, 0.0) / equity, result)
+
+        result.accepted = not result.reasons
+        if result.accepted:
+            account.positions[symbol] = (projected, mark)
+        return result
+
+    @staticmethod
+    def _apply(rules: List[RiskRule], value: float, result: CheckResult):
+        for rule in rules:
+            if rule.breached(value):
+                (result.reasons if rule.blocking else result.warnings).append(rule.reason(value))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'checked': self.checked,
+            'rejected': self.rejected,
+            'tenants': len(self._rules),
+            'accounts': len(self._accounts),
+        }
+
+
+_checker: Optional[PreTradeChecker] = None
+_checker_lock = threading.Lock()
+
+
+def get_pretrade_checker() -> PreTradeChecker:
+    """获取进程内共享的下单前检查"""
+    global _checker
+    if _checker is None:
+        with _checker_lock:
+            if _checker is None:
+                _checker = PreTradeChecker()
+    return _checker
+
+
+def invalidate_tenant_rules(tenant_id):
+    """
+    租户的规则或风险指标变化：本进程立即失效，事务提交后递增 Redis 中的版本号通知其他进程
+    """
+    if _checker is not None:
+        _checker.invalidate(tenant_id)
+
+    def bump():
+        try:
+            get_gateway_client().hincrby(RULE_VERSION_KEY, str(tenant_id), 1)
+        except redis.RedisError as e:
+            logger.warning(f"更新风控规则版本失败 {tenant_id}: {e}")
+
+    transaction.on_commit(bump)
+
+
+@receiver([post_save, post_delete], sender=RiskAlert)
+@receiver([post_save, post_delete], sender=RiskMetrics)
+def _risk_changed(sender, instance, **kwargs):
+    invalidate_tenant_rules(instance.tenant_id)
@@ -0,0 +1,141 @@
+"""
+风险控制测试
+"""
+import json
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+import fakeredis
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from apps.core.models import Tenant
+from apps.trading.gateway import OrderChannel, execute_order_request
+from apps.trading.models import AccountBalance, ExchangeAccount, Order
+from apps.trading.positions import PNL_KEY, positions_key
+from .models import RiskAlert, RiskMetrics
+from .pretrade import RULE_VERSION_KEY, PreTradeChecker, invalidate_tenant_rules
+
+User = get_user_model()
+
+
+class PreTradeCheckTest(TestCase):
+    """下单前风控检查测试"""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name='测试租户', schema_name='test_tenant')
+        user = User.objects.create_user(username='trader', password='testpass123', tenant=self.tenant)
+        self.account = ExchangeAccount(tenant=self.tenant, user=user, name='主账户', exchange='binance')
+        self.account.set_api_credentials('key', 'secret')
+        self.account.save()
+        AccountBalance.objects.create(
+            tenant=self.tenant, exchange_account=self.account, asset='USDT', total=Decimal('10000'),
+        )
+        self.client = fakeredis.FakeRedis(decode_responses=True)
+        # 持仓引擎的快照：0.05 BTC，标记价格 60000，权益 = 10000 + 3000
+        self.client.hset(positions_key(self.account.pk), 'BTC/USDT', json.dumps({'amount': 0.05, 'mark_price': 60000.0}))
+        self.client.hset(PNL_KEY, str(self.account.pk), json.dumps({'net_pnl': -2000.0}))
+        self.now = 0.0
+
+    def checker(self, **kwargs):
+        return PreTradeChecker(client=self.client, clock=lambda: self.now, **kwargs)
+
+    def alert(self, alert_type, threshold, level='high', operator='>'):
+        return RiskAlert.objects.create(
+            tenant=self.tenant, name=alert_type, alert_type=alert_type, alert_level=level,
+            threshold_value=Decimal(threshold), comparison_operator=operator,
+        )
+
+    def order(self, side='buy', amount=0.05, **fields):
+        return {
+            'client_order_id': 'o1', 'exchange_account_id': self.account.pk, 'symbol': 'BTC/USDT', 'side': side,
+            'amount': amount, 'price': 60000.0, **fields,
+        }
+
+    def test_position_ratio_counts_accepted_orders(self):
+        alert = self.alert('position_ratio', '0.5')
+        checker = self.checker()
+
+        self.assertTrue(checker.check(self.order()).accepted)  # 0.1 × 60000 / 13000 ≈ 0.46
+        result = checker.check(self.order())  # 0.15 × 60000 / 13000 ≈ 0.69
+        self.assertFalse(result.accepted)
+        reason = result.to_dict()['reasons'][0]
+        self.assertEqual((reason['code'], reason['alert_id'], reason['threshold']), ('position_ratio', alert.pk, 0.5))
+        self.assertAlmostEqual(reason['value'], 9000 / 13000)
+
+        # 减仓和 reduce_only 总是放行
+        self.assertTrue(checker.check(self.order('sell', 0.1)).accepted)
+        self.assertTrue(checker.check(self.order(amount=1.0, reduce_only=True)).accepted)
+        self.assertEqual(checker.stats()['rejected'], 1)
+
+    def test_warnings_metrics_and_invalidation(self):
+        alert = self.alert('loss_ratio', '0.1', level='medium')
+        checker = self.checker()
+
+        # 中度预警只给出警告：亏损 2000 / 权益 13000
+        result = checker.check(self.order())
+        self.assertTrue(result.accepted)
+        self.assertEqual([w.code for w in result.warnings], ['loss_ratio'])
+
+        # 规则修改后本进程立即重新编译
+        alert.alert_level = 'high'
+        alert.save()
+        self.assertEqual([r.code for r in checker.check(self.order()).reasons], [])
+        from . import pretrade
+        with patch.object(pretrade, '_checker', checker):
+            alert.save()
+        self.assertEqual([r.code for r in checker.check(self.order()).reasons], ['loss_ratio'])
+
+        # 指标类规则按最新的账户级指标判断
+        alert.delete()
+        self.alert('drawdown', '0.2')
+        RiskMetrics.objects.create(tenant=self.tenant, metric_type='drawdown', metric_value=Decimal('0.3'),
+                                   data_source='test')
+        checker.invalidate()
+        result = checker.check(self.order())
+        self.assertEqual([r.code for r in result.reasons], ['drawdown'])
+        self.assertTrue(checker.check(self.order('sell')).accepted)
+
+    def test_other_processes_reload_on_version_change(self):
+        self.alert('position_ratio', '0.9')
+        checker = self.checker(version_interval=1.0)
+        self.assertTrue(checker.check(self.order(amount=0.1)).accepted)
+
+        with patch('apps.risk.pretrade.get_gateway_client', return_value=self.client):
+            with self.captureOnCommitCallbacks(execute=True):
+                RiskAlert.all_objects.filter(tenant=self.tenant).update(threshold_value=Decimal('0.1'))
+                invalidate_tenant_rules(self.tenant.pk)
+        self.assertEqual(self.client.hget(RULE_VERSION_KEY, str(self.tenant.pk)), '1')
+
+        # 版本号按间隔检查，持仓快照按有效期刷新
+        self.assertTrue(checker.check(self.order(amount=0.01)).accepted)
+        self.now += 1.0
+        self.assertEqual([r.code for r in checker.check(self.order(amount=0.01)).reasons], ['position_ratio'])
+
+    def test_missing_price_or_equity_rejects(self):
+        self.alert('position_ratio', '0.5')
+        checker = self.checker()
+        result = checker.check(self.order(symbol='ETH/USDT', price=None))
+        self.assertEqual([r.code for r in result.reasons], ['price_unavailable'])
+        result = checker.check(self.order(symbol='ETH/BTC'))
+        self.assertEqual([r.code for r in result.reasons], ['equity_unavailable'])
+        self.assertEqual([r.code for r in checker.check(self.order(exchange_account_id=0)).reasons],
+                         ['account_unknown'])
+
+    @override_settings(PRETRADE_CHECK_ENABLED=True)
+    def test_execute_order_reports_risk_rejection(self):
+        self.alert('position_ratio', '0.1')
+        channel = OrderChannel(client=fakeredis.FakeRedis(decode_responses=True))
+        exchange = MagicMock()
+        pool = MagicMock()
+        pool.get.return_value.exchange = exchange
+        request = {**self.order(), 'action': 'place', 'exchange': 'binance', 'order_type': 'limit'}
+        with patch('apps.market.connector_pool.get_connector_pool', return_value=pool), \
+                patch('apps.risk.pretrade._checker', self.checker()):
+            reports = execute_order_request(request, channel=channel)
+
+        exchange.create_order.assert_not_called()
+        self.assertEqual(reports[0]['type'], 'rejected')
+        self.assertEqual(reports[0]['risk'][0]['code'], 'position_ratio')
+        self.assertIn('风控拒绝', reports[0]['error'])
+        self.assertEqual(Order.objects.get(client_order_id='o1').status, 'rejected')
@@ -4,4 +4,8 @@ from django.apps import AppConfig
 class StrategiesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.strategies'
-    verbose_name = '策略管理'
\ No newline at end of file
+    verbose_name = '策略管理'
+
+    def ready(self):
+        # 注册回测删除时的结果文件清理
+        from . import result_store  # noqa: F401
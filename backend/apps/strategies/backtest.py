@@ -0,0 +1,339 @@
+"""
+向量化回测引擎
+
+面向"信号型"策略：策略根据完整的K线数组一次性计算出每根K线收盘时的目标仓位
+（-1 ~ 1，占当前权益的比例），引擎用数组运算推导持仓、成交、手续费、滑点和权益曲线，
+没有逐K线的Python循环，多年的1分钟数据也能在数秒内完成。
+
+撮合约定：
+- 第 t 根K线收盘产生的信号，在第 t+1 根K线开盘价成交（不使用未来数据）；
+- 手续费和滑点按换手比例从权益中扣除；
+- 仓位按权益比例计算，逐K线复利（空头仓位等价于每根K线按比例再平衡）。
+
+需要盘中挂单、止损等撮合细节的策略使用事件驱动回测。
+"""
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from . import indicators
+
+logger = logging.getLogger(__name__)
+
+# K线数组字段
+KLINE_FIELDS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+
+# 时间周期对应的秒数
+TIMEFRAME_SECONDS = {
+    '1m': 60,
+    '5m': 300,
+    '15m': 900,
+    '30m': 1800,
+    '1h': 3600,
+    '4h': 14400,
+    '1d': 86400,
+    '1w': 604800,
+    '1M': 2592000,
+}
+
+# 加密货币市场全年无休
+SECONDS_PER_YEAR = 365 * 86400
+
+# 年化收益率上限（999900%）：短区间外推的年化值没有意义，且 Backtest.annual_return 为 DecimalField(10, 4)
+MAX_ANNUAL_RETURN = 9999.0
+
+
+class BacktestError(Exception):
+    """回测异常"""
+    pass
+
+
+def periods_per_year(timeframe: str) -> float:
+    """每年的K线数量，用于年化"""
+    try:
+        return SECONDS_PER_YEAR / TIMEFRAME_SECONDS[timeframe]
+    except KeyError:
+        raise BacktestError(f'不支持的时间周期: {timeframe}')
+
+
+def load_kline_arrays(symbol, timeframe: str, start: datetime, end: datetime) -> Dict[str, np.ndarray]:
+    """
+    从数据库加载K线为列式数组
+
+    价格在SQL中直接转换为浮点数，避免逐行构造 Decimal。
+
+    Returns:
+        {timestamp: int64毫秒, open/high/low/close/volume: float64}
+    """
+    from apps.market.models import Kline
+
+    rows = (
+        Kline.objects
+        .filter(symbol=symbol, timeframe=timeframe, timestamp__gte=start, timestamp__lte=end)
+        .order_by('timestamp')
+        .annotate(
+            o=Cast('open_price', FloatField()),
+            h=Cast('high_price', FloatField()),
+            l=Cast('low_price', FloatField()),
+            c=Cast('close_price', FloatField()),
+            v=Cast('volume', FloatField()),
+        )
+        .values_list('timestamp', 'o', 'h', 'l', 'c', 'v')
+    )
+    frame = pd.DataFrame.from_records(rows.iterator(chunk_size=20000), columns=KLINE_FIELDS)
+    if frame.empty:
+        return {name: np.empty(0, dtype=np.int64 if name == 'timestamp' else np.float64) for name in KLINE_FIELDS}
+
+    timestamps = pd.to_datetime(frame['timestamp'], utc=True).dt.tz_convert(None)
+    data = {'timestamp': timestamps.to_numpy().astype('datetime64[ms]').astype(np.int64)}
+    for name in KLINE_FIELDS[1:]:
+        data[name] = frame[name].to_numpy(dtype=np.float64)
+    return data
+
+
+# ---------------------------------------------------------------------------
+# 信号生成器
+# ---------------------------------------------------------------------------
+
+SIGNAL_GENERATORS: Dict[str, Callable[..., np.ndarray]] = {}
+
+
+def register_signal(name: str):
+    """注册信号生成器，名称与 Strategy.strategy_type 对应"""
+    def decorator(func):
+        SIGNAL_GENERATORS[name] = func
+        return func
+    return decorator
+
+
+def get_signal_generator(name: str) -> Callable[..., np.ndarray]:
+    try:
+        return SIGNAL_GENERATORS[name]
+    except KeyError:
+        raise BacktestError(f'策略类型 {name} 不支持向量化回测')
+
+
+def hold_between(entries: np.ndarray, exits: np.ndarray, value: float = 1.0) -> np.ndarray:
+    """
+    将进出场事件转换为持仓状态
+
+    进场后一直持有到出场事件，同一根K线同时出现时以出场为准。
+    """
+    n = len(entries)
+    index = np.arange(n)
+    events = entries | exits
+    last_event = np.maximum.accumulate(np.where(events, index, -1))
+    state = np.zeros(n, dtype=np.float64)
+    has_event = last_event >= 0
+    state[has_event] = np.where(exits[last_event[has_event]], 0.0, value)
+    return state
+
+
+@register_signal('ma_cross')
+def ma_cross_signal(data, fast_period: int = 10, slow_period: int = 30, allow_short: bool = False):
+    """均线交叉：快线在慢线之上做多，之下空仓（或做空）"""
+    if fast_period >= slow_period:
+        raise BacktestError('快线周期必须小于慢线周期')
+    close = data['close']
+    fast = indicators.sma(close, fast_period)
+    slow = indicators.sma(close, slow_period)
+    signal = np.where(fast > slow, 1.0, -1.0 if allow_short else 0.0)
+    signal[np.isnan(slow)] = 0.0
+    return signal
+
+
+@register_signal('rsi_reversion')
+def rsi_reversion_signal(data, period: int = 14, lower: float = 30, upper: float = 70):
+    """RSI均值回归：超卖进场，超买离场"""
+    value = indicators.rsi(data['close'], period)
+    return hold_between(value < lower, value > upper)
+
+
+@register_signal('bollinger_breakout')
+def bollinger_breakout_signal(data, period: int = 20, num_std: float = 2.0):
+    """布林带突破：收盘突破上轨进场，跌破中轨离场"""
+    close = data['close']
+    upper, middle, _ = indicators.bollinger_bands(close, period, num_std)
+    return hold_between(close > upper, close < middle)
+
+
+# ---------------------------------------------------------------------------
+# 回测
+# ---------------------------------------------------------------------------
+
+@dataclass
+class BacktestResult:
+    """回测结果"""
+    timestamps: np.ndarray
+    equity: np.ndarray
+    positions: np.ndarray
+    returns: np.ndarray
+    trades: Dict[str, np.ndarray]
+    metrics: Dict[str, float] = field(default_factory=dict)
+    fills: Optional[Dict[str, np.ndarray]] = None  # 成交明细列（事件驱动引擎）
+
+    def equity_curve(self, max_points: Optional[int] = None) -> List[List[float]]:
+        """权益曲线 [[时间戳毫秒, 权益], ...]，超过 max_points 时等间隔抽样"""
+        index = np.arange(len(self.equity))
+        if max_points and len(index) > max_points:
+            index = np.unique(np.linspace(0, len(index) - 1, max_points).astype(np.int64))
+        return [[int(self.timestamps[i]), round(float(self.equity[i]), 2)] for i in index]
+
+
+def _segment_trades(positions: np.ndarray, previous: np.ndarray, log_gap: np.ndarray,
+                    log_intrabar: np.ndarray, fee_cost: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    按持仓区间拆分交易
+
+    持仓不变的连续K线构成一个区间，非零持仓的区间即一笔交易；
+    开盘跳空收益属于上一区间，换仓成本按平仓/开仓比例分摊。
+    """
+    n = len(positions)
+    changed = positions != previous
+    segment = np.cumsum(changed)
+    segment_count = segment[-1] + 1
+
+    flipped = np.sign(positions) != np.sign(previous)
+    exit_share = np.where(flipped, np.abs(previous), 0.0)
+    turnover = np.abs(positions - previous)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exit_ratio = np.where(turnover > 0, exit_share / turnover, 0.0)
+    log_cost = np.log1p(-np.minimum(fee_cost, 1.0 - 1e-12))
+
+    # 跳空和平仓成本记到上一区间
+    owner_prev = segment - changed
+    totals = np.bincount(segment, weights=log_intrabar + log_cost * (1 - exit_ratio), minlength=segment_count)
+    totals += np.bincount(owner_prev, weights=log_gap + log_cost * exit_ratio, minlength=segment_count)
+
+    starts = np.flatnonzero(np.concatenate(([True], changed[1:])))
+    ends = np.concatenate((starts[1:] - 1, [n - 1]))
+    sides = positions[starts]
+    mask = sides != 0
+    return {
+        'entry_index': starts[mask],
+        'exit_index': ends[mask],
+        'size': sides[mask],
+        'return': np.expm1(totals[segment[starts[mask]]]),
+        'is_open': (ends[mask] == n - 1),
+    }
+
+
+def run_vectorized_backtest(data: Dict[str, np.ndarray], signal: np.ndarray,
+                            initial_capital: float = 10000.0, fee_rate: float = 0.001,
+                            slippage: float = 0.0005, timeframe: str = '1h') -> BacktestResult:
+    """
+    执行向量化回测
+
+    Args:
+        data: load_kline_arrays 返回的K线数组
+        signal: 每根K线收盘时的目标仓位（权益比例，-1 ~ 1）
+        initial_capital: 初始资金
+        fee_rate: 手续费率（按成交额）
+        slippage: 滑点（按成交额比例）
+        timeframe: 时间周期，用于年化
+    """
+    open_ = np.asarray(data['open'], dtype=np.float64)
+    close = np.asarray(data['close'], dtype=np.float64)
+    n = len(close)
+    if n < 2:
+        raise BacktestError('K线数量不足，无法回测')
+    signal = np.nan_to_num(np.clip(np.asarray(signal, dtype=np.float64), -1.0, 1.0))
+    if len(signal) != n:
+        raise BacktestError('信号长度与K线数量不一致')
+
+    # 第 t 根K线持有的仓位在开盘时建立，来自第 t-1 根的信号
+    positions = np.concatenate(([0.0], signal[:-1]))
+    previous = np.concatenate(([0.0], positions[:-1]))
+
+    prev_close = np.concatenate(([open_[0]], close[:-1]))
+    gap = previous * (open_ / prev_close - 1.0)
+    turnover = np.abs(positions - previous)
+    cost = turnover * (fee_rate + slippage)
+    intrabar = positions * (close / open_ - 1.0)
+
+    growth = np.maximum((1.0 + gap) * (1.0 - cost) * (1.0 + intrabar), 0.0)
+    equity = initial_capital * np.cumprod(growth)
+    returns = growth - 1.0
+
+    equity_before = np.concatenate(([initial_capital], equity[:-1]))
+    fees_paid = float(np.sum(equity_before * (1.0 + gap) * cost))
+
+    with np.errstate(divide='ignore'):
+        trades = _segment_trades(
+            positions, previous,
+            np.log(np.maximum(1.0 + gap, 1e-300)),
+            np.log(np.maximum(1.0 + intrabar, 1e-300)),
+            cost,
+        )
+
+    result = BacktestResult(
+        timestamps=np.asarray(data['timestamp']),
+        equity=equity,
+        positions=positions,
+        returns=returns,
+        trades=trades,
+    )
+    result.metrics = compute_metrics(result, initial_capital, periods_per_year(timeframe))
+    result.metrics['fees_paid'] = round(fees_paid, 4)
+    result.metrics['turnover'] = round(float(turnover.sum()), 4)
+    return result
+
+
+def compute_metrics(result: BacktestResult, initial_capital: float, bars_per_year: float) -> Dict[str, float]:
+    """计算收益、风险和交易统计指标"""
+    equity = result.equity
+    returns = result.returns
+    final = float(equity[-1])
+    total_return = final / initial_capital - 1.0
+
+    years = len(equity) / bars_per_year
+    if years > 0 and final > 0:
+        # 在对数空间计算并截断，几百根分钟K线外推一年不会溢出
+        log_growth = min(np.log(final / initial_capital) / years, np.log1p(MAX_ANNUAL_RETURN))
+        annual_return = float(np.expm1(log_growth))
+    else:
+        annual_return = -1.0
+
+    peak = np.maximum.accumulate(equity)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdown = np.where(peak > 0, equity / peak - 1.0, 0.0)
+    max_drawdown = float(-drawdown.min())
+
+    std = float(returns.std())
+    sharpe = float(returns.mean()) / std * np.sqrt(bars_per_year) if std > 0 else 0.0
+    downside = returns[returns < 0]
+    downside_std = float(np.sqrt(np.mean(downside ** 2))) if len(downside) else 0.0
+    sortino = float(returns.mean()) / downside_std * np.sqrt(bars_per_year) if downside_std > 0 else 0.0
+
+    trade_returns = result.trades['return']
+    wins = trade_returns[trade_returns > 0]
+    losses = trade_returns[trade_returns <= 0]
+    total_trades = len(trade_returns)
+
+    return {
+        'initial_capital': initial_capital,
+        'final_capital': round(final, 2),
+        'total_return': round(total_return, 6),
+        'annual_return': round(annual_return, 6),
+        'max_drawdown': round(max_drawdown, 6),
+        'sharpe_ratio': round(sharpe, 4),
+        'sortino_ratio': round(sortino, 4),
+        'calmar_ratio': round(annual_return / max_drawdown, 4) if max_drawdown > 0 else 0.0,
+        'volatility': round(std * np.sqrt(bars_per_year), 6),
+        'total_trades': total_trades,
+        'win_rate': round(len(wins) / total_trades * 100, 2) if total_trades else 0.0,
+        'avg_trade_return': round(float(trade_returns.mean()), 6) if total_trades else 0.0,
+        'best_trade': round(float(trade_returns.max()), 6) if total_trades else 0.0,
+        'worst_trade': round(float(trade_returns.min()), 6) if total_trades else 0.0,
+        'profit_factor': (
+            round(float(wins.sum() / -losses.sum()), 4) if len(losses) and losses.sum() < 0 else 0.0
+        ),
+        'exposure': round(float(np.mean(result.positions != 0)), 4),
+        'bars': len(equity),
+    }
@@ -0,0 +1,721 @@
+"""
+事件驱动回测引擎
+
+按时间顺序回放K线和逐笔成交，经撮合模拟器处理限价单、止损单、止损限价单、
+跟踪止损和部分成交，策略通过与实盘一致的 StrategyContext 接口交互。
+
+- 事件队列基于 heapq 做多路归并：每个数据源只在堆中保留下一条事件，
+  堆的大小与数据源数量相关而与数据量无关；
+- 行情、订单、成交对象都使用 __slots__；
+- 同一时间戳上逐笔成交先于K线处理，K线事件的时间为收盘时间。
+
+撮合约定（K线）：
+- 在上一个事件中提交的订单，用当前K线的开高低撮合；
+- 市价单按开盘价加滑点成交；限价单在价格触及时按限价成交（开盘即穿越时按开盘价）；
+- 止损单在价格触及止损价时按 max/min(开盘价, 止损价) 加滑点成交；
+- 跟踪止损先用已有极值判断是否触发，未触发再用本根K线更新极值，避免同一根K线内先抬高再触发；
+- 设置 participation_rate 时，每根K线（或每笔成交）可成交数量受成交量限制，剩余部分保持挂单；
+- 同时回放逐笔成交的交易对只按逐笔撮合，K线仅推送给策略。
+"""
+import heapq
+import logging
+import time
+from itertools import count
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from .backtest import (
+    BacktestError, BacktestResult, SECONDS_PER_YEAR, TIMEFRAME_SECONDS, compute_metrics,
+)
+from .indicator_graph import IndicatorGraph, IndicatorSubscriptions
+from .strategy import (
+    ORDER_CANCELLED, ORDER_FILLED, ORDER_PARTIAL, ORDER_REJECTED, ORDER_TYPES,
+    BaseStrategy, Bar, Fill, Order, Position, StrategyContext, Tick,
+)
+
+logger = logging.getLogger(__name__)
+
+# 同一时间戳的处理顺序
+PRIORITY_TICK = 0
+PRIORITY_BAR = 1
+
+_EPSILON = 1e-12
+
+
+def load_trade_arrays(symbol, start, end) -> Dict[str, np.ndarray]:
+    """
+    从数据库加载逐笔成交为列式数组
+
+    Returns:
+        {timestamp: int64毫秒, price/amount: float64, side: bool(买方主动)}
+    """
+    from apps.market.models import Trade
+
+    rows = (
+        Trade.objects
+        .filter(symbol=symbol, timestamp__gte=start, timestamp__lte=end)
+        .order_by('timestamp')
+        .annotate(p=Cast('price', FloatField()), a=Cast('amount', FloatField()))
+        .values_list('timestamp', 'p', 'a', 'side')
+    )
+    frame = pd.DataFrame.from_records(rows.iterator(chunk_size=20000), columns=['timestamp', 'price', 'amount', 'side'])
+    if frame.empty:
+        return {
+            'timestamp': np.empty(0, dtype=np.int64), 'price': np.empty(0), 'amount': np.empty(0),
+            'is_buy': np.empty(0, dtype=bool),
+        }
+    timestamps = pd.to_datetime(frame['timestamp'], utc=True).dt.tz_convert(None)
+    return {
+        'timestamp': timestamps.to_numpy().astype('datetime64[ms]').astype(np.int64),
+        'price': frame['price'].to_numpy(dtype=np.float64),
+        'amount': frame['amount'].to_numpy(dtype=np.float64),
+        'is_buy': (frame['side'] == 'buy').to_numpy(),
+    }
+
+
+class EventQueue:
+    """
+    基于堆的事件队列
+
+    数据源是按时间排序的 (ts, event) 迭代器，出队时才从对应数据源补充下一条；
+    也可以直接 push 单个事件（如定时器）。
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._seq = count()
+
+    def add_source(self, source: Iterator, priority: int):
+        """添加有序数据源"""
+        for ts, event in source:
+            heapq.heappush(self._heap, (ts, priority, next(self._seq), event, source))
+            break
+
+    def push(self, ts: int, event, priority: int = PRIORITY_TICK):
+        heapq.heappush(self._heap, (ts, priority, next(self._seq), event, None))
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __iter__(self):
+        heap = self._heap
+        heappop, heapreplace = heapq.heappop, heapq.heapreplace
+        seq = self._seq
+        while heap:
+            ts, priority, _, event, source = heap[0]
+            if source is not None:
+                item = next(source, None)
+                if item is not None:
+                    # 用同一数据源的下一条替换堆顶，一次调整完成出队和补充
+                    heapreplace(heap, (item[0], priority, next(seq), item[1], source))
+                else:
+                    heappop(heap)
+            else:
+                heappop(heap)
+            yield ts, event
+
+
+def _bar_source(symbol: str, data: Dict[str, np.ndarray], timeframe: str) -> Iterator:
+    """K线数据源，事件时间为收盘时间"""
+    duration = TIMEFRAME_SECONDS[timeframe] * 1000
+    columns = [data[name].tolist() for name in ('timestamp', 'open', 'high', 'low', 'close', 'volume')]
+    for ts, o, h, l, c, v in zip(*columns):
+        close_ts = ts + duration
+        yield close_ts, Bar(close_ts, symbol, o, h, l, c, v)
+
+
+def _tick_source(symbol: str, data: Dict[str, np.ndarray]) -> Iterator:
+    """逐笔成交数据源"""
+    sides = data['is_buy'].tolist() if 'is_buy' in data else [True] * len(data['timestamp'])
+    for ts, price, amount, is_buy in zip(data['timestamp'].tolist(), data['price'].tolist(),
+                                         data['amount'].tolist(), sides):
+        yield ts, Tick(ts, symbol, price, amount, 'buy' if is_buy else 'sell')
+
+
+class StopRule:
+    """
+    止损止盈规则（对应 risk.StopLossRule）
+
+    持仓建立或变化后，引擎按规则挂出只减仓的保护单；持仓归零时撤销剩余保护单。
+    """
+    __slots__ = ('rule_type', 'trigger_condition', 'trigger_value', 'trailing_distance', 'action_type', 'close_ratio')
+
+    def __init__(self, rule_type, trigger_condition='percentage', trigger_value=0.0,
+                 trailing_distance=None, action_type='full_close', close_ratio=1.0):
+        self.rule_type = rule_type
+        self.trigger_condition = trigger_condition
+        self.trigger_value = float(trigger_value)
+        self.trailing_distance = float(trailing_distance) if trailing_distance is not None else None
+        self.action_type = action_type
+        self.close_ratio = close_ratio
+
+    @classmethod
+    def from_model(cls, rule) -> 'StopRule':
+        """由 StopLossRule 模型转换"""
+        ratio = float(rule.action_params.get('ratio', 1.0)) if rule.action_type == 'partial_close' else 1.0
+        return cls(
+            rule.rule_type, rule.trigger_condition, rule.trigger_value,
+            rule.trailing_distance, rule.action_type, ratio,
+        )
+
+    def _distance(self, position: Position) -> float:
+        """百分比/金额触发条件下，触发价与开仓均价的距离（价格单位）"""
+        if self.trigger_condition == 'percentage':
+            return position.avg_price * self.trigger_value / 100
+        return self.trigger_value / abs(position.amount)
+
+    def build_order(self, ctx: 'BacktestContext', position: Position) -> Optional[Order]:
+        """根据当前持仓生成保护单"""
+        is_long = position.amount > 0
+        side = 'sell' if is_long else 'buy'
+        amount = abs(position.amount) * self.close_ratio
+        sign = 1.0 if is_long else -1.0
+
+        if self.rule_type == 'trailing_stop':
+            trail = (self.trailing_distance if self.trailing_distance is not None else self.trigger_value) / 100
+            return ctx.place_order(position.symbol, side, amount, 'trailing_stop', trail=trail,
+                                   tag='trailing_stop', reduce_only=True)
+
+        if self.trigger_condition == 'price':
+            trigger = self.trigger_value
+        elif self.rule_type == 'stop_loss':
+            trigger = position.avg_price - sign * self._distance(position)
+        else:
+            trigger = position.avg_price + sign * self._distance(position)
+
+        if self.rule_type == 'take_profit':
+            return ctx.place_order(position.symbol, side, amount, 'limit', price=trigger,
+                                   tag='take_profit', reduce_only=True)
+        if self.action_type == 'limit_sell':
+            return ctx.place_order(position.symbol, side, amount, 'stop_limit', price=trigger,
+                                   stop_price=trigger, tag='stop_loss', reduce_only=True)
+        return ctx.place_order(position.symbol, side, amount, 'stop', stop_price=trigger,
+                               tag='stop_loss', reduce_only=True)
+
+
+class MatchingEngine:
+    """撮合模拟器"""
+
+    def __init__(self, fee_rate: float = 0.001, maker_fee_rate: Optional[float] = None,
+                 slippage: float = 0.0005, participation_rate: Optional[float] = None):
+        self.fee_rate = fee_rate
+        self.maker_fee_rate = fee_rate if maker_fee_rate is None else maker_fee_rate
+        self.slippage = slippage
+        self.participation_rate = participation_rate
+        self.orders: Dict[str, List[Order]] = {}
+
+    def add(self, order: Order):
+        self.orders.setdefault(order.symbol, []).append(order)
+
+    def has_orders(self, symbol: str) -> bool:
+        return bool(self.orders.get(symbol))
+
+    def _fill(self, order: Order, price: float, amount: float, ts: int, liquidity: str) -> Fill:
+        rate = self.maker_fee_rate if liquidity == 'maker' else self.fee_rate
+        fee = price * amount * rate
+        total = order.filled + amount
+        order.avg_price = (order.avg_price * order.filled + price * amount) / total
+        order.filled = total
+        order.fee += fee
+        order.updated_ts = ts
+        order.status = ORDER_FILLED if order.remaining <= _EPSILON else ORDER_PARTIAL
+        return Fill(ts, order.id, order.symbol, order.side, price, amount, fee, liquidity, order.tag)
+
+    def _taker_price(self, side: str, price: float) -> float:
+        return price * (1 + self.slippage) if side == 'buy' else price * (1 - self.slippage)
+
+    def match_bar(self, bar: Bar, limits, on_fill) -> int:
+        """
+        用K线撮合挂单
+
+        Args:
+            limits: 可成交数量回调 (order, 期望数量, 价格) -> 实际数量，用于只减仓和资金检查
+            on_fill: 成交回调，每笔成交立即结算，后续订单的检查基于最新持仓
+
+        Returns:
+            成交笔数
+        """
+        orders = self.orders.get(bar.symbol)
+        if not orders:
+            return 0
+        fills = 0
+        budget = bar.volume * self.participation_rate if self.participation_rate else float('inf')
+        o, h, l = bar.open, bar.high, bar.low
+
+        for order in list(orders):
+            if budget <= _EPSILON:
+                break
+            if not order.is_active:
+                continue
+            is_buy = order.side == 'buy'
+            price = liquidity = None
+            order_type = order.order_type
+
+            if order_type == 'market':
+                price, liquidity = self._taker_price(order.side, o), 'taker'
+            elif order_type == 'limit' or (order_type == 'stop_limit' and order.triggered):
+                if is_buy and l <= order.price:
+                    price, liquidity = (o, 'taker') if o <= order.price else (order.price, 'maker')
+                elif not is_buy and h >= order.price:
+                    price, liquidity = (o, 'taker') if o >= order.price else (order.price, 'maker')
+            elif order_type in ('stop', 'stop_limit'):
+                if (is_buy and h >= order.stop_price) or (not is_buy and l <= order.stop_price):
+                    if order_type == 'stop':
+                        trigger = max(o, order.stop_price) if is_buy else min(o, order.stop_price)
+                        price, liquidity = self._taker_price(order.side, trigger), 'taker'
+                    else:
+                        order.triggered = True
+                        if (is_buy and l <= order.price) or (not is_buy and h >= order.price):
+                            price, liquidity = order.price, 'maker'
+            elif order_type == 'trailing_stop':
+                if order.extreme is None:
+                    order.extreme = o
+                if is_buy:
+                    stop = order.extreme * (1 + order.trail)
+                    if h >= stop:
+                        price, liquidity = self._taker_price('buy', max(o, stop)), 'taker'
+                    else:
+                        order.extreme = min(order.extreme, l)
+                else:
+                    stop = order.extreme * (1 - order.trail)
+                    if l <= stop:
+                        price, liquidity = self._taker_price('sell', min(o, stop)), 'taker'
+                    else:
+                        order.extreme = max(order.extreme, h)
+
+            if price is None:
+                continue
+            amount = limits(order, min(order.remaining, budget), price)
+            if amount <= _EPSILON:
+                continue
+            budget -= amount
+            fill = self._fill(order, price, amount, bar.ts, liquidity)
+            if order.status == ORDER_FILLED:
+                orders.remove(order)
+            on_fill(fill)
+            fills += 1
+        return fills
+
+    def match_tick(self, tick: Tick, limits, on_fill) -> int:
+        """用逐笔成交撮合挂单，限价单的成交量不超过该笔成交数量"""
+        orders = self.orders.get(tick.symbol)
+        if not orders:
+            return 0
+        fills = 0
+        p = tick.price
+        budget = tick.amount * self.participation_rate if self.participation_rate else tick.amount
+
+        for order in list(orders):
+            if not order.is_active:
+                continue
+            is_buy = order.side == 'buy'
+            price = liquidity = None
+            cap = order.remaining
+            order_type = order.order_type
+
+            if order_type == 'market':
+                price, liquidity = self._taker_price(order.side, p), 'taker'
+            elif order_type == 'limit' or (order_type == 'stop_limit' and order.triggered):
+                if (is_buy and p <= order.price) or (not is_buy and p >= order.price):
+                    price, liquidity, cap = order.price, 'maker', min(cap, budget)
+            elif order_type in ('stop', 'stop_limit'):
+                if (is_buy and p >= order.stop_price) or (not is_buy and p <= order.stop_price):
+                    if order_type == 'stop':
+                        price, liquidity = self._taker_price(order.side, p), 'taker'
+                    else:
+                        order.triggered = True
+                        if (is_buy and p <= order.price) or (not is_buy and p >= order.price):
+                            price, liquidity, cap = order.price, 'maker', min(cap, budget)
+            elif order_type == 'trailing_stop':
+                if order.extreme is None:
+                    order.extreme = p
+                if is_buy:
+                    order.extreme = min(order.extreme, p)
+                    if p >= order.extreme * (1 + order.trail):
+                        price, liquidity = self._taker_price('buy', p), 'taker'
+                else:
+                    order.extreme = max(order.extreme, p)
+                    if p <= order.extreme * (1 - order.trail):
+                        price, liquidity = self._taker_price('sell', p), 'taker'
+
+            if price is None:
+                continue
+            amount = limits(order, cap, price)
+            if amount <= _EPSILON:
+                continue
+            if liquidity == 'maker':
+                budget -= amount
+            fill = self._fill(order, price, amount, tick.ts, liquidity)
+            if order.status == ORDER_FILLED:
+                orders.remove(order)
+            on_fill(fill)
+            fills += 1
+        return fills
+
+    def cancel(self, order: Order) -> bool:
+        orders = self.orders.get(order.symbol)
+        if orders and order in orders:
+            orders.remove(order)
+            return True
+        return False
+
+
+class BacktestContext(StrategyContext):
+    """事件驱动回测的策略上下文"""
+
+    def __init__(self, engine: 'EventBacktester'):
+        self._engine = engine
+        self._indicators = IndicatorSubscriptions(engine.indicators)
+        self.now = 0
+
+    def place_order(self, symbol, side, amount, order_type='market', price=None, stop_price=None,
+                    trail=None, tag=None, reduce_only=False) -> Order:
+        return self._engine.submit_order(symbol, side, amount, order_type, price, stop_price,
+                                         trail, tag, reduce_only)
+
+    def cancel_order(self, order_id) -> bool:
+        return self._engine.cancel_order(order_id)
+
+    def cancel_all(self, symbol=None) -> int:
+        return sum(self._engine.cancel_order(order.id) for order in self.open_orders(symbol))
+
+    def open_orders(self, symbol=None) -> List[Order]:
+        if symbol is not None:
+            return list(self._engine.matching.orders.get(symbol, ()))
+        return [order for orders in self._engine.matching.orders.values() for order in orders]
+
+    def position(self, symbol) -> Position:
+        return self._engine.get_position(symbol)
+
+    @property
+    def cash(self) -> float:
+        return self._engine.cash
+
+    @property
+    def equity(self) -> float:
+        return self._engine.equity()
+
+    def history(self, symbol, field='close', length=None) -> np.ndarray:
+        values = self._engine.history[symbol][field] if symbol in self._engine.history else []
+        if length is not None:
+            values = values[-length:]
+        return np.asarray(values, dtype=np.float64)
+
+    def log(self, message):
+        logger.debug(f"[回测 {self.now}] {message}")
+
+    def indicator(self, symbol, name, **params):
+        engine = self._engine
+        return self._indicators.get(symbol, name, lambda: engine.history.get(symbol), params)
+
+
+class EventBacktester:
+    """
+    事件驱动回测器
+
+    用法：
+        backtester = EventBacktester(MACrossStrategy(fast_period=5), initial_capital=10000)
+        backtester.add_bars('BTC/USDT', kline_arrays, '1m')
+        backtester.add_ticks('BTC/USDT', trade_arrays)
+        result = backtester.run()
+    """
+
+    def __init__(self, strategy: BaseStrategy, initial_capital: float = 10000.0, fee_rate: float = 0.001,
+                 maker_fee_rate: Optional[float] = None, slippage: float = 0.0005,
+                 participation_rate: Optional[float] = None, allow_short: bool = False,
+                 stop_rules: Sequence[StopRule] = (), record_interval: Optional[int] = None,
+                 history_size: int = 1000):
+        self.strategy = strategy
+        self.initial_capital = initial_capital
+        self.cash = initial_capital
+        self.allow_short = allow_short
+        self.stop_rules = list(stop_rules)
+        self.record_interval = record_interval
+        self.history_size = history_size
+        self.matching = MatchingEngine(fee_rate, maker_fee_rate, slippage, participation_rate)
+        self.indicators = IndicatorGraph(history_size)
+        self.context = BacktestContext(self)
+        self.queue = EventQueue()
+
+        self.positions: Dict[str, Position] = {}
+        self.prices: Dict[str, float] = {}
+        self.history: Dict[str, Dict[str, list]] = {}
+        self.orders: Dict[int, Order] = {}
+        self.fills: List[Fill] = []
+        self._order_ids = count(1)
+        self._bar_interval = None
+        self._tick_symbols = set()
+
+        # 权益记录与交易统计
+        self._record_ts: List[int] = []
+        self._record_equity: List[float] = []
+        self._record_exposure: List[float] = []
+        self._next_record = 0
+        self._open_trades: Dict[str, dict] = {}
+        self.closed_trades: List[dict] = []
+        self.events_processed = 0
+
+    # -- 数据 --------------------------------------------------------------
+
+    def add_bars(self, symbol: str, data: Dict[str, np.ndarray], timeframe: str):
+        if timeframe not in TIMEFRAME_SECONDS:
+            raise BacktestError(f'不支持的时间周期: {timeframe}')
+        interval = TIMEFRAME_SECONDS[timeframe] * 1000
+        self._bar_interval = min(self._bar_interval or interval, interval)
+        self.queue.add_source(_bar_source(symbol, data, timeframe), PRIORITY_BAR)
+
+    def add_ticks(self, symbol: str, data: Dict[str, np.ndarray]):
+        self._tick_symbols.add(symbol)
+        self.queue.add_source(_tick_source(symbol, data), PRIORITY_TICK)
+
+    # -- 订单 --------------------------------------------------------------
+
+    def submit_order(self, symbol, side, amount, order_type='market', price=None, stop_price=None,
+                     trail=None, tag=None, reduce_only=False) -> Order:
+        order = Order(next(self._order_ids), symbol, side, order_type, float(amount), price, stop_price,
+                      trail, self.context.now, tag, reduce_only)
+        self.orders[order.id] = order
+
+        reason = None
+        if side not in ('buy', 'sell') or order_type not in ORDER_TYPES:
+            reason = '订单参数错误'
+        elif amount <= 0:
+            reason = '数量必须大于0'
+        elif order_type in ('limit', 'stop_limit') and not price:
+            reason = '限价单缺少价格'
+        elif order_type in ('stop', 'stop_limit') and not stop_price:
+            reason = '止损单缺少触发价'
+        elif order_type == 'trailing_stop' and not trail:
+            reason = '跟踪止损缺少跟踪距离'
+        if reason:
+            order.status = ORDER_REJECTED
+            order.tag = f"{tag or ''}:{reason}"
+            self.strategy.on_order(self.context, order)
+            return order
+
+        if order_type == 'trailing_stop':
+            order.extreme = self.prices.get(symbol)
+        self.matching.add(order)
+        return order
+
+    def cancel_order(self, order_id) -> bool:
+        order = self.orders.get(order_id)
+        if order is None or not order.is_active:
+            return False
+        self.matching.cancel(order)
+        order.status = ORDER_CANCELLED
+        order.updated_ts = self.context.now
+        self.strategy.on_order(self.context, order)
+        return True
+
+    def _fill_limit(self, order: Order, amount: float, price: float) -> float:
+        """检查只减仓和资金，返回实际可成交数量；无法成交时撤销订单"""
+        position = self.get_position(order.symbol).amount
+        if order.reduce_only:
+            reducing = -position if order.side == 'buy' else position
+            amount = min(amount, max(reducing, 0.0))
+        elif order.side == 'sell' and not self.allow_short:
+            amount = min(amount, max(position, 0.0))
+        if order.side == 'buy' and position >= 0:
+            rate = max(self.matching.fee_rate, self.matching.maker_fee_rate)
+            affordable = self.cash / (price * (1 + rate))
+            amount = min(amount, affordable)
+
+        if amount <= _EPSILON:
+            self.matching.cancel(order)
+            order.status = ORDER_CANCELLED if order.filled or order.reduce_only else ORDER_REJECTED
+            order.updated_ts = self.context.now
+            self.strategy.on_order(self.context, order)
+            return 0.0
+        return amount
+
+    # -- 持仓与权益 ----------------------------------------------------------
+
+    def get_position(self, symbol: str) -> Position:
+        position = self.positions.get(symbol)
+        if position is None:
+            position = self.positions[symbol] = Position(symbol)
+        return position
+
+    def equity(self) -> float:
+        value = self.cash
+        for symbol, position in self.positions.items():
+            if position.amount:
+                value += position.amount * self.prices.get(symbol, position.avg_price)
+        return value
+
+    def _apply_fill(self, fill: Fill):
+        """结算一笔成交并通知策略"""
+        ctx = self.context
+        position = self.get_position(fill.symbol)
+        before = position.amount
+        notional = fill.price * fill.amount
+        self.cash += -notional - fill.fee if fill.side == 'buy' else notional - fill.fee
+        realized = position.apply_fill(fill.side, fill.amount, fill.price)
+        self.fills.append(fill)
+        self._track_trade(fill, before, position, realized)
+
+        order = self.orders[fill.order_id]
+        self.strategy.on_fill(ctx, fill)
+        if order.status == ORDER_FILLED:
+            self.strategy.on_order(ctx, order)
+
+        if self.stop_rules and position.amount != before:
+            self._refresh_protection(fill.symbol, position)
+
+    def _track_trade(self, fill: Fill, before: float, position: Position, realized: float):
+        """按持仓从零到零统计一笔完整交易"""
+        trade = self._open_trades.get(fill.symbol)
+        if trade is None:
+            trade = self._open_trades[fill.symbol] = {
+                'symbol': fill.symbol, 'entry_ts': fill.ts, 'side': 'long' if fill.side == 'buy' else 'short',
+                'cost': 0.0, 'pnl': 0.0,
+            }
+        if abs(position.amount) > abs(before) or (before == 0):
+            trade['cost'] += fill.price * fill.amount
+        trade['pnl'] += realized - fill.fee
+        if position.amount == 0 or (before != 0 and (before > 0) != (position.amount > 0)):
+            trade['exit_ts'] = fill.ts
+            trade['return'] = trade['pnl'] / trade['cost'] if trade['cost'] else 0.0
+            self.closed_trades.append(self._open_trades.pop(fill.symbol))
+            if position.amount != 0:
+                # 反手后的剩余仓位作为新的一笔
+                self._open_trades[fill.symbol] = {
+                    'symbol': fill.symbol, 'entry_ts': fill.ts,
+                    'side': 'long' if position.amount > 0 else 'short',
+                    'cost': abs(position.amount) * fill.price, 'pnl': 0.0,
+                }
+
+    def _refresh_protection(self, symbol: str, position: Position):
+        """持仓变化后重建保护单"""
+        for order in list(self.matching.orders.get(symbol, ())):
+            if order.reduce_only and order.tag in ('stop_loss', 'take_profit', 'trailing_stop'):
+                self.cancel_order(order.id)
+        if position.amount != 0:
+            for rule in self.stop_rules:
+                rule.build_order(self.context, position)
+
+    def _record(self, ts: int):
+        equity = self.equity()
+        gross = sum(abs(p.amount) * self.prices.get(s, p.avg_price) for s, p in self.positions.items() if p.amount)
+        self._record_ts.append(ts)
+        self._record_equity.append(equity)
+        self._record_exposure.append(gross / equity if equity > 0 else 0.0)
+
+    # -- 主循环 --------------------------------------------------------------
+
+    def run(self) -> BacktestResult:
+        ctx = self.context
+        strategy = self.strategy
+        matching = self.matching
+        prices = self.prices
+        history = self.history
+        history_size = self.history_size
+        indicators = self.indicators
+        record_interval = self.record_interval or self._bar_interval or 60_000
+        record_on_bar = self.record_interval is None and self._bar_interval is not None
+        wants_ticks = 'tick' in strategy.subscriptions
+        apply_fill = self._apply_fill
+        limits = self._fill_limit
+        tick_symbols = self._tick_symbols
+        processed = 0
+        # 按K线记录时，同一时间戳的多个交易对的K线都处理完后才记录一次
+        pending_record = None
+        started = time.perf_counter()
+
+        strategy.on_start(ctx)
+        for ts, event in self.queue:
+            processed += 1
+            if pending_record is not None and ts > pending_record:
+                self._record(pending_record)
+                pending_record = None
+            ctx.now = ts
+            if event.__class__ is Bar:
+                symbol = event.symbol
+                prices[symbol] = event.close
+                # 有逐笔数据的交易对已经按成交撮合过，K线只用于推送
+                if symbol not in tick_symbols and matching.orders.get(symbol):
+                    matching.match_bar(event, limits, apply_fill)
+
+                series = history.get(symbol)
+                if series is None:
+                    series = history[symbol] = {name: [] for name in ('ts', 'open', 'high', 'low', 'close', 'volume')}
+                series['ts'].append(ts)
+                series['open'].append(event.open)
+                series['high'].append(event.high)
+                series['low'].append(event.low)
+                series['close'].append(event.close)
+                series['volume'].append(event.volume)
+                if len(series['close']) > history_size * 2:
+                    for values in series.values():
+                        del values[:-history_size]
+                if indicators.nodes:
+                    indicators.update(symbol, event)
+
+                strategy.on_bar(ctx, event)
+                if record_on_bar:
+                    pending_record = ts
+                elif ts >= self._next_record:
+                    self._record(ts)
+                    self._next_record = ts + record_interval
+            else:
+                symbol = event.symbol
+                prices[symbol] = event.price
+                if matching.orders.get(symbol):
+                    matching.match_tick(event, limits, apply_fill)
+                if wants_ticks:
+                    strategy.on_tick(ctx, event)
+                if not record_on_bar and ts >= self._next_record:
+                    self._record(ts)
+                    self._next_record = ts + record_interval
+
+        if pending_record is not None:
+            self._record(pending_record)
+        strategy.on_stop(ctx)
+        self.events_processed = processed
+        elapsed = time.perf_counter() - started
+        logger.info(f"事件驱动回测完成: {processed}个事件, {elapsed:.2f}s")
+        return self._build_result(record_interval, elapsed)
+
+    def _build_result(self, record_interval: int, elapsed: float) -> BacktestResult:
+        if not self._record_equity:
+            raise BacktestError('没有可回放的行情数据')
+        equity = np.asarray(self._record_equity)
+        previous = np.concatenate(([self.initial_capital], equity[:-1]))
+        trades = self.closed_trades
+        fills = self.fills
+        result = BacktestResult(
+            timestamps=np.asarray(self._record_ts, dtype=np.int64),
+            equity=equity,
+            positions=np.asarray(self._record_exposure),
+            returns=equity / previous - 1.0,
+            trades={
+                'entry_ts': np.asarray([t['entry_ts'] for t in trades], dtype=np.int64),
+                'exit_ts': np.asarray([t['exit_ts'] for t in trades], dtype=np.int64),
+                'return': np.asarray([t['return'] for t in trades], dtype=np.float64),
+                'pnl': np.asarray([t['pnl'] for t in trades], dtype=np.float64),
+            },
+            fills={
+                'ts': np.asarray([f.ts for f in fills], dtype=np.int64),
+                'order_id': np.asarray([f.order_id for f in fills], dtype=np.int64),
+                'side': np.asarray([1 if f.side == 'buy' else -1 for f in fills], dtype=np.int8),
+                'price': np.asarray([f.price for f in fills], dtype=np.float64),
+                'amount': np.asarray([f.amount for f in fills], dtype=np.float64),
+                'fee': np.asarray([f.fee for f in fills], dtype=np.float64),
+                'maker': np.asarray([f.liquidity == 'maker' for f in fills], dtype=bool),
+            },
+        )
+        result.metrics = compute_metrics(result, self.initial_capital, SECONDS_PER_YEAR * 1000 / record_interval)
+        result.metrics.update({
+            'fees_paid': round(sum(fill.fee for fill in self.fills), 4),
+            'fills': len(self.fills),
+            'orders': len(self.orders),
+            'open_trades': len(self._open_trades),
+            'events': self.events_processed,
+            'events_per_second': round(self.events_processed / elapsed) if elapsed > 0 else 0,
+        })
+        return result
@@ -0,0 +1,463 @@
+"""
+共享增量指标图
+
+多个策略订阅同一交易对和周期时，相同的指标（如 BTC/USDT 1h 的 EMA(20)）只保留一个节点：
+
+- 节点按 (数据源, 指标, 参数) 去重，引用计数归零时移除；
+- 每根K线收盘时每个节点只更新一次，更新为 O(1) 增量计算，
+  CPU 开销与不同指标的数量成正比，与策略数量无关；
+- 复合指标依赖其他节点（布林带上下轨共用同一组均线和标准差节点），
+  节点按创建顺序更新，依赖总是先于使用者创建；
+- 新节点用数据源已有的历史K线逐根回放预热，输出序列与数据源的K线历史对齐。
+
+增量结果与 indicators 模块的向量化实现一致，回测、实盘和沙箱中的策略通过
+StrategyContext.indicator 获取。
+"""
+import math
+from collections import deque
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+NAN = float('nan')
+
+
+class ValueSeries:
+    """单列环形缓冲区，写满后把最近 size 个值移到开头，读取时返回切片"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._data = np.full(size * 2, np.nan)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def append(self, value: float):
+        if self._end == len(self._data):
+            self._data[:self.size] = self._data[self._end - self.size:self._end]
+            self._start, self._end = 0, self.size
+        self._data[self._end] = value
+        self._end += 1
+        if self._end - self._start > self.size:
+            self._start += 1
+
+    def at(self, index: int) -> float:
+        """第 index 个值（从保留的最早值开始计数，负数从末尾计数）"""
+        if index < 0:
+            index += len(self)
+        return float(self._data[self._start + index])
+
+    @property
+    def last(self) -> float:
+        return float(self._data[self._end - 1]) if self._end > self._start else NAN
+
+    def history(self, length: Optional[int] = None, end: Optional[int] = None) -> np.ndarray:
+        stop = self._end if end is None else self._start + end
+        start = self._start if length is None else max(self._start, stop - length)
+        view = self._data[start:stop]
+        view.flags.writeable = False
+        return view
+
+
+class IndicatorNode:
+    """
+    指标节点
+
+    子类声明 defaults（参数及默认值）和 compute(bar, position)；
+    有依赖的子类实现 dependencies(params)，返回 [(指标名, 参数)]。
+    """
+
+    name = ''
+    defaults: Dict[str, Any] = {}
+
+    def __init__(self, key: Tuple, params: Dict[str, Any], inputs: List['IndicatorNode'], size: int):
+        self.key = key
+        self.params = params
+        self.inputs = inputs
+        self.values = ValueSeries(size)
+        self.refs = 0
+        self.setup(**params)
+
+    @classmethod
+    def normalize(cls, params: Dict[str, Any]) -> Dict[str, Any]:
+        unknown = set(params) - set(cls.defaults)
+        if unknown:
+            raise TypeError(f"指标 {cls.name} 不支持参数: {', '.join(sorted(unknown))}")
+        merged = {**cls.defaults, **params}
+        for name, default in cls.defaults.items():
+            if isinstance(default, int) and not isinstance(default, bool):
+                merged[name] = int(merged[name])
+            elif isinstance(default, float):
+                merged[name] = float(merged[name])
+        if merged.get('period', 1) < 1:
+            raise ValueError(f'指标 {cls.name} 的周期必须为正整数')
+        return merged
+
+    @classmethod
+    def dependencies(cls, params: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        return []
+
+    def setup(self, **params):
+        pass
+
+    def compute(self, bar, position: Optional[int]) -> float:
+        raise NotImplementedError
+
+    def update(self, bar, position: Optional[int] = None):
+        """
+        计入一根K线
+
+        Args:
+            position: 预热回放时当前K线在历史中的下标，依赖节点按下标取值；实时更新时为 None
+        """
+        self.values.append(self.compute(bar, position))
+
+    @property
+    def value(self) -> float:
+        return self.values.last
+
+    def input_value(self, index: int, position: Optional[int]) -> float:
+        node = self.inputs[index]
+        return node.values.last if position is None else node.values.at(position)
+
+
+class _WindowNode(IndicatorNode):
+    """滑动窗口指标，每 period 根K线按窗口重新求和一次，避免累计误差"""
+
+    defaults = {'period': 20, 'field': 'close'}
+
+    def setup(self, period, field):
+        self.period = period
+        self.field = field
+        self.window = deque(maxlen=period)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.steps = 0
+
+    def push(self, bar) -> bool:
+        value = getattr(bar, self.field)
+        if len(self.window) == self.period:
+            removed = self.window[0]
+            self.total -= removed
+            self.total_sq -= removed * removed
+        self.window.append(value)
+        self.total += value
+        self.total_sq += value * value
+        self.steps += 1
+        if self.steps % self.period == 0:
+            self.total = math.fsum(self.window)
+            self.total_sq = math.fsum(v * v for v in self.window)
+        return len(self.window) == self.period
+
+
+class SMANode(_WindowNode):
+    name = 'sma'
+
+    def compute(self, bar, position):
+        return self.total / self.period if self.push(bar) else NAN
+
+
+class StdNode(_WindowNode):
+    """滚动总体标准差"""
+    name = 'std'
+
+    def compute(self, bar, position):
+        if not self.push(bar):
+            return NAN
+        mean = self.total / self.period
+        return math.sqrt(max(self.total_sq / self.period - mean * mean, 0.0))
+
+
+class EMANode(IndicatorNode):
+    name = 'ema'
+    defaults = {'period': 20, 'field': 'close'}
+
+    def setup(self, period, field):
+        self.period = period
+        self.field = field
+        self.alpha = 2.0 / (period + 1)
+        self.state = None
+        self.count = 0
+
+    def compute(self, bar, position):
+        value = getattr(bar, self.field)
+        self.state = value if self.state is None else self.state + self.alpha * (value - self.state)
+        self.count += 1
+        return self.state if self.count >= self.period else NAN
+
+
+class _ExtremeNode(IndicatorNode):
+    """滚动最大/最小值，单调队列保存窗口内可能成为极值的 (序号, 值)"""
+
+    defaults = {'period': 20, 'field': 'close'}
+    sign = 1.0
+
+    def setup(self, period, field):
+        self.period = period
+        self.field = field
+        self.queue: deque = deque()
+        self.count = 0
+
+    def compute(self, bar, position):
+        value = getattr(bar, self.field) * self.sign
+        queue = self.queue
+        while queue and queue[-1][1] <= value:
+            queue.pop()
+        queue.append((self.count, value))
+        if queue[0][0] <= self.count - self.period:
+            queue.popleft()
+        self.count += 1
+        return queue[0][1] * self.sign if self.count >= self.period else NAN
+
+
+class MaxNode(_ExtremeNode):
+    name = 'max'
+
+
+class MinNode(_ExtremeNode):
+    name = 'min'
+    sign = -1.0
+
+
+class RSINode(IndicatorNode):
+    """相对强弱指标（Wilder平滑）"""
+    name = 'rsi'
+    defaults = {'period': 14, 'field': 'close'}
+
+    def setup(self, period, field):
+        self.period = period
+        self.field = field
+        self.alpha = 1.0 / period
+        self.previous = None
+        self.avg_gain = self.avg_loss = None
+        self.count = 0
+
+    def compute(self, bar, position):
+        value = getattr(bar, self.field)
+        delta = 0.0 if self.previous is None else value - self.previous
+        self.previous = value
+        gain, loss = max(delta, 0.0), max(-delta, 0.0)
+        if self.avg_gain is None:
+            self.avg_gain, self.avg_loss = gain, loss
+        else:
+            self.avg_gain += self.alpha * (gain - self.avg_gain)
+            self.avg_loss += self.alpha * (loss - self.avg_loss)
+        self.count += 1
+        if self.count <= self.period:
+            return NAN
+        if self.avg_loss == 0:
+            return 100.0 if self.avg_gain > 0 else NAN
+        return 100.0 - 100.0 / (1.0 + self.avg_gain / self.avg_loss)
+
+
+class ATRNode(IndicatorNode):
+    """平均真实波幅"""
+    name = 'atr'
+    defaults = {'period': 14}
+
+    def setup(self, period):
+        self.period = period
+        self.alpha = 1.0 / period
+        self.previous_close = None
+        self.state = None
+        self.count = 0
+
+    def compute(self, bar, position):
+        true_range = bar.high - bar.low
+        if self.previous_close is not None:
+            true_range = max(true_range, abs(bar.high - self.previous_close), abs(bar.low - self.previous_close))
+        self.previous_close = bar.close
+        self.state = true_range if self.state is None else self.state + self.alpha * (true_range - self.state)
+        self.count += 1
+        return self.state if self.count >= self.period else NAN
+
+
+class _BollingerNode(IndicatorNode):
+    """布林带上/下轨，依赖同周期的 sma 和 std 节点"""
+
+    defaults = {'period': 20, 'num_std': 2.0, 'field': 'close'}
+    sign = 1.0
+
+    @classmethod
+    def dependencies(cls, params):
+        window = {'period': params['period'], 'field': params['field']}
+        return [('sma', window), ('std', window)]
+
+    def setup(self, period, num_std, field):
+        self.width = num_std * self.sign
+
+    def compute(self, bar, position):
+        return self.input_value(0, position) + self.input_value(1, position) * self.width
+
+
+class BollingerUpperNode(_BollingerNode):
+    name = 'bollinger_upper'
+
+
+class BollingerLowerNode(_BollingerNode):
+    name = 'bollinger_lower'
+    sign = -1.0
+
+
+INDICATOR_NODES: Dict[str, type] = {
+    cls.name: cls for cls in (
+        SMANode, EMANode, StdNode, MaxNode, MinNode, RSINode, ATRNode, BollingerUpperNode, BollingerLowerNode,
+    )
+}
+
+
+class _HistoryBar:
+    """预热回放时按下标读取历史数组的K线视图"""
+    __slots__ = ('arrays', 'index')
+
+    def __init__(self, arrays: Dict[str, Any]):
+        self.arrays = arrays
+        self.index = 0
+
+    def __getattr__(self, name):
+        return self.arrays[name][self.index].item()
+
+
+class IndicatorGraph:
+    """
+    指标图
+
+    用法：
+        graph = IndicatorGraph()
+        ema = graph.acquire(('binance', 'BTC/USDT', '1h'), 'ema', history=arrays, period=20)
+        graph.update(('binance', 'BTC/USDT', '1h'), bar)   # 每根K线收盘时调用一次
+        ema.value
+        graph.release(ema)
+    """
+
+    def __init__(self, history_size: int = 1000):
+        self.history_size = history_size
+        self.nodes: Dict[Tuple, IndicatorNode] = {}
+        self._order: Dict[Hashable, List[IndicatorNode]] = {}
+
+    def key(self, source: Hashable, name: str, params: Dict[str, Any]) -> Tuple:
+        try:
+            node_class = INDICATOR_NODES[name]
+        except KeyError:
+            raise ValueError(f'不支持的指标: {name}')
+        return source, name, tuple(sorted(node_class.normalize(params).items()))
+
+    def acquire(self, source: Hashable, name: str, history: Optional[Dict[str, Any]] = None,
+                **params) -> IndicatorNode:
+        """
+        获取指标节点（引用计数加一），不存在时创建并用 history 预热
+
+        Args:
+            source: 数据源标识，同一数据源的节点在 update(source, bar) 时更新
+            history: 数据源已有的K线列（open/high/low/close/volume），与节点输出对齐
+        """
+        created: List[IndicatorNode] = []
+        node = self._acquire(source, name, params, created)
+        if created and history is not None:
+            length = min(len(history['close']), self.history_size)
+            arrays = {
+                field: np.asarray(values, dtype=np.float64)[len(values) - length:] for field, values in history.items()
+            }
+            bar = _HistoryBar(arrays)
+            for index in range(length):
+                bar.index = index
+                for new_node in created:
+                    new_node.update(bar, index)
+        return node
+
+    def _acquire(self, source, name, params, created) -> IndicatorNode:
+        key = self.key(source, name, params)
+        node = self.nodes.get(key)
+        if node is None:
+            node_class = INDICATOR_NODES[name]
+            normalized = dict(key[2])
+            inputs = [self._acquire(source, dep_name, dep_params, created)
+                      for dep_name, dep_params in node_class.dependencies(normalized)]
+            node = self.nodes[key] = node_class(key, normalized, inputs, self.history_size)
+            self._order.setdefault(source, []).append(node)
+            created.append(node)
+        node.refs += 1
+        return node
+
+    def release(self, node: IndicatorNode):
+        """释放引用，归零时移除节点并释放其依赖"""
+        node.refs -= 1
+        if node.refs > 0 or self.nodes.get(node.key) is not node:
+            return
+        del self.nodes[node.key]
+        source = node.key[0]
+        order = self._order[source]
+        order.remove(node)
+        if not order:
+            del self._order[source]
+        for dependency in node.inputs:
+            self.release(dependency)
+
+    def update(self, source: Hashable, bar):
+        """K线收盘：按依赖顺序更新该数据源的所有节点，每个节点一次"""
+        nodes = self._order.get(source)
+        if nodes:
+            for node in nodes:
+                node.update(bar)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'sources': len(self._order),
+            'nodes': len(self.nodes),
+            'references': sum(node.refs for node in self.nodes.values()),
+        }
+
+
+class IndicatorView:
+    """
+    策略持有的指标引用
+
+    end 返回当前可见的K线数量（实盘预热回放时只能看到回放位置之前的值），为 None 时读取最新值。
+    """
+    __slots__ = ('node', '_end')
+
+    def __init__(self, node: IndicatorNode, end: Optional[Callable[[], Optional[int]]] = None):
+        self.node = node
+        self._end = end
+
+    @property
+    def value(self) -> float:
+        end = self._end() if self._end is not None else None
+        return self.node.values.last if end is None else self.node.values.at(end - 1)
+
+    def history(self, length: Optional[int] = None) -> np.ndarray:
+        end = self._end() if self._end is not None else None
+        return self.node.values.history(length, end)
+
+    def __float__(self):
+        return self.value
+
+
+class IndicatorSubscriptions:
+    """
+    上下文持有的指标集合
+
+    同一策略重复获取相同指标时直接返回已有引用，不增加引用计数；策略停止时统一释放。
+    """
+
+    def __init__(self, graph: IndicatorGraph, end: Optional[Callable[[], Optional[int]]] = None):
+        self.graph = graph
+        self.end = end
+        self._views: Dict[Tuple, IndicatorView] = {}
+
+    def get(self, source: Hashable, name: str, history: Callable[[], Optional[Dict[str, Any]]],
+            params: Dict[str, Any]) -> IndicatorView:
+        key = (source, name, tuple(sorted(params.items())))
+        view = self._views.get(key)
+        if view is None:
+            view = self._views[key] = IndicatorView(
+                self.graph.acquire(source, name, history=history(), **params), self.end,
+            )
+        return view
+
+    def release_all(self):
+        for view in self._views.values():
+            self.graph.release(view.node)
+        self._views.clear()
@@ -0,0 +1,76 @@
+"""
+向量化技术指标
+
+所有函数接收一维 float64 数组，返回等长数组，数据不足的位置为 NaN。
+滚动和指数平滑使用 pandas 的C实现，避免逐K线的Python循环。
+"""
+import numpy as np
+import pandas as pd
+
+
+def _series(values: np.ndarray) -> pd.Series:
+    return pd.Series(np.asarray(values, dtype=np.float64), copy=False)
+
+
+def sma(values: np.ndarray, period: int) -> np.ndarray:
+    """简单移动平均"""
+    return _series(values).rolling(period, min_periods=period).mean().to_numpy()
+
+
+def ema(values: np.ndarray, period: int) -> np.ndarray:
+    """指数移动平均（前 period-1 个值为 NaN）"""
+    result = _series(values).ewm(span=period, adjust=False).mean().to_numpy(copy=True)
+    result[:period - 1] = np.nan
+    return result
+
+
+def rolling_std(values: np.ndarray, period: int) -> np.ndarray:
+    """滚动标准差（总体标准差）"""
+    return _series(values).rolling(period, min_periods=period).std(ddof=0).to_numpy()
+
+
+def rolling_max(values: np.ndarray, period: int) -> np.ndarray:
+    """滚动最大值"""
+    return _series(values).rolling(period, min_periods=period).max().to_numpy()
+
+
+def rolling_min(values: np.ndarray, period: int) -> np.ndarray:
+    """滚动最小值"""
+    return _series(values).rolling(period, min_periods=period).min().to_numpy()
+
+
+def rsi(close: np.ndarray, period: int = 14) -> np.ndarray:
+    """相对强弱指标（Wilder平滑）"""
+    delta = np.diff(close, prepend=np.nan)
+    gain = _series(np.where(delta > 0, delta, 0.0))
+    loss = _series(np.where(delta < 0, -delta, 0.0))
+    avg_gain = gain.ewm(alpha=1 / period, adjust=False, min_periods=period).mean().to_numpy()
+    avg_loss = loss.ewm(alpha=1 / period, adjust=False, min_periods=period).mean().to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = 100 - 100 / (1 + avg_gain / avg_loss)
+    result[(avg_loss == 0) & (avg_gain > 0)] = 100.0
+    result[:period] = np.nan
+    return result
+
+
+def bollinger_bands(close: np.ndarray, period: int = 20, num_std: float = 2.0):
+    """
+    布林带
+
+    Returns:
+        (上轨, 中轨, 下轨)
+    """
+    middle = sma(close, period)
+    width = rolling_std(close, period) * num_std
+    return middle + width, middle, middle - width
+
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int = 14) -> np.ndarray:
+    """平均真实波幅"""
+    prev_close = np.concatenate(([np.nan], close[:-1]))
+    true_range = np.nanmax(np.vstack([
+        high - low,
+        np.abs(high - prev_close),
+        np.abs(low - prev_close),
+    ]), axis=0)
+    return _series(true_range).ewm(alpha=1 / period, adjust=False, min_periods=period).mean().to_numpy()
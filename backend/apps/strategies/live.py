@@ -0,0 +1,934 @@
+"""
+实盘策略引擎
+
+常驻进程，以消费者组方式读取市场事件日志，在一个 asyncio 事件循环中驱动所有运行中的策略：
+
+- 按 (交易所, 交易对, 周期) 维护共享的K线流（BarFeed），K线历史只保存一份，
+  订阅同一交易对和周期的所有策略共用；
+- K线在收盘时刻由定时器关闭并立即回调策略，不经过任务队列，
+  收盘前到达的逐笔成交会更新未收盘的K线；
+- 策略通过与回测相同的 StrategyContext 接口下单，订单请求交给执行层
+  （订单网关在线时写入订单流，否则提交 execute_order 任务），
+  执行层的回报写入引擎自己的回报流，消费后通过 apply_fill / update_order 回到策略；
+- 策略加载时从订单记录恢复资金、持仓和未完成订单，引擎重启后不会从空仓重新开始；
+- 每个策略记录回调耗时和信号延迟（K线收盘到订单发出），写入延迟直方图，
+  并定期保存到 LiveStrategy.stats。
+
+数据库读写（加载策略、保存统计）和订单请求的发送在线程池中执行；运行沙箱中自定义策略时，
+回调（管道往返）也在线程中串行执行，事件循环不被阻塞。
+"""
+import asyncio
+import logging
+import queue
+import socket
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.monitoring.latency import STRATEGY_ENGINE, get_latency_recorder, now_ms
+from apps.trading.gateway import (
+    REPORT_ACK, REPORT_CANCELLED, REPORT_FILL, REPORT_REJECTED, OrderChannel, report_stream,
+)
+from apps.trading.orders import ACTIVE_STATUSES
+
+from .backtest import TIMEFRAME_SECONDS
+from .indicator_graph import IndicatorGraph, IndicatorSubscriptions
+from .strategy import (
+    ORDER_CANCELLED, ORDER_FILLED, ORDER_OPEN, ORDER_PARTIAL, ORDER_REJECTED,
+    BaseStrategy, Bar, Fill, Order, Position, StrategyContext, Tick, get_strategy_class,
+)
+
+logger = logging.getLogger(__name__)
+
+# 市场事件日志中策略引擎使用的消费者组
+ENGINE_GROUP = 'strategy-engine'
+
+BAR_FIELDS = ('ts', 'open', 'high', 'low', 'close', 'volume')
+
+
+class BarSeries:
+    """
+    K线历史环形缓冲区
+
+    容量为 2 * size 的连续数组，写满后把最近 size 根移到开头，
+    读取最近 N 根时返回数组切片，不复制数据。
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._data = np.zeros((len(BAR_FIELDS), size * 2), dtype=np.float64)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def append(self, bar: Bar):
+        if self._end == self._data.shape[1]:
+            self._data[:, :self.size] = self._data[:, self._end - self.size:self._end]
+            self._start, self._end = 0, self.size
+        self._data[:, self._end] = (bar.ts, bar.open, bar.high, bar.low, bar.close, bar.volume)
+        self._end += 1
+        if self._end - self._start > self.size:
+            self._start += 1
+
+    def history(self, field: str = 'close', length: Optional[int] = None, end: Optional[int] = None) -> np.ndarray:
+        """
+        最近的字段序列（只读视图）
+
+        Args:
+            end: 只取前 end 根（预热回放时使用），默认取全部
+        """
+        stop = self._end if end is None else self._start + end
+        start = self._start if length is None else max(self._start, stop - length)
+        view = self._data[BAR_FIELDS.index(field), start:stop]
+        view.flags.writeable = False
+        return view
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """全部保留的K线列（只读视图）"""
+        return {field: self.history(field) for field in BAR_FIELDS}
+
+    def bar(self, index: int, symbol: str) -> Bar:
+        values = self._data[:, self._start + index]
+        return Bar(int(values[0]), symbol, *values[1:].tolist())
+
+    @property
+    def last_ts(self) -> Optional[int]:
+        return int(self._data[0, self._end - 1]) if self._end > self._start else None
+
+
+class BarFeed:
+    """
+    单个 (交易所, 交易对, 周期) 的K线流
+
+    pending 为未收盘的K线 [开盘时间, 开, 高, 低, 收, 量]。K线事件以开盘时间标识，
+    收到更晚的K线、逐笔成交越过收盘时间或定时器到达收盘时间时关闭当前K线。
+    """
+
+    def __init__(self, exchange: str, symbol: str, timeframe: str, history_size: int):
+        self.exchange = exchange
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.interval = TIMEFRAME_SECONDS[timeframe] * 1000
+        self.series = BarSeries(history_size)
+        self.pending: Optional[list] = None
+        self.last_open_ts: Optional[int] = None
+        self.runners: List['LiveStrategyRunner'] = []
+
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        return self.exchange, self.symbol, self.timeframe
+
+    @property
+    def close_time(self) -> Optional[int]:
+        return self.pending[0] + self.interval if self.pending else None
+
+    def seed(self, data: Dict[str, np.ndarray]):
+        """用数据库中已收盘的K线填充历史"""
+        for values in zip(*(data[name].tolist() for name in ('timestamp', 'open', 'high', 'low', 'close', 'volume'))):
+            open_ts = int(values[0])
+            if self.last_open_ts is None or open_ts > self.last_open_ts:
+                self.series.append(Bar(open_ts + self.interval, self.symbol, *values[1:]))
+                self.last_open_ts = open_ts
+
+    def _close(self) -> Bar:
+        open_ts, o, h, l, c, v = self.pending
+        bar = Bar(open_ts + self.interval, self.symbol, o, h, l, c, v)
+        self.series.append(bar)
+        self.last_open_ts = open_ts
+        self.pending = None
+        return bar
+
+    def update_kline(self, open_ts: int, o: float, h: float, l: float, c: float, v: float, now: float) -> List[Bar]:
+        """K线事件，返回因此收盘的K线"""
+        if self.last_open_ts is not None and open_ts <= self.last_open_ts:
+            return []
+        closed = []
+        if self.pending and open_ts > self.pending[0]:
+            closed.append(self._close())
+        # 交易所K线是权威数据，覆盖由逐笔成交累积的值
+        self.pending = [open_ts, o, h, l, c, v]
+        if now >= open_ts + self.interval:
+            closed.append(self._close())
+        return closed
+
+    def update_trade(self, ts: int, price: float, amount: float) -> List[Bar]:
+        """逐笔成交，更新未收盘的K线，越过收盘时间时先关闭当前K线"""
+        closed = []
+        if self.pending and ts >= self.pending[0] + self.interval:
+            closed.append(self._close())
+        if self.pending is None:
+            open_ts = ts - ts % self.interval
+            if self.last_open_ts is None or open_ts > self.last_open_ts:
+                self.pending = [open_ts, price, price, price, price, amount]
+            return closed
+        pending = self.pending
+        pending[2] = max(pending[2], price)
+        pending[3] = min(pending[3], price)
+        pending[4] = price
+        pending[5] += amount
+        return closed
+
+    def close_due(self, now: float) -> Optional[Bar]:
+        if self.pending and now >= self.pending[0] + self.interval:
+            return self._close()
+        return None
+
+
+class RunnerStats:
+    """单个策略的运行统计"""
+    __slots__ = ('bars', 'ticks', 'orders', 'fills', 'callback_count', 'callback_total_ms', 'callback_max_ms',
+                 'signal_count', 'signal_total_ms', 'signal_max_ms', 'last_event_at')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'bars': self.bars,
+            'ticks': self.ticks,
+            'orders': self.orders,
+            'fills': self.fills,
+            'callback_avg_ms': round(self.callback_total_ms / self.callback_count, 3) if self.callback_count else None,
+            'callback_max_ms': round(self.callback_max_ms, 3),
+            'signal_avg_ms': round(self.signal_total_ms / self.signal_count, 3) if self.signal_count else None,
+            'signal_max_ms': round(self.signal_max_ms, 3),
+            'last_event_at': self.last_event_at or None,
+        }
+
+
+class LiveContext(StrategyContext):
+    """
+    实盘策略上下文
+
+    资金和持仓由成交回报在本地维护；客户端订单号由实例ID、K线时间和序号确定，
+    同一根K线重复投递时生成相同的订单号，执行层据此去重。
+    """
+
+    def __init__(self, runner: 'LiveStrategyRunner', capital: float):
+        self.runner = runner
+        self.now = 0
+        self.warming = False
+        self.orders: Dict[str, Order] = {}
+        self.positions: Dict[str, Position] = {}
+        self._cash = capital
+        self._sequence = 0
+        self._sequence_ts = None
+        self._history_end: Optional[int] = None
+        self._indicators: Optional[IndicatorSubscriptions] = None
+
+    def _next_order_id(self) -> str:
+        if self._sequence_ts != self.now:
+            self._sequence_ts, self._sequence = self.now, 0
+        self._sequence += 1
+        return f"ls{self.runner.live_id}-{self.now}-{self._sequence}"
+
+    def place_order(self, symbol, side, amount, order_type='market', price=None, stop_price=None,
+                    trail=None, tag=None, reduce_only=False) -> Order:
+        order = Order(self._next_order_id(), symbol, side, order_type, float(amount), price, stop_price,
+                      trail, self.now, tag, reduce_only)
+        if self.warming:
+            # 预热回放期间只恢复策略内部状态，不下单
+            order.status = ORDER_REJECTED
+            return order
+        self.orders[order.id] = order
+        self.runner.emit({'action': 'place', **self.runner.order_fields(order)})
+        return order
+
+    def cancel_order(self, order_id) -> bool:
+        order = self.orders.get(order_id)
+        if order is None or not order.is_active:
+            return False
+        self.runner.emit({'action': 'cancel', 'client_order_id': order_id, 'symbol': order.symbol, **self.runner.identity})
+        return True
+
+    def cancel_all(self, symbol=None) -> int:
+        return sum(self.cancel_order(order.id) for order in self.open_orders(symbol))
+
+    def open_orders(self, symbol=None) -> List[Order]:
+        return [o for o in self.orders.values() if o.is_active and (symbol is None or o.symbol == symbol)]
+
+    def position(self, symbol) -> Position:
+        position = self.positions.get(symbol)
+        if position is None:
+            position = self.positions[symbol] = Position(symbol)
+        return position
+
+    @property
+    def cash(self) -> float:
+        return self._cash
+
+    @property
+    def equity(self) -> float:
+        total = self._cash
+        for symbol, position in self.positions.items():
+            if position.amount:
+                total += position.amount * self.runner.last_price(symbol, position.avg_price)
+        return total
+
+    def history(self, symbol, field='close', length=None) -> np.ndarray:
+        feed = self.runner.feed
+        if symbol != feed.symbol:
+            return np.empty(0)
+        return feed.series.history(field, length, self._history_end)
+
+    def log(self, message):
+        logger.info(f"[实盘策略 {self.runner.live_id}] {message}")
+
+    def indicator(self, symbol, name, **params):
+        feed = self.runner.feed
+        if symbol != feed.symbol:
+            raise ValueError(f'实盘策略只订阅了 {feed.symbol}')
+        if self._indicators is None:
+            self._indicators = IndicatorSubscriptions(self.runner.engine.indicators, lambda: self._history_end)
+        return self._indicators.get(feed.key, name, feed.series.arrays, params)
+
+    def release_indicators(self):
+        if self._indicators is not None:
+            self._indicators.release_all()
+
+
+class LiveStrategyRunner:
+    """单个实盘策略实例"""
+
+    def __init__(self, live_id: int, strategy: BaseStrategy, feed: BarFeed, capital: float,
+                 identity: Optional[Dict[str, Any]] = None, session=None):
+        self.live_id = live_id
+        self.strategy = strategy
+        self.feed = feed
+        self.identity = {'live_strategy_id': live_id, **(identity or {})}
+        self.session = session
+        self.context = LiveContext(self, capital)
+        self.stats = RunnerStats()
+        self.engine: Optional['StrategyEngine'] = None
+        self.subscribes_ticks = 'tick' in strategy.subscriptions
+        self._last_price: Optional[float] = None
+        self._bar_close_ms: Optional[float] = None
+
+    def last_price(self, symbol: str, default: float) -> float:
+        return self._last_price if symbol == self.feed.symbol and self._last_price is not None else default
+
+    def order_fields(self, order: Order) -> Dict[str, Any]:
+        return {
+            **self.identity,
+            'client_order_id': order.id,
+            'symbol': order.symbol,
+            'side': order.side,
+            'order_type': order.order_type,
+            'amount': order.amount,
+            'price': order.price,
+            'stop_price': order.stop_price,
+            'trail': order.trail,
+            'reduce_only': order.reduce_only,
+            'tag': order.tag,
+            'created_ts': order.created_ts,
+            # 决策时的最新价，用于执行质量统计中的滑点
+            'arrival_price': self.last_price(order.symbol, None),
+        }
+
+    def emit(self, request: Dict[str, Any]):
+        if request['action'] == 'place':
+            self.stats.orders += 1
+            if self._bar_close_ms is not None:
+                latency = now_ms() - self._bar_close_ms
+                self.stats.signal_count += 1
+                self.stats.signal_total_ms += latency
+                self.stats.signal_max_ms = max(self.stats.signal_max_ms, latency)
+                if self.engine is not None:
+                    self.engine.recorder.observe('signal', latency, f'live:{self.live_id}')
+        self.engine.emit_order(request)
+
+    def restore(self, orders: List[Dict[str, Any]]):
+        """
+        按订单记录恢复资金、持仓和未完成订单（本次启动以来的订单，按创建顺序）
+
+        在预热前调用，策略回放历史时已经能看到实际持仓和挂单，重启后不会重复开仓。
+        """
+        ctx = self.context
+        for row in orders:
+            filled, avg_price, fee = float(row['filled']), float(row['avg_price']), float(row['fee'])
+            if filled > 0:
+                ctx.position(row['symbol']).apply_fill(row['side'], filled, avg_price)
+                ctx._cash += (-filled if row['side'] == 'buy' else filled) * avg_price - fee
+            if row['status'] not in ACTIVE_STATUSES:
+                continue
+            order = Order(
+                row['client_order_id'], row['symbol'], row['side'], row['order_type'], float(row['amount']),
+                float(row['price']) if row['price'] is not None else None,
+                float(row['stop_price']) if row['stop_price'] is not None else None,
+                None, row['created_ts'], row['tag'] or None, row['reduce_only'],
+            )
+            order.filled, order.avg_price, order.fee = filled, avg_price, fee
+            order.status = ORDER_PARTIAL if filled > 0 else ORDER_OPEN
+            ctx.orders[order.id] = order
+
+    def warm_up(self):
+        """启动策略并用共享历史回放K线，恢复指标等内部状态，期间不下单"""
+        ctx = self.context
+        ctx.warming = True
+        try:
+            self.strategy.on_start(ctx)
+            series = self.feed.series
+            for index in range(len(series)):
+                bar = series.bar(index, self.feed.symbol)
+                ctx._history_end = index + 1
+                ctx.now = bar.ts
+                self.strategy.on_bar(ctx, bar)
+                self._last_price = bar.close
+        finally:
+            ctx.warming = False
+            ctx._history_end = None
+
+    def _timed(self, callback: Callable, event) -> None:
+        started = time.perf_counter()
+        callback(self.context, event)
+        elapsed = (time.perf_counter() - started) * 1000
+        stats = self.stats
+        stats.callback_count += 1
+        stats.callback_total_ms += elapsed
+        stats.callback_max_ms = max(stats.callback_max_ms, elapsed)
+        stats.last_event_at = self.context.now
+        self.engine.recorder.observe('callback', elapsed, f'live:{self.live_id}')
+
+    def on_bar(self, bar: Bar):
+        self.context.now = bar.ts
+        self._last_price = bar.close
+        self._bar_close_ms = bar.ts
+        self.stats.bars += 1
+        try:
+            self._timed(self.strategy.on_bar, bar)
+        finally:
+            self._bar_close_ms = None
+
+    def on_tick(self, tick: Tick):
+        self.context.now = tick.ts
+        self._last_price = tick.price
+        self.stats.ticks += 1
+        self._timed(self.strategy.on_tick, tick)
+
+    def apply_fill(self, client_order_id: str, price: float, amount: float, fee: float = 0.0,
+                   ts: Optional[int] = None, liquidity: str = 'taker', filled: Optional[float] = None) -> Optional[Fill]:
+        """
+        成交回报：更新订单、持仓和资金，再回调策略
+
+        Args:
+            filled: 回报中的累计成交数量。已经计入的部分（从订单记录恢复后重新投递的回报）不再重复计入
+        """
+        ctx = self.context
+        order = ctx.orders.get(client_order_id)
+        if order is None or not order.is_active:
+            return None
+        ts = ts or int(now_ms())
+        amount = min(amount, order.remaining)
+        if filled is not None:
+            amount = min(amount, filled - order.filled)
+        if amount <= 1e-12:
+            return None
+        order.avg_price = (order.avg_price * order.filled + price * amount) / (order.filled + amount)
+        order.filled += amount
+        order.fee += fee
+        order.updated_ts = ts
+        order.status = ORDER_FILLED if order.remaining <= 1e-12 else ORDER_PARTIAL
+        ctx.position(order.symbol).apply_fill(order.side, amount, price)
+        ctx._cash += (-amount if order.side == 'buy' else amount) * price - fee
+        fill = Fill(ts, order.id, order.symbol, order.side, price, amount, fee, liquidity, order.tag)
+        self.stats.fills += 1
+        self.strategy.on_fill(ctx, fill)
+        if not order.is_active:
+            self.strategy.on_order(ctx, order)
+        return fill
+
+    def update_order(self, client_order_id: str, status: str) -> bool:
+        """执行层的撤单、拒单回报"""
+        order = self.context.orders.get(client_order_id)
+        if order is None or not order.is_active or status not in (ORDER_CANCELLED, ORDER_REJECTED):
+            return False
+        order.status = status
+        self.strategy.on_order(self.context, order)
+        return True
+
+    def stop(self):
+        try:
+            self.strategy.on_stop(self.context)
+        finally:
+            self.context.release_indicators()
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+
+def dispatch_order_request(request: Dict[str, Any]):
+    """默认的订单出口：交易所的订单网关在线时写入订单流，否则提交 execute_order 任务"""
+    from apps.trading.gateway import get_order_dispatcher
+    get_order_dispatcher()(request)
+
+
+class StrategyEngine:
+    """
+    实盘策略引擎
+
+    用法：
+        engine = StrategyEngine()
+        asyncio.run(engine.run())
+
+    测试或嵌入时可以直接调用 add_runner / handle_events / close_due_bars，不需要事件循环。
+    """
+
+    def __init__(self, event_log=None, order_sink: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 group: str = ENGINE_GROUP, consumer: Optional[str] = None,
+                 batch_size: Optional[int] = None, block_ms: Optional[int] = None,
+                 reload_interval: Optional[float] = None, history_size: Optional[int] = None,
+                 recorder=None, clock: Callable[[], float] = now_ms, report_channel: Optional[OrderChannel] = None):
+        self._event_log = event_log
+        self._report_channel = report_channel
+        self.order_sink = order_sink or dispatch_order_request
+        self.group = group
+        # 固定的消费者名称和回报流，重启后能取回自己未确认的事件和重启期间的成交回报
+        self.consumer = consumer or socket.gethostname()
+        self.batch_size = batch_size or getattr(settings, 'STRATEGY_ENGINE_BATCH_SIZE', 500)
+        self.block_ms = block_ms or getattr(settings, 'STRATEGY_ENGINE_BLOCK_MS', 1000)
+        self.reload_interval = reload_interval or getattr(settings, 'STRATEGY_ENGINE_RELOAD_INTERVAL', 5.0)
+        self.history_size = history_size or getattr(settings, 'STRATEGY_ENGINE_HISTORY_SIZE', 1000)
+        self.recorder = recorder or get_latency_recorder(STRATEGY_ENGINE)
+        self.clock = clock
+        self.report_stream = report_stream(f'strategy:{self.consumer}')
+
+        self.indicators = IndicatorGraph(self.history_size)
+        self.feeds: Dict[Tuple[str, str, str], BarFeed] = {}
+        self.runners: Dict[int, LiveStrategyRunner] = {}
+        self._symbol_feeds: Dict[Tuple[str, str], List[BarFeed]] = {}
+        self._failed: Dict[int, str] = {}
+        self._known_exchanges = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        # 事件循环运行时：订单请求队列和引擎状态锁
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._outbox: Optional[queue.SimpleQueue] = None
+        self._order_ready: Optional[asyncio.Event] = None
+        self._state_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def event_log(self):
+        if self._event_log is None:
+            from apps.market.event_log import MarketEventLog
+            self._event_log = MarketEventLog()
+        return self._event_log
+
+    @property
+    def report_channel(self) -> OrderChannel:
+        if self._report_channel is None:
+            self._report_channel = OrderChannel()
+        return self._report_channel
+
+    # -- 策略管理 ----------------------------------------------------------
+
+    def get_feed(self, exchange: str, symbol: str, timeframe: str) -> BarFeed:
+        key = (exchange, symbol, timeframe)
+        feed = self.feeds.get(key)
+        if feed is None:
+            feed = self.feeds[key] = BarFeed(exchange, symbol, timeframe, self.history_size)
+            self._symbol_feeds.setdefault((exchange, symbol), []).append(feed)
+        return feed
+
+    def add_runner(self, runner: LiveStrategyRunner):
+        """加入策略并用共享历史预热"""
+        runner.engine = self
+        try:
+            runner.warm_up()
+        except Exception as e:
+            self._fail(runner, e)
+            self._release_feed(runner.feed)
+            return
+        runner.feed.runners.append(runner)
+        self.runners[runner.live_id] = runner
+        logger.info(f"实盘策略 {runner.live_id} 已加入 {'/'.join(runner.feed.key)}")
+
+    def remove_runner(self, live_id: int):
+        runner = self.runners.pop(live_id, None)
+        if runner is None:
+            return
+        runner.feed.runners.remove(runner)
+        try:
+            runner.stop()
+        except Exception as e:
+            logger.error(f"实盘策略 {live_id} 停止回调出错: {e}")
+        self._release_feed(runner.feed)
+
+    def _release_feed(self, feed: BarFeed):
+        """没有策略订阅的K线流不再保留"""
+        if not feed.runners and self.feeds.get(feed.key) is feed:
+            del self.feeds[feed.key]
+            self._symbol_feeds[(feed.exchange, feed.symbol)].remove(feed)
+
+    def _fail(self, runner: LiveStrategyRunner, error: Exception):
+        logger.error(f"实盘策略 {runner.live_id} 出错，已停止: {error}", exc_info=True)
+        self._failed[runner.live_id] = str(error)
+        if runner.live_id in self.runners:
+            self.remove_runner(runner.live_id)
+        else:
+            runner.context.release_indicators()
+            if runner.session is not None:
+                runner.session.close()
+
+    @property
+    def exchanges(self) -> List[str]:
+        return sorted({feed.exchange for feed in self.feeds.values()})
+
+    # -- 事件分发 ----------------------------------------------------------
+
+    def handle_events(self, events) -> int:
+        """处理一批市场事件，返回回调的K线数"""
+        now = self.clock()
+        dispatched = 0
+        for event in events:
+            feeds = self._symbol_feeds.get((event.exchange, event.symbol))
+            if not feeds:
+                continue
+            data = event.data
+            if event.event_type == 'kline' and event.timestamp:
+                for feed in feeds:
+                    if feed.timeframe == data.get('timeframe'):
+                        for bar in feed.update_kline(
+                            int(event.timestamp), float(data['open']), float(data['high']), float(data['low']),
+                            float(data['close']), float(data['volume']), now,
+                        ):
+                            dispatched += self._dispatch_bar(feed, bar)
+            elif event.event_type == 'trade' and event.timestamp:
+                price, amount = float(data['price']), float(data['amount'])
+                tick = None
+                for feed in feeds:
+                    for bar in feed.update_trade(int(event.timestamp), price, amount):
+                        dispatched += self._dispatch_bar(feed, bar)
+                    for runner in list(feed.runners):
+                        if runner.subscribes_ticks:
+                            tick = tick or Tick(int(event.timestamp), event.symbol, price, amount, data.get('side'))
+                            self._call(runner, runner.on_tick, tick)
+        return dispatched
+
+    def close_due_bars(self, now: Optional[float] = None) -> int:
+        """关闭到达收盘时间的K线"""
+        now = self.clock() if now is None else now
+        dispatched = 0
+        for feed in list(self.feeds.values()):
+            bar = feed.close_due(now)
+            if bar is not None:
+                dispatched += self._dispatch_bar(feed, bar)
+        return dispatched
+
+    def next_deadline(self) -> Optional[float]:
+        deadlines = [feed.close_time for feed in self.feeds.values() if feed.pending]
+        return min(deadlines) if deadlines else None
+
+    def _dispatch_bar(self, feed: BarFeed, bar: Bar) -> int:
+        self.recorder.observe('bar_close', self.clock() - bar.ts, feed.timeframe)
+        # 共享指标每根K线只更新一次，再回调所有订阅的策略
+        self.indicators.update(feed.key, bar)
+        for runner in list(feed.runners):
+            self._call(runner, runner.on_bar, bar)
+        return 1
+
+    def _call(self, runner: LiveStrategyRunner, handler: Callable, event):
+        try:
+            handler(event)
+        except Exception as e:
+            self._fail(runner, e)
+
+    # -- 执行层回报 --------------------------------------------------------
+
+    def emit_order(self, request: Dict[str, Any]):
+        """发送订单请求；事件循环运行时放入队列，由 _order_loop 在线程中发送"""
+        if self._outbox is not None:
+            # 策略回调可能在线程中执行
+            self._outbox.put(request)
+            self._loop.call_soon_threadsafe(self._order_ready.set)
+        else:
+            self._send_orders([request])
+
+    def _take_orders(self) -> List[Dict[str, Any]]:
+        requests = []
+        while True:
+            try:
+                requests.append(self._outbox.get_nowait())
+            except queue.Empty:
+                return requests
+
+    def _send_orders(self, requests: List[Dict[str, Any]]):
+        for request in requests:
+            try:
+                self.order_sink(request)
+            except Exception as e:
+                logger.error(f"订单请求发送失败 {request.get('client_order_id')}: {e}")
+
+    def apply_fill(self, live_id: int, client_order_id: str, price: float, amount: float, **kwargs) -> Optional[Fill]:
+        runner = self.runners.get(live_id)
+        if runner is None:
+            return None
+        try:
+            return runner.apply_fill(client_order_id, float(price), float(amount), **kwargs)
+        except Exception as e:
+            self._fail(runner, e)
+            return None
+
+    def update_order(self, live_id: int, client_order_id: str, status: str) -> bool:
+        runner = self.runners.get(live_id)
+        if runner is None:
+            return False
+        try:
+            return runner.update_order(client_order_id, status)
+        except Exception as e:
+            self._fail(runner, e)
+            return False
+
+    def handle_reports(self, reports: List[Dict[str, Any]]) -> int:
+        """处理执行层的回报，返回回调的成交数"""
+        fills = 0
+        for report in reports:
+            live_id = report.get('live_strategy_id')
+            if live_id is None:
+                continue
+            report_type = report.get('type')
+            client_order_id = report['client_order_id']
+            if report_type == REPORT_FILL:
+                fill = self.apply_fill(
+                    int(live_id), client_order_id, report['price'], report['amount'],
+                    fee=float(report.get('fee') or 0.0), ts=report.get('ts'),
+                    filled=float(report['filled']) if report.get('filled') is not None else None,
+                )
+                fills += fill is not None
+            elif report_type == REPORT_CANCELLED:
+                self.update_order(int(live_id), client_order_id, ORDER_CANCELLED)
+            elif report_type == REPORT_REJECTED:
+                self.update_order(int(live_id), client_order_id, ORDER_REJECTED)
+            elif report_type == REPORT_ACK and report.get('sent_ts'):
+                self.recorder.observe('order_ack', self.clock() - report['sent_ts'], f'live:{live_id}')
+        return fills
+
+    def stats(self) -> Dict[int, Dict[str, Any]]:
+        return {live_id: runner.stats.to_dict() for live_id, runner in self.runners.items()}
+
+    # -- 数据库同步（在线程池中执行）----------------------------------------
+
+    def load_changes(self, running_ids, stats: Dict[int, Dict[str, Any]], failed: Dict[int, str]):
+        """
+        保存统计和错误，读取需要启动和停止的策略
+
+        Returns:
+            (新策略的 (LiveStrategy, 策略对象, 会话, 预热K线, 订单记录) 列表, 需要停止的ID列表)
+        """
+        from .models import LiveStrategy
+
+        for live_id, message in failed.items():
+            LiveStrategy.all_objects.filter(pk=live_id).update(
+                status='error', error_message=message[:2000], stopped_at=timezone.now(),
+            )
+        if stats:
+            instances = list(LiveStrategy.all_objects.filter(pk__in=list(stats)).only('pk', 'stats'))
+            for instance in instances:
+                instance.stats = stats[instance.pk]
+            LiveStrategy.all_objects.bulk_update(instances, ['stats'])
+
+        active = {
+            instance.pk: instance
+            for instance in LiveStrategy.all_objects.filter(status='running').select_related(
+                'strategy', 'symbol__exchange', 'exchange_account',
+            )
+        }
+        removed = [live_id for live_id in running_ids if live_id not in active]
+        added = []
+        for live_id, instance in active.items():
+            if live_id in running_ids:
+                continue
+            try:
+                added.append(self._build(instance))
+            except Exception as e:
+                logger.error(f"实盘策略 {live_id} 启动失败: {e}")
+                LiveStrategy.all_objects.filter(pk=live_id).update(status='error', error_message=str(e)[:2000])
+        return added, removed
+
+    def _build(self, instance):
+        parameters = {**instance.strategy.parameters, **instance.parameters}
+        session = None
+        if instance.strategy.strategy_type == 'custom':
+            from .sandbox import get_sandbox_pool
+            session = get_sandbox_pool().session(instance.strategy.code, parameters, instance.strategy.tenant_id)
+            try:
+                strategy = session.strategy()
+            except Exception:
+                session.close()
+                raise
+        else:
+            strategy = get_strategy_class(instance.strategy.strategy_type)(**parameters)
+        key = (instance.symbol.exchange.code, instance.symbol.symbol, instance.timeframe)
+        history = None if key in self.feeds else self._load_history(instance)
+        return instance, strategy, session, history, self._load_orders(instance)
+
+    @staticmethod
+    def _load_orders(instance) -> List[Dict[str, Any]]:
+        """本次启动以来有成交或未完成的订单，用于恢复资金、持仓和挂单"""
+        from apps.trading.models import Order as OrderRecord
+
+        orders = OrderRecord.all_objects.filter(live_strategy_id=instance.pk).filter(
+            Q(filled__gt=0) | Q(status__in=ACTIVE_STATUSES),
+        )
+        if instance.started_at is not None:
+            orders = orders.filter(created_at__gte=instance.started_at)
+        rows = list(orders.order_by('created_at', 'pk').values(
+            'client_order_id', 'symbol', 'side', 'order_type', 'amount', 'price', 'stop_price', 'reduce_only',
+            'tag', 'status', 'filled', 'avg_price', 'fee', 'created_at',
+        ))
+        for row in rows:
+            row['created_ts'] = int(row.pop('created_at').timestamp() * 1000)
+        return rows
+
+    def _load_history(self, instance) -> Dict[str, np.ndarray]:
+        """最近 history_size 根已收盘的K线，用于新K线流的预热"""
+        from apps.market.models import Kline
+        from .backtest import load_kline_arrays
+
+        end = timezone.now() - timedelta(seconds=TIMEFRAME_SECONDS[instance.timeframe])
+        timestamps = list(
+            Kline.objects.filter(symbol=instance.symbol, timeframe=instance.timeframe, timestamp__lte=end)
+            .order_by('-timestamp').values_list('timestamp', flat=True)[:self.history_size]
+        )
+        if not timestamps:
+            return {}
+        return load_kline_arrays(instance.symbol, instance.timeframe, timestamps[-1], timestamps[0])
+
+    def apply_changes(self, added, removed):
+        for live_id in removed:
+            self.remove_runner(live_id)
+            logger.info(f"实盘策略 {live_id} 已停止")
+        for instance, strategy, session, history, orders in added:
+            feed = self.get_feed(instance.symbol.exchange.code, instance.symbol.symbol, instance.timeframe)
+            if history and not len(feed.series):
+                feed.seed(history)
+            runner = LiveStrategyRunner(
+                instance.pk, strategy, feed, float(instance.capital),
+                identity={
+                    'tenant_id': instance.tenant_id,
+                    'exchange_account_id': instance.exchange_account_id,
+                    'exchange': instance.exchange_account.exchange,
+                    'reply_to': self.report_stream,
+                },
+                session=session,
+            )
+            runner.restore(orders)
+            self.add_runner(runner)
+
+    # -- 事件循环 ----------------------------------------------------------
+
+    async def _locked(self, func: Callable, *args):
+        """
+        修改引擎状态的调用串行执行
+
+        有沙箱中的自定义策略时在线程中执行，策略回调的管道往返不阻塞事件循环；
+        只有内置策略时直接执行，省去线程切换。
+        """
+        async with self._state_lock:
+            if any(runner.session is not None for runner in self.runners.values()):
+                return await asyncio.to_thread(func, *args)
+            return func(*args)
+
+    async def reload(self):
+        async with self._state_lock:
+            failed, self._failed = self._failed, {}
+            running, stats = set(self.runners), self.stats()
+        added, removed = await asyncio.to_thread(self.load_changes, running, stats, failed)
+        if added or removed:
+            # 新策略的预热也可能是沙箱调用
+            async with self._state_lock:
+                await asyncio.to_thread(self.apply_changes, added, removed)
+        for exchange in self.exchanges:
+            if exchange not in self._known_exchanges:
+                # 新组从最新位置开始，不回放历史事件
+                await asyncio.to_thread(self.event_log.ensure_group, exchange, self.group, '$')
+                self._known_exchanges.add(exchange)
+
+    async def _clock_loop(self, stop: asyncio.Event):
+        """在K线收盘时刻关闭K线，不等待下一条行情"""
+        while not stop.is_set():
+            deadline = self.next_deadline()
+            delay = 1.0 if deadline is None else min(max((deadline - self.clock()) / 1000, 0.0), 1.0)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            await self._locked(self.close_due_bars)
+
+    async def _consume_loop(self, stop: asyncio.Event):
+        # run() 启动时已经加载过一次
+        last_reload = time.monotonic()
+        while not stop.is_set():
+            if time.monotonic() - last_reload >= self.reload_interval:
+                await self.reload()
+                last_reload = time.monotonic()
+            exchanges = self.exchanges
+            if not exchanges:
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=self.reload_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            events = await asyncio.to_thread(
+                self.event_log.consume, self.group, self.consumer, exchanges, self.batch_size, self.block_ms,
+            )
+            if events:
+                await self._locked(self.handle_events, events)
+                # 可能出现了新的未收盘K线，让定时器重新计算收盘时刻
+                self._wakeup.set()
+                await asyncio.to_thread(self.event_log.ack, self.group, events)
+
+    async def _report_loop(self, stop: asyncio.Event):
+        while not stop.is_set():
+            entries = await asyncio.to_thread(
+                self.report_channel.read, self.report_stream, self.group, self.consumer,
+                self.batch_size, self.block_ms,
+            )
+            if entries:
+                await self._locked(self.handle_reports, [report for _, report in entries])
+                await asyncio.to_thread(
+                    self.report_channel.ack, self.report_stream, self.group, [entry_id for entry_id, _ in entries],
+                )
+
+    async def _order_loop(self, stop: asyncio.Event):
+        """在线程中发送订单请求（写入订单流或提交任务），不阻塞事件循环"""
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(self._order_ready.wait(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            self._order_ready.clear()
+            requests = self._take_orders()
+            if requests:
+                await asyncio.to_thread(self._send_orders, requests)
+
+    async def run(self, stop: Optional[asyncio.Event] = None):
+        """运行直到 stop 被设置"""
+        stop = stop or asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._state_lock = asyncio.Lock()
+        self._loop = asyncio.get_running_loop()
+        self._outbox = queue.SimpleQueue()
+        self._order_ready = asyncio.Event()
+        logger.info(f"策略引擎启动: 消费者 {self.consumer}")
+        try:
+            # 先恢复运行中的策略，再处理重启前未确认的回报
+            await self.reload()
+            await asyncio.gather(
+                self._consume_loop(stop), self._clock_loop(stop), self._report_loop(stop), self._order_loop(stop),
+            )
+        finally:
+            # 停止前发出队列中剩余的请求，之后（on_stop 中）的请求直接发送
+            self._send_orders(self._take_orders())
+            self._outbox = self._loop = None
+            for live_id in list(self.runners):
+                self.remove_runner(live_id)
+            self.recorder.flush()
+            logger.info("策略引擎已停止")
@@ -0,0 +1,34 @@
+"""
+运行实盘策略引擎的管理命令
+"""
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from apps.strategies.live import StrategyEngine
+
+
+class Command(BaseCommand):
+    help = '运行实盘策略引擎，消费市场事件日志并驱动运行中的策略'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--consumer',
+            type=str,
+            default=None,
+            help='消费者名称 (默认: 主机名-进程号)'
+        )
+
+    def handle(self, *args, **options):
+        engine = StrategyEngine(consumer=options['consumer'])
+        self.stdout.write(f'策略引擎启动: 消费者 {engine.consumer}')
+        asyncio.run(self._run(engine))
+        self.stdout.write(self.style.SUCCESS('策略引擎已停止'))
+
+    async def _run(self, engine: StrategyEngine):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await engine.run(stop)
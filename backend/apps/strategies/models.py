@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+策略管理数据模型
+"""
+import hashlib
+
+from django.db import models
+from django.contrib.auth import get_user_model
+from decimal import Decimal
+from apps.core.models import TenantModel
+from apps.market.models import Symbol
+
+User = get_user_model()
+
+
+class Strategy(TenantModel):
+    """策略模型"""
+
+    STRATEGY_TYPES = [
+        ('ma_cross', '均线交叉'),
+        ('rsi_reversion', 'RSI均值回归'),
+        ('bollinger_breakout', '布林带突破'),
+        ('custom', '自定义代码'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='strategies', verbose_name='创建者')
+    name = models.CharField(max_length=100, verbose_name='策略名称')
+    description = models.TextField(blank=True, verbose_name='策略描述')
+    strategy_type = models.CharField(max_length=30, choices=STRATEGY_TYPES, default='custom', verbose_name='策略类型')
+    code = models.TextField(blank=True, verbose_name='策略代码')
+    parameters = models.JSONField(default=dict, verbose_name='默认参数')
+    is_active = models.BooleanField(default=False, verbose_name='是否启用')
+
+    class Meta:
+        verbose_name = '策略'
+        verbose_name_plural = '策略'
+        db_table = 'strategies_strategy'
+        indexes = [
+            models.Index(fields=['tenant', 'is_active']),
+            models.Index(fields=['tenant', 'strategy_type']),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def version(self) -> str:
+        """策略版本：策略类型和代码的摘要，代码变化后回测结果缓存自动失效"""
+        payload = f"{self.strategy_type}\n{self.code}".encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()[:16]
+
+
+class BacktestArtifact(TenantModel):
+    """
+    回测结果存档
+
+    按 (策略版本, 参数, 数据范围指纹) 去重，汇总指标保存在数据库，
+    权益曲线、交易和成交明细保存在磁盘的列式压缩文件中。
+    """
+
+    cache_key = models.CharField(max_length=64, verbose_name='缓存键')
+    strategy_version = models.CharField(max_length=32, verbose_name='策略版本')
+    parameters_hash = models.CharField(max_length=64, verbose_name='参数摘要')
+    data_hash = models.CharField(max_length=64, verbose_name='数据范围指纹')
+
+    metrics = models.JSONField(default=dict, verbose_name='详细指标')
+    bars = models.IntegerField(default=0, verbose_name='权益曲线点数')
+    trades = models.IntegerField(default=0, verbose_name='交易数')
+    fills = models.IntegerField(default=0, verbose_name='成交数')
+    file_size = models.BigIntegerField(default=0, verbose_name='文件大小')
+    hits = models.IntegerField(default=0, verbose_name='命中次数')
+    last_hit_at = models.DateTimeField(null=True, blank=True, verbose_name='最近命中时间')
+
+    class Meta:
+        verbose_name = '回测结果存档'
+        verbose_name_plural = '回测结果存档'
+        db_table = 'strategies_backtest_artifact'
+        unique_together = ['tenant', 'cache_key']
+
+    def __str__(self):
+        return self.cache_key[:12]
+
+
+class Backtest(TenantModel):
+    """回测模型"""
+
+    ENGINE_CHOICES = [
+        ('vectorized', '向量化'),
+        ('event', '事件驱动'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', '等待中'),
+        ('running', '运行中'),
+        ('completed', '已完成'),
+        ('failed', '失败'),
+    ]
+
+    strategy = models.ForeignKey(Strategy, on_delete=models.CASCADE, related_name='backtests', verbose_name='策略')
+    symbol = models.ForeignKey(Symbol, on_delete=models.CASCADE, verbose_name='交易对')
+    timeframe = models.CharField(max_length=10, default='1h', verbose_name='时间周期')
+    start_date = models.DateTimeField(verbose_name='开始时间')
+    end_date = models.DateTimeField(verbose_name='结束时间')
+
+    # 回测配置
+    engine = models.CharField(max_length=20, choices=ENGINE_CHOICES, default='vectorized', verbose_name='回测引擎')
+    use_trades = models.BooleanField(default=False, verbose_name='回放逐笔成交')  # 仅事件驱动引擎
+    parameters = models.JSONField(default=dict, verbose_name='参数覆盖')
+    initial_capital = models.DecimalField(max_digits=20, decimal_places=2, default=Decimal('10000'), verbose_name='初始资金')
+    fee_rate = models.DecimalField(max_digits=10, decimal_places=6, default=Decimal('0.001'), verbose_name='手续费率')
+    slippage = models.DecimalField(max_digits=10, decimal_places=6, default=Decimal('0.0005'), verbose_name='滑点')
+
+    # 运行状态
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='状态')
+    error_message = models.TextField(blank=True, verbose_name='错误信息')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='开始运行时间')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='完成时间')
+
+    # 回测结果
+    final_capital = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, verbose_name='最终资金')
+    total_return = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True, verbose_name='总收益率')
+    annual_return = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True, verbose_name='年化收益率')
+    max_drawdown = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True, verbose_name='最大回撤')
+    sharpe_ratio = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True, verbose_name='夏普比率')
+    win_rate = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True, verbose_name='胜率')
+    total_trades = models.IntegerField(default=0, verbose_name='交易次数')
+    metrics = models.JSONField(default=dict, verbose_name='详细指标')
+    equity_curve = models.JSONField(default=list, verbose_name='权益曲线')  # [[timestamp_ms, equity], ...] 降采样预览
+    artifact = models.ForeignKey(
+        BacktestArtifact, on_delete=models.SET_NULL, null=True, blank=True, related_name='backtests', verbose_name='结果存档'
+    )
+    cache_hit = models.BooleanField(default=False, verbose_name='命中缓存')
+
+    class Meta:
+        verbose_name = '回测'
+        verbose_name_plural = '回测'
+        db_table = 'strategies_backtest'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['tenant', 'strategy', '-created_at']),
+            models.Index(fields=['tenant', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.strategy.name} {self.symbol.symbol} {self.start_date:%Y-%m-%d}~{self.end_date:%Y-%m-%d}"
+
+
+class Optimization(TenantModel):
+    """参数优化模型"""
+
+    METHOD_CHOICES = [
+        ('grid', '网格搜索'),
+        ('random', '随机搜索'),
+        ('genetic', '遗传算法'),
+    ]
+
+    STATUS_CHOICES = Backtest.STATUS_CHOICES
+
+    strategy = models.ForeignKey(Strategy, on_delete=models.CASCADE, related_name='optimizations', verbose_name='策略')
+    symbol = models.ForeignKey(Symbol, on_delete=models.CASCADE, verbose_name='交易对')
+    timeframe = models.CharField(max_length=10, default='1h', verbose_name='时间周期')
+    start_date = models.DateTimeField(verbose_name='开始时间')
+    end_date = models.DateTimeField(verbose_name='结束时间')
+
+    # 优化配置
+    method = models.CharField(max_length=20, choices=METHOD_CHOICES, default='grid', verbose_name='搜索方式')
+    parameter_ranges = models.JSONField(default=dict, verbose_name='参数范围')
+    samples = models.IntegerField(null=True, blank=True, verbose_name='采样数量')
+    objective = models.CharField(max_length=30, default='sharpe_ratio', verbose_name='优化目标')
+    top_n = models.IntegerField(default=10, verbose_name='保留结果数')
+    max_drawdown = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True, verbose_name='回撤上限')
+    options = models.JSONField(default=dict, verbose_name='算法参数')  # 遗传算法的种群规模、代数等
+    initial_capital = models.DecimalField(max_digits=20, decimal_places=2, default=Decimal('10000'), verbose_name='初始资金')
+    fee_rate = models.DecimalField(max_digits=10, decimal_places=6, default=Decimal('0.001'), verbose_name='手续费率')
+    slippage = models.DecimalField(max_digits=10, decimal_places=6, default=Decimal('0.0005'), verbose_name='滑点')
+
+    # 运行状态
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='状态')
+    error_message = models.TextField(blank=True, verbose_name='错误信息')
+    total_candidates = models.IntegerField(default=0, verbose_name='候选总数')
+    completed_candidates = models.IntegerField(default=0, verbose_name='已完成数')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='开始运行时间')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='完成时间')
+
+    # 优化结果（运行中持续更新）
+    top_results = models.JSONField(default=list, verbose_name='最优结果')
+    best_parameters = models.JSONField(default=dict, verbose_name='最优参数')
+    summary = models.JSONField(default=dict, verbose_name='运行统计')
+
+    class Meta:
+        verbose_name = '参数优化'
+        verbose_name_plural = '参数优化'
+        db_table = 'strategies_optimization'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['tenant', 'strategy', '-created_at']),
+            models.Index(fields=['tenant', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.strategy.name} {self.get_method_display()} {self.objective}"
+
+
+class WalkForward(TenantModel):
+    """滚动前推分析模型"""
+
+    STATUS_CHOICES = Backtest.STATUS_CHOICES
+
+    strategy = models.ForeignKey(Strategy, on_delete=models.CASCADE, related_name='walk_forwards', verbose_name='策略')
+    symbol = models.ForeignKey(Symbol, on_delete=models.CASCADE, verbose_name='交易对')
+    timeframe = models.CharField(max_length=10, default='1h', verbose_name='时间周期')
+    start_date = models.DateTimeField(verbose_name='开始时间')
+    end_date = models.DateTimeField(verbose_name='结束时间')
+
+    # 分析配置
+    parameter_ranges = models.JSONField(default=dict, verbose_name='参数范围')
+    method = models.CharField(max_length=20, choices=Optimization.METHOD_CHOICES[:2], default='grid', verbose_name='搜索方式')
+    samples = models.IntegerField(null=True, blank=True, verbose_name='采样数量')
+    objective = models.CharField(max_length=30, default='sharpe_ratio', verbose_name='优化目标')
+    train_bars = models.IntegerField(verbose_name='训练窗口K线数')
+    test_bars = models.IntegerField(verbose_name='测试窗口K线数')
+    anchored = models.BooleanField(default=False, verbose_name='锚定起点')  # 训练窗口从数据开头扩张
+    initial_capital = models.DecimalField(max_digits=20, decimal_places=2, default=Decimal('10000'), verbose_name='初始资金')
+    fee_rate = models.DecimalField(max_digits=10, decimal_places=6, default=Decimal('0.001'), verbose_name='手续费率')
+    slippage = models.DecimalField(max_digits=10, decimal_places=6, default=Decimal('0.0005'), verbose_name='滑点')
+
+    # 运行状态
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='状态')
+    error_message = models.TextField(blank=True, verbose_name='错误信息')
+    total_candidates = models.IntegerField(default=0, verbose_name='候选总数')
+    completed_candidates = models.IntegerField(default=0, verbose_name='已完成数')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='开始运行时间')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='完成时间')
+
+    # 分析结果
+    windows = models.JSONField(default=list, verbose_name='窗口结果')  # 每个窗口的最优参数与样本内外表现
+    metrics = models.JSONField(default=dict, verbose_name='样本外指标')
+    equity_curve = models.JSONField(default=list, verbose_name='样本外权益曲线')
+
+    class Meta:
+        verbose_name = '滚动前推分析'
+        verbose_name_plural = '滚动前推分析'
+        db_table = 'strategies_walk_forward'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['tenant', 'strategy', '-created_at']),
+            models.Index(fields=['tenant', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.strategy.name} {self.symbol.symbol} {self.train_bars}/{self.test_bars}"
+
+
+class PortfolioBacktest(TenantModel):
+    """
+    组合回测模型
+
+    同一策略在多个交易对上运行，共用一份资金，按资金分配方式和调仓周期确定各资产权重。
+    """
+
+    ALLOCATION_CHOICES = [
+        ('equal', '等权'),
+        ('active', '按持仓等分'),
+        ('inverse_volatility', '波动率倒数'),
+    ]
+
+    STATUS_CHOICES = Backtest.STATUS_CHOICES
+
+    strategy = models.ForeignKey(
+        Strategy, on_delete=models.CASCADE, related_name='portfolio_backtests', verbose_name='策略'
+    )
+    symbols = models.ManyToManyField(Symbol, related_name='portfolio_backtests', verbose_name='交易对')
+    timeframe = models.CharField(max_length=10, default='1h', verbose_name='时间周期')
+    start_date = models.DateTimeField(verbose_name='开始时间')
+    end_date = models.DateTimeField(verbose_name='结束时间')
+
+    # 回测配置
+    parameters = models.JSONField(default=dict, verbose_name='参数覆盖')
+    allocation = models.CharField(max_length=30, choices=ALLOCATION_CHOICES, default='equal', verbose_name='资金分配')
+    rebalance_every = models.IntegerField(default=1, verbose_name='调仓周期K线数')
+    leverage = models.DecimalField(max_digits=10, decimal_places=4, default=Decimal('1'), verbose_name='总敞口上限')
+    max_weight = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True, verbose_name='单资产权重上限')
+    initial_capital = models.DecimalField(max_digits=20, decimal_places=2, default=Decimal('10000'), verbose_name='初始资金')
+    fee_rate = models.DecimalField(max_digits=10, decimal_places=6, default=Decimal('0.001'), verbose_name='手续费率')
+    slippage = models.DecimalField(max_digits=10, decimal_places=6, default=Decimal('0.0005'), verbose_name='滑点')
+
+    # 运行状态
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='状态')
+    error_message = models.TextField(blank=True, verbose_name='错误信息')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='开始运行时间')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='完成时间')
+
+    # 回测结果
+    final_capital = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, verbose_name='最终资金')
+    total_return = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True, verbose_name='总收益率')
+    max_drawdown = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True, verbose_name='最大回撤')
+    sharpe_ratio = models.DecimalField(max_digits=10, decimal_places=4, null=True, blank=True, verbose_name='夏普比率')
+    total_trades = models.IntegerField(default=0, verbose_name='交易次数')
+    metrics = models.JSONField(default=dict, verbose_name='详细指标')
+    equity_curve = models.JSONField(default=list, verbose_name='权益曲线')
+    assets = models.JSONField(default=list, verbose_name='资产统计')  # 每个交易对的K线数、缺失数、收益贡献、换手
+
+    class Meta:
+        verbose_name = '组合回测'
+        verbose_name_plural = '组合回测'
+        db_table = 'strategies_portfolio_backtest'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['tenant', 'strategy', '-created_at']),
+            models.Index(fields=['tenant', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.strategy.name} {self.get_allocation_display()} {self.start_date:%Y-%m-%d}~{self.end_date:%Y-%m-%d}"
+
+
+class LiveStrategy(TenantModel):
+    """
+    实盘策略实例
+
+    策略在指定交易账户和交易对上的运行配置，由策略引擎进程加载，
+    行情事件到达时直接回调策略，订单发往执行层。
+    """
+
+    STATUS_CHOICES = [
+        ('stopped', '已停止'),
+        ('running', '运行中'),
+        ('error', '异常'),
+    ]
+
+    strategy = models.ForeignKey(Strategy, on_delete=models.CASCADE, related_name='live_instances', verbose_name='策略')
+    exchange_account = models.ForeignKey(
+        'trading.ExchangeAccount', on_delete=models.CASCADE, related_name='live_strategies', verbose_name='交易账户'
+    )
+    symbol = models.ForeignKey(Symbol, on_delete=models.CASCADE, verbose_name='交易对')
+    timeframe = models.CharField(max_length=10, default='1h', verbose_name='时间周期')
+    parameters = models.JSONField(default=dict, verbose_name='参数覆盖')
+    capital = models.DecimalField(max_digits=20, decimal_places=2, default=Decimal('10000'), verbose_name='分配资金')
+
+    # 运行状态
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='stopped', verbose_name='状态')
+    error_message = models.TextField(blank=True, verbose_name='错误信息')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='启动时间')
+    stopped_at = models.DateTimeField(null=True, blank=True, verbose_name='停止时间')
+    stats = models.JSONField(default=dict, verbose_name='运行统计')  # 事件数、订单数、回调和信号延迟
+
+    class Meta:
+        verbose_name = '实盘策略'
+        verbose_name_plural = '实盘策略'
+        db_table = 'strategies_live_strategy'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['tenant', 'strategy']),
+            models.Index(fields=['status']),
+        ]
+
+    def __str__(self):
+        return f"{self.strategy.name} {self.symbol.symbol} {self.timeframe}"
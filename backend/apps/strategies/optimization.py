@@ -0,0 +1,654 @@
+"""
+策略参数优化
+
+网格/随机搜索：把参数范围展开为候选参数组合，分发到进程池并行回测。
+遗传算法：在整数/浮点/类别混合参数空间上进化种群，同一基因组只回测一次。
+
+- K线数组只从数据库加载一次，写入一块共享内存，工作进程直接映射为 NumPy 视图，
+  不再逐个候选查询数据库，也不通过管道复制数据；
+- 候选按块分发（imap_unordered），每完成一个就更新前 N 名并回调，调用方可以在
+  优化进行中读取当前最优结果；
+- 工作进程之间没有共享状态，吞吐随核心数线性增长；
+- 设置回撤上限时先回测前一段数据，前段回撤已超限的候选直接淘汰，不再回测全段。
+"""
+import heapq
+import logging
+import math
+import multiprocessing
+import os
+import random
+import time
+from itertools import count, product
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .backtest import BacktestError, get_signal_generator, run_vectorized_backtest
+
+logger = logging.getLogger(__name__)
+
+# 可作为优化目标的指标
+OBJECTIVES = (
+    'total_return', 'annual_return', 'sharpe_ratio', 'sortino_ratio', 'calmar_ratio',
+    'profit_factor', 'win_rate', 'max_drawdown',
+)
+
+# 越小越好的指标，评分时取负值
+MINIMIZE_OBJECTIVES = ('max_drawdown',)
+
+# 设置回撤上限时，先回测的数据比例
+DEFAULT_PRUNE_FRACTION = 0.3
+
+# 随每个候选返回的指标
+RESULT_METRICS = (
+    'total_return', 'annual_return', 'max_drawdown', 'sharpe_ratio', 'sortino_ratio',
+    'calmar_ratio', 'win_rate', 'profit_factor', 'total_trades', 'final_capital',
+)
+
+
+# -- 参数空间 -------------------------------------------------------------
+
+
+def _is_int(*values) -> bool:
+    return all(isinstance(v, int) and not isinstance(v, bool) for v in values)
+
+
+def _range_values(spec: Dict[str, Any]) -> List[Any]:
+    """{'min', 'max', 'step'} 展开为取值列表（包含 max）"""
+    low, high = spec['min'], spec['max']
+    step = spec.get('step', 1 if _is_int(low, high) else None)
+    if step is None:
+        raise BacktestError('浮点参数范围需要指定 step')
+    if step <= 0 or high < low:
+        raise BacktestError(f'无效的参数范围: {spec}')
+    if _is_int(low, high, step):
+        return list(range(low, high + 1, step))
+    n = int(math.floor((high - low) / step + 1e-9)) + 1
+    return [round(low + i * step, 10) for i in range(n)]
+
+
+def parameter_grid(parameter_ranges: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    展开为网格搜索的全部组合
+
+    每个参数可以是取值列表、{'min', 'max', 'step'} 范围或单个固定值。
+    """
+    names, axes = [], []
+    for name, spec in parameter_ranges.items():
+        if isinstance(spec, dict):
+            values = _range_values(spec)
+        elif isinstance(spec, (list, tuple)):
+            values = list(spec)
+        else:
+            values = [spec]
+        if not values:
+            raise BacktestError(f'参数 {name} 没有可选值')
+        names.append(name)
+        axes.append(values)
+    return [dict(zip(names, combo)) for combo in product(*axes)]
+
+
+def random_parameters(parameter_ranges: Dict[str, Any], samples: int,
+                      seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    随机搜索的候选组合（去重）
+
+    范围参数未指定 step 时在 [min, max] 内连续均匀采样，整数范围只取整数。
+    """
+    rng = random.Random(seed)
+    samplers = {}
+    for name, spec in parameter_ranges.items():
+        if isinstance(spec, dict) and ('step' in spec or _is_int(spec['min'], spec['max'])):
+            values = _range_values(spec)
+            samplers[name] = lambda values=values: rng.choice(values)
+        elif isinstance(spec, dict):
+            low, high = float(spec['min']), float(spec['max'])
+            samplers[name] = lambda low=low, high=high: round(rng.uniform(low, high), 10)
+        elif isinstance(spec, (list, tuple)):
+            values = list(spec)
+            samplers[name] = lambda values=values: rng.choice(values)
+        else:
+            samplers[name] = lambda value=spec: value
+
+    candidates, seen = [], set()
+    attempts = samples * 20
+    while len(candidates) < samples and attempts > 0:
+        attempts -= 1
+        params = {name: sample() for name, sample in samplers.items()}
+        key = tuple(sorted(params.items()))
+        if key not in seen:
+            seen.add(key)
+            candidates.append(params)
+    return candidates
+
+
+def build_candidates(parameter_ranges: Dict[str, Any], method: str = 'grid', samples: Optional[int] = None,
+                     seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """按搜索方式生成候选组合；网格搜索指定 samples 时从网格中随机抽样"""
+    if method == 'grid':
+        candidates = parameter_grid(parameter_ranges)
+        if samples and samples < len(candidates):
+            candidates = random.Random(seed).sample(candidates, samples)
+        return candidates
+    if method == 'random':
+        return random_parameters(parameter_ranges, samples or 100, seed)
+    raise BacktestError(f'不支持的搜索方式: {method}')
+
+
+# -- 共享内存 -------------------------------------------------------------
+
+
+class SharedArrays:
+    """
+    把一组 NumPy 数组放进同一块共享内存
+
+    父进程 create 后把 spec（名称、各数组的 dtype/偏移/长度）传给子进程，
+    子进程 attach 得到零拷贝的只读视图。父进程负责 close 并释放共享内存。
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, spec: Dict[str, Any], owner: bool):
+        self.shm = shm
+        self.spec = spec
+        self.owner = owner
+        self.arrays = {}
+        for name, dtype, offset, length in spec['fields']:
+            array = np.ndarray((length,), dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+            array.flags.writeable = False
+            self.arrays[name] = array
+
+    @classmethod
+    def create(cls, arrays: Dict[str, np.ndarray]) -> 'SharedArrays':
+        fields, offset = [], 0
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            offset = (offset + 7) // 8 * 8  # 8 字节对齐
+            fields.append((name, array.dtype.str, offset, len(array)))
+            offset += array.nbytes
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        try:
+            for name, dtype, start, length in fields:
+                target = np.ndarray((length,), dtype=np.dtype(dtype), buffer=shm.buf, offset=start)
+                target[:] = arrays[name]
+                del target
+            return cls(shm, {'name': shm.name, 'fields': fields}, owner=True)
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+
+    @classmethod
+    def attach(cls, spec: Dict[str, Any]) -> 'SharedArrays':
+        return cls(shared_memory.SharedMemory(name=spec['name']), spec, owner=False)
+
+    def close(self):
+        # 先释放视图，否则 mmap 仍被引用无法关闭
+        self.arrays = {}
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# -- 候选评估 -------------------------------------------------------------
+
+# 工作进程内的评估环境，由 _init_worker 设置
+_worker_state: Dict[str, Any] = {}
+
+
+def evaluate_candidate(data: Dict[str, np.ndarray], strategy_type: str, params: Dict[str, Any],
+                       config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    回测单个候选组合，只返回指标，不返回权益曲线等大数组
+
+    config 设置 max_drawdown 时先用前 prune_fraction 的数据回测：前段的最大回撤
+    不会大于全段，前段已超限的候选必然不满足约束，标记为 pruned 并跳过全段回测。
+    """
+    generator = get_signal_generator(strategy_type)
+    bound = config.get('max_drawdown')
+    try:
+        signal = generator(data, **params)
+        if bound is not None:
+            cut = int(len(signal) * config.get('prune_fraction', DEFAULT_PRUNE_FRACTION))
+            if cut >= 2:
+                partial = _backtest(data, signal, config, cut)
+                if partial.metrics['max_drawdown'] > bound:
+                    return {'parameters': params, 'pruned': True, 'bars': cut}
+        result = _backtest(data, signal, config)
+    except (TypeError, ValueError, ArithmeticError, BacktestError) as e:
+        return {'parameters': params, 'error': str(e)}
+    metrics = result.metrics
+    if bound is not None and metrics['max_drawdown'] > bound:
+        return {'parameters': params, 'pruned': True, 'bars': metrics['bars']}
+    return {'parameters': params, 'metrics': {name: metrics.get(name) for name in RESULT_METRICS}}
+
+
+def _backtest(data: Dict[str, np.ndarray], signal: np.ndarray, config: Dict[str, Any], length: Optional[int] = None):
+    if length is not None:
+        data = {name: values[:length] for name, values in data.items()}
+        signal = signal[:length]
+    return run_vectorized_backtest(
+        data, signal,
+        initial_capital=config['initial_capital'],
+        fee_rate=config['fee_rate'],
+        slippage=config['slippage'],
+        timeframe=config['timeframe'],
+    )
+
+
+def _init_worker(spec: Dict[str, Any], strategy_type: str, config: Dict[str, Any], evaluator: Callable):
+    """工作进程初始化：映射共享内存中的K线数组"""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    shared = SharedArrays.attach(spec)
+    _worker_state.update(shared=shared, strategy_type=strategy_type, config=config, evaluator=evaluator)
+
+
+def _evaluate_in_worker(item: Tuple[int, Dict[str, Any]]) -> Tuple[int, Dict[str, Any]]:
+    index, params = item
+    state = _worker_state
+    return index, state['evaluator'](state['shared'].arrays, state['strategy_type'], params, state['config'])
+
+
+# -- 优化器 ---------------------------------------------------------------
+
+
+def objective_score(objective: str, metrics: Dict[str, Any]) -> Optional[float]:
+    """目标指标转换为越大越好的评分，指标缺失或非有限值时返回 None"""
+    value = metrics.get(objective)
+    if value is None or not math.isfinite(value):
+        return None
+    return -float(value) if objective in MINIMIZE_OBJECTIVES else float(value)
+
+
+class TopResults:
+    """按目标指标维护前 N 名（小顶堆）"""
+
+    def __init__(self, objective: str, size: int):
+        self.objective = objective
+        self.size = size
+        self._heap: List[Tuple[float, int, Dict[str, Any]]] = []
+        self._seq = count()
+
+    def score(self, result: Dict[str, Any]) -> Optional[float]:
+        if 'metrics' not in result:
+            return None
+        return objective_score(self.objective, result['metrics'])
+
+    def push(self, result: Dict[str, Any]) -> bool:
+        """加入结果，进入前 N 名时返回 True"""
+        score = self.score(result)
+        if score is None:
+            return False
+        entry = (score, next(self._seq), result)
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, entry)
+            return True
+        if score > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+            return True
+        return False
+
+    def ranked(self) -> List[Dict[str, Any]]:
+        return [
+            {**result, 'score': score}
+            for score, _, result in sorted(self._heap, key=lambda e: (-e[0], e[1]))
+        ]
+
+
+class CandidatePool:
+    """
+    候选评估进程池
+
+    进入时创建共享内存和进程池，可以多次 map（遗传算法每一代复用同一个池），
+    退出时释放。workers 为 1 时在当前进程中直接评估。
+    守护进程（Celery prefork 工作进程）不能再创建子进程，此时同样退化为当前进程评估。
+
+    evaluator 为模块级函数 (data, strategy_type, params, config) -> 结果字典，默认回测全段数据。
+    """
+
+    def __init__(self, strategy_type: str, data: Dict[str, np.ndarray], config: Dict[str, Any], workers: int,
+                 evaluator: Callable = evaluate_candidate):
+        self.strategy_type = strategy_type
+        self.data = data
+        self.config = config
+        self.workers = workers
+        self.evaluator = evaluator
+        self._shared = None
+        self._pool = None
+
+    def __enter__(self):
+        if self.workers > 1 and multiprocessing.current_process().daemon:
+            logger.info('当前为守护进程，无法创建进程池，改为单进程评估')
+            self.workers = 1
+        if self.workers > 1:
+            method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._shared = SharedArrays.create(self.data)
+            try:
+                self._pool = multiprocessing.get_context(method).Pool(
+                    processes=self.workers,
+                    initializer=_init_worker,
+                    initargs=(self._shared.spec, self.strategy_type, self.config, self.evaluator),
+                )
+            except BaseException:
+                self._shared.close()
+                self._shared = None
+                raise
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
+    def _chunksize(self, total: int) -> int:
+        # 每个进程约分到 20 块：块足够小以便及时回传结果，又不至于让调度开销占主导
+        return max(1, min(64, total // (self.workers * 20)))
+
+    def map(self, candidates: List[Dict[str, Any]]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """评估候选组合，按完成顺序返回 (下标, 结果)"""
+        items = list(enumerate(candidates))
+        if self._pool is None or len(items) <= 1:
+            for index, params in items:
+                yield index, self.evaluator(self.data, self.strategy_type, params, self.config)
+            return
+        yield from self._pool.imap_unordered(_evaluate_in_worker, items, chunksize=self._chunksize(len(items)))
+
+
+class ParameterOptimizer:
+    """
+    并行参数优化器
+
+    用法：
+        optimizer = ParameterOptimizer('ma_cross', kline_arrays, '1h', objective='sharpe_ratio')
+        report = optimizer.run(build_candidates({'fast_period': {'min': 5, 'max': 50, 'step': 5}}))
+    """
+
+    def __init__(self, strategy_type: str, data: Dict[str, np.ndarray], timeframe: str,
+                 initial_capital: float = 10000.0, fee_rate: float = 0.001, slippage: float = 0.0005,
+                 objective: str = 'sharpe_ratio', top_n: int = 10, workers: Optional[int] = None,
+                 base_parameters: Optional[Dict[str, Any]] = None, max_drawdown: Optional[float] = None,
+                 prune_fraction: float = DEFAULT_PRUNE_FRACTION):
+        if objective not in OBJECTIVES:
+            raise BacktestError(f'不支持的优化目标: {objective}')
+        get_signal_generator(strategy_type)
+        self.strategy_type = strategy_type
+        self.data = data
+        self.objective = objective
+        self.top_n = top_n
+        self.workers = workers or os.cpu_count() or 1
+        self.base_parameters = base_parameters or {}
+        self.config = {
+            'initial_capital': float(initial_capital),
+            'fee_rate': float(fee_rate),
+            'slippage': float(slippage),
+            'timeframe': timeframe,
+            'max_drawdown': float(max_drawdown) if max_drawdown is not None else None,
+            'prune_fraction': prune_fraction,
+        }
+
+    def _pool(self) -> CandidatePool:
+        return CandidatePool(self.strategy_type, self.data, self.config, self.workers)
+
+    def run(self, candidates: List[Dict[str, Any]],
+            on_progress: Optional[Callable[[int, int, List[Dict[str, Any]]], None]] = None,
+            progress_interval: float = 1.0) -> Dict[str, Any]:
+        """
+        执行优化
+
+        Args:
+            candidates: 候选参数组合（与 base_parameters 合并后回测）
+            on_progress: 进度回调 (已完成数, 总数, 当前前 N 名)；前 N 名变化后
+                最多每 progress_interval 秒调用一次，结束时必定调用一次
+
+        Returns:
+            {'results': 前 N 名, 'evaluated', 'failed', 'pruned', 'elapsed', 'candidates_per_second'}
+        """
+        if not candidates:
+            raise BacktestError('没有候选参数组合')
+        top = TopResults(self.objective, self.top_n)
+        total = len(candidates)
+        done = failed = pruned = 0
+        started = last_report = time.perf_counter()
+        dirty = False
+
+        with self._pool() as pool:
+            for _, result in pool.map([{**self.base_parameters, **params} for params in candidates]):
+                done += 1
+                if 'error' in result:
+                    failed += 1
+                elif result.get('pruned'):
+                    pruned += 1
+                elif top.push(result):
+                    dirty = True
+                now = time.perf_counter()
+                if on_progress and dirty and now - last_report >= progress_interval:
+                    on_progress(done, total, top.ranked())
+                    last_report = now
+                    dirty = False
+
+        elapsed = time.perf_counter() - started
+        ranked = top.ranked()
+        if on_progress:
+            on_progress(done, total, ranked)
+        logger.info(f"参数优化完成: {total}个候选, {self.workers}进程, {elapsed:.2f}s")
+        return {
+            'results': ranked,
+            'evaluated': done,
+            'failed': failed,
+            'pruned': pruned,
+            'elapsed': round(elapsed, 3),
+            'candidates_per_second': round(done / elapsed, 2) if elapsed > 0 else 0,
+        }
+
+
+# -- 遗传算法 -------------------------------------------------------------
+
+
+class Gene:
+    """
+    单个参数的取值空间
+
+    - ordinal：有序离散值（整数范围、带 step 的浮点范围），变异在下标上做高斯扰动；
+    - float：连续浮点范围，变异在取值上做高斯扰动；
+    - categorical：取值列表，变异为重新随机选取；
+    - fixed：固定值，不参与进化。
+    """
+    __slots__ = ('name', 'kind', 'values', 'low', 'high')
+
+    # 高斯变异的标准差占取值范围的比例
+    MUTATION_SCALE = 0.15
+
+    def __init__(self, name: str, spec: Any):
+        self.name = name
+        self.values = None
+        self.low = self.high = None
+        if isinstance(spec, dict) and ('step' in spec or _is_int(spec['min'], spec['max'])):
+            self.kind = 'ordinal'
+            self.values = _range_values(spec)
+        elif isinstance(spec, dict):
+            self.kind = 'float'
+            self.low, self.high = float(spec['min']), float(spec['max'])
+            if self.high < self.low:
+                raise BacktestError(f'无效的参数范围: {spec}')
+        elif isinstance(spec, (list, tuple)):
+            if not spec:
+                raise BacktestError(f'参数 {name} 没有可选值')
+            self.kind = 'categorical'
+            self.values = list(spec)
+        else:
+            self.kind = 'fixed'
+            self.values = [spec]
+
+    def sample(self, rng: random.Random):
+        if self.kind == 'float':
+            return round(rng.uniform(self.low, self.high), 10)
+        return rng.choice(self.values)
+
+    def mutate(self, value, rng: random.Random):
+        if self.kind == 'fixed':
+            return value
+        if self.kind == 'categorical':
+            return rng.choice(self.values)
+        if self.kind == 'float':
+            sigma = (self.high - self.low) * self.MUTATION_SCALE
+            return round(min(self.high, max(self.low, value + rng.gauss(0, sigma))), 10)
+        index = self.values.index(value)
+        step = round(rng.gauss(0, max(1.0, len(self.values) * self.MUTATION_SCALE))) or rng.choice((-1, 1))
+        return self.values[min(len(self.values) - 1, max(0, index + step))]
+
+
+class GeneticOptimizer(ParameterOptimizer):
+    """
+    遗传算法参数优化器
+
+    每一代只回测缓存中没有的基因组（按参数值去重），同一个进程池和共享内存在各代之间复用。
+    选择使用锦标赛，交叉为均匀交叉，保留精英个体；连续 patience 代最优值没有提升时提前结束。
+
+    用法：
+        optimizer = GeneticOptimizer('ma_cross', kline_arrays, '1h', max_drawdown=0.3)
+        report = optimizer.evolve({'fast_period': {'min': 2, 'max': 60}, 'slow_period': {'min': 20, 'max': 300}})
+    """
+
+    def __init__(self, strategy_type: str, data: Dict[str, np.ndarray], timeframe: str,
+                 population_size: int = 30, generations: int = 20, elite_size: int = 2,
+                 crossover_rate: float = 0.8, mutation_rate: float = 0.2, tournament_size: int = 3,
+                 patience: Optional[int] = 5, seed: Optional[int] = None, **kwargs):
+        super().__init__(strategy_type, data, timeframe, **kwargs)
+        if population_size < 2:
+            raise BacktestError('种群规模至少为 2')
+        self.population_size = population_size
+        self.generations = generations
+        self.elite_size = min(elite_size, population_size)
+        self.crossover_rate = crossover_rate
+        self.mutation_rate = mutation_rate
+        self.tournament_size = tournament_size
+        self.patience = patience
+        self.rng = random.Random(seed)
+        self.cache: Dict[tuple, Dict[str, Any]] = {}
+
+    @staticmethod
+    def _key(genome: Dict[str, Any]) -> tuple:
+        return tuple(sorted(genome.items()))
+
+    def _fitness(self, top: TopResults, genome: Dict[str, Any]) -> float:
+        score = top.score(self.cache[self._key(genome)])
+        return float('-inf') if score is None else score
+
+    def _select(self, population: List[Dict[str, Any]], fitness: List[float]) -> Dict[str, Any]:
+        contenders = self.rng.sample(range(len(population)), min(self.tournament_size, len(population)))
+        return population[max(contenders, key=lambda i: fitness[i])]
+
+    def _offspring(self, genes: List[Gene], first: Dict[str, Any], second: Dict[str, Any]) -> Dict[str, Any]:
+        rng = self.rng
+        if rng.random() < self.crossover_rate:
+            child = {gene.name: (first if rng.random() < 0.5 else second)[gene.name] for gene in genes}
+        else:
+            child = dict(first)
+        for gene in genes:
+            if rng.random() < self.mutation_rate:
+                child[gene.name] = gene.mutate(child[gene.name], rng)
+        return child
+
+    def _breed(self, genes: List[Gene], population: List[Dict[str, Any]], fitness: List[float]) -> List[Dict[str, Any]]:
+        ranked = sorted(range(len(population)), key=lambda i: fitness[i], reverse=True)
+        children = [population[i] for i in ranked[:self.elite_size]]
+        seen = {self._key(child) for child in children}
+        attempts = self.population_size * 10
+        while len(children) < self.population_size and attempts > 0:
+            attempts -= 1
+            child = self._offspring(genes, self._select(population, fitness), self._select(population, fitness))
+            key = self._key(child)
+            # 同一代内不重复；搜索空间很小时放宽为允许重复，由缓存负责跳过回测
+            if key not in seen or attempts < self.population_size:
+                seen.add(key)
+                children.append(child)
+        return children
+
+    def evolve(self, parameter_ranges: Dict[str, Any],
+               on_progress: Optional[Callable[[int, int, List[Dict[str, Any]]], None]] = None) -> Dict[str, Any]:
+        """
+        执行遗传算法
+
+        Args:
+            parameter_ranges: 参数空间，格式同 parameter_grid；{'min', 'max'} 浮点范围为连续参数
+            on_progress: 每一代结束后回调 (已回测数, 回测预算, 当前前 N 名)
+
+        Returns:
+            {'results', 'evaluated', 'cache_hits', 'failed', 'pruned', 'generations', 'history', 'elapsed'}
+        """
+        genes = [Gene(name, spec) for name, spec in parameter_ranges.items()]
+        top = TopResults(self.objective, self.top_n)
+        budget = self.population_size * self.generations
+        population = [{gene.name: gene.sample(self.rng) for gene in genes} for _ in range(self.population_size)]
+        evaluated = cache_hits = failed = pruned = 0
+        history = []
+        best, stale = float('-inf'), 0
+        started = time.perf_counter()
+
+        with self._pool() as pool:
+            for generation in range(self.generations):
+                pending = {}
+                for genome in population:
+                    key = self._key(genome)
+                    if key in self.cache or key in pending:
+                        cache_hits += 1
+                    else:
+                        pending[key] = genome
+                keys = list(pending)
+                for index, result in pool.map([{**self.base_parameters, **pending[key]} for key in keys]):
+                    self.cache[keys[index]] = result
+                    evaluated += 1
+                    if 'error' in result:
+                        failed += 1
+                    elif result.get('pruned'):
+                        pruned += 1
+                    else:
+                        top.push(result)
+
+                fitness = [self._fitness(top, genome) for genome in population]
+                finite = [value for value in fitness if math.isfinite(value)]
+                generation_best = max(fitness)
+                history.append({
+                    'generation': generation,
+                    'best': generation_best if finite else None,
+                    'mean': round(sum(finite) / len(finite), 6) if finite else None,
+                    'evaluated': len(keys),
+                })
+                if on_progress:
+                    on_progress(evaluated, budget, top.ranked())
+
+                if generation_best > best:
+                    best, stale = generation_best, 0
+                else:
+                    stale += 1
+                    if self.patience is not None and stale >= self.patience:
+                        break
+                population = self._breed(genes, population, fitness)
+
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"遗传算法优化完成: {len(history)}代, 回测{evaluated}次, 缓存命中{cache_hits}次, "
+            f"剪枝{pruned}次, {elapsed:.2f}s"
+        )
+        return {
+            'results': top.ranked(),
+            'evaluated': evaluated,
+            'cache_hits': cache_hits,
+            'failed': failed,
+            'pruned': pruned,
+            'generations': len(history),
+            'history': history,
+            'elapsed': round(elapsed, 3),
+        }
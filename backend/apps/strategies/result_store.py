@@ -0,0 +1,180 @@
+"""
+回测结果存储
+
+汇总指标保存在数据库（BacktestArtifact），权益曲线、交易和成交明细以列式压缩文件
+保存在磁盘：每个结果一个 .npz 文件，每列单独压缩，读取权益曲线时不会解压交易明细。
+
+- 时间戳按差分存储，等间隔K线的差分几乎全部相同，压缩后接近零开销；
+- 结果按 (策略版本, 参数, 数据范围指纹) 计算缓存键，相同请求直接复用已有结果；
+- 图表接口用 LTTB 算法按像素宽度降采样，保留曲线的峰谷形态；
+- 最后一个引用存档的回测删除后，存档随之删除；同一缓存键没有任何租户的存档时删除文件。
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .backtest import BacktestResult
+from .models import Backtest, BacktestArtifact
+
+# 回测引擎或存储格式不兼容变更时递增，使旧缓存失效
+RESULT_FORMAT_VERSION = 1
+
+
+def _canonical(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def result_cache_key(strategy_version: str, parameters_hash: str, data_hash: str) -> str:
+    """回测结果缓存键"""
+    payload = _canonical([RESULT_FORMAT_VERSION, strategy_version, parameters_hash, data_hash])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def hash_payload(value: Any) -> str:
+    """任意可 JSON 序列化对象的摘要，用于参数和数据范围指纹"""
+    return hashlib.sha256(_canonical(value).encode('utf-8')).hexdigest()
+
+
+def lttb_downsample(x: np.ndarray, y: np.ndarray, threshold: int):
+    """
+    Largest-Triangle-Three-Buckets 降采样
+
+    保留首尾点，其余点分成 threshold - 2 个桶，每个桶选出与前一个选中点、
+    下一个桶均值构成的三角形面积最大的点。
+
+    Returns:
+        选中点的下标数组
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        if next_start >= next_end:
+            next_x, next_y = x[-1], y[-1]
+        else:
+            next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        px, py = x[previous], y[previous]
+        area = np.abs((px - next_x) * (y[start:end] - py) - (px - x[start:end]) * (next_y - py))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+class BacktestResultStore:
+    """
+    回测结果文件存储
+
+    文件路径为 ``{存储目录}/{缓存键前两位}/{缓存键}.npz``，写入先落临时文件再原子替换。
+    列名前缀：``equity_`` 权益曲线，``trade_`` 交易，``fill_`` 成交。
+    """
+
+    def __init__(self, base_dir: Optional[str] = None):
+        self.base_dir = Path(base_dir or getattr(settings, 'BACKTEST_RESULT_DIR', 'backtest_results'))
+
+    def path_for(self, key: str) -> Path:
+        return self.base_dir / key[:2] / f'{key}.npz'
+
+    def exists(self, key: str) -> bool:
+        return self.path_for(key).exists()
+
+    def save(self, key: str, result: BacktestResult) -> int:
+        """
+        保存权益曲线、交易和成交明细
+
+        Returns:
+            文件大小（字节）
+        """
+        timestamps = np.asarray(result.timestamps, dtype=np.int64)
+        columns = {
+            'equity_ts_start': timestamps[:1],
+            'equity_ts_delta': np.diff(timestamps),
+            'equity_value': np.asarray(result.equity, dtype=np.float64),
+            'equity_position': np.asarray(result.positions, dtype=np.float32),
+        }
+        for name, values in result.trades.items():
+            columns[f'trade_{name}'] = np.asarray(values)
+        for name, values in (result.fills or {}).items():
+            columns[f'fill_{name}'] = np.asarray(values)
+
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **columns)
+        os.replace(tmp_path, path)
+        return path.stat().st_size
+
+    def _load(self, key: str, prefix: str) -> Dict[str, np.ndarray]:
+        with np.load(self.path_for(key)) as blob:
+            return {name[len(prefix):]: blob[name] for name in blob.files if name.startswith(prefix)}
+
+    def load_equity(self, key: str) -> Dict[str, np.ndarray]:
+        """权益曲线列：timestamp、equity、position"""
+        columns = self._load(key, 'equity_')
+        timestamps = np.concatenate((columns['ts_start'], columns['ts_start'][0] + np.cumsum(columns['ts_delta'])))
+        return {'timestamp': timestamps, 'equity': columns['value'], 'position': columns['position']}
+
+    def load_trades(self, key: str) -> Dict[str, np.ndarray]:
+        return self._load(key, 'trade_')
+
+    def load_fills(self, key: str) -> Dict[str, np.ndarray]:
+        return self._load(key, 'fill_')
+
+    def equity_curve(self, key: str, width: Optional[int] = None):
+        """
+        图表用权益曲线 [[时间戳毫秒, 权益], ...]
+
+        Args:
+            width: 图表像素宽度，点数超过宽度时用 LTTB 降采样
+        """
+        columns = self.load_equity(key)
+        timestamps, equity = columns['timestamp'], columns['equity']
+        index = lttb_downsample(timestamps, equity, width) if width else np.arange(len(equity))
+        return [[int(timestamps[i]), round(float(equity[i]), 2)] for i in index]
+
+    def delete(self, key: str):
+        try:
+            self.path_for(key).unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _release_artifact(artifact_id: int):
+    """没有回测再引用的存档随之删除"""
+    if not Backtest.all_objects.filter(artifact_id=artifact_id).exists():
+        BacktestArtifact.all_objects.filter(pk=artifact_id).delete()
+
+
+@receiver(post_delete, sender=Backtest)
+def _backtest_deleted(sender, instance, **kwargs):
+    if instance.artifact_id is not None:
+        artifact_id = instance.artifact_id
+        transaction.on_commit(lambda: _release_artifact(artifact_id))
+
+
+@receiver(post_delete, sender=BacktestArtifact)
+def _artifact_deleted(sender, instance, **kwargs):
+    # 文件按缓存键存放，不同租户的相同请求共用一个文件
+    cache_key = instance.cache_key
+
+    def remove():
+        if not BacktestArtifact.all_objects.filter(cache_key=cache_key).exists():
+            BacktestResultStore().delete(cache_key)
+
+    transaction.on_commit(remove)
@@ -0,0 +1,945 @@
+"""
+用户策略沙箱运行时
+
+用户编写的 Python 策略（strategy_type='custom'）不在 Celery 或 Web 进程内执行，
+而是交给一组常驻的受限子进程：
+
+- 子进程以清空的环境变量启动（SECRET_KEY、ENCRYPTION_KEY、交易所密钥、数据库和 Redis 地址都不会传入），
+  导入 NumPy/pandas 和本模块后才开始接收用户代码；
+- 导入完成后子进程降为低权限用户（STRATEGY_SANDBOX_USER，主进程为 root 时），并启用 seccomp 系统调用过滤：
+  不能打开、创建或删除文件，不能创建套接字（没有网络），不能执行程序、派生进程、发送信号或调试其他进程，
+  被禁止的调用返回 EPERM；无法启用过滤时子进程拒绝运行用户代码；
+- 子进程常驻复用，按代码摘要缓存编译结果，同一策略的多次回测只编译一次，
+  每次回测的启动开销是几次管道往返（毫秒级），而不是启动解释器和导入依赖（秒级）；
+- 用户代码可以改写 np、pd 等模块和缓存的命名空间，这些状态会留在子进程中，
+  所以子进程在第一次会话时归属于该租户，之后只复用给同一租户；未指定租户的会话结束后子进程直接替换；
+- 内存通过 RLIMIT_AS 限制，每次调用前通过 RLIMIT_CPU 重新设定 CPU 时间预算，
+  单次调用超时由主进程强制结束子进程，出错或超限的子进程会被替换；
+- 用户代码只能导入白名单中的模块，内置函数去掉了文件、eval/exec 等入口。
+  白名单只是为了给出清晰的错误，NumPy/pandas 本身可以间接访问 os 等模块，安全边界是上面的进程隔离；
+  需要更强的隔离（独立的文件系统视图、cgroup）时，可以通过 STRATEGY_SANDBOX_WRAPPER 用 nsjail 或 bubblewrap 启动子进程。
+
+用户代码约定（二选一或同时提供）：
+
+    def generate_signals(data, **params):       # 向量化回测，返回目标仓位数组
+        return (data['close'] > indicators.sma(data['close'], params['period'])).astype(float)
+
+    class Strategy(BaseStrategy):                # 事件驱动回测和实盘，接口同 strategy.BaseStrategy
+        parameters = {'period': 20}
+        def on_bar(self, ctx, bar): ...
+
+命名空间中预置 np、pd、indicators、BaseStrategy 和行情/订单类型。
+
+数据交换：向量化回测的K线数组和信号通过匿名共享内存（memfd，文件描述符经管道传递）交换；事件驱动回测把两次K线之间的
+订单、成交回报和下一根K线打包成一批发送，子进程回放回调后一次性返回下单/撤单指令，
+每根K线只有一次管道往返。
+"""
+import builtins
+import ctypes
+import hashlib
+import importlib
+import logging
+import mmap
+import os
+import platform
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from itertools import count
+from multiprocessing.connection import Connection
+from multiprocessing.reduction import recv_handle, send_handle
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import indicators
+from .indicator_graph import IndicatorGraph, IndicatorSubscriptions
+from .strategy import BaseStrategy, Bar, Fill, Order, Position, StrategyContext, Tick
+
+logger = logging.getLogger(__name__)
+
+# 用户代码可以导入的顶层模块
+ALLOWED_MODULES = frozenset({
+    'numpy', 'pandas', 'math', 'cmath', 'statistics', 'random', 'decimal', 'fractions',
+    'collections', 'itertools', 'functools', 'operator', 'heapq', 'bisect',
+    'datetime', 'time', 'typing', 'dataclasses', 'enum', 're', 'json',
+})
+
+# 从内置函数中去掉的入口
+BLOCKED_BUILTINS = frozenset({
+    'open', 'exec', 'eval', 'compile', 'input', 'breakpoint', 'help', 'exit', 'quit',
+    'globals', 'locals', 'vars', 'memoryview', '__loader__', '__spec__',
+})
+
+# 子进程启用过滤后禁止的系统调用：文件、网络、进程、调试、内核接口
+DENIED_SYSCALLS = (
+    'open', 'openat', 'openat2', 'creat', 'open_by_handle_at', 'name_to_handle_at',
+    'unlink', 'unlinkat', 'rename', 'renameat', 'renameat2', 'mkdir', 'mkdirat', 'rmdir',
+    'link', 'linkat', 'symlink', 'symlinkat', 'chmod', 'fchmodat', 'fchmodat2', 'chown', 'fchownat', 'lchown',
+    'truncate', 'mknod', 'mknodat', 'uselib',
+    'socket', 'socketpair', 'connect', 'bind', 'listen', 'accept', 'accept4',
+    'execve', 'execveat', 'fork', 'vfork', 'clone', 'clone3',
+    'kill', 'tkill', 'tgkill', 'rt_sigqueueinfo', 'rt_tgsigqueueinfo', 'pidfd_send_signal',
+    'ptrace', 'process_vm_readv', 'process_vm_writev',
+    'mount', 'umount2', 'pivot_root', 'chroot', 'unshare', 'setns', 'personality', 'acct', 'reboot',
+    'keyctl', 'add_key', 'request_key', 'bpf', 'perf_event_open', 'userfaultfd',
+    'io_uring_setup', 'io_uring_enter', 'io_uring_register',
+    'init_module', 'finit_module', 'delete_module', 'kexec_load',
+)
+
+# 系统调用号（只列出 DENIED_SYSCALLS 中该架构存在的调用）和 seccomp 审计架构标识
+_SYSCALL_TABLES = {
+    'x86_64': (0xC000003E, {
+        'open': 2, 'openat': 257, 'openat2': 437, 'creat': 85, 'open_by_handle_at': 304, 'name_to_handle_at': 303,
+        'unlink': 87, 'unlinkat': 263, 'rename': 82, 'renameat': 264, 'renameat2': 316, 'mkdir': 83,
+        'mkdirat': 258, 'rmdir': 84, 'link': 86, 'linkat': 265, 'symlink': 88, 'symlinkat': 266, 'chmod': 90,
+        'fchmodat': 268, 'fchmodat2': 452, 'chown': 92, 'fchownat': 260, 'lchown': 94, 'truncate': 76,
+        'mknod': 133, 'mknodat': 259, 'uselib': 134,
+        'socket': 41, 'socketpair': 53, 'connect': 42, 'bind': 49, 'listen': 50, 'accept': 43, 'accept4': 288,
+        'execve': 59, 'execveat': 322, 'fork': 57, 'vfork': 58, 'clone': 56, 'clone3': 435,
+        'kill': 62, 'tkill': 200, 'tgkill': 234, 'rt_sigqueueinfo': 129, 'rt_tgsigqueueinfo': 297,
+        'pidfd_send_signal': 424,
+        'ptrace': 101, 'process_vm_readv': 310, 'process_vm_writev': 311,
+        'mount': 165, 'umount2': 166, 'pivot_root': 155, 'chroot': 161, 'unshare': 272, 'setns': 308,
+        'personality': 135, 'acct': 163, 'reboot': 169,
+        'keyctl': 250, 'add_key': 248, 'request_key': 249, 'bpf': 321, 'perf_event_open': 298, 'userfaultfd': 323,
+        'io_uring_setup': 425, 'io_uring_enter': 426, 'io_uring_register': 427,
+        'init_module': 175, 'finit_module': 313, 'delete_module': 176, 'kexec_load': 246,
+    }),
+    'aarch64': (0xC00000B7, {
+        'openat': 56, 'openat2': 437, 'open_by_handle_at': 265, 'name_to_handle_at': 264,
+        'unlinkat': 35, 'renameat': 38, 'renameat2': 276, 'mkdirat': 34, 'linkat': 37, 'symlinkat': 36,
+        'fchmodat': 53, 'fchmodat2': 452, 'fchownat': 54, 'truncate': 45, 'mknodat': 33,
+        'socket': 198, 'socketpair': 199, 'connect': 203, 'bind': 200, 'listen': 201, 'accept': 202, 'accept4': 242,
+        'execve': 221, 'execveat': 281, 'clone': 220, 'clone3': 435,
+        'kill': 129, 'tkill': 130, 'tgkill': 131, 'rt_sigqueueinfo': 138, 'rt_tgsigqueueinfo': 240,
+        'pidfd_send_signal': 424,
+        'ptrace': 117, 'process_vm_readv': 270, 'process_vm_writev': 271,
+        'mount': 40, 'umount2': 39, 'pivot_root': 41, 'chroot': 51, 'unshare': 97, 'setns': 268,
+        'personality': 92, 'acct': 89, 'reboot': 142,
+        'keyctl': 219, 'add_key': 217, 'request_key': 218, 'bpf': 280, 'perf_event_open': 241, 'userfaultfd': 282,
+        'io_uring_setup': 425, 'io_uring_enter': 426, 'io_uring_register': 427,
+        'init_module': 105, 'finit_module': 273, 'delete_module': 106, 'kexec_load': 104,
+    }),
+}
+
+# 子进程的环境变量：只保留运行解释器需要的项，数值库限制为单线程
+WORKER_ENV = {
+    'PATH': '/usr/bin:/bin',
+    'LANG': 'C.UTF-8',
+    'OPENBLAS_NUM_THREADS': '1',
+    'OMP_NUM_THREADS': '1',
+    'MKL_NUM_THREADS': '1',
+}
+
+# 启动子进程（导入 NumPy/pandas 并完成隔离）的超时（秒）
+WORKER_START_TIMEOUT = 60
+
+# 子进程中缓存的编译结果数量
+CODE_CACHE_SIZE = 32
+
+# 错误信息中保留的回溯长度
+TRACEBACK_LIMIT = 2000
+
+
+class SandboxError(Exception):
+    """沙箱执行异常（用户代码出错、超时或超出资源限制）"""
+    pass
+
+
+# ---------------------------------------------------------------------------
+# 子进程
+# ---------------------------------------------------------------------------
+
+def _restricted_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level != 0 or name.split('.')[0] not in ALLOWED_MODULES:
+        raise ImportError(f'策略代码不允许导入模块: {name}')
+    return builtins.__import__(name, globals, locals, fromlist, level)
+
+
+def _safe_builtins() -> Dict[str, Any]:
+    safe = {name: value for name, value in vars(builtins).items() if name not in BLOCKED_BUILTINS}
+    safe['__import__'] = _restricted_import
+    return safe
+
+
+def compile_strategy_code(code: str) -> Dict[str, Any]:
+    """
+    编译并执行用户代码，返回命名空间
+
+    Raises:
+        SandboxError: 语法错误或执行出错
+    """
+    namespace = {
+        '__builtins__': _safe_builtins(),
+        '__name__': 'user_strategy',
+        'np': np,
+        'pd': pd,
+        'indicators': indicators,
+        'BaseStrategy': BaseStrategy,
+        'Bar': Bar,
+        'Tick': Tick,
+        'Order': Order,
+        'Fill': Fill,
+        'Position': Position,
+    }
+    try:
+        exec(compile(code, '<strategy>', 'exec'), namespace)
+    except Exception:
+        raise SandboxError(_format_error())
+    return namespace
+
+
+def _find_strategy_class(namespace: Dict[str, Any]):
+    candidate = namespace.get('Strategy')
+    if isinstance(candidate, type) and issubclass(candidate, BaseStrategy):
+        return candidate
+    classes = [
+        value for value in namespace.values()
+        if isinstance(value, type) and issubclass(value, BaseStrategy) and value is not BaseStrategy
+    ]
+    return classes[0] if len(classes) == 1 else None
+
+
+def _format_error() -> str:
+    return traceback.format_exc(limit=-3)[-TRACEBACK_LIMIT:]
+
+
+class SandboxContext(StrategyContext):
+    """
+    子进程内的策略上下文
+
+    查询由主进程随每批事件发送的状态快照回答；下单、撤单记录为指令，
+    回调结束后统一返回给主进程执行。新订单先使用负数临时ID，主进程分配正式ID后在下一批事件中回传。
+    """
+
+    def __init__(self, history_size: int):
+        self.now = 0
+        self.history_size = history_size
+        self.commands: List[tuple] = []
+        self._temp_ids = count(-1, -1)
+        self._pending: Dict[int, Order] = {}
+        self._snapshot: Dict[str, Any] = {'cash': 0.0, 'equity': 0.0, 'positions': {}, 'orders': []}
+        self._history: Dict[str, Dict[str, deque]] = {}
+        self._graph = IndicatorGraph(history_size)
+        self._indicators = IndicatorSubscriptions(self._graph)
+
+    def update(self, snapshot: Dict[str, Any]):
+        for temp_id, order_id in snapshot.get('id_map', {}).items():
+            order = self._pending.pop(temp_id, None)
+            if order is not None:
+                order.id = order_id
+        self._snapshot = snapshot
+        self.now = snapshot.get('now', self.now)
+
+    def add_bar(self, bar: Bar):
+        series = self._history.get(bar.symbol)
+        if series is None:
+            series = self._history[bar.symbol] = {
+                name: deque(maxlen=self.history_size) for name in ('ts', 'open', 'high', 'low', 'close', 'volume')
+            }
+        for name in series:
+            series[name].append(getattr(bar, name))
+        self._graph.update(bar.symbol, bar)
+
+    def place_order(self, symbol, side, amount, order_type='market', price=None, stop_price=None,
+                    trail=None, tag=None, reduce_only=False):
+        order = Order(next(self._temp_ids), symbol, side, order_type, float(amount), price, stop_price,
+                      trail, self.now, tag, reduce_only)
+        self._pending[order.id] = order
+        self.commands.append(('place', order.id, {
+            'symbol': symbol, 'side': side, 'amount': float(amount), 'order_type': order_type, 'price': price,
+            'stop_price': stop_price, 'trail': trail, 'tag': tag, 'reduce_only': reduce_only,
+        }))
+        return order
+
+    def cancel_order(self, order_id) -> bool:
+        self.commands.append(('cancel', order_id))
+        return True
+
+    def cancel_all(self, symbol=None) -> int:
+        self.commands.append(('cancel_all', symbol))
+        return len(self.open_orders(symbol))
+
+    def open_orders(self, symbol=None) -> List[Order]:
+        orders = [_order_from_dict(data) for data in self._snapshot['orders']]
+        orders.extend(self._pending.values())
+        return [o for o in orders if symbol is None or o.symbol == symbol]
+
+    def position(self, symbol) -> Position:
+        amount, avg_price, realized = self._snapshot['positions'].get(symbol, (0.0, 0.0, 0.0))
+        return Position(symbol, amount, avg_price, realized)
+
+    @property
+    def cash(self) -> float:
+        return self._snapshot['cash']
+
+    @property
+    def equity(self) -> float:
+        return self._snapshot['equity']
+
+    def history(self, symbol, field='close', length=None) -> np.ndarray:
+        series = self._history.get(symbol)
+        if series is None:
+            return np.empty(0)
+        values = series[field]
+        if length is not None and length < len(values):
+            values = list(values)[-length:]
+        return np.fromiter(values, dtype=np.float64, count=len(values))
+
+    def log(self, message):
+        self.commands.append(('log', str(message)))
+
+    def indicator(self, symbol, name, **params):
+        return self._indicators.get(symbol, name, lambda: self._history.get(symbol), params)
+
+
+def _order_from_dict(data: Dict[str, Any]) -> Order:
+    order = Order.__new__(Order)
+    for name in Order.__slots__:
+        setattr(order, name, data[name])
+    return order
+
+
+class _WorkerSession:
+    """子进程内的一次策略会话"""
+
+    def __init__(self, namespace: Dict[str, Any], params: Dict[str, Any], history_size: int):
+        self.namespace = namespace
+        self.params = params
+        self.history_size = history_size
+        self.strategy = None
+        self.context = None
+
+    def generate_signals(self, fields: Sequence[tuple], length: int, source_fd: int, target_fd: int):
+        function = self.namespace.get('generate_signals')
+        if not callable(function):
+            raise SandboxError('策略代码没有定义 generate_signals(data, **params)')
+        try:
+            source = mmap.mmap(source_fd, 0, access=mmap.ACCESS_READ)
+            target = mmap.mmap(target_fd, 0)
+        finally:
+            os.close(source_fd)
+            os.close(target_fd)
+        try:
+            data = {
+                name: np.ndarray((size,), dtype=np.dtype(dtype), buffer=source, offset=offset)
+                for name, dtype, offset, size in fields
+            }
+            positions = np.asarray(function(data, **self.params), dtype=np.float64)
+            if positions.shape != (length,):
+                raise SandboxError(f'generate_signals 返回的长度为 {positions.shape}，应为 ({length},)')
+            np.ndarray((length,), dtype=np.float64, buffer=target)[:] = positions
+            del data
+        finally:
+            _close_mapping(source)
+            _close_mapping(target)
+
+    def start(self) -> Dict[str, Any]:
+        strategy_class = _find_strategy_class(self.namespace)
+        if strategy_class is None:
+            raise SandboxError('策略代码没有定义 BaseStrategy 子类（建议命名为 Strategy）')
+        self.strategy = strategy_class(**self.params)
+        self.context = SandboxContext(self.history_size)
+        return {'subscriptions': list(self.strategy.subscriptions)}
+
+    def dispatch(self, events: List[tuple], snapshot: Dict[str, Any]) -> List[tuple]:
+        ctx, strategy = self.context, self.strategy
+        if strategy is None:
+            raise SandboxError('事件驱动会话尚未开始')
+        ctx.update(snapshot)
+        ctx.commands = []
+        for event in events:
+            kind = event[0]
+            if kind == 'bar':
+                bar = Bar(*event[1])
+                ctx.now = bar.ts
+                ctx.add_bar(bar)
+                strategy.on_bar(ctx, bar)
+            elif kind == 'tick':
+                tick = Tick(*event[1])
+                ctx.now = tick.ts
+                strategy.on_tick(ctx, tick)
+            elif kind == 'order':
+                strategy.on_order(ctx, _order_from_dict(event[1]))
+            elif kind == 'fill':
+                strategy.on_fill(ctx, Fill(**event[1]))
+            elif kind == 'start':
+                strategy.on_start(ctx)
+            elif kind == 'stop':
+                strategy.on_stop(ctx)
+        return ctx.commands
+
+
+def _close_mapping(buffer: mmap.mmap):
+    try:
+        buffer.close()
+    except BufferError:
+        # 用户代码仍持有数组引用，映射随对象回收释放
+        pass
+
+
+def _set_cpu_budget(seconds: Optional[float]):
+    """把 CPU 时间软限制设为 已用时间 + 预算，超出时内核发送 SIGXCPU 结束进程"""
+    import resource
+    if not seconds:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime + seconds) + 1
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _seccomp_program(machine: str) -> bytes:
+    """
+    seccomp BPF 程序：其他架构的调用直接结束进程，DENIED_SYSCALLS 返回 EPERM，其余放行
+
+    Raises:
+        SandboxError: 不支持的处理器架构
+    """
+    if machine not in _SYSCALL_TABLES:
+        raise SandboxError(f'系统调用过滤不支持该处理器架构: {machine}')
+    audit_arch, numbers = _SYSCALL_TABLES[machine]
+    load, jump_eq, jump_ge, ret = 0x20, 0x15, 0x35, 0x06
+    kill, deny, allow = 0x80000000, 0x00050000 | 1, 0x7FFF0000  # KILL_PROCESS、ERRNO(EPERM)、ALLOW
+
+    def op(code, k, jt=0, jf=0):
+        return struct.pack('HBBI', code, jt, jf, k)
+
+    program = [op(load, 4), op(jump_eq, audit_arch, 1, 0), op(ret, kill), op(load, 0)]
+    if machine == 'x86_64':
+        # x32 ABI 的调用号带 0x40000000 标志，不能绕过过滤
+        program += [op(jump_ge, 0x40000000, 0, 1), op(ret, deny)]
+    for number in sorted(numbers[name] for name in DENIED_SYSCALLS if name in numbers):
+        program += [op(jump_eq, number, 0, 1), op(ret, deny)]
+    program.append(op(ret, allow))
+    return b''.join(program)
+
+
+def _install_seccomp():
+    """启用 no_new_privs 和系统调用过滤，之后无法撤销"""
+    class SockFprog(ctypes.Structure):
+        _fields_ = [('len', ctypes.c_ushort), ('filter', ctypes.c_char_p)]
+
+    program = _seccomp_program(platform.machine())
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.prctl(38, 1, 0, 0, 0) != 0:  # PR_SET_NO_NEW_PRIVS
+        raise OSError(ctypes.get_errno(), '无法设置 no_new_privs')
+    fprog = SockFprog(len(program) // 8, program)
+    if libc.prctl(22, 2, ctypes.byref(fprog), 0, 0) != 0:  # PR_SET_SECCOMP, SECCOMP_MODE_FILTER
+        raise OSError(ctypes.get_errno(), '无法启用 seccomp')
+
+
+def _isolate(config: Dict[str, Any]):
+    """
+    在接收用户代码前隔离子进程
+
+    先导入白名单模块（之后不能再打开文件），设置内存上限，降权，最后启用系统调用过滤。
+    """
+    import resource
+    for module in ALLOWED_MODULES:
+        importlib.import_module(module)
+    memory_limit_mb = config.get('memory_limit_mb')
+    if memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    os.chdir('/')
+    if config.get('uid') is not None:
+        os.setgroups([])
+        os.setgid(config['gid'])
+        os.setuid(config['uid'])
+    try:
+        _install_seccomp()
+    except (OSError, AttributeError, SandboxError) as e:
+        if config.get('enforce', True):
+            raise SandboxError(f'无法启用系统调用过滤: {e}')
+
+
+def _worker_main(conn):
+    """子进程主循环：第一条消息为隔离配置，隔离完成后回复进程号"""
+    try:
+        config, = conn.recv()
+        _isolate(config)
+    except BaseException as e:
+        conn.send(('error', str(e) if isinstance(e, SandboxError) else _format_error()))
+        return
+    conn.send(('ok', os.getpid()))
+
+    code_cache: Dict[str, Dict[str, Any]] = {}
+    session: Optional[_WorkerSession] = None
+    cpu_seconds = None
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        command = message[0]
+        if command == 'shutdown':
+            return
+        try:
+            if command == 'load':
+                cpu_seconds = message[5]
+            # CPU 预算按调用设定，常驻的实盘会话不会累计超限
+            _set_cpu_budget(cpu_seconds)
+            if command == 'load':
+                _, code_hash, code, params, history_size, _ = message
+                namespace = code_cache.get(code_hash)
+                compiled = namespace is None
+                if compiled:
+                    namespace = compile_strategy_code(code)
+                    if len(code_cache) >= CODE_CACHE_SIZE:
+                        code_cache.pop(next(iter(code_cache)))
+                    code_cache[code_hash] = namespace
+                session = _WorkerSession(namespace, params, history_size)
+                reply = {
+                    'compiled': compiled,
+                    'vectorized': callable(namespace.get('generate_signals')),
+                    'event': _find_strategy_class(namespace) is not None,
+                }
+            elif command == 'signals':
+                # 共享内存的文件描述符紧随指令发送，先取出再检查会话，保持管道中的消息顺序
+                source_fd, target_fd = recv_handle(conn), recv_handle(conn)
+                if session is None:
+                    os.close(source_fd)
+                    os.close(target_fd)
+                    raise SandboxError('没有加载策略代码')
+                session.generate_signals(message[1], message[2], source_fd, target_fd)
+                reply = None
+            elif session is None:
+                raise SandboxError('没有加载策略代码')
+            elif command == 'start':
+                reply = session.start()
+            elif command == 'events':
+                reply = session.dispatch(message[1], message[2])
+            elif command == 'ping':
+                reply = os.getpid()
+            else:
+                raise SandboxError(f'未知指令: {command}')
+            conn.send(('ok', reply))
+        except SandboxError as e:
+            conn.send(('error', str(e)))
+        except MemoryError:
+            conn.send(('error', '策略超出内存限制'))
+        except BaseException:
+            conn.send(('error', _format_error()))
+
+
+def _worker_entry():
+    """子进程入口：python -c 启动，argv[1] 为管道的文件描述符，其余为模块搜索路径"""
+    _worker_main(Connection(int(sys.argv[1])))
+
+
+# ---------------------------------------------------------------------------
+# 主进程
+# ---------------------------------------------------------------------------
+
+def _memfd(size: int) -> int:
+    """创建匿名共享内存，返回文件描述符"""
+    fd = os.memfd_create('strategy-sandbox', os.MFD_CLOEXEC)
+    os.ftruncate(fd, max(size, 1))
+    return fd
+
+
+def _pack_arrays(data: Dict[str, np.ndarray]) -> Tuple[int, List[tuple]]:
+    """把K线数组写入一块匿名共享内存，返回 (文件描述符, [(字段, dtype, 偏移, 长度)])"""
+    arrays = {name: np.ascontiguousarray(values) for name, values in data.items()}
+    fields, offset = [], 0
+    for name, array in arrays.items():
+        fields.append((name, array.dtype.str, offset, len(array)))
+        offset += (array.nbytes + 7) // 8 * 8
+    fd = _memfd(offset)
+    with mmap.mmap(fd, max(offset, 1)) as buffer:
+        for (name, _, start, _), array in zip(fields, arrays.values()):
+            buffer[start:start + array.nbytes] = array.tobytes()
+    return fd, fields
+
+
+def _sandbox_user() -> Optional[Tuple[int, int]]:
+    """主进程为 root 时子进程切换到的用户 (uid, gid)"""
+    if os.geteuid() != 0:
+        return None
+    import pwd
+    from django.conf import settings
+    name = getattr(settings, 'STRATEGY_SANDBOX_USER', 'nobody')
+    try:
+        entry = pwd.getpwnam(name)
+    except KeyError:
+        raise SandboxError(f'策略沙箱用户不存在: {name}')
+    return entry.pw_uid, entry.pw_gid
+
+
+class SandboxWorker:
+    """一个受限子进程"""
+
+    def __init__(self, memory_limit_mb: Optional[int]):
+        from django.conf import settings
+
+        user = _sandbox_user()
+        config = {
+            'memory_limit_mb': memory_limit_mb,
+            'uid': user[0] if user else None,
+            'gid': user[1] if user else None,
+            'enforce': getattr(settings, 'STRATEGY_SANDBOX_ENFORCE_ISOLATION', True),
+        }
+        parent_sock, child_sock = socket.socketpair()
+        self.conn = Connection(parent_sock.detach())
+        child_fd = child_sock.detach()
+        command = [
+            *getattr(settings, 'STRATEGY_SANDBOX_WRAPPER', []), sys.executable, '-I', '-c',
+            'import sys; sys.path[:] = sys.argv[2:]; '
+            'from apps.strategies.sandbox import _worker_entry; _worker_entry()',
+            str(child_fd), *[path for path in sys.path if path],
+        ]
+        try:
+            self.process = subprocess.Popen(
+                command, env=dict(WORKER_ENV), pass_fds=(child_fd,), stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+            )
+        except OSError as e:
+            self.conn.close()
+            raise SandboxError(f'无法启动策略沙箱进程: {e}')
+        finally:
+            os.close(child_fd)
+        self.tasks = 0
+        self.tenant_id = None
+        self.broken = False
+        try:
+            self.pid = self.call((config,), WORKER_START_TIMEOUT)
+        except SandboxError:
+            self.kill()
+            raise
+
+    @property
+    def alive(self) -> bool:
+        return not self.broken and self.process.poll() is None
+
+    def call(self, message: tuple, timeout: float, fds: Sequence[int] = ()):
+        """发送指令（和随后的文件描述符）并等待结果，超时或子进程退出时结束子进程并抛出 SandboxError"""
+        try:
+            self.conn.send(message)
+            for fd in fds:
+                send_handle(self.conn, fd, self.process.pid)
+            if not self.conn.poll(timeout):
+                self.kill()
+                raise SandboxError(f'策略执行超时（{timeout}秒）')
+            status, payload = self.conn.recv()
+        except (EOFError, BrokenPipeError, ConnectionResetError, OSError):
+            self._wait(1)
+            code = self.process.returncode
+            self.kill()
+            if code is not None and code < 0 and -code == signal.SIGXCPU:
+                raise SandboxError('策略超出CPU时间限制')
+            raise SandboxError(f'策略进程异常退出（退出码 {code}）')
+        if status == 'error':
+            raise SandboxError(payload)
+        return payload
+
+    def _wait(self, timeout: float):
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            pass
+
+    def kill(self):
+        self.broken = True
+        if self.process.poll() is None:
+            self.process.kill()
+        self._wait(1)
+        self.conn.close()
+
+    def shutdown(self):
+        if self.alive:
+            try:
+                self.conn.send(('shutdown',))
+                self._wait(1)
+            except OSError:
+                pass
+        if self.process.poll() is None:
+            self.process.kill()
+            self._wait(1)
+        self.broken = True
+        self.conn.close()
+
+
+class SandboxSession:
+    """
+    主进程侧的策略会话，占用一个子进程直到 close
+
+    用法：
+        with get_sandbox_pool().session(strategy.code, parameters) as session:
+            signal = session.generate_signals(kline_arrays)
+    """
+
+    def __init__(self, pool: 'StrategySandboxPool', worker: SandboxWorker, info: Dict[str, Any]):
+        self.pool = pool
+        self.worker = worker
+        self.info = info
+
+    def generate_signals(self, data: Dict[str, np.ndarray]) -> np.ndarray:
+        """向量化信号：K线数组和结果都通过匿名共享内存传递"""
+        length = len(data['close'])
+        source_fd, fields = _pack_arrays(data)
+        target_fd = _memfd(length * 8)
+        try:
+            self.worker.call(('signals', fields, length), self.pool.time_limit, fds=(source_fd, target_fd))
+            with mmap.mmap(target_fd, max(length * 8, 1), access=mmap.ACCESS_READ) as buffer:
+                positions = np.frombuffer(buffer, dtype=np.float64, count=length).copy()
+        finally:
+            os.close(source_fd)
+            os.close(target_fd)
+        return positions
+
+    def strategy(self) -> 'RemoteStrategy':
+        """事件驱动策略代理，可直接交给 EventBacktester 或实盘运行器"""
+        info = self.worker.call(('start',), self.pool.call_timeout)
+        return RemoteStrategy(self, info['subscriptions'])
+
+    def call(self, message: tuple):
+        return self.worker.call(message, self.pool.call_timeout)
+
+    def close(self):
+        self.pool.release(self.worker)
+        self.worker = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.worker is not None:
+            self.close()
+
+
+class RemoteStrategy(BaseStrategy):
+    """
+    运行在沙箱中的策略在主进程中的代理
+
+    订单和成交回报先缓存，遇到K线、逐笔或开始/结束事件时连同账户快照一次性发给子进程，
+    再在主进程上下文中执行子进程返回的下单/撤单指令。
+    """
+
+    def __init__(self, session: SandboxSession, subscriptions):
+        self.params = {}
+        self.subscriptions = tuple(subscriptions)
+        self.session = session
+        self._events: List[tuple] = []
+        self._id_map: Dict[int, Any] = {}
+        self._symbols = set()
+
+    def _snapshot(self, ctx: StrategyContext) -> Dict[str, Any]:
+        orders = ctx.open_orders()
+        self._symbols.update(order.symbol for order in orders)
+        positions = {}
+        for symbol in self._symbols:
+            position = ctx.position(symbol)
+            positions[symbol] = (position.amount, position.avg_price, position.realized_pnl)
+        snapshot = {
+            'now': ctx.now,
+            'cash': ctx.cash,
+            'equity': ctx.equity,
+            'positions': positions,
+            'orders': [order.to_dict() for order in orders],
+            'id_map': self._id_map,
+        }
+        self._id_map = {}
+        return snapshot
+
+    def _flush(self, ctx: StrategyContext, event: tuple):
+        self._events.append(event)
+        events, self._events = self._events, []
+        commands = self.session.call(('events', events, self._snapshot(ctx)))
+        self._apply(ctx, commands)
+
+    def _apply(self, ctx: StrategyContext, commands: List[tuple]):
+        resolved: Dict[int, Any] = {}
+        for command in commands:
+            kind = command[0]
+            if kind == 'place':
+                order = ctx.place_order(**command[2])
+                self._symbols.add(order.symbol)
+                resolved[command[1]] = order.id
+            elif kind == 'cancel':
+                ctx.cancel_order(resolved.get(command[1], command[1]))
+            elif kind == 'cancel_all':
+                ctx.cancel_all(command[1])
+            elif kind == 'log':
+                ctx.log(command[1])
+        self._id_map.update(resolved)
+
+    def on_start(self, ctx):
+        self._flush(ctx, ('start',))
+
+    def on_bar(self, ctx, bar):
+        self._symbols.add(bar.symbol)
+        self._flush(ctx, ('bar', (bar.ts, bar.symbol, bar.open, bar.high, bar.low, bar.close, bar.volume)))
+
+    def on_tick(self, ctx, tick):
+        self._symbols.add(tick.symbol)
+        self._flush(ctx, ('tick', (tick.ts, tick.symbol, tick.price, tick.amount, tick.side)))
+
+    def on_order(self, ctx, order):
+        self._events.append(('order', order.to_dict()))
+
+    def on_fill(self, ctx, fill):
+        self._events.append(('fill', fill.to_dict()))
+
+    def on_stop(self, ctx):
+        self._flush(ctx, ('stop',))
+
+
+class StrategySandboxPool:
+    """
+    常驻沙箱子进程池
+
+    Args:
+        size: 子进程数量
+        memory_limit_mb: 每个子进程的虚拟内存上限
+        cpu_seconds: 每次调用（加载代码、计算信号、处理一批事件）的 CPU 时间预算
+        time_limit: 向量化信号计算的超时（秒）
+        call_timeout: 事件驱动单批事件的超时（秒）
+        max_tasks: 子进程处理多少次会话后替换，避免用户代码泄漏的内存累积
+    """
+
+    def __init__(self, size: int = 2, memory_limit_mb: Optional[int] = 2048, cpu_seconds: Optional[float] = 300,
+                 time_limit: float = 120, call_timeout: float = 5, max_tasks: int = 200,
+                 history_size: int = 1000):
+        self.size = size
+        self.memory_limit_mb = memory_limit_mb
+        self.cpu_seconds = cpu_seconds
+        self.time_limit = time_limit
+        self.call_timeout = call_timeout
+        self.max_tasks = max_tasks
+        self.history_size = history_size
+        self._idle: List[SandboxWorker] = []
+        self._busy = 0
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def warm_up(self):
+        """预先启动全部子进程"""
+        with self._condition:
+            while len(self._idle) + self._busy < self.size:
+                self._idle.append(SandboxWorker(self.memory_limit_mb))
+
+    def _take_idle(self, tenant_id: Optional[int]) -> Optional[SandboxWorker]:
+        """取出同一租户用过的空闲子进程，没有时取新启动的子进程"""
+        for worker in [worker for worker in self._idle if not worker.alive]:
+            self._idle.remove(worker)
+            worker.shutdown()
+        for wanted in ((tenant_id,) if tenant_id is not None else ()) + (None,):
+            for index in range(len(self._idle) - 1, -1, -1):
+                if self._idle[index].tenant_id == wanted:
+                    return self._idle.pop(index)
+        return None
+
+    def _acquire(self, tenant_id: Optional[int], timeout: Optional[float]) -> SandboxWorker:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise SandboxError('沙箱进程池已关闭')
+                worker = self._take_idle(tenant_id)
+                if worker is not None:
+                    worker.tenant_id = tenant_id
+                    self._busy += 1
+                    return worker
+                if self._idle and self._busy + len(self._idle) >= self.size:
+                    # 空闲子进程都归属于其他租户，替换最久未使用的一个
+                    self._idle.pop(0).shutdown()
+                if self._busy + len(self._idle) < self.size:
+                    self._busy += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise SandboxError('没有空闲的策略沙箱进程')
+                self._condition.wait(remaining)
+        try:
+            worker = SandboxWorker(self.memory_limit_mb)
+        except Exception:
+            with self._condition:
+                self._busy -= 1
+                self._condition.notify()
+            raise
+        worker.tenant_id = tenant_id
+        return worker
+
+    def release(self, worker: SandboxWorker):
+        worker.tasks += 1
+        with self._condition:
+            self._busy -= 1
+            reusable = worker.tenant_id is not None and worker.tasks < self.max_tasks
+            if worker.alive and reusable and not self._closed:
+                self._idle.append(worker)
+            else:
+                worker.shutdown()
+            self._condition.notify()
+
+    def session(self, code: str, parameters: Optional[Dict[str, Any]] = None, tenant_id: Optional[int] = None,
+                acquire_timeout: Optional[float] = 30) -> SandboxSession:
+        """
+        占用一个子进程并加载策略代码（按代码摘要复用编译结果）
+
+        只复用同一租户用过的子进程或新启动的子进程；tenant_id 为 None 时会话结束后替换子进程。
+        """
+        worker = self._acquire(tenant_id, acquire_timeout)
+        code_hash = hashlib.sha256(code.encode('utf-8')).hexdigest()
+        try:
+            info = worker.call(
+                ('load', code_hash, code, dict(parameters or {}), self.history_size, self.cpu_seconds),
+                self.time_limit,
+            )
+        except Exception:
+            self.release(worker)
+            raise
+        return SandboxSession(self, worker, info)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {'size': self.size, 'idle': len(self._idle), 'busy': self._busy}
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.shutdown()
+
+
+_pool: Optional[StrategySandboxPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool() -> StrategySandboxPool:
+    """获取进程内共享的沙箱进程池"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from django.conf import settings
+                _pool = StrategySandboxPool(
+                    size=getattr(settings, 'STRATEGY_SANDBOX_WORKERS', 2),
+                    memory_limit_mb=getattr(settings, 'STRATEGY_SANDBOX_MEMORY_MB', 2048),
+                    cpu_seconds=getattr(settings, 'STRATEGY_SANDBOX_CPU_SECONDS', 300),
+                    time_limit=getattr(settings, 'STRATEGY_SANDBOX_TIME_LIMIT', 120),
+                    call_timeout=getattr(settings, 'STRATEGY_SANDBOX_CALL_TIMEOUT', 5),
+                )
+    return _pool
+
+
+def _reset_after_fork():
+    """子进程不能使用父进程的管道和子进程，丢弃继承来的进程池"""
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,55 @@
+from rest_framework import serializers
+from .models import Backtest, BacktestArtifact
+
+
+class BacktestArtifactSerializer(serializers.ModelSerializer):
+    """回测结果存档序列化器"""
+
+    class Meta:
+        model = BacktestArtifact
+        fields = ['id', 'cache_key', 'strategy_version', 'bars', 'trades', 'fills', 'file_size', 'hits', 'created_at']
+        read_only_fields = fields
+
+
+class BacktestSerializer(serializers.ModelSerializer):
+    """回测序列化器"""
+
+    strategy_name = serializers.CharField(source='strategy.name', read_only=True)
+    symbol_name = serializers.CharField(source='symbol.symbol', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    artifact = BacktestArtifactSerializer(read_only=True)
+
+    class Meta:
+        model = Backtest
+        fields = [
+            'id', 'strategy', 'strategy_name', 'symbol', 'symbol_name', 'timeframe', 'start_date', 'end_date',
+            'engine', 'use_trades', 'parameters', 'initial_capital', 'fee_rate', 'slippage',
+            'status', 'status_display', 'error_message', 'started_at', 'finished_at',
+            'final_capital', 'total_return', 'annual_return', 'max_drawdown', 'sharpe_ratio', 'win_rate',
+            'total_trades', 'metrics', 'equity_curve', 'artifact', 'cache_hit', 'created_at',
+        ]
+        read_only_fields = [
+            'id', 'strategy_name', 'symbol_name', 'status', 'status_display', 'error_message',
+            'started_at', 'finished_at', 'final_capital', 'total_return', 'annual_return', 'max_drawdown',
+            'sharpe_ratio', 'win_rate', 'total_trades', 'metrics', 'equity_curve', 'artifact', 'cache_hit',
+            'created_at',
+        ]
+
+    def validate_strategy(self, value):
+        """只能回测本租户的策略"""
+        request = self.context.get('request')
+        if request and value.tenant_id != request.user.tenant_id:
+            raise serializers.ValidationError("策略不存在")
+        return value
+
+    def validate_symbol(self, value):
+        """只能回测本租户的交易对"""
+        request = self.context.get('request')
+        if request and value.tenant_id != request.user.tenant_id:
+            raise serializers.ValidationError("交易对不存在")
+        return value
+
+    def validate(self, attrs):
+        if attrs['start_date'] >= attrs['end_date']:
+            raise serializers.ValidationError("开始时间必须早于结束时间")
+        return attrs
@@ -0,0 +1,561 @@
+"""
+策略服务
+"""
+import logging
+import time
+from decimal import Decimal
+from typing import Any, Dict
+
+from django.conf import settings
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .backtest import (
+    BacktestError, BacktestResult, get_signal_generator,
+    load_kline_arrays, run_vectorized_backtest,
+)
+from .event_backtest import EventBacktester, StopRule, load_trade_arrays
+from .models import (
+    Backtest, BacktestArtifact, LiveStrategy, Optimization, PortfolioBacktest, Strategy, WalkForward,
+)
+from .optimization import GeneticOptimizer, ParameterOptimizer, build_candidates
+from .portfolio import PortfolioResult, load_kline_panel, panel_signals, run_portfolio_backtest
+from .result_store import BacktestResultStore, hash_payload, lttb_downsample, result_cache_key
+from .sandbox import SandboxError, get_sandbox_pool
+from .strategy import get_strategy_class
+from .walkforward import WalkForwardAnalyzer
+
+logger = logging.getLogger(__name__)
+
+
+def _decimal(value, places: str = '0.0001') -> Decimal:
+    return Decimal(str(value)).quantize(Decimal(places))
+
+
+class BacktestService:
+    """回测服务"""
+
+    # 保存到数据库的权益曲线最大点数
+    EQUITY_CURVE_POINTS = getattr(settings, 'BACKTEST_EQUITY_CURVE_POINTS', 1000)
+
+    def __init__(self, store: BacktestResultStore = None):
+        self.store = store or BacktestResultStore()
+
+    def run_backtest(self, backtest_id: int, use_cache: bool = True) -> Dict[str, Any]:
+        """
+        运行回测并保存结果；相同策略版本、参数和数据范围的结果已存在时直接复用
+
+        Returns:
+            回测指标
+        """
+        backtest = Backtest.all_objects.select_related('strategy', 'symbol').get(pk=backtest_id)
+        backtest.status = 'running'
+        backtest.started_at = timezone.now()
+        backtest.error_message = ''
+        backtest.save(update_fields=['status', 'started_at', 'error_message', 'updated_at'])
+
+        try:
+            identity = self.cache_identity(backtest)
+            if use_cache and self.load_cached(backtest, identity['cache_key']):
+                return backtest.metrics
+            result = self.execute(backtest)
+            self.save_result(backtest, result, identity)
+        except Exception as e:
+            backtest.status = 'failed'
+            backtest.error_message = str(e)
+            backtest.finished_at = timezone.now()
+            backtest.save(update_fields=['status', 'error_message', 'finished_at', 'updated_at'])
+            raise
+        return result.metrics
+
+    def submit(self, backtest: Backtest) -> bool:
+        """
+        提交回测：命中结果缓存时立即完成并返回 True，否则提交异步任务
+        """
+        identity = self.cache_identity(backtest)
+        if self.load_cached(backtest, identity['cache_key']):
+            return True
+        from .tasks import run_backtest
+        run_backtest.delay(backtest.pk)
+        return False
+
+    def data_fingerprint(self, backtest: Backtest) -> Dict[str, Any]:
+        """
+        数据范围指纹：区间内K线（和逐笔成交）的数量、首尾时间、最大ID和价格、成交量之和
+
+        只做一次聚合查询，补录或重新导入数据后指纹会变化。收集器用 update_or_create
+        更新未收盘K线时行数和ID不变，价格、成交量之和作为内容校验使缓存失效。
+        """
+        from apps.market.models import Kline, Trade
+
+        fingerprint = {
+            'symbol': backtest.symbol_id,
+            'timeframe': backtest.timeframe,
+            'start': backtest.start_date.isoformat(),
+            'end': backtest.end_date.isoformat(),
+            'klines': Kline.objects.filter(
+                symbol_id=backtest.symbol_id, timeframe=backtest.timeframe,
+                timestamp__gte=backtest.start_date, timestamp__lte=backtest.end_date,
+            ).aggregate(
+                count=Count('id'), first=Min('timestamp'), last=Max('timestamp'), max_id=Max('id'),
+                high_sum=Sum('high_price'), low_sum=Sum('low_price'), close_sum=Sum('close_price'),
+                volume_sum=Sum('volume'),
+            ),
+        }
+        if backtest.engine == 'event' and backtest.use_trades:
+            fingerprint['trades'] = Trade.objects.filter(
+                symbol_id=backtest.symbol_id, timestamp__gte=backtest.start_date, timestamp__lte=backtest.end_date,
+            ).aggregate(
+                count=Count('id'), first=Min('timestamp'), last=Max('timestamp'), max_id=Max('id'),
+                price_sum=Sum('price'), amount_sum=Sum('amount'),
+            )
+        return fingerprint
+
+    def cache_identity(self, backtest: Backtest) -> Dict[str, str]:
+        """回测结果缓存键及其组成部分"""
+        parameters = {
+            'parameters': {**backtest.strategy.parameters, **backtest.parameters},
+            'engine': backtest.engine,
+            'use_trades': backtest.use_trades if backtest.engine == 'event' else False,
+            'initial_capital': str(backtest.initial_capital),
+            'fee_rate': str(backtest.fee_rate),
+            'slippage': str(backtest.slippage),
+        }
+        if backtest.engine == 'event':
+            parameters['stop_rules'] = [
+                [getattr(rule, name) for name in StopRule.__slots__] for rule in self._stop_rules(backtest)
+            ]
+        strategy_version = backtest.strategy.version
+        parameters_hash = hash_payload(parameters)
+        data_hash = hash_payload(self.data_fingerprint(backtest))
+        return {
+            'cache_key': result_cache_key(strategy_version, parameters_hash, data_hash),
+            'strategy_version': strategy_version,
+            'parameters_hash': parameters_hash,
+            'data_hash': data_hash,
+        }
+
+    def load_cached(self, backtest: Backtest, cache_key: str) -> bool:
+        """命中缓存时把已有结果写入回测记录并返回 True"""
+        artifact = BacktestArtifact.all_objects.filter(tenant_id=backtest.tenant_id, cache_key=cache_key).first()
+        if artifact is None or not self.store.exists(cache_key):
+            return False
+        BacktestArtifact.all_objects.filter(pk=artifact.pk).update(hits=F('hits') + 1, last_hit_at=timezone.now())
+        self._apply_metrics(backtest, artifact.metrics)
+        backtest.started_at = backtest.started_at or backtest.finished_at
+        backtest.equity_curve = self.store.equity_curve(cache_key, self.EQUITY_CURVE_POINTS)
+        backtest.artifact = artifact
+        backtest.cache_hit = True
+        backtest.save()
+        logger.info(f"回测 {backtest.pk} 命中结果缓存 {cache_key[:12]}")
+        return True
+
+    def execute(self, backtest: Backtest) -> BacktestResult:
+        """加载数据并执行回测（不写数据库）"""
+        started = time.perf_counter()
+        data = load_kline_arrays(backtest.symbol, backtest.timeframe, backtest.start_date, backtest.end_date)
+        loaded = time.perf_counter()
+
+        parameters = {**backtest.strategy.parameters, **backtest.parameters}
+        if backtest.engine == 'event':
+            result = self._execute_event(backtest, data, parameters)
+        else:
+            signal = self._generate_signals(backtest.strategy, data, parameters)
+
+            result = run_vectorized_backtest(
+                data, signal,
+                initial_capital=float(backtest.initial_capital),
+                fee_rate=float(backtest.fee_rate),
+                slippage=float(backtest.slippage),
+                timeframe=backtest.timeframe,
+            )
+        finished = time.perf_counter()
+        result.metrics['load_seconds'] = round(loaded - started, 3)
+        result.metrics['run_seconds'] = round(finished - loaded, 3)
+        logger.info(
+            f"回测 {backtest.pk} 完成: {result.metrics['bars']}根K线, "
+            f"加载 {result.metrics['load_seconds']}s, 计算 {result.metrics['run_seconds']}s"
+        )
+        return result
+
+    def _generate_signals(self, strategy: Strategy, data, parameters):
+        """向量化回测的目标仓位，自定义代码在沙箱进程中计算"""
+        if strategy.strategy_type == 'custom':
+            try:
+                with get_sandbox_pool().session(strategy.code, parameters, strategy.tenant_id) as session:
+                    return session.generate_signals(data)
+            except SandboxError as e:
+                raise BacktestError(f'策略代码执行失败: {e}')
+        generator = get_signal_generator(strategy.strategy_type)
+        try:
+            return generator(data, **parameters)
+        except TypeError as e:
+            raise BacktestError(f'策略参数错误: {e}')
+
+    def _execute_event(self, backtest: Backtest, data, parameters) -> BacktestResult:
+        """使用事件驱动引擎回测，策略关联的止损止盈规则作为保护单"""
+        if backtest.strategy.strategy_type == 'custom':
+            try:
+                with get_sandbox_pool().session(backtest.strategy.code, parameters, backtest.strategy.tenant_id) as session:
+                    return self._run_event(backtest, data, session.strategy())
+            except SandboxError as e:
+                raise BacktestError(f'策略代码执行失败: {e}')
+        try:
+            strategy = get_strategy_class(backtest.strategy.strategy_type)(**parameters)
+        except KeyError as e:
+            raise BacktestError(str(e.args[0]))
+        except TypeError as e:
+            raise BacktestError(f'策略参数错误: {e}')
+        return self._run_event(backtest, data, strategy)
+
+    def _run_event(self, backtest: Backtest, data, strategy) -> BacktestResult:
+        symbol = backtest.symbol.symbol
+        backtester = EventBacktester(
+            strategy,
+            initial_capital=float(backtest.initial_capital),
+            fee_rate=float(backtest.fee_rate),
+            slippage=float(backtest.slippage),
+            stop_rules=self._stop_rules(backtest),
+        )
+        backtester.add_bars(symbol, data, backtest.timeframe)
+        if backtest.use_trades:
+            backtester.add_ticks(symbol, load_trade_arrays(backtest.symbol, backtest.start_date, backtest.end_date))
+        return backtester.run()
+
+    def _stop_rules(self, backtest: Backtest):
+        """策略关联、交易对为空或匹配的启用止损止盈规则"""
+        from apps.risk.models import StopLossRule
+
+        rules = StopLossRule.all_objects.filter(
+            Q(symbol='') | Q(symbol=backtest.symbol.symbol),
+            tenant_id=backtest.tenant_id, strategy_id=backtest.strategy_id, is_active=True,
+        ).order_by('pk')
+        return [StopRule.from_model(rule) for rule in rules]
+
+    def _apply_metrics(self, backtest: Backtest, metrics: Dict[str, Any]):
+        backtest.status = 'completed'
+        backtest.finished_at = timezone.now()
+        backtest.final_capital = _decimal(metrics['final_capital'], '0.01')
+        backtest.total_return = _decimal(metrics['total_return'])
+        backtest.annual_return = _decimal(metrics['annual_return'])
+        backtest.max_drawdown = _decimal(metrics['max_drawdown'])
+        backtest.sharpe_ratio = _decimal(metrics['sharpe_ratio'])
+        backtest.win_rate = _decimal(metrics['win_rate'], '0.01')
+        backtest.total_trades = metrics['total_trades']
+        backtest.metrics = metrics
+
+    def save_result(self, backtest: Backtest, result: BacktestResult, identity: Dict[str, str] = None):
+        """保存回测指标，权益曲线和交易明细写入结果存储"""
+        identity = identity or self.cache_identity(backtest)
+        file_size = self.store.save(identity['cache_key'], result)
+        artifact, _ = BacktestArtifact.all_objects.update_or_create(
+            tenant_id=backtest.tenant_id, cache_key=identity['cache_key'],
+            defaults={
+                'strategy_version': identity['strategy_version'],
+                'parameters_hash': identity['parameters_hash'],
+                'data_hash': identity['data_hash'],
+                'metrics': result.metrics,
+                'bars': len(result.equity),
+                'trades': len(result.trades['return']),
+                'fills': len(result.fills['ts']) if result.fills else 0,
+                'file_size': file_size,
+            },
+        )
+        self._apply_metrics(backtest, result.metrics)
+        index = lttb_downsample(result.timestamps, result.equity, self.EQUITY_CURVE_POINTS)
+        backtest.equity_curve = [[int(result.timestamps[i]), round(float(result.equity[i]), 2)] for i in index]
+        backtest.artifact = artifact
+        backtest.cache_hit = False
+        backtest.save()
+
+
+class OptimizationService:
+    """参数优化服务"""
+
+    # 运行中写回最优结果的最小间隔（秒）
+    PROGRESS_INTERVAL = getattr(settings, 'OPTIMIZATION_PROGRESS_INTERVAL', 2.0)
+    # 并行进程数，None 表示使用全部核心
+    WORKERS = getattr(settings, 'OPTIMIZATION_WORKERS', None)
+
+    def create_optimization(self, strategy_id: int, parameter_ranges: Dict[str, Any], **options) -> Optimization:
+        """
+        创建优化记录
+
+        options 包含 symbol_id、timeframe、start_date、end_date（支持 ISO 字符串），
+        以及可选的 method、samples、objective、top_n、max_drawdown、initial_capital、fee_rate、slippage；
+        遗传算法的种群规模、代数等放在 options 中。
+        """
+        strategy = Strategy.all_objects.get(pk=strategy_id)
+        for key in ('start_date', 'end_date'):
+            if isinstance(options.get(key), str):
+                options[key] = parse_datetime(options[key])
+        return Optimization.all_objects.create(
+            tenant_id=strategy.tenant_id, strategy=strategy, parameter_ranges=parameter_ranges, **options
+        )
+
+    def optimize_parameters(self, strategy_id: int, parameter_ranges: Dict[str, Any],
+                            optimization_id: int = None, **options) -> Dict[str, Any]:
+        """
+        运行参数优化，返回前 N 名结果
+
+        指定 optimization_id 时使用已有记录，否则按 options 新建。
+        """
+        if optimization_id is None:
+            optimization = self.create_optimization(strategy_id, parameter_ranges, **options)
+        else:
+            optimization = Optimization.all_objects.get(pk=optimization_id, strategy_id=strategy_id)
+        return self.run_optimization(optimization)
+
+    def run_optimization(self, optimization: Optimization) -> Dict[str, Any]:
+        optimization.status = 'running'
+        optimization.started_at = timezone.now()
+        optimization.error_message = ''
+        optimization.save(update_fields=['status', 'started_at', 'error_message', 'updated_at'])
+
+        try:
+            report = self.execute(optimization)
+        except Exception as e:
+            optimization.status = 'failed'
+            optimization.error_message = str(e)
+            optimization.finished_at = timezone.now()
+            optimization.save(update_fields=['status', 'error_message', 'finished_at', 'updated_at'])
+            raise
+
+        optimization.status = 'completed'
+        optimization.finished_at = timezone.now()
+        optimization.summary = {key: value for key, value in report.items() if key != 'results'}
+        optimization.save(update_fields=['status', 'finished_at', 'summary', 'updated_at'])
+        return report
+
+    def execute(self, optimization: Optimization) -> Dict[str, Any]:
+        """加载一次K线数据，分发候选组合并持续写回当前最优结果"""
+        strategy = optimization.strategy
+        data = load_kline_arrays(
+            optimization.symbol, optimization.timeframe, optimization.start_date, optimization.end_date
+        )
+        if len(data['close']) == 0:
+            raise BacktestError('回测区间内没有K线数据')
+
+        def on_progress(done, total, top):
+            optimization.completed_candidates = done
+            optimization.top_results = top
+            optimization.best_parameters = top[0]['parameters'] if top else {}
+            optimization.save(update_fields=['completed_candidates', 'top_results', 'best_parameters', 'updated_at'])
+
+        kwargs = dict(
+            initial_capital=float(optimization.initial_capital),
+            fee_rate=float(optimization.fee_rate),
+            slippage=float(optimization.slippage),
+            objective=optimization.objective,
+            top_n=optimization.top_n,
+            workers=self.WORKERS,
+            base_parameters=strategy.parameters,
+            max_drawdown=float(optimization.max_drawdown) if optimization.max_drawdown is not None else None,
+        )
+        if optimization.method == 'genetic':
+            try:
+                optimizer = GeneticOptimizer(strategy.strategy_type, data, optimization.timeframe,
+                                             **optimization.options, **kwargs)
+            except TypeError as e:
+                raise BacktestError(f'算法参数错误: {e}')
+            optimization.total_candidates = optimizer.population_size * optimizer.generations
+            optimization.save(update_fields=['total_candidates', 'updated_at'])
+            report = optimizer.evolve(optimization.parameter_ranges, on_progress=on_progress)
+        else:
+            candidates = build_candidates(optimization.parameter_ranges, optimization.method, optimization.samples)
+            optimization.total_candidates = len(candidates)
+            optimization.save(update_fields=['total_candidates', 'updated_at'])
+            optimizer = ParameterOptimizer(strategy.strategy_type, data, optimization.timeframe, **kwargs)
+            report = optimizer.run(candidates, on_progress=on_progress, progress_interval=self.PROGRESS_INTERVAL)
+        logger.info(f"参数优化 {optimization.pk} 完成: 回测{report['evaluated']}次, 用时{report['elapsed']}s")
+        return report
+
+
+class WalkForwardService:
+    """滚动前推分析服务"""
+
+    def run_walk_forward(self, walk_forward_id: int) -> Dict[str, Any]:
+        """
+        运行滚动前推分析并保存结果
+
+        Returns:
+            样本外指标
+        """
+        walk_forward = WalkForward.all_objects.select_related('strategy', 'symbol').get(pk=walk_forward_id)
+        walk_forward.status = 'running'
+        walk_forward.started_at = timezone.now()
+        walk_forward.error_message = ''
+        walk_forward.save(update_fields=['status', 'started_at', 'error_message', 'updated_at'])
+
+        try:
+            report = self.execute(walk_forward)
+        except Exception as e:
+            walk_forward.status = 'failed'
+            walk_forward.error_message = str(e)
+            walk_forward.finished_at = timezone.now()
+            walk_forward.save(update_fields=['status', 'error_message', 'finished_at', 'updated_at'])
+            raise
+
+        walk_forward.status = 'completed'
+        walk_forward.finished_at = timezone.now()
+        walk_forward.windows = report['windows']
+        walk_forward.metrics = report['metrics']
+        walk_forward.equity_curve = report['result'].equity_curve(BacktestService.EQUITY_CURVE_POINTS)
+        walk_forward.save()
+        return report['metrics']
+
+    def execute(self, walk_forward: WalkForward) -> Dict[str, Any]:
+        strategy = walk_forward.strategy
+        candidates = build_candidates(walk_forward.parameter_ranges, walk_forward.method, walk_forward.samples)
+        data = load_kline_arrays(walk_forward.symbol, walk_forward.timeframe, walk_forward.start_date, walk_forward.end_date)
+        analyzer = WalkForwardAnalyzer(
+            strategy.strategy_type, data, walk_forward.timeframe,
+            train_bars=walk_forward.train_bars,
+            test_bars=walk_forward.test_bars,
+            anchored=walk_forward.anchored,
+            initial_capital=float(walk_forward.initial_capital),
+            fee_rate=float(walk_forward.fee_rate),
+            slippage=float(walk_forward.slippage),
+            objective=walk_forward.objective,
+            workers=OptimizationService.WORKERS,
+            base_parameters=strategy.parameters,
+        )
+        walk_forward.total_candidates = len(candidates)
+        walk_forward.save(update_fields=['total_candidates', 'updated_at'])
+
+        def on_progress(done, total):
+            walk_forward.completed_candidates = done
+            walk_forward.save(update_fields=['completed_candidates', 'updated_at'])
+
+        report = analyzer.run(candidates, on_progress=on_progress, progress_interval=OptimizationService.PROGRESS_INTERVAL)
+        logger.info(
+            f"滚动前推分析 {walk_forward.pk} 完成: {len(report['windows'])}个窗口, "
+            f"样本外收益 {report['metrics']['total_return']}"
+        )
+        return report
+
+
+class PortfolioBacktestService:
+    """组合回测服务"""
+
+    def run_portfolio_backtest(self, portfolio_id: int) -> Dict[str, Any]:
+        """
+        运行组合回测并保存结果
+
+        Returns:
+            回测指标
+        """
+        portfolio = PortfolioBacktest.all_objects.select_related('strategy').get(pk=portfolio_id)
+        portfolio.status = 'running'
+        portfolio.started_at = timezone.now()
+        portfolio.error_message = ''
+        portfolio.save(update_fields=['status', 'started_at', 'error_message', 'updated_at'])
+
+        try:
+            result = self.execute(portfolio)
+        except Exception as e:
+            portfolio.status = 'failed'
+            portfolio.error_message = str(e)
+            portfolio.finished_at = timezone.now()
+            portfolio.save(update_fields=['status', 'error_message', 'finished_at', 'updated_at'])
+            raise
+
+        metrics = result.metrics
+        portfolio.status = 'completed'
+        portfolio.finished_at = timezone.now()
+        portfolio.final_capital = _decimal(metrics['final_capital'], '0.01')
+        portfolio.total_return = _decimal(metrics['total_return'])
+        portfolio.max_drawdown = _decimal(metrics['max_drawdown'])
+        portfolio.sharpe_ratio = _decimal(metrics['sharpe_ratio'])
+        portfolio.total_trades = metrics['total_trades']
+        portfolio.metrics = metrics
+        portfolio.assets = result.asset_stats
+        index = lttb_downsample(result.timestamps, result.equity, BacktestService.EQUITY_CURVE_POINTS)
+        portfolio.equity_curve = [[int(result.timestamps[i]), round(float(result.equity[i]), 2)] for i in index]
+        portfolio.save()
+        return metrics
+
+    def execute(self, portfolio: PortfolioBacktest) -> PortfolioResult:
+        """加载对齐的K线面板并执行组合回测（不写数据库）"""
+        started = time.perf_counter()
+        symbols = list(portfolio.symbols.order_by('pk').values_list('pk', 'symbol'))
+        if not symbols:
+            raise BacktestError('组合中没有交易对')
+        panel = load_kline_panel(
+            [pk for pk, _ in symbols], portfolio.timeframe, portfolio.start_date, portfolio.end_date,
+        )
+        loaded = time.perf_counter()
+
+        signals = self._panel_signals(portfolio.strategy, panel, {**portfolio.strategy.parameters, **portfolio.parameters})
+        result = run_portfolio_backtest(
+            panel, signals,
+            initial_capital=float(portfolio.initial_capital),
+            fee_rate=float(portfolio.fee_rate),
+            slippage=float(portfolio.slippage),
+            timeframe=portfolio.timeframe,
+            allocation=portfolio.allocation,
+            rebalance_every=portfolio.rebalance_every,
+            leverage=float(portfolio.leverage),
+            max_weight=float(portfolio.max_weight) if portfolio.max_weight is not None else None,
+        )
+        names = dict(symbols)
+        for stats in result.asset_stats:
+            stats['symbol_name'] = names[stats['symbol']]
+        finished = time.perf_counter()
+        result.metrics['load_seconds'] = round(loaded - started, 3)
+        result.metrics['run_seconds'] = round(finished - loaded, 3)
+        result.metrics['panel_mb'] = round(panel.nbytes / 1e6, 1)
+        logger.info(
+            f"组合回测 {portfolio.pk} 完成: {len(symbols)}个交易对 x {result.metrics['bars']}根K线, "
+            f"加载 {result.metrics['load_seconds']}s, 计算 {result.metrics['run_seconds']}s"
+        )
+        return result
+
+    def _panel_signals(self, strategy: Strategy, panel, parameters):
+        """逐资产计算信号，自定义代码在同一个沙箱会话中计算全部资产"""
+        if strategy.strategy_type == 'custom':
+            try:
+                with get_sandbox_pool().session(strategy.code, parameters, strategy.tenant_id) as session:
+                    return panel_signals(panel, session.generate_signals)
+            except SandboxError as e:
+                raise BacktestError(f'策略代码执行失败: {e}')
+        generator = get_signal_generator(strategy.strategy_type)
+        try:
+            return panel_signals(panel, lambda data: generator(data, **parameters))
+        except TypeError as e:
+            raise BacktestError(f'策略参数错误: {e}')
+
+
+class LiveStrategyService:
+    """
+    实盘策略服务
+
+    只修改运行状态，策略引擎进程按 STRATEGY_ENGINE_RELOAD_INTERVAL 重新加载运行中的实例。
+    """
+
+    def start_strategy(self, strategy_id: int) -> int:
+        """
+        启用策略并启动其全部实盘实例
+
+        Returns:
+            启动的实例数
+        """
+        strategy = Strategy.all_objects.get(pk=strategy_id)
+        if not strategy.is_active:
+            strategy.is_active = True
+            strategy.save(update_fields=['is_active', 'updated_at'])
+        started = LiveStrategy.all_objects.filter(strategy=strategy).exclude(status='running').update(
+            status='running', error_message='', started_at=timezone.now(), stopped_at=None, updated_at=timezone.now(),
+        )
+        logger.info(f"策略 {strategy_id} 启动 {started} 个实盘实例")
+        return started
+
+    def stop_strategy(self, strategy_id: int) -> int:
+        """停用策略并停止其全部实盘实例"""
+        Strategy.all_objects.filter(pk=strategy_id).update(is_active=False, updated_at=timezone.now())
+        stopped = LiveStrategy.all_objects.filter(strategy_id=strategy_id, status='running').update(
+            status='stopped', stopped_at=timezone.now(), updated_at=timezone.now(),
+        )
+        logger.info(f"策略 {strategy_id} 停止 {stopped} 个实盘实例")
+        return stopped
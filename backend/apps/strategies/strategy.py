@@ -0,0 +1,316 @@
+"""
+策略接口
+
+事件驱动回测和实盘运行器使用同一套策略接口：策略只通过回调接收行情，
+通过上下文（StrategyContext）下单、撤单和查询持仓，不感知自己运行在哪个环境。
+
+行情和订单对象使用 __slots__，回测时每秒会创建数十万个，需要尽量紧凑。
+"""
+from typing import Any, Dict, List, Optional, Type
+
+import numpy as np
+
+# 订单类型
+ORDER_TYPES = ('market', 'limit', 'stop', 'stop_limit', 'trailing_stop')
+
+# 订单状态
+ORDER_OPEN = 'open'
+ORDER_PARTIAL = 'partial'
+ORDER_FILLED = 'filled'
+ORDER_CANCELLED = 'cancelled'
+ORDER_REJECTED = 'rejected'
+
+
+class Bar:
+    """K线（收盘后推送，ts 为收盘时间）"""
+    __slots__ = ('ts', 'symbol', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, ts, symbol, open, high, low, close, volume):
+        self.ts = ts
+        self.symbol = symbol
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    def __repr__(self):
+        return f"Bar({self.symbol} {self.ts} o={self.open} h={self.high} l={self.low} c={self.close})"
+
+
+class Tick:
+    """逐笔成交"""
+    __slots__ = ('ts', 'symbol', 'price', 'amount', 'side')
+
+    def __init__(self, ts, symbol, price, amount, side):
+        self.ts = ts
+        self.symbol = symbol
+        self.price = price
+        self.amount = amount
+        self.side = side
+
+    def __repr__(self):
+        return f"Tick({self.symbol} {self.ts} {self.side} {self.amount}@{self.price})"
+
+
+class Order:
+    """
+    订单
+
+    amount 为基础资产数量；stop_price 为止损触发价；
+    trailing_stop 订单的 trail 为跟踪距离（比例，0.02 表示 2%）。
+    """
+    __slots__ = (
+        'id', 'symbol', 'side', 'order_type', 'amount', 'price', 'stop_price', 'trail',
+        'filled', 'avg_price', 'fee', 'status', 'created_ts', 'updated_ts', 'tag',
+        'triggered', 'extreme', 'reduce_only',
+    )
+
+    def __init__(self, id, symbol, side, order_type, amount, price=None, stop_price=None,
+                 trail=None, created_ts=0, tag=None, reduce_only=False):
+        self.id = id
+        self.symbol = symbol
+        self.side = side
+        self.order_type = order_type
+        self.amount = amount
+        self.price = price
+        self.stop_price = stop_price
+        self.trail = trail
+        self.filled = 0.0
+        self.avg_price = 0.0
+        self.fee = 0.0
+        self.status = ORDER_OPEN
+        self.created_ts = created_ts
+        self.updated_ts = created_ts
+        self.tag = tag
+        self.triggered = False
+        self.extreme = None
+        self.reduce_only = reduce_only
+
+    @property
+    def remaining(self) -> float:
+        return self.amount - self.filled
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in (ORDER_OPEN, ORDER_PARTIAL)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return (f"Order({self.id} {self.symbol} {self.side} {self.order_type} "
+                f"{self.filled}/{self.amount} {self.status})")
+
+
+class Fill:
+    """成交回报"""
+    __slots__ = ('ts', 'order_id', 'symbol', 'side', 'price', 'amount', 'fee', 'liquidity', 'tag')
+
+    def __init__(self, ts, order_id, symbol, side, price, amount, fee, liquidity, tag=None):
+        self.ts = ts
+        self.order_id = order_id
+        self.symbol = symbol
+        self.side = side
+        self.price = price
+        self.amount = amount
+        self.fee = fee
+        self.liquidity = liquidity  # maker / taker
+        self.tag = tag
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Position:
+    """持仓（数量为正表示多头，为负表示空头）"""
+    __slots__ = ('symbol', 'amount', 'avg_price', 'realized_pnl')
+
+    def __init__(self, symbol, amount=0.0, avg_price=0.0, realized_pnl=0.0):
+        self.symbol = symbol
+        self.amount = amount
+        self.avg_price = avg_price
+        self.realized_pnl = realized_pnl
+
+    def apply_fill(self, side: str, amount: float, price: float) -> float:
+        """
+        应用成交并返回本次实现的盈亏
+        """
+        signed = amount if side == 'buy' else -amount
+        realized = 0.0
+        if self.amount == 0 or (self.amount > 0) == (signed > 0):
+            total = self.amount + signed
+            self.avg_price = (self.avg_price * abs(self.amount) + price * amount) / abs(total)
+            self.amount = total
+        else:
+            closing = min(abs(signed), abs(self.amount))
+            direction = 1.0 if self.amount > 0 else -1.0
+            realized = closing * (price - self.avg_price) * direction
+            self.amount += signed
+            if abs(self.amount) < 1e-12:
+                self.amount = 0.0
+                self.avg_price = 0.0
+            elif (self.amount > 0) != (direction > 0):
+                # 反手：剩余部分按成交价开新仓
+                self.avg_price = price
+        self.realized_pnl += realized
+        return realized
+
+    def unrealized_pnl(self, price: float) -> float:
+        return self.amount * (price - self.avg_price)
+
+
+class StrategyContext:
+    """
+    策略上下文接口
+
+    回测引擎和实盘运行器各自实现，策略只依赖这里定义的方法。
+    """
+
+    now: int = 0  # 当前事件时间（毫秒）
+
+    def place_order(self, symbol: str, side: str, amount: float, order_type: str = 'market',
+                    price: Optional[float] = None, stop_price: Optional[float] = None,
+                    trail: Optional[float] = None, tag: Optional[str] = None,
+                    reduce_only: bool = False) -> Order:
+        raise NotImplementedError
+
+    def cancel_order(self, order_id) -> bool:
+        raise NotImplementedError
+
+    def cancel_all(self, symbol: Optional[str] = None) -> int:
+        raise NotImplementedError
+
+    def open_orders(self, symbol: Optional[str] = None) -> List[Order]:
+        raise NotImplementedError
+
+    def position(self, symbol: str) -> Position:
+        raise NotImplementedError
+
+    @property
+    def cash(self) -> float:
+        raise NotImplementedError
+
+    @property
+    def equity(self) -> float:
+        raise NotImplementedError
+
+    def history(self, symbol: str, field: str = 'close', length: Optional[int] = None) -> np.ndarray:
+        """最近的K线字段序列（最新的在最后）"""
+        raise NotImplementedError
+
+    def log(self, message: str):
+        raise NotImplementedError
+
+    def indicator(self, symbol: str, name: str, **params):
+        """
+        共享的增量指标（见 indicator_graph），返回的引用可以长期持有
+
+        .value 为包含当前K线的最新值，.history(length) 为最近的指标序列；
+        相同交易对、指标和参数的引用在同一运行环境中共用一个节点。
+        """
+        raise NotImplementedError
+
+    # 便捷方法
+    def buy(self, symbol: str, amount: float, price: Optional[float] = None, **kwargs) -> Order:
+        order_type = kwargs.pop('order_type', 'limit' if price is not None else 'market')
+        return self.place_order(symbol, 'buy', amount, order_type, price=price, **kwargs)
+
+    def sell(self, symbol: str, amount: float, price: Optional[float] = None, **kwargs) -> Order:
+        order_type = kwargs.pop('order_type', 'limit' if price is not None else 'market')
+        return self.place_order(symbol, 'sell', amount, order_type, price=price, **kwargs)
+
+    def close_position(self, symbol: str, tag: Optional[str] = None) -> Optional[Order]:
+        """市价平掉全部持仓"""
+        amount = self.position(symbol).amount
+        if amount == 0:
+            return None
+        side = 'sell' if amount > 0 else 'buy'
+        return self.place_order(symbol, side, abs(amount), 'market', tag=tag, reduce_only=True)
+
+
+class BaseStrategy:
+    """
+    策略基类
+
+    子类通过 parameters 声明默认参数，按需实现回调。
+    """
+
+    # 默认参数
+    parameters: Dict[str, Any] = {}
+    # 订阅的数据类型：bar / tick
+    subscriptions = ('bar',)
+
+    def __init__(self, **params):
+        unknown = set(params) - set(self.parameters)
+        if unknown:
+            raise TypeError(f"未知参数: {', '.join(sorted(unknown))}")
+        self.params = {**self.parameters, **params}
+
+    def on_start(self, ctx: StrategyContext):
+        pass
+
+    def on_bar(self, ctx: StrategyContext, bar: Bar):
+        pass
+
+    def on_tick(self, ctx: StrategyContext, tick: Tick):
+        pass
+
+    def on_order(self, ctx: StrategyContext, order: Order):
+        """订单状态变化（成交、撤销、拒绝）"""
+        pass
+
+    def on_fill(self, ctx: StrategyContext, fill: Fill):
+        pass
+
+    def on_stop(self, ctx: StrategyContext):
+        pass
+
+
+STRATEGY_CLASSES: Dict[str, Type[BaseStrategy]] = {}
+
+
+def register_strategy(name: str):
+    """注册事件驱动策略类，名称与 Strategy.strategy_type 对应"""
+    def decorator(cls):
+        STRATEGY_CLASSES[name] = cls
+        return cls
+    return decorator
+
+
+def get_strategy_class(name: str) -> Type[BaseStrategy]:
+    try:
+        return STRATEGY_CLASSES[name]
+    except KeyError:
+        raise KeyError(f'策略类型 {name} 没有事件驱动实现')
+
+
+@register_strategy('ma_cross')
+class MACrossStrategy(BaseStrategy):
+    """均线交叉（事件驱动版本），金叉全仓买入，死叉平仓"""
+
+    parameters = {
+        'fast_period': 10,
+        'slow_period': 30,
+        'position_ratio': 0.95,
+    }
+
+    def on_start(self, ctx):
+        # 均线由上下文的共享指标图增量维护，订阅相同参数的策略共用节点
+        self._averages: Dict[str, tuple] = {}
+
+    def on_bar(self, ctx, bar):
+        averages = self._averages.get(bar.symbol)
+        if averages is None:
+            averages = self._averages[bar.symbol] = (
+                ctx.indicator(bar.symbol, 'sma', period=self.params['fast_period']),
+                ctx.indicator(bar.symbol, 'sma', period=self.params['slow_period']),
+            )
+        fast, slow = averages[0].value, averages[1].value
+        if slow != slow:  # NaN：K线数量不足
+            return
+        position = ctx.position(bar.symbol).amount
+        if fast > slow and position == 0 and not ctx.open_orders(bar.symbol):
+            ctx.buy(bar.symbol, ctx.equity * self.params['position_ratio'] / bar.close)
+        elif fast < slow and position > 0:
+            ctx.close_position(bar.symbol)
@@ -11,17 +11,18 @@ logger = logging.getLogger(__name__)
 def run_strategy(strategy_id):
     """
     运行策略任务
+
+    启动策略的实盘实例，行情由策略引擎进程（run_strategy_engine 命令）直接驱动
     """
     try:
         logger.info(f"开始运行策略: {strategy_id}")
-        
-        # 这里将实现具体的策略运行逻辑
-        # from apps.strategies.services import StrategyService
-        # service = StrategyService()
-        # result = service.run_strategy(strategy_id)
-        
-        logger.info(f"策略运行完成: {strategy_id}")
-        return True
+
+        from apps.strategies.services import LiveStrategyService
+        service = LiveStrategyService()
+        started = service.start_strategy(strategy_id)
+
+        logger.info(f"策略运行完成: {strategy_id}, 启动 {started} 个实盘实例")
+        return started
     except Exception as e:
         logger.error(f"策略运行失败: {e}")
         return False
@@ -35,33 +36,71 @@ def run_backtest(backtest_id):
     try:
         logger.info(f"开始运行回测: {backtest_id}")
         
-        # 这里将实现具体的回测逻辑
-        # from apps.strategies.services import BacktestService
-        # service = BacktestService()
-        # result = service.run_backtest(backtest_id)
+        from apps.strategies.services import BacktestService
+        service = BacktestService()
+        result = service.run_backtest(backtest_id)
         
         logger.info(f"回测运行完成: {backtest_id}")
-        return True
+        return result
     except Exception as e:
         logger.error(f"回测运行失败: {e}")
         return False
 
 
 @shared_task
-def optimize_strategy_parameters(strategy_id, parameter_ranges):
+def optimize_strategy_parameters(strategy_id, parameter_ranges, **options):
     """
     优化策略参数任务
+
+    options 见 OptimizationService.create_optimization，或传入 optimization_id 使用已有记录
     """
     try:
         logger.info(f"开始优化策略参数: {strategy_id}")
-        
-        # 这里将实现具体的参数优化逻辑
-        # from apps.strategies.services import OptimizationService
-        # service = OptimizationService()
-        # result = service.optimize_parameters(strategy_id, parameter_ranges)
-        
+
+        from apps.strategies.services import OptimizationService
+        service = OptimizationService()
+        result = service.optimize_parameters(strategy_id, parameter_ranges, **options)
+
         logger.info(f"策略参数优化完成: {strategy_id}")
-        return True
+        return result
     except Exception as e:
         logger.error(f"策略参数优化失败: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+@shared_task
+def run_walk_forward(walk_forward_id):
+    """
+    滚动前推分析任务
+    """
+    try:
+        logger.info(f"开始滚动前推分析: {walk_forward_id}")
+
+        from apps.strategies.services import WalkForwardService
+        service = WalkForwardService()
+        result = service.run_walk_forward(walk_forward_id)
+
+        logger.info(f"滚动前推分析完成: {walk_forward_id}")
+        return result
+    except Exception as e:
+        logger.error(f"滚动前推分析失败: {e}")
+        return False
+
+
+@shared_task
+def run_portfolio_backtest(portfolio_id):
+    """
+    组合回测任务
+    """
+    try:
+        logger.info(f"开始组合回测: {portfolio_id}")
+
+        from apps.strategies.services import PortfolioBacktestService
+        service = PortfolioBacktestService()
+        result = service.run_portfolio_backtest(portfolio_id)
+
+        logger.info(f"组合回测完成: {portfolio_id}")
+        return result
+    except Exception as e:
+        logger.error(f"组合回测失败: {e}")
+        return False
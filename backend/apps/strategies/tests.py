@@ -0,0 +1,1493 @@
+"""
+策略模块测试
+"""
+import asyncio
+import multiprocessing
+import tempfile
+import threading
+from datetime import timedelta, timezone as dt_timezone, datetime
+from decimal import Decimal
+from multiprocessing import shared_memory
+from unittest.mock import MagicMock, patch
+
+import fakeredis
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from apps.core.models import Tenant
+from apps.market.event_log import MarketEvent, MarketEventLog
+from apps.market.models import Exchange, Kline, Symbol
+from apps.monitoring.latency import LatencyRecorder, now_ms
+from apps.trading.gateway import OrderChannel
+from apps.trading.models import ExchangeAccount, Order as OrderRecord
+from . import indicators
+from .backtest import (
+    MAX_ANNUAL_RETURN, BacktestError, hold_between, ma_cross_signal, run_vectorized_backtest,
+)
+from .event_backtest import EventBacktester, EventQueue, StopRule
+from .indicator_graph import IndicatorGraph
+from .live import BarFeed, LiveStrategyRunner, StrategyEngine
+from .models import (
+    Backtest, BacktestArtifact, LiveStrategy, Optimization, PortfolioBacktest, Strategy, WalkForward,
+)
+from .optimization import (
+    GeneticOptimizer, Gene, ParameterOptimizer, SharedArrays, build_candidates, evaluate_candidate, parameter_grid,
+)
+from .portfolio import KlinePanel, allocate_weights, load_kline_panel, run_portfolio_backtest
+from .result_store import BacktestResultStore, lttb_downsample
+from .sandbox import SandboxError, StrategySandboxPool
+from .services import BacktestService, OptimizationService
+from .strategy import Bar, BaseStrategy, MACrossStrategy
+from .tasks import (
+    optimize_strategy_parameters, run_backtest, run_portfolio_backtest as run_portfolio_backtest_task,
+    run_strategy, run_walk_forward,
+)
+from .walkforward import WalkForwardAnalyzer, walk_forward_windows
+
+User = get_user_model()
+
+
+def make_klines(n=500, seed=7, start=100.0):
+    """生成随机游走K线数组"""
+    rng = np.random.default_rng(seed)
+    close = start * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    open_ = np.concatenate(([start], close[:-1])) * (1 + rng.normal(0, 0.001, n))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.002, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.002, n)))
+    return {
+        'timestamp': 1700000000000 + np.arange(n, dtype=np.int64) * 3600_000,
+        'open': open_,
+        'high': high,
+        'low': low,
+        'close': close,
+        'volume': np.full(n, 10.0),
+    }
+
+
+def reference_equity(data, signal, capital, fee_rate, slippage):
+    """逐K线计算的参考实现"""
+    equity, position, prev_close = capital, 0.0, data['open'][0]
+    curve = []
+    for t in range(len(data['close'])):
+        target = signal[t - 1] if t > 0 else 0.0
+        equity *= 1 + position * (data['open'][t] / prev_close - 1)
+        equity *= 1 - abs(target - position) * (fee_rate + slippage)
+        position = target
+        equity *= 1 + position * (data['close'][t] / data['open'][t] - 1)
+        prev_close = data['close'][t]
+        curve.append(equity)
+    return np.array(curve)
+
+
+def _daemon_target(queue, func, args):
+    try:
+        queue.put(('ok', func(*args)))
+    except BaseException as exc:
+        queue.put(('error', repr(exc)))
+
+
+def run_in_daemon(func, *args):
+    """在守护子进程中执行 func（模拟 Celery prefork 工作进程），返回其结果"""
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=_daemon_target, args=(queue, func, args), daemon=True)
+    process.start()
+    status, value = queue.get(timeout=120)
+    process.join()
+    if status != 'ok':
+        raise AssertionError(f'守护进程中执行失败: {value}')
+    return value
+
+
+CUSTOM_STRATEGY_CODE = """
+import numpy as np
+
+
+def generate_signals(data, fast_period=5, slow_period=20):
+    fast = indicators.sma(data['close'], fast_period)
+    slow = indicators.sma(data['close'], slow_period)
+    return np.nan_to_num((fast > slow).astype(float))
+
+
+class Strategy(BaseStrategy):
+    parameters = {'fast_period': 5, 'slow_period': 20, 'position_ratio': 0.95}
+
+    def on_bar(self, ctx, bar):
+        closes = ctx.history(bar.symbol, 'close', self.params['slow_period'])
+        if len(closes) < self.params['slow_period']:
+            return
+        fast = closes[-self.params['fast_period']:].mean()
+        slow = closes.mean()
+        amount = ctx.position(bar.symbol).amount
+        if fast > slow and amount == 0:
+            ctx.buy(bar.symbol, ctx.cash * self.params['position_ratio'] / bar.close)
+        elif fast < slow and amount > 0:
+            ctx.close_position(bar.symbol)
+"""
+
+
+class IndicatorTest(SimpleTestCase):
+    """技术指标测试"""
+
+    def test_sma_and_rsi(self):
+        values = np.arange(1.0, 11.0)
+        result = indicators.sma(values, 3)
+        self.assertTrue(np.isnan(result[:2]).all())
+        self.assertAlmostEqual(result[2], 2.0)
+        self.assertAlmostEqual(result[-1], 9.0)
+
+        rising = indicators.rsi(values, 3)
+        self.assertEqual(rising[-1], 100.0)
+
+    def test_hold_between(self):
+        entries = np.array([False, True, False, False, True, False])
+        exits = np.array([False, False, False, True, False, False])
+        np.testing.assert_array_equal(hold_between(entries, exits), [0, 1, 1, 0, 1, 1])
+
+
+class IndicatorGraphTest(SimpleTestCase):
+    """共享增量指标图测试"""
+
+    SPECS = [
+        ('sma', {'period': 5}), ('ema', {'period': 5}), ('std', {'period': 5}),
+        ('max', {'period': 5}), ('min', {'period': 5}), ('rsi', {'period': 4}),
+        ('atr', {'period': 4}), ('bollinger_upper', {'period': 5}), ('bollinger_lower', {'period': 5}),
+    ]
+
+    def test_incremental_matches_vectorized(self):
+        fields = ('open', 'high', 'low', 'close', 'volume')
+        data = make_klines(300)
+        graph = IndicatorGraph(history_size=300)
+        # 前一半K线用于预热，后一半逐根更新
+        history = {field: data[field][:150] for field in fields}
+        nodes = [graph.acquire('s', name, history=history, **params) for name, params in self.SPECS]
+        for i in range(150, 300):
+            graph.update('s', Bar(int(data['timestamp'][i]), 's', *(float(data[f][i]) for f in fields)))
+
+        close, high, low = data['close'], data['high'], data['low']
+        upper, _, lower = indicators.bollinger_bands(close, 5, 2.0)
+        expected = [
+            indicators.sma(close, 5), indicators.ema(close, 5), indicators.rolling_std(close, 5),
+            indicators.rolling_max(close, 5), indicators.rolling_min(close, 5), indicators.rsi(close, 4),
+            indicators.atr(high, low, close, 4), upper, lower,
+        ]
+        for (name, _), node, reference in zip(self.SPECS, nodes, expected):
+            np.testing.assert_allclose(node.values.history(), reference, rtol=1e-9, equal_nan=True, err_msg=name)
+
+    def test_nodes_are_shared_and_reference_counted(self):
+        graph = IndicatorGraph(history_size=50)
+        first = graph.acquire('s', 'ema', period=20)
+        second = graph.acquire('s', 'ema', period=20.0, field='close')
+        self.assertIs(first, second)
+        upper = graph.acquire('s', 'bollinger_upper', period=20)
+        lower = graph.acquire('s', 'bollinger_lower', period=20)
+        # 上下轨共用 sma(20) 和 std(20)
+        self.assertIs(upper.inputs[0], lower.inputs[0])
+        self.assertEqual(graph.stats(), {'sources': 1, 'nodes': 5, 'references': 8})
+
+        for node in (first, second, upper, lower):
+            graph.release(node)
+        self.assertEqual(graph.stats(), {'sources': 0, 'nodes': 0, 'references': 0})
+        with self.assertRaises(ValueError):
+            graph.acquire('s', 'macd')
+        with self.assertRaises(TypeError):
+            graph.acquire('s', 'sma', window=5)
+
+
+class VectorizedBacktestTest(SimpleTestCase):
+    """向量化回测测试"""
+
+    def test_matches_bar_by_bar_reference(self):
+        """向量化结果与逐K线实现一致（含做空、手续费、滑点）"""
+        data = make_klines()
+        signal = ma_cross_signal(data, fast_period=5, slow_period=20, allow_short=True)
+        result = run_vectorized_backtest(data, signal, 10000, fee_rate=0.001, slippage=0.0005)
+        expected = reference_equity(data, signal, 10000, 0.001, 0.0005)
+        np.testing.assert_allclose(result.equity, expected, rtol=1e-10)
+
+    def test_signal_executes_next_bar(self):
+        """信号在下一根K线开盘成交"""
+        data = make_klines(10)
+        signal = np.zeros(10)
+        signal[4] = 1.0
+        result = run_vectorized_backtest(data, signal, 1000, fee_rate=0, slippage=0)
+        self.assertEqual(result.positions[4], 0.0)
+        self.assertEqual(result.positions[5], 1.0)
+        self.assertEqual(result.positions[6], 0.0)
+        self.assertAlmostEqual(result.equity[5], 1000 * data['close'][5] / data['open'][5])
+
+    def test_trade_statistics(self):
+        """交易区间统计"""
+        data = make_klines(12)
+        close = np.full(12, 100.0)
+        close[3:8] = 110.0   # 第一笔交易盈利
+        close[8:] = 99.0     # 第二笔交易亏损
+        data['close'] = close
+        data['open'] = np.concatenate(([100.0], close[:-1]))
+        signal = np.zeros(12)
+        signal[2] = 1.0
+        signal[7] = 1.0
+        result = run_vectorized_backtest(data, signal, 1000, fee_rate=0, slippage=0)
+
+        trades = result.trades
+        np.testing.assert_array_equal(trades['entry_index'], [3, 8])
+        np.testing.assert_array_equal(trades['exit_index'], [3, 8])
+        np.testing.assert_allclose(trades['return'], [0.1, -0.1])
+        self.assertEqual(result.metrics['total_trades'], 2)
+        self.assertEqual(result.metrics['win_rate'], 50.0)
+        self.assertAlmostEqual(result.metrics['total_return'], 1.1 * 0.9 - 1, places=6)
+
+    def test_annual_return_is_capped_on_short_windows(self):
+        """短区间外推的年化收益率不会溢出，截断到 MAX_ANNUAL_RETURN"""
+        data = make_klines(200)
+        data['close'] = np.linspace(100.0, 140.0, 200)
+        data['open'] = np.concatenate(([100.0], data['close'][:-1]))
+        result = run_vectorized_backtest(data, np.ones(200), 1000, fee_rate=0, slippage=0, timeframe='1m')
+        self.assertEqual(result.metrics['annual_return'], MAX_ANNUAL_RETURN)
+        self.assertGreater(result.metrics['total_return'], 0.39)
+
+    def test_rejects_mismatched_signal(self):
+        data = make_klines(10)
+        with self.assertRaises(BacktestError):
+            run_vectorized_backtest(data, np.zeros(5))
+
+
+class PortfolioBacktestTest(SimpleTestCase):
+    """组合回测测试"""
+
+    FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+    def test_single_asset_matches_vectorized_backtest(self):
+        data = make_klines(400)
+        signal = ma_cross_signal(data, fast_period=5, slow_period=20)
+        panel = KlinePanel([1], data['timestamp'], {name: data[name][:, None] for name in self.FIELDS})
+        portfolio = run_portfolio_backtest(panel, signal[:, None])
+        single = run_vectorized_backtest(data, signal)
+        np.testing.assert_allclose(portfolio.equity, single.equity, rtol=1e-12)
+        self.assertEqual(portfolio.metrics['total_trades'], single.metrics['total_trades'])
+        self.assertAlmostEqual(portfolio.metrics['fees_paid'], single.metrics['fees_paid'])
+
+    def test_listing_and_missing_bars(self):
+        nan = np.nan
+        # 资产 B 第 2 根K线上市，第 4 根K线缺失
+        close = np.array([[100, nan], [100, nan], [100, 10], [100, 11], [100, nan], [100, 12.1]])
+        open_ = np.array([[100, nan], [100, nan], [100, 10], [100, 10], [100, nan], [100, 12.1]])
+        panel = KlinePanel([1, 2], np.arange(6) * 3600_000, {
+            'open': open_, 'high': close, 'low': close, 'close': close, 'volume': np.ones((6, 2)),
+        })
+        result = run_portfolio_backtest(panel, np.ones((6, 2)), initial_capital=10000, fee_rate=0, slippage=0)
+        # 缺失K线的资产不能调仓，沿用漂移后的权重（上一根K线上涨 10%）
+        np.testing.assert_allclose(result.weights, [
+            [0, 0], [1, 0], [1, 0], [0.5, 0.5], [0.5, 11 / 21], [0.5, 0.5],
+        ])
+        # 缺失K线收益为 0，缺口期间的涨幅在下一根K线开盘时计入
+        self.assertAlmostEqual(result.equity[-1], 10000 * 1.05 * (1 + 0.1 * 11 / 21))
+        self.assertEqual(result.asset_stats[1]['bars'], 3)
+        self.assertEqual(result.asset_stats[1]['missing_bars'], 1)
+        self.assertAlmostEqual(result.asset_stats[1]['contribution'], 0.05 + 0.1 * 11 / 21 * 1.05)
+        trades = result.trades
+        np.testing.assert_array_equal(trades['asset'], [0, 1])
+        self.assertAlmostEqual(trades['return'][1], 1.1 * 1.1 - 1)
+
+    def test_allocation_and_rebalance(self):
+        signals = np.array([[1.0, -1.0, 0.0]] * 30)
+        listed = np.ones((30, 3), dtype=bool)
+        close = np.ones((30, 3))
+        equal = allocate_weights(signals, listed, close, 'equal')
+        np.testing.assert_allclose(equal[0], [1 / 3, -1 / 3, 0])
+        active = allocate_weights(signals, listed, close, 'active', max_weight=0.4)
+        np.testing.assert_allclose(active[0], [0.4, -0.4, 0])
+
+        rng = np.random.default_rng(5)
+        close = np.exp(np.cumsum(rng.normal(0, [0.01, 0.02, 0.01], (30, 3)), axis=0))
+        weights = allocate_weights(signals, listed, close, 'inverse_volatility', volatility_window=10)
+        self.assertAlmostEqual(np.abs(weights[-1]).sum(), 1.0)
+        self.assertGreater(weights[-1, 0], -weights[-1, 1])
+        with self.assertRaises(BacktestError):
+            allocate_weights(signals, listed, close, 'kelly')
+
+        data = make_klines(100)
+        panel = KlinePanel([1], data['timestamp'], {name: data[name][:, None] for name in self.FIELDS})
+        signal = rng.integers(0, 2, 100).astype(float)
+        result = run_portfolio_backtest(panel, signal[:, None], rebalance_every=10)
+        # 只在每 10 根K线的收盘更新目标
+        sampled = signal[::10]
+        self.assertEqual(len(np.unique(result.weights[1:11])), 1)
+        self.assertEqual(result.metrics['turnover'], sampled[0] + np.abs(np.diff(sampled)).sum())
+
+    def test_weights_drift_between_rebalances(self):
+        rows = 101
+        # A 从 100 线性涨到 200，B 不变；开盘价为上一收盘价
+        close = np.column_stack([np.linspace(100, 200, rows), np.full(rows, 100.0)])
+        open_ = np.vstack([close[:1], close[:-1]])
+        panel = KlinePanel([1, 2], np.arange(rows) * 3600_000, {
+            'open': open_, 'high': close, 'low': close, 'close': close, 'volume': np.ones((rows, 2)),
+        })
+        signals = np.ones((rows, 2))
+        held = run_portfolio_backtest(panel, signals, fee_rate=0, slippage=0, rebalance_every=1000)
+        # 不调仓时与买入持有相同
+        self.assertAlmostEqual(held.equity[-1], 15000)
+        # 权重为最后一根K线开盘时的值（A 开盘价 199）
+        np.testing.assert_allclose(held.weights[-1], [199 / 299, 100 / 299])
+        self.assertAlmostEqual(held.metrics['turnover'], 1.0)
+
+        rebalanced = run_portfolio_backtest(panel, signals, fee_rate=0.001, slippage=0, rebalance_every=1)
+        np.testing.assert_allclose(rebalanced.weights[1:], 0.5)
+        self.assertLess(rebalanced.equity[-1], held.equity[-1])
+        # 每次调仓把漂移的权重拉回目标，换手和手续费随之增加
+        self.assertGreater(rebalanced.metrics['turnover'], 1.2)
+        self.assertGreater(rebalanced.metrics['fees_paid'], 10000 * 0.001 * 1.2)
+
+
+class BacktestServiceTest(TestCase):
+    """回测服务测试"""
+
+    def setUp(self):
+        result_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(result_dir.cleanup)
+        result_settings = override_settings(BACKTEST_RESULT_DIR=result_dir.name)
+        result_settings.enable()
+        self.addCleanup(result_settings.disable)
+
+        self.tenant = Tenant.objects.create(name='测试租户', schema_name='test_tenant')
+        self.user = User.objects.create_user(username='quant', password='testpass123', tenant=self.tenant)
+        exchange = Exchange.objects.create(name='Binance', code='binance', api_url='https://api.binance.com')
+        self.symbol = Symbol.objects.create(
+            tenant=self.tenant, exchange=exchange, symbol='BTC/USDT', base_asset='BTC', quote_asset='USDT',
+            min_order_size=Decimal('0.0001'), max_order_size=Decimal('1000'),
+            price_precision=2, amount_precision=6,
+        )
+        data = make_klines(300)
+        self.start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        Kline.objects.bulk_create([
+            Kline(
+                symbol=self.symbol, timeframe='1h', timestamp=self.start + timedelta(hours=i),
+                open_price=Decimal(f"{data['open'][i]:.8f}"), high_price=Decimal(f"{data['high'][i]:.8f}"),
+                low_price=Decimal(f"{data['low'][i]:.8f}"), close_price=Decimal(f"{data['close'][i]:.8f}"),
+                volume=Decimal('10'),
+            )
+            for i in range(300)
+        ])
+        self.strategy = Strategy.objects.create(
+            tenant=self.tenant, user=self.user, name='均线交叉', strategy_type='ma_cross',
+            parameters={'fast_period': 5, 'slow_period': 20},
+        )
+
+    def _create_backtest(self, **kwargs):
+        return Backtest.objects.create(
+            tenant=self.tenant, strategy=self.strategy, symbol=self.symbol, timeframe='1h',
+            start_date=self.start, end_date=self.start + timedelta(hours=299), **kwargs
+        )
+
+    def test_run_backtest_task_saves_results(self):
+        backtest = self._create_backtest(parameters={'slow_period': 30})
+        metrics = run_backtest(backtest.pk)
+
+        backtest.refresh_from_db()
+        self.assertEqual(backtest.status, 'completed')
+        self.assertEqual(metrics['bars'], 300)
+        self.assertEqual(backtest.total_trades, metrics['total_trades'])
+        self.assertEqual(backtest.final_capital, Decimal(str(metrics['final_capital'])).quantize(Decimal('0.01')))
+        self.assertEqual(len(backtest.equity_curve), 300)
+        self.assertEqual(backtest.equity_curve[0][0], int(self.start.timestamp() * 1000))
+
+    def test_identical_backtest_reuses_stored_result(self):
+        first = self._create_backtest()
+        metrics = BacktestService().run_backtest(first.pk)
+        first.refresh_from_db()
+        artifact = first.artifact
+        self.assertFalse(first.cache_hit)
+        self.assertEqual(artifact.bars, 300)
+        self.assertTrue(BacktestService().store.exists(artifact.cache_key))
+
+        second = self._create_backtest()
+        with patch.object(BacktestService, 'execute', side_effect=AssertionError('不应重新回测')):
+            self.assertEqual(BacktestService().run_backtest(second.pk), metrics)
+        second.refresh_from_db()
+        self.assertTrue(second.cache_hit)
+        self.assertEqual(second.artifact_id, artifact.pk)
+        self.assertEqual(second.total_return, first.total_return)
+        self.assertEqual(second.equity_curve, first.equity_curve)
+        artifact.refresh_from_db()
+        self.assertEqual(artifact.hits, 1)
+
+    def test_deleting_last_backtest_removes_stored_result(self):
+        first, second = self._create_backtest(), self._create_backtest()
+        service = BacktestService()
+        service.run_backtest(first.pk)
+        service.run_backtest(second.pk)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        artifact = first.artifact
+        # 其他租户的相同请求共用同一个文件
+        other = Tenant.objects.create(name='其他租户', schema_name='other_tenant')
+        shared = BacktestArtifact.all_objects.create(
+            tenant=other, cache_key=artifact.cache_key, strategy_version=artifact.strategy_version,
+            parameters_hash=artifact.parameters_hash, data_hash=artifact.data_hash,
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(BacktestArtifact.objects.filter(pk=artifact.pk).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(BacktestArtifact.objects.filter(pk=artifact.pk).exists())
+        self.assertTrue(service.store.exists(artifact.cache_key))
+        with self.captureOnCommitCallbacks(execute=True):
+            shared.delete()
+        self.assertFalse(service.store.exists(artifact.cache_key))
+
+    def test_cache_key_tracks_version_parameters_and_data(self):
+        service = BacktestService()
+        backtest = self._create_backtest()
+        key = service.cache_identity(backtest)['cache_key']
+
+        self.assertNotEqual(service.cache_identity(self._create_backtest(parameters={'fast_period': 6}))['cache_key'], key)
+        self.assertNotEqual(service.cache_identity(self._create_backtest(fee_rate=Decimal('0.002')))['cache_key'], key)
+        # 收集器原地更新未收盘的K线：行数和ID不变，内容校验变化
+        last = self.start + timedelta(hours=299)
+        Kline.objects.filter(symbol=self.symbol, timestamp=last).update(close_price=F('close_price') + 1)
+        self.assertNotEqual(service.cache_identity(backtest)['cache_key'], key)
+        key = service.cache_identity(backtest)['cache_key']
+        Kline.objects.filter(symbol=self.symbol, timestamp=last).update(volume=F('volume') + 1)
+        self.assertNotEqual(service.cache_identity(backtest)['cache_key'], key)
+        key = service.cache_identity(backtest)['cache_key']
+        Kline.objects.filter(symbol=self.symbol, timestamp=self.start + timedelta(hours=299)).delete()
+        self.assertNotEqual(service.cache_identity(backtest)['cache_key'], key)
+
+        key = service.cache_identity(backtest)['cache_key']
+        self.strategy.code = 'def signal(data): ...'
+        self.strategy.save()
+        backtest.refresh_from_db()
+        self.assertNotEqual(service.cache_identity(backtest)['cache_key'], key)
+
+    @override_settings(ROOT_URLCONF='apps.strategies.urls')
+    def test_backtest_api_serves_downsampled_equity_and_trades(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        payload = {
+            'strategy': self.strategy.pk, 'symbol': self.symbol.pk, 'timeframe': '1h',
+            'start_date': self.start.isoformat(), 'end_date': (self.start + timedelta(hours=299)).isoformat(),
+        }
+        response = client.post('/backtests/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertFalse(response.data['cache_hit'])
+
+        response = client.post('/backtests/', payload, format='json')
+        self.assertTrue(response.data['cache_hit'])
+        backtest_id = response.data['id']
+
+        response = client.get(f'/backtests/{backtest_id}/equity/', {'width': 50})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['points']), 50)
+        self.assertEqual(response.data['total'], 300)
+
+        total_trades = Backtest.objects.get(pk=backtest_id).total_trades
+        response = client.get(f'/backtests/{backtest_id}/trades/', {'offset': 1, 'limit': 2})
+        self.assertEqual(response.data['total'], total_trades)
+        self.assertEqual(len(response.data['results']), min(2, total_trades - 1))
+        self.assertIn('return', response.data['results'][0])
+
+    @override_settings(ROOT_URLCONF='apps.strategies.urls')
+    def test_backtest_api_rejects_other_tenant_symbol(self):
+        other = Tenant.objects.create(name='其他租户', schema_name='other_tenant')
+        symbol = Symbol.objects.create(
+            tenant=other, exchange=self.symbol.exchange, symbol='ETH/USDT', base_asset='ETH', quote_asset='USDT',
+            min_order_size=Decimal('0.001'), max_order_size=Decimal('1000'), price_precision=2, amount_precision=6,
+        )
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.post('/backtests/', {
+            'strategy': self.strategy.pk, 'symbol': symbol.pk, 'timeframe': '1h',
+            'start_date': self.start.isoformat(), 'end_date': (self.start + timedelta(hours=299)).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('symbol', response.data)
+        self.assertFalse(Backtest.all_objects.exists())
+
+    def test_invalid_parameters_mark_failed(self):
+        backtest = self._create_backtest(parameters={'unknown': 1})
+        with self.assertRaises(BacktestError):
+            BacktestService().run_backtest(backtest.pk)
+        backtest.refresh_from_db()
+        self.assertEqual(backtest.status, 'failed')
+        self.assertIn('参数', backtest.error_message)
+
+    def test_event_engine_applies_stop_rules(self):
+        from apps.risk.models import StopLossRule
+        StopLossRule.objects.create(
+            tenant=self.tenant, name='5%止损', rule_type='stop_loss', strategy_id=self.strategy.pk,
+            trigger_condition='percentage', trigger_value=Decimal('5'), action_type='full_close',
+        )
+        backtest = self._create_backtest(engine='event')
+        metrics = BacktestService().run_backtest(backtest.pk)
+
+        backtest.refresh_from_db()
+        self.assertEqual(backtest.status, 'completed')
+        self.assertEqual(metrics['events'], 300)
+        self.assertGreater(metrics['fills'], 0)
+        self.assertEqual(len(backtest.equity_curve), 300)
+
+    def test_custom_strategy_runs_in_sandbox(self):
+        self.strategy.strategy_type = 'custom'
+        self.strategy.code = CUSTOM_STRATEGY_CODE
+        self.strategy.save()
+        vectorized = BacktestService().run_backtest(self._create_backtest().pk)
+        self.assertGreater(vectorized['total_trades'], 0)
+
+        event = BacktestService().run_backtest(self._create_backtest(engine='event').pk)
+        self.assertEqual(event['events'], 300)
+        self.assertGreater(event['fills'], 0)
+
+        self.strategy.code = 'import os'
+        self.strategy.save()
+        backtest = self._create_backtest(engine='event')
+        with self.assertRaises(BacktestError):
+            BacktestService().run_backtest(backtest.pk)
+        backtest.refresh_from_db()
+        self.assertIn('os', backtest.error_message)
+
+    def test_run_strategy_starts_live_instances_in_engine(self):
+        account = ExchangeAccount(tenant=self.tenant, user=self.user, name='主账户', exchange='binance')
+        account.set_api_credentials('key', 'secret')
+        account.save()
+        live = LiveStrategy.objects.create(
+            tenant=self.tenant, strategy=self.strategy, exchange_account=account, symbol=self.symbol,
+            timeframe='1h', parameters={'slow_period': 10},
+        )
+        self.assertEqual(run_strategy(self.strategy.pk), 1)
+        live.refresh_from_db()
+        self.assertEqual(live.status, 'running')
+
+        requests = []
+        engine = StrategyEngine(
+            event_log=MarketEventLog(client=fakeredis.FakeRedis(decode_responses=True)),
+            order_sink=requests.append, recorder=LatencyRecorder('test', client=fakeredis.FakeRedis(decode_responses=True)),
+        )
+        added, removed = engine.load_changes(set(), {}, {})
+        engine.apply_changes(added, removed)
+        runner = engine.runners[live.pk]
+        # 共享历史用数据库中的K线预热，预热期间不下单
+        self.assertEqual(len(runner.feed.series), 300)
+        self.assertEqual(runner.strategy.params['slow_period'], 10)
+        self.assertEqual(requests, [])
+
+        runner.stats.bars = 3
+        engine._failed[live.pk] = '测试错误'
+        engine.load_changes(set(engine.runners), engine.stats(), engine._failed)
+        live.refresh_from_db()
+        self.assertEqual(live.stats['bars'], 3)
+        self.assertEqual(live.status, 'error')
+        _, removed = engine.load_changes(set(engine.runners), {}, {})
+        self.assertEqual(removed, [live.pk])
+
+    def test_restarted_engine_restores_cash_positions_and_orders(self):
+        account = ExchangeAccount(tenant=self.tenant, user=self.user, name='主账户', exchange='binance')
+        account.set_api_credentials('key', 'secret')
+        account.save()
+        live = LiveStrategy.objects.create(
+            tenant=self.tenant, strategy=self.strategy, exchange_account=account, symbol=self.symbol,
+            timeframe='1h', capital=Decimal('10000'),
+        )
+        run_strategy(self.strategy.pk)
+        live.refresh_from_db()
+        common = {'tenant': self.tenant, 'exchange_account': account, 'live_strategy': live, 'symbol': 'BTC/USDT'}
+        # 上次启动之前的订单不计入
+        old = OrderRecord.objects.create(**common, client_order_id='ls-old', side='buy', amount=Decimal('5'),
+                                         status='filled', filled=Decimal('5'), avg_price=Decimal('100'))
+        OrderRecord.objects.filter(pk=old.pk).update(created_at=live.started_at - timedelta(days=1))
+        OrderRecord.objects.create(**common, client_order_id='ls-buy', side='buy', amount=Decimal('2'),
+                                   status='filled', filled=Decimal('2'), avg_price=Decimal('100'), fee=Decimal('0.2'))
+        OrderRecord.objects.create(**common, client_order_id='ls-sell', side='sell', order_type='limit',
+                                   amount=Decimal('1'), price=Decimal('120'), status='partial',
+                                   filled=Decimal('0.5'), avg_price=Decimal('120'))
+        OrderRecord.objects.create(**common, client_order_id='ls-rejected', side='buy', amount=Decimal('1'),
+                                   status='rejected')
+
+        engine = StrategyEngine(
+            event_log=MarketEventLog(client=fakeredis.FakeRedis(decode_responses=True)),
+            order_sink=lambda request: None,
+            recorder=LatencyRecorder('test', client=fakeredis.FakeRedis(decode_responses=True)),
+        )
+        engine.apply_changes(*engine.load_changes(set(), {}, {}))
+        ctx = engine.runners[live.pk].context
+        self.assertAlmostEqual(ctx.position('BTC/USDT').amount, 1.5)
+        self.assertAlmostEqual(ctx.cash, 10000 - 200 - 0.2 + 60)
+        [order] = ctx.open_orders()
+        self.assertEqual((order.id, order.status, order.filled, order.price), ('ls-sell', 'partial', 0.5, 120.0))
+
+        # 重启期间的回报重新投递：已经计入订单记录的成交不重复计入
+        base = {'live_strategy_id': live.pk, 'client_order_id': 'ls-sell', 'type': 'fill', 'price': 120.0}
+        self.assertEqual(engine.handle_reports([{**base, 'amount': 0.5, 'filled': 0.5}]), 0)
+        self.assertEqual(engine.handle_reports([{**base, 'amount': 0.5, 'filled': 1.0}]), 1)
+        self.assertAlmostEqual(ctx.position('BTC/USDT').amount, 1.0)
+        self.assertEqual(order.status, 'filled')
+        engine.remove_runner(live.pk)
+
+    def test_portfolio_backtest_task_aligns_symbols(self):
+        second = Symbol.objects.create(
+            tenant=self.tenant, exchange=self.symbol.exchange, symbol='ETH/USDT', base_asset='ETH',
+            quote_asset='USDT', min_order_size=Decimal('0.001'), max_order_size=Decimal('1000'),
+            price_precision=2, amount_precision=4,
+        )
+        data = make_klines(300, seed=11)
+        # 第 50 根K线上市，第 100~104 根缺失
+        Kline.objects.bulk_create([
+            Kline(
+                symbol=second, timeframe='1h', timestamp=self.start + timedelta(hours=i),
+                open_price=Decimal(f"{data['open'][i]:.8f}"), high_price=Decimal(f"{data['high'][i]:.8f}"),
+                low_price=Decimal(f"{data['low'][i]:.8f}"), close_price=Decimal(f"{data['close'][i]:.8f}"),
+                volume=Decimal('10'),
+            )
+            for i in range(50, 300) if not 100 <= i < 105
+        ])
+        end = self.start + timedelta(hours=299)
+        panel = load_kline_panel([second, self.symbol], '1h', self.start, end, fields=('open', 'close'))
+        self.assertEqual(panel.shape, (300, 2))
+        self.assertEqual(int(panel.valid[:, 0].sum()), 245)
+        self.assertTrue(np.isnan(panel['close'][100:105, 0]).all())
+        np.testing.assert_allclose(panel['close'][:, 1], make_klines(300)['close'], rtol=1e-8)
+
+        portfolio = PortfolioBacktest.objects.create(
+            tenant=self.tenant, strategy=self.strategy, timeframe='1h', start_date=self.start, end_date=end,
+            allocation='active', rebalance_every=4, max_weight=Decimal('0.6'),
+        )
+        portfolio.symbols.set([self.symbol, second])
+        metrics = run_portfolio_backtest_task(portfolio.pk)
+
+        portfolio.refresh_from_db()
+        self.assertEqual(portfolio.status, 'completed')
+        self.assertEqual(metrics['assets'], 2)
+        self.assertEqual(metrics['bars'], 300)
+        self.assertLessEqual(metrics['max_gross_exposure'], 1.2)
+        stats = {item['symbol_name']: item for item in portfolio.assets}
+        self.assertEqual(stats['ETH/USDT']['missing_bars'], 5)
+        self.assertEqual(stats['BTC/USDT']['bars'], 300)
+        self.assertTrue(portfolio.equity_curve)
+
+    def test_optimize_strategy_parameters_task(self):
+        report = optimize_strategy_parameters(
+            self.strategy.pk, {'fast_period': [3, 5, 8], 'slow_period': {'min': 20, 'max': 40, 'step': 10}},
+            symbol_id=self.symbol.pk, timeframe='1h', top_n=3,
+            start_date=self.start.isoformat(), end_date=(self.start + timedelta(hours=299)).isoformat(),
+        )
+
+        optimization = Optimization.objects.get()
+        self.assertEqual(optimization.status, 'completed')
+        self.assertEqual(optimization.total_candidates, 9)
+        self.assertEqual(optimization.completed_candidates, 9)
+        self.assertEqual(len(optimization.top_results), 3)
+        self.assertEqual(optimization.best_parameters, report['results'][0]['parameters'])
+        scores = [item['score'] for item in report['results']]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_walk_forward_task(self):
+        walk_forward = WalkForward.objects.create(
+            tenant=self.tenant, strategy=self.strategy, symbol=self.symbol, timeframe='1h',
+            start_date=self.start, end_date=self.start + timedelta(hours=299),
+            parameter_ranges={'fast_period': [3, 5], 'slow_period': [10, 20]}, train_bars=100, test_bars=50,
+        )
+        metrics = run_walk_forward(walk_forward.pk)
+
+        walk_forward.refresh_from_db()
+        self.assertEqual(walk_forward.status, 'completed')
+        self.assertEqual(metrics['windows'], 4)
+        self.assertEqual(len(walk_forward.windows), 4)
+        self.assertEqual(walk_forward.completed_candidates, 4)
+        self.assertEqual(len(walk_forward.equity_curve), 200)
+        self.assertEqual(walk_forward.equity_curve[0][0], int((self.start + timedelta(hours=100)).timestamp() * 1000))
+
+    def test_genetic_optimization(self):
+        optimization = OptimizationService().create_optimization(
+            self.strategy.pk, {'fast_period': {'min': 2, 'max': 15}, 'slow_period': {'min': 20, 'max': 60}},
+            symbol_id=self.symbol.pk, timeframe='1h', start_date=self.start,
+            end_date=self.start + timedelta(hours=299), method='genetic',
+            options={'population_size': 8, 'generations': 3, 'seed': 1},
+        )
+        report = OptimizationService().run_optimization(optimization)
+
+        optimization.refresh_from_db()
+        self.assertEqual(optimization.status, 'completed')
+        self.assertEqual(optimization.total_candidates, 24)
+        self.assertEqual(optimization.completed_candidates, report['evaluated'])
+        self.assertEqual(optimization.summary['generations'], 3)
+        self.assertEqual(optimization.best_parameters, report['results'][0]['parameters'])
+
+        optimization = OptimizationService().create_optimization(
+            self.strategy.pk, {'fast_period': [5]}, symbol_id=self.symbol.pk, start_date=self.start,
+            end_date=self.start, method='genetic', options={'population': 8},
+        )
+        with self.assertRaises(BacktestError):
+            OptimizationService().run_optimization(optimization)
+
+
+def bar_arrays(rows, start_ts=0):
+    """由 (open, high, low, close, volume) 列表构造K线数组（1分钟）"""
+    rows = np.asarray(rows, dtype=np.float64)
+    return {
+        'timestamp': start_ts + np.arange(len(rows), dtype=np.int64) * 60_000,
+        'open': rows[:, 0], 'high': rows[:, 1], 'low': rows[:, 2], 'close': rows[:, 3], 'volume': rows[:, 4],
+    }
+
+
+class ScriptedStrategy(BaseStrategy):
+    """按K线序号执行预设动作的测试策略"""
+
+    parameters = {'actions': None}
+
+    def on_start(self, ctx):
+        self.index = -1
+        self.orders = []
+        self.fills = []
+
+    def on_bar(self, ctx, bar):
+        self.index += 1
+        action = (self.params['actions'] or {}).get(self.index)
+        if action:
+            self.orders.append(action(ctx, bar))
+
+    def on_fill(self, ctx, fill):
+        self.fills.append(fill)
+
+
+class EventQueueTest(SimpleTestCase):
+    """事件队列测试"""
+
+    def test_merges_sources_in_time_order(self):
+        queue = EventQueue()
+        queue.add_source(iter([(1, 'a1'), (5, 'a5'), (9, 'a9')]), priority=1)
+        queue.add_source(iter([(5, 'b5'), (6, 'b6')]), priority=0)
+        queue.push(3, 'timer')
+        self.assertEqual([event for _, event in queue], ['a1', 'timer', 'b5', 'a5', 'b6', 'a9'])
+
+
+class EventBacktestTest(SimpleTestCase):
+    """事件驱动回测测试"""
+
+    def _run(self, rows, actions, **kwargs):
+        strategy = ScriptedStrategy(actions=actions)
+        backtester = EventBacktester(strategy, initial_capital=10000, fee_rate=0.0, slippage=0.0, **kwargs)
+        backtester.add_bars('BTC/USDT', bar_arrays(rows), '1m')
+        result = backtester.run()
+        return backtester, strategy, result
+
+    def test_market_order_fills_next_open(self):
+        rows = [(100, 101, 99, 100, 10), (102, 103, 101, 102, 10), (103, 104, 102, 103, 10)]
+        backtester, strategy, result = self._run(rows, {0: lambda ctx, bar: ctx.buy('BTC/USDT', 1)})
+        self.assertEqual(strategy.fills[0].price, 102)
+        self.assertEqual(backtester.get_position('BTC/USDT').amount, 1)
+        self.assertAlmostEqual(result.equity[-1], 10000 + 1)
+
+    def test_limit_order_waits_for_price(self):
+        rows = [(100, 101, 99, 100, 10), (100, 101, 99.5, 100, 10), (99, 99.5, 97, 98, 10)]
+        _, strategy, _ = self._run(rows, {0: lambda ctx, bar: ctx.buy('BTC/USDT', 1, price=98.5)})
+        self.assertEqual(len(strategy.fills), 1)
+        self.assertEqual(strategy.fills[0].price, 98.5)
+        self.assertEqual(strategy.fills[0].liquidity, 'maker')
+        self.assertEqual(strategy.fills[0].ts, 3 * 60_000)
+
+    def test_stop_order_gap_fills_at_open(self):
+        rows = [(100, 101, 99, 100, 10), (100, 101, 99, 100, 10), (95, 96, 94, 95, 10)]
+        actions = {
+            0: lambda ctx, bar: ctx.buy('BTC/USDT', 1),
+            1: lambda ctx, bar: ctx.sell('BTC/USDT', 1, order_type='stop', stop_price=98),
+        }
+        backtester, strategy, _ = self._run(rows, actions)
+        self.assertEqual([fill.price for fill in strategy.fills], [100, 95])
+        self.assertEqual(backtester.get_position('BTC/USDT').amount, 0)
+        self.assertEqual(len(backtester.closed_trades), 1)
+        self.assertAlmostEqual(backtester.closed_trades[0]['return'], -0.05)
+
+    def test_partial_fills_limited_by_volume(self):
+        rows = [(100, 101, 99, 100, 10)] + [(100, 101, 99, 100, 10)] * 3
+        _, strategy, _ = self._run(
+            rows, {0: lambda ctx, bar: ctx.buy('BTC/USDT', 2.5, price=100)}, participation_rate=0.1,
+        )
+        order = strategy.orders[0]
+        self.assertEqual([fill.amount for fill in strategy.fills], [1.0, 1.0, 0.5])
+        self.assertEqual(order.status, 'filled')
+
+    def test_stop_rules_trailing_and_take_profit(self):
+        """跟踪止损在回撤时平仓，止盈单随之撤销"""
+        rows = [
+            (100, 100, 100, 100, 10),
+            (100, 101, 99, 100, 10),   # 市价买入 @100
+            (100, 110, 100, 110, 10),  # 未触发，跟踪极值更新为110
+            (110, 111, 104, 105, 10),  # 止损价 110*0.95=104.5，最低价104触发
+        ]
+        rules = [
+            StopRule('trailing_stop', trigger_value=5),
+            StopRule('take_profit', trigger_value=20),
+        ]
+        backtester, strategy, _ = self._run(rows, {0: lambda ctx, bar: ctx.buy('BTC/USDT', 1)}, stop_rules=rules)
+        exit_fill = strategy.fills[-1]
+        self.assertEqual(exit_fill.tag, 'trailing_stop')
+        self.assertAlmostEqual(exit_fill.price, 104.5)
+        self.assertEqual(backtester.get_position('BTC/USDT').amount, 0)
+        take_profit = [o for o in backtester.orders.values() if o.tag == 'take_profit'][0]
+        self.assertEqual(take_profit.status, 'cancelled')
+
+    def test_reduce_only_cannot_flip_position(self):
+        """同一根K线同时触发止损和止盈时只平一次"""
+        rows = [(100, 100, 100, 100, 10), (100, 100, 100, 100, 10), (100, 130, 70, 100, 10)]
+        rules = [StopRule('stop_loss', trigger_value=10), StopRule('take_profit', trigger_value=10)]
+        backtester, _, _ = self._run(rows, {0: lambda ctx, bar: ctx.buy('BTC/USDT', 1)}, stop_rules=rules)
+        self.assertEqual(backtester.get_position('BTC/USDT').amount, 0)
+
+    def test_ticks_match_limit_orders(self):
+        """有逐笔数据时按成交撮合，K线不再重复撮合"""
+        strategy = ScriptedStrategy(actions={0: lambda ctx, bar: ctx.buy('BTC/USDT', 3, price=99)})
+        backtester = EventBacktester(strategy, initial_capital=10000, fee_rate=0.0, slippage=0.0)
+        backtester.add_bars('BTC/USDT', bar_arrays([(100, 100, 100, 100, 1), (100, 100, 98, 99, 1)]), '1m')
+        backtester.add_ticks('BTC/USDT', {
+            'timestamp': np.array([70_000, 80_000, 90_000], dtype=np.int64),
+            'price': np.array([99.5, 99.0, 98.0]),
+            'amount': np.array([5.0, 1.0, 1.5]),
+        })
+        backtester.run()
+        self.assertEqual([fill.amount for fill in strategy.fills], [1.0, 1.5])
+        self.assertEqual(strategy.orders[0].status, 'partial')
+
+    def test_ma_cross_strategy_matches_interface(self):
+        data = make_klines(400)
+        backtester = EventBacktester(MACrossStrategy(fast_period=5, slow_period=20), initial_capital=10000)
+        backtester.add_bars('BTC/USDT', data, '1h')
+        result = backtester.run()
+        self.assertEqual(result.metrics['events'], 400)
+        self.assertGreater(result.metrics['total_trades'], 0)
+        self.assertEqual(len(result.equity), 400)
+
+    def test_equity_recorded_once_per_timestamp(self):
+        """多个交易对同一时间戳的K线只记录一个权益点"""
+        data = make_klines(100)
+        strategy = ScriptedStrategy(actions={0: lambda ctx, bar: ctx.buy('BTC/USDT', 1)})
+        backtester = EventBacktester(strategy, initial_capital=10000, fee_rate=0.0, slippage=0.0)
+        backtester.add_bars('BTC/USDT', data, '1h')
+        backtester.add_bars('ETH/USDT', make_klines(100, seed=8), '1h')
+        result = backtester.run()
+        self.assertEqual(result.metrics['events'], 200)
+        self.assertEqual(len(result.equity), 100)
+        np.testing.assert_array_equal(result.timestamps, data['timestamp'] + 3600_000)  # K线在收盘时推送
+        self.assertAlmostEqual(result.equity[-1], 10000 + data['close'][-1] - data['open'][1])
+
+
+class ParameterOptimizerTest(SimpleTestCase):
+    """参数优化测试"""
+
+    def test_parameter_grid(self):
+        grid = parameter_grid({'fast_period': {'min': 5, 'max': 15, 'step': 5}, 'num_std': [1.5, 2.0], 'period': 20})
+        self.assertEqual(len(grid), 6)
+        self.assertIn({'fast_period': 10, 'num_std': 2.0, 'period': 20}, grid)
+        self.assertEqual(len(parameter_grid({'x': {'min': 0.1, 'max': 0.3, 'step': 0.1}})), 3)
+
+    def test_random_candidates_are_unique_and_in_range(self):
+        candidates = build_candidates(
+            {'fast_period': {'min': 2, 'max': 30}, 'ratio': {'min': 0.5, 'max': 1.0}}, 'random', samples=50, seed=1,
+        )
+        self.assertEqual(len(candidates), 50)
+        self.assertEqual(len({tuple(sorted(c.items())) for c in candidates}), 50)
+        for candidate in candidates:
+            self.assertIsInstance(candidate['fast_period'], int)
+            self.assertTrue(0.5 <= candidate['ratio'] <= 1.0)
+        with self.assertRaises(BacktestError):
+            build_candidates({'x': [1]}, 'annealing')
+
+    def test_shared_arrays_round_trip(self):
+        data = make_klines(100)
+        with SharedArrays.create(data) as shared:
+            attached = SharedArrays.attach(shared.spec)
+            for name, values in data.items():
+                np.testing.assert_array_equal(attached.arrays[name], values)
+                self.assertEqual(attached.arrays[name].dtype, values.dtype)
+            attached.close()
+
+    def test_pool_failure_releases_shared_memory(self):
+        created = []
+        original = SharedArrays.create
+
+        def create(arrays):
+            created.append(original(arrays))
+            return created[-1]
+
+        context = MagicMock()
+        context.Pool.side_effect = OSError('no more processes')
+        with patch.object(SharedArrays, 'create', side_effect=create), \
+                patch('multiprocessing.get_context', return_value=context):
+            with self.assertRaises(OSError):
+                ParameterOptimizer('ma_cross', make_klines(100), '1h', workers=2).run([{'fast_period': 3}])
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=created[0].spec['name'])
+
+    def test_runs_inside_daemonic_process(self):
+        data = make_klines(1000)
+        candidates = build_candidates({'fast_period': [3, 5, 8], 'slow_period': [21, 34]})
+        serial = ParameterOptimizer('ma_cross', data, '1h', workers=1).run(candidates)
+        daemonic = run_in_daemon(ParameterOptimizer('ma_cross', data, '1h', workers=4).run, candidates)
+        self.assertEqual(serial['results'], daemonic['results'])
+
+    def test_parallel_matches_serial(self):
+        data = make_klines(2000)
+        candidates = build_candidates({'fast_period': [3, 5, 8, 13], 'slow_period': [21, 34, 55]})
+        candidates.append({'fast_period': 5, 'unknown': 1})
+        serial = ParameterOptimizer('ma_cross', data, '1h', top_n=5, workers=1).run(candidates)
+        progress = []
+        parallel = ParameterOptimizer('ma_cross', data, '1h', top_n=5, workers=2).run(
+            candidates, on_progress=lambda done, total, top: progress.append((done, total)),
+        )
+
+        self.assertEqual(serial['results'], parallel['results'])
+        self.assertEqual(parallel['evaluated'], 13)
+        self.assertEqual(parallel['failed'], 1)
+        self.assertEqual(progress[-1], (13, 13))
+        best = serial['results'][0]
+        signal = ma_cross_signal(data, **best['parameters'])
+        expected = run_vectorized_backtest(data, signal, 10000.0, 0.001, 0.0005, '1h').metrics['sharpe_ratio']
+        self.assertEqual(best['score'], expected)
+
+    def test_drawdown_objective_prefers_smaller_drawdown(self):
+        candidates = build_candidates({'fast_period': [3, 5, 8, 13], 'slow_period': [21, 34, 55]})
+        report = ParameterOptimizer('ma_cross', make_klines(2000), '1h', objective='max_drawdown', workers=1).run(candidates)
+        drawdowns = [item['metrics']['max_drawdown'] for item in report['results']]
+        self.assertEqual(drawdowns, sorted(drawdowns))
+
+    def test_drawdown_bound_prunes_on_prefix(self):
+        data = make_klines(2000)
+        config = {'initial_capital': 10000.0, 'fee_rate': 0.001, 'slippage': 0.0005, 'timeframe': '1h'}
+        params = {'fast_period': 3, 'slow_period': 21}
+        full = evaluate_candidate(data, 'ma_cross', params, config)
+        drawdown = full['metrics']['max_drawdown']
+
+        self.assertEqual(evaluate_candidate(data, 'ma_cross', params, {**config, 'max_drawdown': drawdown}), full)
+        pruned = evaluate_candidate(data, 'ma_cross', params, {**config, 'max_drawdown': drawdown / 100})
+        self.assertTrue(pruned['pruned'])
+        self.assertEqual(pruned['bars'], 600)
+
+    def test_invalid_objective(self):
+        with self.assertRaises(BacktestError):
+            ParameterOptimizer('ma_cross', make_klines(10), '1h', objective='luck')
+
+
+class GeneticOptimizerTest(SimpleTestCase):
+    """遗传算法优化测试"""
+
+    space = {
+        'fast_period': {'min': 2, 'max': 40},
+        'slow_period': {'min': 20, 'max': 200, 'step': 5},
+        'allow_short': [False, True],
+    }
+
+    def test_gene_mutation_stays_in_space(self):
+        import random
+        rng = random.Random(3)
+        ordinal, continuous, categorical = Gene('a', {'min': 2, 'max': 9}), Gene('b', {'min': 0.5, 'max': 1.0}), Gene('c', ['x', 'y'])
+        self.assertEqual((ordinal.kind, continuous.kind, categorical.kind), ('ordinal', 'float', 'categorical'))
+        value, ratio = 5, 0.7
+        for _ in range(200):
+            value = ordinal.mutate(value, rng)
+            ratio = continuous.mutate(ratio, rng)
+            self.assertIn(value, range(2, 10))
+            self.assertTrue(0.5 <= ratio <= 1.0)
+            self.assertIn(categorical.mutate('x', rng), ('x', 'y'))
+        self.assertEqual(Gene('d', 3).mutate(3, rng), 3)
+
+    def test_evolve_caches_genomes_and_uses_fewer_backtests_than_grid(self):
+        data = make_klines(3000)
+        optimizer = GeneticOptimizer('ma_cross', data, '1h', population_size=20, generations=8, patience=None,
+                                     seed=11, workers=1, top_n=5)
+        report = optimizer.evolve(self.space)
+
+        grid_size = len(parameter_grid(self.space))
+        self.assertEqual(report['generations'], 8)
+        self.assertEqual(report['evaluated'] + report['cache_hits'], 20 * 8)
+        self.assertGreater(report['cache_hits'], 0)
+        self.assertEqual(report['evaluated'], len(optimizer.cache))
+        self.assertLess(report['evaluated'], grid_size / 10)
+        # 精英保留，每代最优值单调不减
+        bests = [item['best'] for item in report['history']]
+        self.assertEqual(bests, sorted(bests))
+
+        # 在完整网格中的排名靠前
+        grid = ParameterOptimizer('ma_cross', data, '1h', top_n=grid_size, workers=1).run(parameter_grid(self.space))
+        scores = [item['score'] for item in grid['results']]
+        self.assertLess(scores.index(report['results'][0]['score']), grid_size * 0.05)
+
+    def test_parallel_evolve_matches_serial_and_prunes(self):
+        data = make_klines(2000)
+        kwargs = dict(population_size=10, generations=3, seed=5, max_drawdown=0.15, patience=None)
+        serial = GeneticOptimizer('ma_cross', data, '1h', workers=1, **kwargs).evolve(self.space)
+        parallel = GeneticOptimizer('ma_cross', data, '1h', workers=2, **kwargs).evolve(self.space)
+
+        self.assertEqual(serial['results'], parallel['results'])
+        self.assertEqual(serial['history'], parallel['history'])
+        self.assertGreater(serial['pruned'], 0)
+        for item in serial['results']:
+            self.assertLessEqual(item['metrics']['max_drawdown'], 0.15)
+
+    def test_evolve_inside_daemonic_process(self):
+        data = make_klines(1000)
+        kwargs = dict(population_size=6, generations=2, seed=3, patience=None)
+        serial = GeneticOptimizer('ma_cross', data, '1h', workers=1, **kwargs).evolve(self.space)
+        daemonic = run_in_daemon(GeneticOptimizer('ma_cross', data, '1h', workers=4, **kwargs).evolve, self.space)
+        self.assertEqual(serial['results'], daemonic['results'])
+        self.assertEqual(serial['history'], daemonic['history'])
+
+    def test_early_stopping(self):
+        report = GeneticOptimizer('ma_cross', make_klines(500), '1h', population_size=4, generations=50,
+                                  patience=2, seed=1, workers=1).evolve({'fast_period': [3, 5], 'slow_period': 20})
+        self.assertLess(report['generations'], 50)
+        self.assertEqual(report['evaluated'], 2)
+
+
+class WalkForwardTest(SimpleTestCase):
+    """滚动前推分析测试"""
+
+    space = {'fast_period': [3, 5, 8, 13], 'slow_period': [21, 34, 55]}
+
+    def test_windows(self):
+        windows = walk_forward_windows(1050, train_bars=500, test_bars=200)
+        self.assertEqual([w.as_tuple() for w in windows], [
+            (0, 500, 500, 700), (200, 700, 700, 900), (400, 900, 900, 1050),
+        ])
+        anchored = walk_forward_windows(1050, train_bars=500, test_bars=200, anchored=True)
+        self.assertEqual([w.train_start for w in anchored], [0, 0, 0])
+        with self.assertRaises(BacktestError):
+            walk_forward_windows(501, train_bars=500, test_bars=200)
+
+    def test_selects_best_train_parameters_and_stitches_out_of_sample(self):
+        data = make_klines(3000)
+        analyzer = WalkForwardAnalyzer('ma_cross', data, '1h', train_bars=1000, test_bars=500, workers=1)
+        candidates = build_candidates(self.space)
+        report = analyzer.run(candidates)
+
+        self.assertEqual(len(report['windows']), 4)
+        segments = []
+        for window, result in zip(analyzer.windows, report['windows']):
+            # 逐个候选在训练窗口上回测，最优参数与分析结果一致
+            scores = []
+            for params in candidates:
+                signal = ma_cross_signal(data, **params)
+                train = {k: v[window.train_start:window.train_end] for k, v in data.items()}
+                scores.append(run_vectorized_backtest(train, signal[window.train_start:window.train_end]).metrics['sharpe_ratio'])
+            self.assertEqual(result['parameters'], candidates[int(np.argmax(scores))])
+            self.assertEqual(result['train_score'], max(scores))
+
+            signal = ma_cross_signal(data, **result['parameters'])
+            test = {k: v[window.test_start:window.test_end] for k, v in data.items()}
+            segments.append(run_vectorized_backtest(test, signal[window.test_start:window.test_end]))
+            self.assertEqual(result['test_metrics']['total_return'], segments[-1].metrics['total_return'])
+
+        stitched = report['result']
+        self.assertEqual(len(stitched.equity), 2000)
+        self.assertEqual(stitched.timestamps[0], data['timestamp'][1000])
+        expected = 10000.0 * np.prod([1 + s.metrics['total_return'] for s in segments])
+        self.assertAlmostEqual(stitched.equity[-1], expected, delta=expected * 1e-5)
+        self.assertEqual(report['metrics']['total_trades'], sum(s.metrics['total_trades'] for s in segments))
+
+    def test_parallel_matches_serial(self):
+        data = make_klines(2000)
+        candidates = build_candidates(self.space) + [{'fast_period': 3, 'unknown': 1}]
+        serial = WalkForwardAnalyzer('ma_cross', data, '1h', 600, 300, anchored=True, workers=1).run(candidates)
+        parallel = WalkForwardAnalyzer('ma_cross', data, '1h', 600, 300, anchored=True, workers=2).run(candidates)
+
+        self.assertEqual(serial['windows'], parallel['windows'])
+        self.assertEqual(serial['metrics'], parallel['metrics'])
+        self.assertEqual(parallel['failed'], 1)
+
+    def test_runs_inside_daemonic_process(self):
+        data = make_klines(1500)
+        candidates = build_candidates(self.space)
+        serial = WalkForwardAnalyzer('ma_cross', data, '1h', 600, 300, workers=1).run(candidates)
+        daemonic = run_in_daemon(WalkForwardAnalyzer('ma_cross', data, '1h', 600, 300, workers=4).run, candidates)
+        self.assertEqual(serial['windows'], daemonic['windows'])
+        self.assertEqual(serial['metrics'], daemonic['metrics'])
+
+
+class BacktestResultStoreTest(SimpleTestCase):
+    """回测结果存储测试"""
+
+    def test_round_trip_and_compression(self):
+        data = make_klines(50000)
+        result = run_vectorized_backtest(data, ma_cross_signal(data, 5, 20))
+        with tempfile.TemporaryDirectory() as base_dir:
+            store = BacktestResultStore(base_dir)
+            size = store.save('ab' * 32, result)
+            equity = store.load_equity('ab' * 32)
+            np.testing.assert_array_equal(equity['timestamp'], result.timestamps)
+            np.testing.assert_array_equal(equity['equity'], result.equity)
+            trades = store.load_trades('ab' * 32)
+            for name, values in result.trades.items():
+                np.testing.assert_array_equal(trades[name], values)
+            self.assertEqual(store.load_fills('ab' * 32), {})
+            # 原始列总大小的一半以内
+            self.assertLess(size, (result.timestamps.nbytes + result.equity.nbytes + result.positions.nbytes) / 2)
+
+            self.assertEqual(len(store.equity_curve('ab' * 32, 800)), 800)
+            store.delete('ab' * 32)
+            self.assertFalse(store.exists('ab' * 32))
+
+    def test_event_backtest_fills_are_stored(self):
+        strategy = MACrossStrategy(fast_period=3, slow_period=10)
+        backtester = EventBacktester(strategy)
+        backtester.add_bars('BTC/USDT', make_klines(500), '1h')
+        result = backtester.run()
+        with tempfile.TemporaryDirectory() as base_dir:
+            store = BacktestResultStore(base_dir)
+            store.save('cd' * 32, result)
+            fills = store.load_fills('cd' * 32)
+        self.assertEqual(len(fills['price']), result.metrics['fills'])
+        self.assertEqual(set(np.unique(fills['side'])), {-1, 1})
+
+    def test_lttb_keeps_extremes(self):
+        x = np.arange(10000)
+        y = np.sin(x / 500.0)
+        y[1234] = 5.0
+        y[8765] = -5.0
+        index = lttb_downsample(x, y, 100)
+        self.assertEqual(len(index), 100)
+        self.assertEqual((index[0], index[-1]), (0, 9999))
+        self.assertTrue(np.all(np.diff(index) > 0))
+        self.assertIn(1234, index)
+        self.assertIn(8765, index)
+        np.testing.assert_array_equal(lttb_downsample(x[:50], y[:50], 100), np.arange(50))
+
+
+SANDBOX_ESCAPE_CODE = """
+def generate_signals(data):
+    os = pd.io.common.os
+    socket = os.sys.modules['socket']
+    checks = ['SANDBOX_TEST_SECRET' in os.environ, os.getuid() == 0]
+    for attempt in (lambda: os.open('/etc/hostname', os.O_RDONLY), lambda: pd.read_pickle('/etc/hostname'),
+                    lambda: socket.create_connection(('127.0.0.1', 6379), timeout=1),
+                    lambda: os.sys.modules['signal'].pthread_kill(os.sys.modules['threading'].get_ident(), 0)):
+        try:
+            attempt()
+            checks.append(True)
+        except Exception:
+            checks.append(False)
+    return np.array(checks + [False] * (len(data['close']) - len(checks)), dtype=float)
+"""
+
+SIGN_CODE = """
+def generate_signals(data):
+    return np.sign(data['close'])
+"""
+
+CPU_BOUND_CODE = """
+def generate_signals(data):
+    deadline = time.process_time() + 0.8
+    while time.process_time() < deadline:
+        pass
+    return np.zeros(len(data['close']))
+"""
+
+
+class StrategySandboxTest(SimpleTestCase):
+    """用户策略沙箱测试"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.pool = StrategySandboxPool(size=1, time_limit=2, call_timeout=2)
+        cls.pool.warm_up()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        super().tearDownClass()
+
+    def test_vectorized_signals_match_builtin_and_reuse_compiled_code(self):
+        data = make_klines(400)
+        with self.pool.session(CUSTOM_STRATEGY_CODE, {'fast_period': 5, 'slow_period': 20}, tenant_id=1) as session:
+            signal = session.generate_signals(data)
+            pid = session.call(('ping',))
+        np.testing.assert_array_equal(signal, ma_cross_signal(data, 5, 20))
+
+        with self.pool.session(CUSTOM_STRATEGY_CODE, tenant_id=1) as session:
+            self.assertFalse(session.info['compiled'])
+            self.assertEqual(session.call(('ping',)), pid)
+
+    def test_event_strategy_matches_local_execution(self):
+        data = make_klines(400)
+        with self.pool.session(CUSTOM_STRATEGY_CODE) as session:
+            remote = EventBacktester(session.strategy())
+            remote.add_bars('BTC/USDT', data, '1h')
+            remote_result = remote.run()
+
+        namespace = {}
+        exec(CUSTOM_STRATEGY_CODE, {'indicators': indicators, 'BaseStrategy': BaseStrategy}, namespace)
+        local = EventBacktester(namespace['Strategy']())
+        local.add_bars('BTC/USDT', data, '1h')
+        local_result = local.run()
+        self.assertGreater(remote_result.metrics['fills'], 0)
+        np.testing.assert_allclose(remote_result.equity, local_result.equity)
+
+    def test_rejects_forbidden_code(self):
+        for code in ('import os', "open('/etc/passwd')", 'eval("1")'):
+            with self.assertRaises(SandboxError):
+                self.pool.session(code)
+        with self.pool.session('def generate_signals(data):\n    return [1.0]') as session:
+            with self.assertRaises(SandboxError):
+                session.generate_signals(make_klines(10))
+
+    def test_worker_is_isolated_from_host(self):
+        """环境变量不传入子进程，降权后不能打开文件、创建套接字"""
+        with patch.dict('os.environ', {'SANDBOX_TEST_SECRET': 'secret'}):
+            pool = StrategySandboxPool(size=1, time_limit=5)
+            try:
+                with pool.session('import time\n' + SANDBOX_ESCAPE_CODE) as session:
+                    checks = session.generate_signals(make_klines(10))[:6]
+            finally:
+                pool.close()
+        np.testing.assert_array_equal(checks, np.zeros(6))
+
+    def test_worker_state_does_not_cross_tenants(self):
+        """用户代码改写的模块只影响同一租户的会话"""
+        patched = 'np.sign = lambda values: values * 0 + 7\n' + SIGN_CODE
+        data = make_klines(10)
+        with self.pool.session(patched, tenant_id=1) as session:
+            pid = session.call(('ping',))
+            np.testing.assert_array_equal(session.generate_signals(data), np.full(10, 7.0))
+        with self.pool.session(SIGN_CODE, tenant_id=1) as session:
+            self.assertEqual(session.call(('ping',)), pid)
+        with self.pool.session(SIGN_CODE, tenant_id=2) as session:
+            self.assertNotEqual(session.call(('ping',)), pid)
+            np.testing.assert_array_equal(session.generate_signals(data), np.ones(10))
+            pid = session.call(('ping',))
+        # 未指定租户的会话结束后子进程被替换
+        with self.pool.session(SIGN_CODE) as session:
+            self.assertNotEqual(session.call(('ping',)), pid)
+            pid = session.call(('ping',))
+        with self.pool.session(SIGN_CODE) as session:
+            self.assertNotEqual(session.call(('ping',)), pid)
+
+    def test_cpu_budget_applies_per_call(self):
+        """常驻会话累计的 CPU 时间超过预算也不会被结束"""
+        pool = StrategySandboxPool(size=1, cpu_seconds=1, time_limit=5)
+        try:
+            with pool.session('import time\n' + CPU_BOUND_CODE) as session:
+                for _ in range(4):
+                    session.generate_signals(make_klines(10))
+        finally:
+            pool.close()
+
+    def test_timeout_replaces_worker(self):
+        with self.pool.session('def generate_signals(data):\n    while True:\n        pass') as session:
+            pid = session.call(('ping',))
+            with self.assertRaisesMessage(SandboxError, '超时'):
+                session.generate_signals(make_klines(10))
+        with self.pool.session(CUSTOM_STRATEGY_CODE) as session:
+            self.assertNotEqual(session.call(('ping',)), pid)
+            self.assertTrue(session.info['compiled'])
+
+
+def kline_event(ts, close, timeframe='1h', symbol='BTC/USDT'):
+    return MarketEvent('0-0', 'binance', 'kline', symbol, ts, {
+        'timeframe': timeframe, 'open': close, 'high': close, 'low': close, 'close': close, 'volume': 10,
+    })
+
+
+class LiveStrategyEngineTest(SimpleTestCase):
+    """实盘策略引擎测试"""
+
+    HOUR = 3600_000
+
+    def setUp(self):
+        self.now = 1700000000000
+        self.requests = []
+        self.engine = StrategyEngine(
+            event_log=MarketEventLog(client=fakeredis.FakeRedis(decode_responses=True)),
+            order_sink=self.requests.append, clock=lambda: self.now,
+            recorder=LatencyRecorder('test', client=fakeredis.FakeRedis(decode_responses=True)),
+        )
+
+    def _runner(self, live_id, strategy, timeframe='1h'):
+        feed = self.engine.get_feed('binance', 'BTC/USDT', timeframe)
+        runner = LiveStrategyRunner(live_id, strategy, feed, 10000.0, identity={'exchange_account_id': 1})
+        self.engine.add_runner(runner)
+        return runner
+
+    def test_bar_feed_closes_on_next_kline_trade_or_timer(self):
+        feed = BarFeed('binance', 'BTC/USDT', '1h', 100)
+        start = 1700000000000 - 1700000000000 % self.HOUR
+        self.assertEqual(feed.update_kline(start, 1, 2, 0.5, 1.5, 10, now=start + 1000), [])
+        self.assertEqual(feed.close_time, start + self.HOUR)
+        self.assertEqual(feed.update_trade(start + 5000, 3.0, 1.0), [])
+        self.assertIsNone(feed.close_due(start + self.HOUR - 1))
+        bar = feed.close_due(start + self.HOUR)
+        self.assertEqual((bar.ts, bar.high, bar.close, bar.volume), (start + self.HOUR, 3.0, 3.0, 11.0))
+        # 已收盘的K线重复投递会被忽略，越过收盘时间的成交关闭由成交累积的K线
+        self.assertEqual(feed.update_kline(start, 1, 2, 0.5, 1.5, 10, now=start + 2 * self.HOUR), [])
+        feed.update_trade(start + self.HOUR + 10, 4.0, 1.0)
+        closed = feed.update_trade(start + 2 * self.HOUR, 5.0, 1.0)
+        self.assertEqual([b.close for b in closed], [4.0])
+        np.testing.assert_array_equal(feed.series.history('close'), [3.0, 4.0])
+
+    def test_strategies_share_indicator_nodes(self):
+        first = self._runner(1, MACrossStrategy(fast_period=2, slow_period=3))
+        self._runner(2, MACrossStrategy(fast_period=2, slow_period=4))
+        start = self.now - 10 * self.HOUR
+        self.engine.handle_events([kline_event(start + i * self.HOUR, 10 + i) for i in range(6)])
+        # sma(2) 两个策略共用，每根K线只计算一次
+        self.assertEqual(self.engine.indicators.stats(), {'sources': 1, 'nodes': 3, 'references': 4})
+        fast = self.engine.indicators.nodes[(first.feed.key, 'sma', (('field', 'close'), ('period', 2)))]
+        self.assertEqual(len(fast.values), len(first.feed.series))
+        self.assertAlmostEqual(fast.value, np.mean(first.feed.series.history('close')[-2:]))
+
+        self.engine.remove_runner(2)
+        self.assertEqual(self.engine.indicators.stats(), {'sources': 1, 'nodes': 2, 'references': 2})
+        self.engine.remove_runner(1)
+        self.assertEqual(self.engine.indicators.stats(), {'sources': 0, 'nodes': 0, 'references': 0})
+
+    def test_strategies_share_feed_and_emit_orders_on_bar_close(self):
+        fast = self._runner(1, MACrossStrategy(fast_period=2, slow_period=3))
+        slow = self._runner(2, MACrossStrategy(fast_period=2, slow_period=4))
+        self.assertIs(fast.feed, slow.feed)
+        self.assertEqual(len(self.engine.feeds), 1)
+
+        start = self.now - 10 * self.HOUR
+        closes = [10, 9, 8, 7, 8, 10, 12]
+        events = [kline_event(start + i * self.HOUR, close) for i, close in enumerate(closes)]
+        self.assertEqual(self.engine.handle_events(events), len(closes))
+        self.assertEqual(len(fast.feed.series), len(closes))
+
+        places = [r for r in self.requests if r['action'] == 'place']
+        self.assertEqual({r['live_strategy_id'] for r in places}, {1, 2})
+        request = places[0]
+        self.assertEqual(request['side'], 'buy')
+        self.assertEqual(request['exchange_account_id'], 1)
+        self.assertTrue(request['client_order_id'].startswith('ls1-'))
+
+        # 成交回报更新持仓和资金，平仓后回到策略
+        fill = self.engine.apply_fill(1, request['client_order_id'], 12.0, request['amount'], fee=0.1)
+        self.assertEqual(fill.amount, request['amount'])
+        self.assertAlmostEqual(fast.context.position('BTC/USDT').amount, request['amount'])
+        self.assertAlmostEqual(fast.context.cash, 10000.0 - 12.0 * request['amount'] - 0.1)
+        self.assertFalse(fast.context.open_orders())
+
+        stats = self.engine.stats()[1]
+        self.assertEqual(stats['bars'], len(closes))
+        self.assertEqual(stats['orders'], 1)
+        self.assertIsNotNone(stats['callback_avg_ms'])
+        self.assertIsNotNone(stats['signal_avg_ms'])
+
+    def test_execution_reports_update_orders(self):
+        runner = self._runner(1, MACrossStrategy(fast_period=2, slow_period=3))
+        start = self.now - 10 * self.HOUR
+        closes = [10, 9, 8, 7, 8, 10, 12]
+        self.engine.handle_events([kline_event(start + i * self.HOUR, close) for i, close in enumerate(closes)])
+        request = self.requests[-1]
+        cid, amount = request['client_order_id'], request['amount']
+        base = {'live_strategy_id': 1, 'client_order_id': cid, 'sent_ts': self.now - 5}
+
+        fills = self.engine.handle_reports([
+            {**base, 'type': 'ack'},
+            {**base, 'type': 'fill', 'price': 12.0, 'amount': amount / 4, 'fee': 0.01, 'ts': self.now},
+            {**base, 'live_strategy_id': 99, 'type': 'fill', 'price': 12.0, 'amount': amount},
+        ])
+        self.assertEqual(fills, 1)
+        order = runner.context.orders[cid]
+        self.assertEqual(order.status, 'partial')
+        self.assertAlmostEqual(order.filled, amount / 4)
+        self.engine.recorder.flush()
+        self.assertAlmostEqual(self.engine.recorder.snapshot()['order_ack|live:1']['sum_ms'], 5.0)
+
+        self.engine.handle_reports([{**base, 'type': 'cancelled'}])
+        self.assertEqual(order.status, 'cancelled')
+        self.assertAlmostEqual(runner.context.position('BTC/USDT').amount, amount / 4)
+
+    def test_failing_strategy_is_removed(self):
+        class Broken(BaseStrategy):
+            def on_bar(self, ctx, bar):
+                raise ValueError('boom')
+
+        self._runner(1, Broken())
+        healthy = self._runner(2, MACrossStrategy(fast_period=2, slow_period=3))
+        self.engine.handle_events([kline_event(self.now - 2 * self.HOUR, 10)])
+        self.assertEqual(list(self.engine.runners), [2])
+        self.assertEqual(self.engine._failed, {1: 'boom'})
+        self.assertEqual(healthy.stats.bars, 1)
+        self.engine.remove_runner(2)
+        self.assertEqual(self.engine.feeds, {})
+
+    def test_sandbox_callbacks_and_order_sends_run_off_event_loop(self):
+        loop_threads, callback_threads, send_threads = [], [], []
+
+        class Remote(BaseStrategy):
+            def on_bar(self, ctx, bar):
+                callback_threads.append(threading.get_ident())
+                ctx.place_order(bar.symbol, 'buy', 1.0)
+
+        def sink(request):
+            send_threads.append(threading.get_ident())
+
+        engine = StrategyEngine(
+            event_log=MarketEventLog(client=fakeredis.FakeRedis(decode_responses=True)),
+            order_sink=sink, block_ms=10, reload_interval=60,
+            recorder=LatencyRecorder('test', client=fakeredis.FakeRedis(decode_responses=True)),
+            report_channel=OrderChannel(client=fakeredis.FakeRedis(decode_responses=True)),
+        )
+        # 有会话的策略视为沙箱中的自定义策略
+        engine.add_runner(LiveStrategyRunner(
+            1, Remote(), engine.get_feed('binance', 'BTC/USDT', '1h'), 10000.0, session=MagicMock(),
+        ))
+
+        async def scenario():
+            loop_threads.append(threading.get_ident())
+            stop = asyncio.Event()
+            task = asyncio.create_task(engine.run(stop))
+            while 'binance' not in engine._known_exchanges:
+                await asyncio.sleep(0.01)
+            engine.event_log.append_many('binance', [
+                ('kline', 'BTC/USDT', kline_event(0, 10 + i).data, self.now - (3 - i) * self.HOUR) for i in range(2)
+            ])
+            while not send_threads:
+                await asyncio.sleep(0.01)
+            stop.set()
+            await task
+
+        with patch.object(StrategyEngine, 'load_changes', return_value=([], [])):
+            asyncio.run(scenario())
+        self.assertEqual(len(callback_threads), 2)
+        self.assertNotIn(loop_threads[0], callback_threads + send_threads)
+
+    def test_run_loop_closes_bars_at_candle_close(self):
+        class Recorder(BaseStrategy):
+            def on_start(self, ctx):
+                self.bars = []
+
+            def on_bar(self, ctx, bar):
+                self.bars.append((bar.ts, now_ms()))
+
+        engine = StrategyEngine(
+            event_log=MarketEventLog(client=fakeredis.FakeRedis(decode_responses=True)),
+            order_sink=self.requests.append, block_ms=10, reload_interval=60,
+            recorder=LatencyRecorder('test', client=fakeredis.FakeRedis(decode_responses=True)),
+            report_channel=OrderChannel(client=fakeredis.FakeRedis(decode_responses=True)),
+        )
+        strategy = Recorder()
+        engine.add_runner(LiveStrategyRunner(1, strategy, engine.get_feed('binance', 'BTC/USDT', '1m'), 10000.0))
+
+        async def scenario():
+            stop = asyncio.Event()
+            task = asyncio.create_task(engine.run(stop))
+            while 'binance' not in engine._known_exchanges:
+                await asyncio.sleep(0.01)
+            # 收盘时间在 300 毫秒之后的K线：定时器在收盘时刻关闭，无需等待下一条行情
+            open_ts = int(now_ms()) + 300 - 60000
+            engine.event_log.append('binance', 'kline', 'BTC/USDT', {
+                'timeframe': '1m', 'open': 1, 'high': 1, 'low': 1, 'close': 1, 'volume': 1,
+            }, open_ts)
+            await asyncio.sleep(0.6)
+            stop.set()
+            await task
+
+        with patch.object(StrategyEngine, 'load_changes', return_value=([], [])):
+            asyncio.run(scenario())
+        self.assertEqual(len(strategy.bars), 1)
+        close_ts, dispatched_at = strategy.bars[0]
+        self.assertGreaterEqual(dispatched_at, close_ts)
+        self.assertLess(dispatched_at - close_ts, 100)
@@ -3,12 +3,13 @@
 """
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import views
 
 router = DefaultRouter()
 
 # 注册视图集
 # router.register(r'strategies', StrategyViewSet)
-# router.register(r'backtests', BacktestViewSet)
+router.register(r'backtests', views.BacktestViewSet, basename='backtests')
 
 urlpatterns = [
     path('', include(router.urls)),
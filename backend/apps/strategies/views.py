@@ -0,0 +1,95 @@
+"""
+策略管理视图
+"""
+import logging
+
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from apps.core.permissions import TenantPermission
+from .models import Backtest
+from .serializers import BacktestSerializer
+from .services import BacktestService
+
+logger = logging.getLogger(__name__)
+
+# 权益曲线接口允许的最大像素宽度
+MAX_CHART_WIDTH = 10000
+
+
+def _int_param(request, name, default, minimum=0, maximum=None):
+    try:
+        value = int(request.query_params.get(name, default))
+    except (TypeError, ValueError):
+        value = default
+    value = max(minimum, value)
+    return min(value, maximum) if maximum is not None else value
+
+
+class BacktestViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                      mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """回测视图集"""
+
+    serializer_class = BacktestSerializer
+    permission_classes = [IsAuthenticated, TenantPermission]
+
+    def get_queryset(self):
+        return (
+            Backtest.objects.filter(tenant=self.request.user.tenant)
+            .select_related('strategy', 'symbol', 'artifact')
+        )
+
+    def perform_create(self, serializer):
+        """创建回测：相同请求已有结果时立即返回，否则提交异步任务"""
+        backtest = serializer.save(tenant=self.request.user.tenant)
+        BacktestService().submit(backtest)
+        backtest.refresh_from_db()
+
+    def _artifact_or_404(self, backtest):
+        if backtest.artifact is None or not BacktestService().store.exists(backtest.artifact.cache_key):
+            return None
+        return backtest.artifact
+
+    @action(detail=True, methods=['get'])
+    def equity(self, request, pk=None):
+        """权益曲线，width 为图表像素宽度，按宽度做 LTTB 降采样"""
+        backtest = self.get_object()
+        artifact = self._artifact_or_404(backtest)
+        if artifact is None:
+            return Response({'error': '回测结果不存在'}, status=status.HTTP_404_NOT_FOUND)
+        width = _int_param(request, 'width', 1000, minimum=3, maximum=MAX_CHART_WIDTH)
+        try:
+            points = BacktestService().store.equity_curve(artifact.cache_key, width)
+            return Response({'points': points, 'total': artifact.bars})
+        except Exception as e:
+            logger.error(f"读取权益曲线失败: {e}")
+            return Response({'error': '读取权益曲线失败'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def _columns_page(self, request, backtest, loader_name, total_field):
+        artifact = self._artifact_or_404(backtest)
+        if artifact is None:
+            return Response({'error': '回测结果不存在'}, status=status.HTTP_404_NOT_FOUND)
+        offset = _int_param(request, 'offset', 0)
+        limit = _int_param(request, 'limit', 100, minimum=1, maximum=1000)
+        try:
+            columns = getattr(BacktestService().store, loader_name)(artifact.cache_key)
+            rows = [
+                {name: values[i].item() for name, values in columns.items()}
+                for i in range(offset, min(offset + limit, getattr(artifact, total_field)))
+            ]
+            return Response({'results': rows, 'total': getattr(artifact, total_field), 'offset': offset})
+        except Exception as e:
+            logger.error(f"读取回测明细失败: {e}")
+            return Response({'error': '读取回测明细失败'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=True, methods=['get'])
+    def trades(self, request, pk=None):
+        """交易明细（offset / limit 分页）"""
+        return self._columns_page(request, self.get_object(), 'load_trades', 'trades')
+
+    @action(detail=True, methods=['get'])
+    def fills(self, request, pk=None):
+        """成交明细（事件驱动回测，offset / limit 分页）"""
+        return self._columns_page(request, self.get_object(), 'load_fills', 'fills')
@@ -0,0 +1,241 @@
+"""
+滚动前推（walk-forward）分析
+
+把历史数据切分为依次向后滚动的训练/测试窗口：在每个训练窗口上优化参数，
+用最优参数回测紧随其后的测试窗口，最后把各测试窗口的样本外收益拼接为一条权益曲线。
+
+- 信号生成器只使用历史数据（因果），在全段数据上计算一次信号后按窗口切片，
+  与在窗口数据上单独计算完全一致，而且窗口开头的指标已经用前面的数据完成预热；
+- 因此以候选参数为并行单位：每个候选只计算一次信号，然后依次回测所有训练和测试窗口，
+  窗口之间重叠部分的指标计算只做一次；
+- 候选分发复用参数优化的进程池和共享内存（CandidatePool）。
+"""
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from .backtest import (
+    BacktestError, BacktestResult, compute_metrics, get_signal_generator, periods_per_year,
+    run_vectorized_backtest,
+)
+from .optimization import OBJECTIVES, RESULT_METRICS, CandidatePool, objective_score
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WalkForwardWindow:
+    """训练/测试窗口（K线下标，左闭右开）"""
+    index: int
+    train_start: int
+    train_end: int
+    test_start: int
+    test_end: int
+
+    def as_tuple(self):
+        return self.train_start, self.train_end, self.test_start, self.test_end
+
+
+def walk_forward_windows(total_bars: int, train_bars: int, test_bars: int,
+                         anchored: bool = False) -> List[WalkForwardWindow]:
+    """
+    生成滚动窗口
+
+    测试窗口首尾相接、互不重叠，最后一个测试窗口可以不足 test_bars。
+    anchored 为 True 时训练窗口起点固定在数据开头（扩张窗口）。
+    """
+    if train_bars < 2 or test_bars < 2:
+        raise BacktestError('训练和测试窗口至少需要 2 根K线')
+    windows = []
+    test_start = train_bars
+    while total_bars - test_start >= 2:
+        windows.append(WalkForwardWindow(
+            index=len(windows),
+            train_start=0 if anchored else test_start - train_bars,
+            train_end=test_start,
+            test_start=test_start,
+            test_end=min(test_start + test_bars, total_bars),
+        ))
+        test_start += test_bars
+    if not windows:
+        raise BacktestError(f'K线数量不足: 需要至少 {train_bars + 2} 根，实际 {total_bars} 根')
+    return windows
+
+
+def _slice_backtest(data: Dict[str, np.ndarray], signal: np.ndarray, start: int, end: int,
+                    config: Dict[str, Any]) -> BacktestResult:
+    window = {name: values[start:end] for name, values in data.items()}
+    return run_vectorized_backtest(
+        window, signal[start:end],
+        initial_capital=config['initial_capital'],
+        fee_rate=config['fee_rate'],
+        slippage=config['slippage'],
+        timeframe=config['timeframe'],
+    )
+
+
+def evaluate_windows(data: Dict[str, np.ndarray], strategy_type: str, params: Dict[str, Any],
+                     config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    在全部窗口上评估单个候选：信号只计算一次，训练窗口只返回目标评分，测试窗口返回指标
+
+    CandidatePool 的评估函数，config['windows'] 为 (训练起, 训练止, 测试起, 测试止) 列表。
+    """
+    generator = get_signal_generator(strategy_type)
+    objective = config['objective']
+    try:
+        signal = generator(data, **params)
+        train_scores, test_metrics = [], []
+        for train_start, train_end, test_start, test_end in config['windows']:
+            train = _slice_backtest(data, signal, train_start, train_end, config)
+            train_scores.append(objective_score(objective, train.metrics))
+            test = _slice_backtest(data, signal, test_start, test_end, config)
+            test_metrics.append({name: test.metrics.get(name) for name in RESULT_METRICS})
+    except (TypeError, ValueError, ArithmeticError, BacktestError) as e:
+        return {'parameters': params, 'error': str(e)}
+    return {'parameters': params, 'train_scores': train_scores, 'test_metrics': test_metrics}
+
+
+def _stitch(results: List[BacktestResult], initial_capital: float) -> BacktestResult:
+    """按收益率拼接各测试窗口，资金在窗口之间延续"""
+    returns = np.concatenate([r.returns for r in results])
+    offsets = np.cumsum([0] + [len(r.returns) for r in results[:-1]])
+    trades = {
+        name: np.concatenate([
+            r.trades[name] + offset if name in ('entry_index', 'exit_index') else r.trades[name]
+            for r, offset in zip(results, offsets)
+        ])
+        for name in results[0].trades
+    }
+    return BacktestResult(
+        timestamps=np.concatenate([r.timestamps for r in results]),
+        equity=initial_capital * np.cumprod(1.0 + returns),
+        positions=np.concatenate([r.positions for r in results]),
+        returns=returns,
+        trades=trades,
+    )
+
+
+class WalkForwardAnalyzer:
+    """
+    滚动前推分析器
+
+    用法：
+        analyzer = WalkForwardAnalyzer('ma_cross', kline_arrays, '1h', train_bars=2000, test_bars=500)
+        report = analyzer.run(build_candidates({'fast_period': [5, 10, 20], 'slow_period': [50, 100]}))
+    """
+
+    def __init__(self, strategy_type: str, data: Dict[str, np.ndarray], timeframe: str,
+                 train_bars: int, test_bars: int, anchored: bool = False,
+                 initial_capital: float = 10000.0, fee_rate: float = 0.001, slippage: float = 0.0005,
+                 objective: str = 'sharpe_ratio', workers: Optional[int] = None,
+                 base_parameters: Optional[Dict[str, Any]] = None):
+        if objective not in OBJECTIVES:
+            raise BacktestError(f'不支持的优化目标: {objective}')
+        get_signal_generator(strategy_type)
+        self.strategy_type = strategy_type
+        self.data = data
+        self.timeframe = timeframe
+        self.objective = objective
+        self.workers = workers or os.cpu_count() or 1
+        self.base_parameters = base_parameters or {}
+        self.windows = walk_forward_windows(len(data['close']), train_bars, test_bars, anchored)
+        self.config = {
+            'initial_capital': float(initial_capital),
+            'fee_rate': float(fee_rate),
+            'slippage': float(slippage),
+            'timeframe': timeframe,
+            'objective': objective,
+            'windows': [window.as_tuple() for window in self.windows],
+        }
+
+    def run(self, candidates: List[Dict[str, Any]],
+            on_progress: Optional[Callable[[int, int], None]] = None,
+            progress_interval: float = 1.0) -> Dict[str, Any]:
+        """
+        执行分析
+
+        Args:
+            candidates: 每个训练窗口上参与优化的候选参数组合
+            on_progress: 进度回调 (已完成候选数, 候选总数)，最多每 progress_interval 秒一次
+
+        Returns:
+            {'windows': 各窗口的最优参数与样本内外表现, 'result': 拼接的样本外 BacktestResult,
+             'metrics': 样本外指标, 'evaluated', 'failed', 'elapsed'}
+        """
+        if not candidates:
+            raise BacktestError('没有候选参数组合')
+        count = len(self.windows)
+        best_scores: List[Optional[float]] = [None] * count
+        best: List[Optional[Dict[str, Any]]] = [None] * count
+        done = failed = 0
+        started = last_report = time.perf_counter()
+
+        params_list = [{**self.base_parameters, **params} for params in candidates]
+        with CandidatePool(self.strategy_type, self.data, self.config, self.workers, evaluate_windows) as pool:
+            for index, result in pool.map(params_list):
+                done += 1
+                if 'error' in result:
+                    failed += 1
+                else:
+                    for w, score in enumerate(result['train_scores']):
+                        # 评分相同时取候选列表中靠前的，结果与完成顺序无关
+                        if score is not None and (best_scores[w] is None or score > best_scores[w]
+                                                  or (score == best_scores[w] and index < best[w]['index'])):
+                            best_scores[w] = score
+                            best[w] = {'index': index, 'test_metrics': result['test_metrics'][w]}
+                now = time.perf_counter()
+                if on_progress and now - last_report >= progress_interval:
+                    on_progress(done, len(candidates))
+                    last_report = now
+
+        if any(choice is None for choice in best):
+            raise BacktestError('存在没有有效候选参数的训练窗口')
+
+        # 用各窗口的最优参数重新回测测试窗口，得到完整的样本外收益序列
+        timestamps = self.data['timestamp']
+        segments, windows = [], []
+        signals: Dict[int, np.ndarray] = {}
+        generator = get_signal_generator(self.strategy_type)
+        for window, choice, score in zip(self.windows, best, best_scores):
+            index = choice['index']
+            if index not in signals:
+                signals[index] = generator(self.data, **params_list[index])
+            segments.append(_slice_backtest(self.data, signals[index], window.test_start, window.test_end, self.config))
+            windows.append({
+                'index': window.index,
+                'train_start': int(timestamps[window.train_start]),
+                'train_end': int(timestamps[window.train_end - 1]),
+                'test_start': int(timestamps[window.test_start]),
+                'test_end': int(timestamps[window.test_end - 1]),
+                'parameters': params_list[index],
+                'train_score': score,
+                'test_metrics': choice['test_metrics'],
+            })
+
+        result = _stitch(segments, self.config['initial_capital'])
+        result.metrics = compute_metrics(result, self.config['initial_capital'], periods_per_year(self.timeframe))
+        train_scores = [w['train_score'] for w in windows]
+        test_scores = [objective_score(self.objective, w['test_metrics']) for w in windows]
+        test_scores = [score for score in test_scores if score is not None]
+        result.metrics['windows'] = count
+        result.metrics['profitable_windows'] = sum(1 for w in windows if (w['test_metrics']['total_return'] or 0) > 0)
+        result.metrics['mean_train_score'] = round(float(np.mean(train_scores)), 6)
+        result.metrics['mean_test_score'] = round(float(np.mean(test_scores)), 6) if test_scores else None
+
+        if on_progress:
+            on_progress(done, len(candidates))
+        elapsed = time.perf_counter() - started
+        logger.info(f"滚动前推分析完成: {count}个窗口, {len(candidates)}个候选, {elapsed:.2f}s")
+        return {
+            'windows': windows,
+            'result': result,
+            'metrics': result.metrics,
+            'evaluated': done,
+            'failed': failed,
+            'elapsed': round(elapsed, 3),
+        }
@@ -0,0 +1,402 @@
+"""
+交易账户增量同步
+
+以前 sync_exchange_data 是空任务，逐账户全量下载订单历史在几百个账户时不可行。
+本模块在一个 asyncio 事件循环中并发同步多个账户，每个账户只拉取变化：
+
+- 余额：每次拉取一次，与同步开始时从数据库读取的余额比较，只写入变化的资产；
+- 成交：按账户和交易对的游标（AccountSyncState.trade_cursors）只拉取游标之后的成交，
+  用于发现在同步间隔内成交、已经不在挂单列表中的订单；
+- 订单：拉取当前挂单；本地未结束、但已不在挂单列表中的订单单独查询一次最终状态；
+  平台之外下的订单（手工下单等）以确定的订单号登记，之后同样增量更新。
+
+订单状态统一通过 OrderStore.apply_exchange_order 按累计成交校正，与订单网关推送的成交使用相同的成交ID，
+不会重复入库。同一交易所的请求共用一个令牌桶，市场信息每个交易所只加载一次。
+数据库只在同步开始（读取游标和本地状态）和结束（批量写入全部变化）时访问。
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .gateway import AsyncRateLimiter, create_async_exchange
+from .orders import OrderState, OrderStore, make_client_order_id
+from .simulator import paper_trading_enabled
+
+logger = logging.getLogger(__name__)
+
+# 交易所支持不指定交易对查询成交时使用的游标键
+ALL_SYMBOLS = '*'
+
+
+@dataclass
+class AccountContext:
+    """同步开始时从数据库读取的账户状态"""
+    account: Any
+    cursors: Dict[str, int]
+    active_orders: List[OrderState]
+    symbols: Set[str]
+
+
+@dataclass
+class AccountSnapshot:
+    """一次同步从交易所取回的数据"""
+    account: Any
+    balances: Optional[Dict[str, Tuple[float, float, float]]] = None
+    orders: List[Tuple[str, Dict[str, Any]]] = field(default_factory=list)   # (本地订单号, 交易所订单)
+    external_orders: List[Dict[str, Any]] = field(default_factory=list)
+    cursors: Optional[Dict[str, int]] = None
+    trades: int = 0
+    requests: int = 0
+    elapsed_ms: float = 0.0
+    error: str = ''
+
+
+class AccountSyncer:
+    """
+    账户同步器
+
+    用法：
+        AccountSyncer().sync()              # 全部启用的账户
+        AccountSyncer().sync([account_id])  # 指定账户
+
+    同一个同步器可以反复使用，市场信息保存在实例中。余额和订单状态每次同步从数据库重新读取，
+    多个 worker 进程各有同步器时，不会因为进程内的旧数据跳过写入或覆盖其他进程的写入。
+    """
+
+    def __init__(self, exchange_factory: Optional[Callable[[Any], Any]] = None,
+                 concurrency: Optional[int] = None, burst: Optional[int] = None,
+                 page_size: Optional[int] = None, overlap_ms: Optional[int] = None,
+                 lookback_ms: Optional[int] = None, markets_ttl: Optional[float] = None, paper: bool = False):
+        self.exchange_factory = exchange_factory or create_async_exchange
+        self.concurrency = concurrency or getattr(settings, 'ACCOUNT_SYNC_CONCURRENCY', 20)
+        self.burst = burst or getattr(settings, 'ACCOUNT_SYNC_BURST', 5)
+        self.page_size = page_size or getattr(settings, 'ACCOUNT_SYNC_PAGE_SIZE', 500)
+        self.overlap_ms = overlap_ms if overlap_ms is not None else getattr(settings, 'ACCOUNT_SYNC_OVERLAP_MS', 5000)
+        self.lookback_ms = lookback_ms or getattr(settings, 'ACCOUNT_SYNC_LOOKBACK_MS', 86400000)
+        self.markets_ttl = markets_ttl if markets_ttl is not None else getattr(settings, 'EXCHANGE_MARKETS_TTL', 3600)
+        # 模拟盘账户的余额和订单在订单网关进程的模拟交易所中，由网关中的同步器（paper=True）同步
+        self.paper = paper
+
+        self.order_store = OrderStore()
+        # 本次同步的账户余额：账户ID -> {资产: (主键, 可用, 冻结, 总额)}
+        self._balances: Dict[int, Dict[str, Tuple[Optional[int], float, float, float]]] = {}
+        self._limiters: Dict[Tuple[str, bool], AsyncRateLimiter] = {}
+        self._markets: Dict[Tuple[str, bool], Tuple[float, dict, Optional[dict]]] = {}
+        self._market_locks: Dict[Tuple[str, bool], asyncio.Lock] = {}
+        self._needs_symbol: Set[str] = set()
+
+    def sync(self, account_ids: Optional[List[int]] = None) -> Dict[int, Dict[str, Any]]:
+        """同步账户，返回每个账户的统计"""
+        return asyncio.run(self.run(account_ids))
+
+    async def run(self, account_ids: Optional[List[int]] = None) -> Dict[int, Dict[str, Any]]:
+        contexts = await asyncio.to_thread(self.load, account_ids)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # 每次运行都是新的事件循环，锁和限速器重新创建
+        self._market_locks = {}
+        self._limiters = {}
+
+        async def fetch(context: AccountContext) -> AccountSnapshot:
+            async with semaphore:
+                return await self.fetch(context)
+
+        snapshots = await asyncio.gather(*(fetch(context) for context in contexts))
+        return await asyncio.to_thread(self.apply, snapshots)
+
+    # -- 读取本地状态 ----------------------------------------------------------
+
+    def load(self, account_ids: Optional[List[int]] = None) -> List[AccountContext]:
+        from apps.strategies.models import LiveStrategy
+        from .models import AccountBalance, AccountSyncState, ExchangeAccount
+
+        accounts = ExchangeAccount.all_objects.filter(is_active=True)
+        if account_ids is not None:
+            accounts = accounts.filter(pk__in=account_ids)
+        if self.paper:
+            accounts = accounts.filter(is_testnet=True)
+        elif paper_trading_enabled():
+            accounts = accounts.filter(is_testnet=False)
+        accounts = list(accounts)
+        ids = [account.pk for account in accounts]
+
+        cursors = dict(AccountSyncState.all_objects.filter(exchange_account_id__in=ids).values_list(
+            'exchange_account_id', 'trade_cursors'))
+        self._balances = {pk: {} for pk in ids}
+        for balance in AccountBalance.all_objects.filter(exchange_account_id__in=ids):
+            self._balances[balance.exchange_account_id][balance.asset] = (
+                balance.pk, float(balance.free), float(balance.used), float(balance.total),
+            )
+
+        # 订单状态每次从数据库重新读取，订单网关在两次同步之间的更新不会被旧状态覆盖
+        self.order_store = OrderStore()
+        self.order_store.load(active_only=True, exchange_account_ids=ids)
+        active: Dict[int, List[OrderState]] = {pk: [] for pk in ids}
+        for state in list(self.order_store.orders.values()):
+            if state.is_active and state.exchange_account_id in active:
+                active[state.exchange_account_id].append(state)
+
+        symbols: Dict[int, Set[str]] = {pk: set() for pk in ids}
+        for account_id, symbol in LiveStrategy.all_objects.filter(
+                exchange_account_id__in=ids, status='running').values_list('exchange_account_id', 'symbol__symbol'):
+            symbols[account_id].add(symbol)
+        for pk, states in active.items():
+            symbols[pk].update(state.symbol for state in states)
+
+        return [
+            AccountContext(account, dict(cursors.get(account.pk) or {}), active[account.pk], symbols[account.pk])
+            for account in accounts
+        ]
+
+    def known_orders(self, account_id: int, exchange_order_ids: List[str]) -> Dict[str, str]:
+        """已登记的订单：交易所订单号 -> 本地订单号"""
+        from .models import Order
+
+        return dict(Order.all_objects.filter(
+            exchange_account_id=account_id, exchange_order_id__in=exchange_order_ids,
+        ).values_list('exchange_order_id', 'client_order_id'))
+
+    # -- 拉取交易所数据 --------------------------------------------------------
+
+    def _limiter(self, account, exchange) -> AsyncRateLimiter:
+        key = (account.exchange, account.is_testnet)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = self._limiters[key] = AsyncRateLimiter(getattr(exchange, 'rateLimit', 0) or 0, self.burst)
+        return limiter
+
+    async def _prepare_markets(self, account, exchange, call):
+        """同一交易所的账户共用一份市场信息"""
+        key = (account.exchange, account.is_testnet)
+        lock = self._market_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            cached = self._markets.get(key)
+            if cached is None or time.monotonic() - cached[0] > self.markets_ttl:
+                await call('load_markets')
+                cached = self._markets[key] = (time.monotonic(), exchange.markets, exchange.currencies)
+        exchange.set_markets(cached[1], cached[2])
+
+    async def fetch(self, context: AccountContext) -> AccountSnapshot:
+        import ccxt
+
+        account = context.account
+        snapshot = AccountSnapshot(account)
+        started = time.perf_counter()
+        exchange = self.exchange_factory(account)
+        limiter = self._limiter(account, exchange)
+
+        async def call(method: str, *args, **kwargs):
+            await limiter.acquire()
+            snapshot.requests += 1
+            return await getattr(exchange, method)(*args, **kwargs)
+
+        try:
+            await self._prepare_markets(account, exchange, call)
+            balance = await call('fetch_balance')
+            snapshot.balances = {
+                asset: (float((balance.get('free') or {}).get(asset) or 0.0),
+                        float((balance.get('used') or {}).get(asset) or 0.0),
+                        float(total or 0.0))
+                for asset, total in (balance.get('total') or {}).items()
+            }
+
+            by_client_id = {state.client_order_id: state for state in context.active_orders}
+            by_exchange_id = {state.exchange_order_id: state for state in context.active_orders
+                              if state.exchange_order_id}
+            seen = set()
+            exchange.options['warnOnFetchOpenOrdersWithoutSymbol'] = False
+            for order in await call('fetch_open_orders'):
+                state = by_client_id.get(order.get('clientOrderId')) or by_exchange_id.get(str(order.get('id')))
+                if state is not None:
+                    seen.add(state.client_order_id)
+                    snapshot.orders.append((state.client_order_id, order))
+                else:
+                    snapshot.external_orders.append(order)
+            open_ids = {str(order.get('id')) for order in snapshot.external_orders}
+
+            # 本地未结束、已不在挂单列表中的订单：查询最终状态
+            for state in context.active_orders:
+                if state.client_order_id not in seen and state.exchange_order_id:
+                    try:
+                        order = await call('fetch_order', state.exchange_order_id, state.symbol)
+                    except ccxt.OrderNotFound:
+                        continue
+                    snapshot.orders.append((state.client_order_id, order))
+
+            trades, snapshot.cursors = await self._fetch_trades(context, exchange, call, snapshot.balances)
+            snapshot.trades = len(trades)
+
+            # 成交中出现的陌生订单：平台之外下的订单
+            order_symbols = {}
+            for trade in trades:
+                order_id = trade.get('order')
+                if order_id and str(order_id) not in by_exchange_id and str(order_id) not in open_ids:
+                    order_symbols[str(order_id)] = trade.get('symbol')
+            if order_symbols:
+                known = await asyncio.to_thread(self.known_orders, account.pk, list(order_symbols))
+                for order_id, symbol in order_symbols.items():
+                    if order_id not in known:
+                        snapshot.external_orders.append(await call('fetch_order', order_id, symbol))
+        except Exception as e:
+            snapshot.error = str(e)[:2000]
+            logger.warning(f"账户同步失败 {account.exchange}#{account.pk}: {e}")
+        finally:
+            try:
+                await exchange.close()
+            except Exception:
+                pass
+            snapshot.elapsed_ms = (time.perf_counter() - started) * 1000
+        return snapshot
+
+    async def _fetch_trades(self, context: AccountContext, exchange, call,
+                            balances: Dict[str, Tuple[float, float, float]]) -> Tuple[List[dict], Dict[str, int]]:
+        """按游标拉取成交，返回 (成交, 新游标)"""
+        import ccxt
+
+        cursors = dict(context.cursors)
+        start = int(time.time() * 1000) - self.lookback_ms
+        trades: List[dict] = []
+
+        if exchange.id not in self._needs_symbol and exchange.has.get('fetchMyTrades'):
+            try:
+                page = await self._fetch_since(call, None, cursors.get(ALL_SYMBOLS, start))
+            except ccxt.ArgumentsRequired:
+                self._needs_symbol.add(exchange.id)
+            else:
+                trades.extend(page)
+                cursors[ALL_SYMBOLS] = max([cursors.get(ALL_SYMBOLS, start)] + [t['timestamp'] for t in page])
+                return trades, cursors
+
+        # 需要指定交易对：游标中已有的、挂单和实盘策略的，以及持有资产对应的 USDT 交易对
+        symbols = {symbol for symbol in cursors if symbol != ALL_SYMBOLS} | context.symbols
+        for asset, (_, _, total) in balances.items():
+            symbol = f"{asset}/USDT"
+            if total and symbol in (exchange.markets or {}):
+                symbols.add(symbol)
+        for symbol in sorted(symbols):
+            page = await self._fetch_since(call, symbol, cursors.get(symbol, start))
+            trades.extend(page)
+            cursors[symbol] = max([cursors.get(symbol, start)] + [t['timestamp'] for t in page])
+        return trades, cursors
+
+    async def _fetch_since(self, call, symbol: Optional[str], cursor: int) -> List[dict]:
+        """分页拉取游标之后的成交（向前重叠 overlap_ms，防止交易所延迟入库的成交被跳过）"""
+        since = max(int(cursor) - self.overlap_ms, 0)
+        trades: Dict[str, dict] = {}
+        while True:
+            page = await call('fetch_my_trades', symbol, since, self.page_size)
+            new = [trade for trade in page if str(trade.get('id')) not in trades]
+            for trade in new:
+                trades[str(trade.get('id'))] = trade
+            if len(page) < self.page_size or not new:
+                break
+            since = max(trade['timestamp'] for trade in page)
+        return list(trades.values())
+
+    # -- 写入变化 --------------------------------------------------------------
+
+    def _external_request(self, account, order: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'client_order_id': make_client_order_id('ext', account.pk, order['id']),
+            'exchange_account_id': account.pk,
+            'tenant_id': account.tenant_id,
+            'symbol': order['symbol'],
+            'side': order['side'],
+            'order_type': order.get('type') if order.get('type') in ('market', 'limit') else 'limit',
+            'amount': order.get('amount') or order.get('filled') or 0.0,
+            'price': order.get('price'),
+            'tag': 'external',
+        }
+
+    def apply(self, snapshots: List[AccountSnapshot]) -> Dict[int, Dict[str, Any]]:
+        """把全部账户的变化批量写入数据库"""
+        from .models import AccountBalance, AccountSyncState
+
+        now = timezone.now()
+        new_balances, changed_balances = [], []
+        results = {}
+        store = self.order_store
+        for snapshot in snapshots:
+            account = snapshot.account
+            balance_changes = orders_updated = 0
+            if snapshot.balances is not None:
+                cached = self._balances.setdefault(account.pk, {})
+                current = dict(snapshot.balances)
+                for asset, (pk, free, used, total) in cached.items():
+                    if asset not in current and (free or used or total):
+                        current[asset] = (0.0, 0.0, 0.0)
+                for asset, (free, used, total) in current.items():
+                    previous = cached.get(asset)
+                    if previous is not None and all(abs(a - b) <= 1e-12 for a, b in zip(previous[1:], (free, used, total))):
+                        continue
+                    if previous is None and not (free or used or total):
+                        continue
+                    balance_changes += 1
+                    row = AccountBalance(
+                        tenant_id=account.tenant_id, exchange_account_id=account.pk, asset=asset,
+                        free=free, used=used, total=total, updated_at=now,
+                    )
+                    if previous is None:
+                        new_balances.append(row)
+                    else:
+                        row.pk = previous[0]
+                        changed_balances.append(row)
+
+            for client_order_id, order in snapshot.orders:
+                orders_updated += store.apply_exchange_order(client_order_id, order)
+            for order in snapshot.external_orders:
+                state, created = store.create(self._external_request(account, order))
+                orders_updated += store.apply_exchange_order(state.client_order_id, order) or created
+
+            results[account.pk] = {
+                'requests': snapshot.requests,
+                'balances_changed': balance_changes,
+                'orders_updated': int(orders_updated),
+                'external_orders': len(snapshot.external_orders),
+                'trades': snapshot.trades,
+                'elapsed_ms': round(snapshot.elapsed_ms, 1),
+                'error': snapshot.error,
+            }
+
+        states = {state.exchange_account_id: state for state in AccountSyncState.all_objects.filter(
+            exchange_account_id__in=[snapshot.account.pk for snapshot in snapshots])}
+        new_states, changed_states = [], []
+        for snapshot in snapshots:
+            account = snapshot.account
+            state = states.get(account.pk)
+            if state is None:
+                state = AccountSyncState(tenant_id=account.tenant_id, exchange_account_id=account.pk)
+                new_states.append(state)
+            else:
+                changed_states.append(state)
+            if snapshot.cursors is not None:
+                state.trade_cursors = snapshot.cursors
+            state.last_synced_at = now
+            state.last_error = snapshot.error
+            state.stats = results[account.pk]
+            state.updated_at = now
+
+        with transaction.atomic():
+            AccountBalance.all_objects.bulk_create(new_balances)
+            AccountBalance.all_objects.bulk_update(changed_balances, ['free', 'used', 'total', 'updated_at'])
+            AccountSyncState.all_objects.bulk_create(new_states)
+            AccountSyncState.all_objects.bulk_update(
+                changed_states, ['trade_cursors', 'last_synced_at', 'last_error', 'stats', 'updated_at'])
+            store.flush()
+        return results
+
+
+_syncer: Optional[AccountSyncer] = None
+
+
+def get_account_syncer() -> AccountSyncer:
+    """获取进程内共享的账户同步器（保留市场信息）"""
+    global _syncer
+    if _syncer is None:
+        _syncer = AccountSyncer()
+    return _syncer
@@ -0,0 +1,1158 @@
+"""
+算法执行
+
+常驻的 asyncio 进程（run_algo_engine 命令）把算法单（母单）拆分为子单，经订单网关执行：
+
+- TWAP：[开始, 结束] 等分为 slices 个时间片，每片把累计下单量补到 总量 × 已过片数 / slices；
+- VWAP：时间片相同，累计目标按历史同时段的成交量分布（volume profile）分配；
+- 冰山：始终只挂出 display_amount 的限价单，成交完再挂下一笔；
+- 智能路由（SOR）：按各交易所缓存的订单簿，把订单拆分到租户的多个账户，以 IOC 限价单立即成交（router.py）。
+
+子单定价使用市场事件日志中最新的 ticker / orderbook（新交易对由 Ticker、OrderBook 表预热）。
+TWAP/VWAP 的 style='market' 发市价单；style='passive' 按买一/卖一挂限价单，
+下一个时间片撤掉未成交部分，撤单回报到达后补到新的目标。行情越过 limit_price 时跳过本片，数量顺延。
+计划结束后，未成交的余量在 sweep=True 时以市价补齐。
+
+所有算法单共用一个哈希时间轮（TimerWheel），添加、取消定时器都是 O(1)，
+单个进程可以同时运行数千个算法单。子单回报写入引擎自己的回报流。
+"""
+import asyncio
+import logging
+import math
+import random
+import socket
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from apps.monitoring.latency import now_ms
+
+from .gateway import (
+    REPORT_ACK, REPORT_CANCELLED, REPORT_FILL, REPORT_REJECTED, OrderChannel, report_stream,
+)
+from .orders import ACTIVE_STATUSES, ORDER_CANCELLED, ORDER_NEW, ORDER_REJECTED, ORDER_SUBMITTED, make_client_order_id
+from .router import Route, Venue, book_levels, load_venues, route_order
+
+logger = logging.getLogger(__name__)
+
+# 市场事件日志中算法引擎使用的消费者组
+ALGO_GROUP = 'algo-engine'
+
+ALGO_PENDING = 'pending'
+ALGO_RUNNING = 'running'
+ALGO_CANCELLING = 'cancelling'
+ALGO_COMPLETED = 'completed'
+ALGO_CANCELLED = 'cancelled'
+ALGO_FAILED = 'failed'
+
+LIVE_STATUSES = (ALGO_PENDING, ALGO_RUNNING, ALGO_CANCELLING)
+FINISHED_STATUSES = (ALGO_COMPLETED, ALGO_CANCELLED, ALGO_FAILED)
+
+EPS = 1e-12
+
+
+class AlgoError(Exception):
+    """算法单参数无效"""
+    pass
+
+
+class TimerWheel:
+    """
+    哈希时间轮
+
+    时间按 tick_ms 划分为刻度，定时器放入 到期刻度 % 槽数 的槽中，超过一圈的定时器留在槽里，
+    转到对应的那一圈才到期。每个 key 最多一个定时器，添加和取消都是字典操作；
+    advance 每经过一个刻度只检查一个槽，与定时器总数无关。
+    """
+
+    def __init__(self, tick_ms: float = 100, slots: int = 1024, now: float = 0.0):
+        self.tick_ms = tick_ms
+        self._slots: List[Dict[Hashable, int]] = [{} for _ in range(slots)]
+        self._deadlines: Dict[Hashable, int] = {}  # key -> 到期刻度
+        self._tick = int(now // tick_ms)
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key) -> bool:
+        return key in self._deadlines
+
+    def schedule(self, key: Hashable, deadline: float):
+        """设置 key 的定时器（替换已有的），deadline 为毫秒时间戳，不早于下一个刻度到期"""
+        self.cancel(key)
+        tick = max(math.ceil(deadline / self.tick_ms), self._tick + 1)
+        self._deadlines[key] = tick
+        self._slots[tick % len(self._slots)][key] = tick
+
+    def cancel(self, key: Hashable) -> bool:
+        tick = self._deadlines.pop(key, None)
+        if tick is None:
+            return False
+        del self._slots[tick % len(self._slots)][key]
+        return True
+
+    def advance(self, now: float) -> List[Hashable]:
+        """转到 now，返回到期的 key（按到期时间排序）"""
+        target = int(now // self.tick_ms)
+        if target <= self._tick:
+            return []
+        count = len(self._slots)
+        expired = []
+        # 跨过一整圈时每个槽只需检查一次
+        for tick in range(self._tick + 1, min(target, self._tick + count) + 1):
+            slot = self._slots[tick % count]
+            if not slot:
+                continue
+            due = [(deadline, key) for key, deadline in slot.items() if deadline <= target]
+            for deadline, key in due:
+                del slot[key]
+                del self._deadlines[key]
+            expired.extend(due)
+        self._tick = target
+        expired.sort(key=lambda item: item[0])
+        return [key for _, key in expired]
+
+
+@dataclass
+class Quote:
+    """交易对的最新报价"""
+    bid: Optional[float] = None
+    ask: Optional[float] = None
+    last: Optional[float] = None
+    ts: float = 0.0
+    # orderbook 事件的前 depth 档 (价格, 数量)，供智能路由使用
+    bids: Tuple[Tuple[float, float], ...] = ()
+    asks: Tuple[Tuple[float, float], ...] = ()
+    book_ts: float = 0.0
+
+    @property
+    def mid(self) -> Optional[float]:
+        """买一卖一的中间价，缺少一侧时为最新价"""
+        if self.bid and self.ask:
+            return (self.bid + self.ask) / 2
+        return self.last
+
+
+class MarketState:
+    """由市场事件维护的最新报价和订单簿前几档"""
+
+    def __init__(self, depth: Optional[int] = None):
+        self.quotes: Dict[Tuple[str, str], Quote] = {}
+        self.depth = depth or getattr(settings, 'ROUTER_BOOK_DEPTH', 10)
+
+    def get(self, exchange: str, symbol: str) -> Optional[Quote]:
+        return self.quotes.get((exchange, symbol))
+
+    def update(self, exchange: str, symbol: str, bid=None, ask=None, last=None, ts: float = 0.0):
+        quote = self.quotes.get((exchange, symbol))
+        if quote is None:
+            quote = self.quotes[(exchange, symbol)] = Quote()
+        elif ts and ts < quote.ts:
+            return
+        if bid:
+            quote.bid = float(bid)
+        if ask:
+            quote.ask = float(ask)
+        if last:
+            quote.last = float(last)
+        quote.ts = ts or quote.ts
+
+    def update_book(self, exchange: str, symbol: str, bids, asks, ts: float = 0.0):
+        quote = self.quotes.get((exchange, symbol))
+        if quote is None:
+            quote = self.quotes[(exchange, symbol)] = Quote()
+        elif ts and ts < quote.book_ts:
+            return
+        depth = self.depth
+        quote.bids = tuple((float(level[0]), float(level[1])) for level in bids[:depth])
+        quote.asks = tuple((float(level[0]), float(level[1])) for level in asks[:depth])
+        quote.book_ts = ts or quote.book_ts
+
+    def apply_event(self, event):
+        data = event.data
+        ts = event.timestamp or 0
+        if event.event_type == 'ticker':
+            self.update(event.exchange, event.symbol, data.get('bid'), data.get('ask'), data.get('last'), ts)
+        elif event.event_type == 'orderbook':
+            bids, asks = data.get('bids') or [], data.get('asks') or []
+            self.update(
+                event.exchange, event.symbol, bids[0][0] if bids else None, asks[0][0] if asks else None, ts=ts,
+            )
+            self.update_book(event.exchange, event.symbol, bids, asks, ts)
+        elif event.event_type == 'trade':
+            self.update(event.exchange, event.symbol, last=data.get('price'), ts=ts)
+
+
+@dataclass
+class ChildOrder:
+    """算法单的子单"""
+    client_order_id: str
+    amount: float
+    price: Optional[float] = None
+    order_type: str = 'market'
+    filled: float = 0.0
+    cost: float = 0.0
+    cancelling: bool = False
+    closed: bool = False  # 交易所已结束，但可能还有成交回报没处理
+    done: bool = False
+
+    @property
+    def working(self) -> float:
+        return 0.0 if self.done else max(self.amount - self.filled, 0.0)
+
+
+class ExecutionAlgo:
+    """
+    执行算法基类
+
+    子类实现 advance：在定时器到期或子单结束时决定下一步（下单、撤单、结束），并设置 next_wakeup。
+    算法本身不做IO，只返回订单请求，由引擎发送。
+    """
+    algorithm = ''
+    prefix = ''
+
+    def __init__(self, algo_id: int, symbol: str, side: str, amount: float, identity: Dict[str, Any],
+                 limit_price: Optional[float] = None, start_ms: float = 0.0, end_ms: Optional[float] = None,
+                 parameters: Optional[Dict[str, Any]] = None):
+        parameters = parameters or {}
+        self.algo_id = algo_id
+        self.symbol = symbol
+        self.side = side
+        self.amount = float(amount)
+        self.identity = identity
+        self.limit_price = float(limit_price) if limit_price is not None else None
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.lot_size = float(parameters.get('lot_size') or 0.0)
+        self.min_amount = max(float(parameters.get('min_amount') or 0.0), self.lot_size)
+        self.max_rejects = int(parameters.get('max_rejects', 3))
+
+        self.children: Dict[str, ChildOrder] = {}
+        self.active: Dict[str, ChildOrder] = {}
+        self.seq = 0
+        self.filled = 0.0
+        self.cost = 0.0
+        self.status = ALGO_RUNNING
+        self.error = ''
+        self.next_wakeup: Optional[float] = start_ms
+        self.cancel_requested = False
+        self._rejects = 0
+
+    @property
+    def exchange(self) -> str:
+        return self.identity.get('exchange', '')
+
+    @property
+    def exchanges(self) -> Tuple[str, ...]:
+        """需要订阅行情的交易所"""
+        return (self.exchange,)
+
+    @property
+    def remaining(self) -> float:
+        return max(self.amount - self.filled, 0.0)
+
+    @property
+    def working(self) -> float:
+        return sum(child.working for child in self.active.values())
+
+    @property
+    def avg_price(self) -> float:
+        return self.cost / self.filled if self.filled > EPS else 0.0
+
+    @property
+    def is_done(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def tag(self) -> str:
+        return f'algo:{self.algo_id}'
+
+    def restore(self, seq: int, children: List[Dict[str, Any]]):
+        """由已有的子单恢复进度（重启后）"""
+        self.seq = max(self.seq, seq, len(children))
+        for data in children:
+            child = ChildOrder(
+                data['client_order_id'], float(data['amount']), data.get('price'),
+                data.get('order_type') or 'market', filled=float(data['filled']),
+                cost=float(data['filled']) * float(data.get('avg_price') or 0.0),
+            )
+            self.children[child.client_order_id] = child
+            self.filled += child.filled
+            self.cost += child.filled * float(data.get('avg_price') or 0.0)
+            if data['status'] in ACTIVE_STATUSES:
+                self.active[child.client_order_id] = child
+            else:
+                child.done = True
+
+    # -- 子单 --------------------------------------------------------------
+
+    def round_amount(self, amount: float) -> float:
+        if self.lot_size:
+            amount = math.floor(amount / self.lot_size + 1e-9) * self.lot_size
+        return round(max(amount, 0.0), 12)
+
+    def price_allowed(self, price: Optional[float]) -> bool:
+        if self.limit_price is None or price is None:
+            return True
+        return price <= self.limit_price if self.side == 'buy' else price >= self.limit_price
+
+    def quote_price(self, quote: Optional[Quote], passive: bool) -> Optional[float]:
+        """被动取同侧最优价，主动取对手价，缺失时用最新价"""
+        if quote is None:
+            return None
+        if (self.side == 'buy') == passive:
+            return quote.bid or quote.last
+        return quote.ask or quote.last
+
+    def place(self, amount: float, order_type: str = 'market', price: Optional[float] = None) -> Dict[str, Any]:
+        client_order_id = make_client_order_id(self.prefix, self.algo_id, self.seq)
+        self.seq += 1
+        child = ChildOrder(client_order_id, amount, price, order_type)
+        self.children[client_order_id] = child
+        self.active[client_order_id] = child
+        return {
+            **self.identity,
+            'action': 'place',
+            'client_order_id': client_order_id,
+            'symbol': self.symbol,
+            'side': self.side,
+            'order_type': order_type,
+            'amount': amount,
+            'price': price,
+            'tag': self.tag,
+        }
+
+    def cancel_child(self, child: ChildOrder) -> Optional[Dict[str, Any]]:
+        if child.cancelling or child.done:
+            return None
+        child.cancelling = True
+        return {**self.identity, 'action': 'cancel', 'client_order_id': child.client_order_id, 'symbol': self.symbol}
+
+    def cancel_resting(self) -> List[Dict[str, Any]]:
+        """撤掉挂单中的限价子单（市价单很快结束，不撤）"""
+        requests = []
+        for child in list(self.active.values()):
+            if child.order_type == 'limit':
+                request = self.cancel_child(child)
+                if request is not None:
+                    requests.append(request)
+        return requests
+
+    def cancel(self) -> List[Dict[str, Any]]:
+        """撤销算法单：撤掉全部子单，子单都结束后状态变为 cancelled"""
+        self.cancel_requested = True
+        self.next_wakeup = None
+        return [request for request in map(self.cancel_child, list(self.active.values())) if request]
+
+    def _close(self, child: ChildOrder):
+        child.done = True
+        self.active.pop(child.client_order_id, None)
+
+    def apply_report(self, report: Dict[str, Any]) -> bool:
+        """子单回报，返回是否属于本算法单"""
+        child = self.children.get(report.get('client_order_id'))
+        if child is None:
+            return False
+        report_type = report.get('type')
+        if report_type == REPORT_FILL:
+            cumulative = report.get('filled')
+            amount = float(report['amount']) if cumulative is None else float(cumulative) - child.filled
+            if amount > EPS:
+                child.filled += amount
+                child.cost += amount * float(report['price'])
+                self.filled += amount
+                self.cost += amount * float(report['price'])
+                self._rejects = 0
+                if child.filled >= child.amount - EPS:
+                    self._close(child)
+        elif report_type == REPORT_CANCELLED:
+            self._close(child)
+        elif report_type == REPORT_REJECTED:
+            self._close(child)
+            self._rejects += 1
+            self.error = report.get('error') or '子单被拒绝'
+        elif report_type == REPORT_ACK and report.get('status') in ('closed', 'canceled', 'cancelled', 'expired'):
+            # 同一批回报中可能还有成交，等 step 时再结束子单
+            child.closed = True
+        return True
+
+    # -- 驱动 --------------------------------------------------------------
+
+    def finish(self, status: str, error: str = ''):
+        self.status = status
+        self.next_wakeup = None
+        if error:
+            self.error = error
+
+    def step(self, now: float, quote: Optional[Quote], timer: bool = False) -> List[Dict[str, Any]]:
+        """定时器到期（timer=True）、子单回报或撤销之后推进算法，返回需要发送的订单请求"""
+        if self.is_done:
+            return []
+        for child in list(self.active.values()):
+            if child.closed:
+                self._close(child)
+        if self.cancel_requested:
+            if not self.active:
+                self.finish(ALGO_CANCELLED)
+            return []
+        if self.max_rejects and self._rejects >= self.max_rejects:
+            requests = self.cancel()
+            self.cancel_requested = False
+            if not self.active:
+                self.finish(ALGO_FAILED)
+            return requests
+        return self.advance(now, quote, timer)
+
+    def configure(self, parameters: Dict[str, Any]):
+        """读取算法自己的参数，无效时抛出 AlgoError"""
+        pass
+
+    def observe(self, market: 'MarketState') -> Optional[Quote]:
+        """推进前读取行情，默认取本交易所的报价"""
+        return market.get(self.exchange, self.symbol)
+
+    def advance(self, now: float, quote: Optional[Quote], timer: bool) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def progress(self) -> Dict[str, Any]:
+        return {
+            'status': self.status,
+            'filled': self.filled,
+            'avg_price': self.avg_price,
+            'child_count': self.seq,
+            'error_message': self.error,
+        }
+
+
+class ScheduledAlgo(ExecutionAlgo):
+    """
+    按时间片执行的算法（TWAP、VWAP 共用）
+
+    weights 为各时间片的权重，第 k 片开始时累计目标为 总量 × 前 k+1 片权重之和。
+    """
+
+    def __init__(self, *args, weights: Sequence[float] = (), **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.end_ms is None or self.end_ms <= self.start_ms:
+            raise AlgoError('结束时间必须晚于开始时间')
+        weights = np.asarray(weights, dtype=float)
+        if not len(weights) or weights.sum() <= 0:
+            weights = np.ones(max(len(weights), 1))
+        self.slices = len(weights)
+        self.interval = (self.end_ms - self.start_ms) / self.slices
+        self.targets = (np.cumsum(weights) / weights.sum()).tolist()
+        self.targets[-1] = 1.0
+        self.slice = 0  # 已开始的时间片数
+        self.finishing = False
+        self.swept = False
+
+    def configure(self, parameters: Dict[str, Any]):
+        self.style = parameters.get('style', 'market')
+        if self.style not in ('market', 'passive'):
+            raise AlgoError(f'无效的下单方式: {self.style}')
+        self.sweep = bool(parameters.get('sweep', True))
+
+    def slice_start(self, index: int) -> float:
+        return self.start_ms + index * self.interval
+
+    @property
+    def target(self) -> float:
+        return self.amount * self.targets[self.slice - 1] if self.slice else 0.0
+
+    def advance(self, now, quote, timer):
+        requests = []
+        started = self.slice
+        while self.slice < self.slices and now >= self.slice_start(self.slice):
+            self.slice += 1
+        if now >= self.end_ms:
+            self.finishing = True
+        if self.finishing or (self.slice > started and started):
+            # 新的时间片：撤掉上一片未成交的挂单，撤单回报到达后补到新目标
+            requests.extend(self.cancel_resting())
+
+        if self.finishing:
+            if self.active:
+                return requests
+            if self.remaining >= max(self.min_amount, EPS) and self.sweep and not self.swept:
+                price = self.quote_price(quote, passive=False)
+                amount = self.round_amount(self.remaining)
+                if self.price_allowed(price) and amount > EPS:
+                    self.swept = True
+                    requests.append(self.place(amount))
+                    return requests
+            self.finish(ALGO_COMPLETED)
+            return requests
+
+        if self.slice:
+            requests.extend(self.top_up(quote))
+        self.next_wakeup = self.slice_start(self.slice) if self.slice < self.slices else self.end_ms
+        return requests
+
+    def top_up(self, quote: Optional[Quote]) -> List[Dict[str, Any]]:
+        amount = self.round_amount(self.target - self.filled - self.working)
+        if amount < max(self.min_amount, EPS):
+            return []
+        passive = self.style == 'passive'
+        price = self.quote_price(quote, passive)
+        if (price is None and (passive or self.limit_price is not None)) or not self.price_allowed(price):
+            return []
+        if passive:
+            return [self.place(amount, 'limit', price)]
+        return [self.place(amount)]
+
+
+class TWAPAlgo(ScheduledAlgo):
+    """时间加权：各时间片数量相同"""
+    algorithm = 'twap'
+    prefix = 'twap'
+
+
+class VWAPAlgo(ScheduledAlgo):
+    """成交量加权：各时间片数量按历史同时段成交量分配"""
+    algorithm = 'vwap'
+    prefix = 'vwap'
+
+
+class IcebergAlgo(ExecutionAlgo):
+    """
+    冰山单
+
+    每次只挂出 display_amount（可按 variance 随机浮动）的限价单，成交或被撤后挂出下一笔。
+    没有 limit_price 时按下单时的买一/卖一定价。设置了结束时间时，到期撤掉挂单并结束。
+    """
+    algorithm = 'iceberg'
+    prefix = 'ice'
+
+    # 没有行情时重试的间隔（毫秒）
+    RETRY_MS = 1000
+
+    def configure(self, parameters: Dict[str, Any]):
+        self.display_amount = float(parameters.get('display_amount') or 0.0)
+        if self.display_amount <= 0:
+            raise AlgoError('冰山单需要 display_amount')
+        self.variance = min(max(float(parameters.get('variance') or 0.0), 0.0), 0.9)
+        self._random = random.Random(self.algo_id)
+
+    def advance(self, now, quote, timer):
+        if now < self.start_ms:
+            self.next_wakeup = self.start_ms
+            return []
+        if self.end_ms is not None and now >= self.end_ms:
+            requests = self.cancel_resting()
+            if not self.active:
+                self.finish(ALGO_COMPLETED)
+            return requests
+        self.next_wakeup = self.end_ms
+        if self.active:
+            return []
+        if self.remaining < max(self.min_amount, EPS):
+            self.finish(ALGO_COMPLETED)
+            return []
+        display = self.display_amount
+        if self.variance:
+            display *= 1 + self._random.uniform(-self.variance, self.variance)
+        amount = self.round_amount(min(display, self.remaining))
+        if amount < max(self.min_amount, EPS):
+            amount = self.round_amount(self.remaining)
+        price = self.limit_price if self.limit_price is not None else self.quote_price(quote, passive=True)
+        if price is None or amount <= EPS:
+            self.next_wakeup = now + self.RETRY_MS if self.end_ms is None else min(now + self.RETRY_MS, self.end_ms)
+            return []
+        return [self.place(amount, 'limit', price)]
+
+
+class SmartRouteAlgo(ExecutionAlgo):
+    """
+    智能路由
+
+    每一轮按各交易所缓存的订单簿把剩余数量分配到多个账户（router.route_order），子单以 IOC 限价单发出。
+    本轮子单全部结束后，间隔 round_interval 毫秒按最新的订单簿重新路由未成交的部分，最多 max_rounds 轮。
+    没有可用的流动性时每隔 RETRY_MS 重试，设置了结束时间时到期结束。
+
+    账户余额在下单时预留（买单按 IOC 限价和手续费计算），子单结束后退回未成交的部分。
+    """
+    algorithm = 'sor'
+    prefix = 'sor'
+
+    RETRY_MS = 1000
+
+    def __init__(self, *args, venues: Sequence[Venue] = (), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.venues = {venue.account_id: venue for venue in venues}
+        if not self.venues:
+            raise AlgoError('没有可路由的交易账户')
+        self.books: Dict[str, Sequence[Tuple[float, float]]] = {}
+        self.rounds = 0
+        self.last_route: Optional[Route] = None
+        self._accounts: Dict[str, int] = {}  # 子单号 -> 账户ID
+        self._reserved: Dict[str, float] = {}  # 子单号 -> 每单位数量预留的余额
+        self._next_round = 0.0
+
+    def configure(self, parameters: Dict[str, Any]):
+        self.max_rounds = int(parameters.get('max_rounds') or 5)
+        if self.max_rounds <= 0:
+            raise AlgoError('max_rounds 必须大于0')
+        self.round_interval = float(parameters.get('round_interval') or 500)
+
+    @property
+    def exchanges(self) -> Tuple[str, ...]:
+        return tuple(sorted({venue.exchange for venue in self.venues.values()}))
+
+    def observe(self, market: MarketState) -> Optional[Quote]:
+        for exchange in self.exchanges:
+            self.books[exchange] = book_levels(market.get(exchange, self.symbol), self.side)
+        return None
+
+    def restore(self, seq: int, children: List[Dict[str, Any]]):
+        super().restore(seq, children)
+        for data in children:
+            if data.get('exchange_account_id') is not None:
+                self._accounts[data['client_order_id']] = data['exchange_account_id']
+
+    def place_on(self, venue: Venue, amount: float, price: float) -> Dict[str, Any]:
+        request = self.place(amount, 'limit', price)
+        request.update(exchange_account_id=venue.account_id, exchange=venue.exchange, time_in_force='IOC')
+        client_order_id = request['client_order_id']
+        self._accounts[client_order_id] = venue.account_id
+        if self.side == 'buy':
+            self._reserved[client_order_id] = venue.effective_price(self.side, price)
+            if venue.quote_free is not None:
+                venue.quote_free -= amount * self._reserved[client_order_id]
+        else:
+            self._reserved[client_order_id] = 1.0
+            if venue.base_free is not None:
+                venue.base_free -= amount
+        return request
+
+    def cancel_child(self, child: ChildOrder) -> Optional[Dict[str, Any]]:
+        request = super().cancel_child(child)
+        venue = self.venues.get(self._accounts.get(child.client_order_id))
+        if request is not None and venue is not None:
+            request.update(exchange_account_id=venue.account_id, exchange=venue.exchange)
+        return request
+
+    def _close(self, child: ChildOrder):
+        reserved = self._reserved.pop(child.client_order_id, None)
+        venue = self.venues.get(self._accounts.get(child.client_order_id))
+        if reserved is not None and venue is not None:
+            unfilled = max(child.amount - child.filled, 0.0) * reserved
+            if self.side == 'buy' and venue.quote_free is not None:
+                venue.quote_free += unfilled
+            elif self.side == 'sell' and venue.base_free is not None:
+                venue.base_free += unfilled
+        super()._close(child)
+
+    def advance(self, now, quote, timer):
+        if now < self.start_ms:
+            self.next_wakeup = self.start_ms
+            return []
+        self.next_wakeup = self.end_ms
+        if self.active:
+            return []
+        remaining = self.round_amount(self.remaining)
+        if remaining < max(self.min_amount, EPS) or self.rounds >= self.max_rounds:
+            self.finish(ALGO_COMPLETED)
+            return []
+        if self.end_ms is not None and now >= self.end_ms:
+            self.finish(ALGO_COMPLETED)
+            return []
+        if not any(venue.budget(self.side) > EPS for venue in self.venues.values()):
+            self.finish(ALGO_FAILED, '各账户可用余额不足')
+            return []
+        if now < self._next_round:
+            self.next_wakeup = self._next_round
+            return []
+        route = route_order(
+            self.side, remaining, self.venues.values(), self.books, self.limit_price, self.lot_size, self.min_amount,
+        )
+        if not route.slices:
+            retry = now + self.RETRY_MS
+            self.next_wakeup = retry if self.end_ms is None else min(retry, self.end_ms)
+            return []
+        self.rounds += 1
+        self.last_route = route
+        self._next_round = now + self.round_interval
+        return [self.place_on(item.venue, item.amount, item.price) for item in route.slices]
+
+
+ALGORITHMS = {cls.algorithm: cls for cls in (TWAPAlgo, VWAPAlgo, IcebergAlgo, SmartRouteAlgo)}
+
+
+def volume_profile(timestamps: Sequence[float], volumes: Sequence[float], start_ms: float, end_ms: float,
+                   slices: int) -> List[float]:
+    """
+    历史成交量在各时间片的分布
+
+    按一天内的时刻对齐：历史K线落在 [开始时刻, 开始时刻 + 时长) 内的，按偏移归入对应的时间片。
+    时长超过一天或没有历史成交量时返回均匀分布。
+
+    Args:
+        timestamps: 历史K线的开盘时间（毫秒）
+        volumes: 对应的成交量
+    """
+    duration = end_ms - start_ms
+    if slices <= 0 or duration <= 0 or duration > 86400000 or not len(timestamps):
+        return [1.0] * max(slices, 1)
+    offsets = (np.asarray(timestamps, dtype=float) - start_ms) % 86400000
+    volumes = np.asarray(volumes, dtype=float)
+    mask = offsets < duration
+    buckets = np.minimum((offsets[mask] / (duration / slices)).astype(int), slices - 1)
+    weights = np.bincount(buckets, weights=volumes[mask], minlength=slices)
+    if weights.sum() <= 0:
+        return [1.0] * slices
+    return weights.tolist()
+
+
+def load_volume_profile(tenant_id: int, exchange: str, symbol: str, start_ms: float, end_ms: float, slices: int,
+                        timeframe: Optional[str] = None, days: Optional[int] = None) -> List[float]:
+    """从最近 days 天的K线读取成交量分布"""
+    from apps.market.models import Kline
+
+    timeframe = timeframe or getattr(settings, 'ALGO_VWAP_TIMEFRAME', '5m')
+    days = days or getattr(settings, 'ALGO_VWAP_LOOKBACK_DAYS', 7)
+    since = datetime.fromtimestamp((start_ms - days * 86400000) / 1000, tz=dt_timezone.utc)
+    rows = Kline.objects.filter(
+        symbol__tenant_id=tenant_id, symbol__exchange__code=exchange, symbol__symbol=symbol,
+        timeframe=timeframe, timestamp__gte=since,
+    ).values_list('timestamp', 'volume')
+    timestamps, volumes = [], []
+    for timestamp, volume in rows.iterator():
+        timestamps.append(timestamp.timestamp() * 1000)
+        volumes.append(float(volume))
+    return volume_profile(timestamps, volumes, start_ms, end_ms, slices)
+
+
+def build_algo(instance, identity: Dict[str, Any], now: float, weights: Optional[Sequence[float]] = None,
+               venues: Optional[Sequence[Venue]] = None) -> ExecutionAlgo:
+    """由 AlgoOrder 创建算法对象，开始和结束时间已经确定"""
+    cls = ALGORITHMS.get(instance.algorithm)
+    if cls is None:
+        raise AlgoError(f'不支持的算法: {instance.algorithm}')
+    parameters = instance.parameters or {}
+    start_ms = instance.start_time.timestamp() * 1000 if instance.start_time else now
+    end_ms = instance.end_time.timestamp() * 1000 if instance.end_time else None
+    kwargs = {}
+    if issubclass(cls, ScheduledAlgo):
+        slices = int(parameters.get('slices') or 10)
+        if slices <= 0:
+            raise AlgoError('时间片数必须大于0')
+        kwargs['weights'] = weights if weights is not None else [1.0] * slices
+    elif cls is SmartRouteAlgo:
+        kwargs['venues'] = venues or ()
+    algo = cls(
+        instance.pk, instance.symbol, instance.side, float(instance.amount), identity,
+        limit_price=instance.limit_price, start_ms=start_ms, end_ms=end_ms, parameters=parameters, **kwargs,
+    )
+    algo.configure(parameters)
+    return algo
+
+
+def _datetime(ts_ms: float) -> datetime:
+    return datetime.fromtimestamp(ts_ms / 1000, tz=dt_timezone.utc)
+
+
+class AlgoEngine:
+    """
+    算法执行引擎
+
+    用法：
+        engine = AlgoEngine()
+        asyncio.run(engine.run())
+
+    测试或嵌入时可以直接调用 add / fire_timers / handle_reports / handle_events，不需要事件循环。
+    """
+
+    def __init__(self, event_log=None, order_sink: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 report_channel: Optional[OrderChannel] = None, group: str = ALGO_GROUP,
+                 consumer: Optional[str] = None, tick_ms: Optional[float] = None, slots: Optional[int] = None,
+                 batch_size: Optional[int] = None, block_ms: Optional[int] = None,
+                 reload_interval: Optional[float] = None, clock: Callable[[], float] = now_ms):
+        self._event_log = event_log
+        self._report_channel = report_channel
+        self.order_sink = order_sink or self._dispatch
+        self.group = group
+        # 固定的消费者名称：重启后回报流不变，重启前发出的子单的回报仍能收到
+        self.consumer = consumer or socket.gethostname()
+        self.tick_ms = tick_ms or getattr(settings, 'ALGO_ENGINE_TICK_MS', 100)
+        self.batch_size = batch_size or getattr(settings, 'ALGO_ENGINE_BATCH_SIZE', 500)
+        self.block_ms = block_ms or getattr(settings, 'ALGO_ENGINE_BLOCK_MS', 1000)
+        self.reload_interval = reload_interval or getattr(settings, 'ALGO_ENGINE_RELOAD_INTERVAL', 2.0)
+        self.clock = clock
+        self.report_stream = report_stream(f'algo:{self.consumer}')
+
+        self.wheel = TimerWheel(self.tick_ms, slots or getattr(settings, 'ALGO_ENGINE_WHEEL_SLOTS', 1024), clock())
+        self.market = MarketState()
+        self.algos: Dict[int, ExecutionAlgo] = {}
+        self._children: Dict[str, int] = {}  # 子单号 -> 算法单ID
+        self._changed = set()
+        self._known_exchanges = set()
+        self.orders_sent = 0
+
+    @staticmethod
+    def _dispatch(request: Dict[str, Any]):
+        from .gateway import get_order_dispatcher
+        get_order_dispatcher()(request)
+
+    @property
+    def event_log(self):
+        if self._event_log is None:
+            from apps.market.event_log import MarketEventLog
+            self._event_log = MarketEventLog()
+        return self._event_log
+
+    @property
+    def report_channel(self) -> OrderChannel:
+        if self._report_channel is None:
+            self._report_channel = OrderChannel()
+        return self._report_channel
+
+    @property
+    def exchanges(self) -> List[str]:
+        return sorted({exchange for algo in self.algos.values() for exchange in algo.exchanges if exchange})
+
+    # -- 内存状态 ----------------------------------------------------------
+
+    def add(self, algo: ExecutionAlgo):
+        self.algos[algo.algo_id] = algo
+        for client_order_id in algo.children:
+            self._children[client_order_id] = algo.algo_id
+        self._step(algo)
+
+    def remove(self, algo_id: int):
+        algo = self.algos.pop(algo_id, None)
+        if algo is None:
+            return
+        self.wheel.cancel(algo_id)
+        for client_order_id in algo.children:
+            self._children.pop(client_order_id, None)
+
+    def cancel(self, algo_id: int) -> bool:
+        algo = self.algos.get(algo_id)
+        if algo is None or algo.is_done:
+            return False
+        self._send(algo, algo.cancel())
+        self._step(algo)
+        return True
+
+    def _send(self, algo: ExecutionAlgo, requests: List[Dict[str, Any]]):
+        for request in requests:
+            if request['action'] == 'place':
+                self._children[request['client_order_id']] = algo.algo_id
+                self.orders_sent += 1
+                # 决策时的中间价，用于执行质量统计中的滑点
+                quote = self.market.get(request.get('exchange', ''), request['symbol'])
+                if quote is not None and request.get('arrival_price') is None:
+                    request['arrival_price'] = quote.mid
+            try:
+                self.order_sink(request)
+            except Exception as e:
+                logger.error(f"子单请求发送失败 {request['client_order_id']}: {e}")
+
+    def _step(self, algo: ExecutionAlgo, timer: bool = False):
+        requests = algo.step(self.clock(), algo.observe(self.market), timer)
+        self._send(algo, requests)
+        self._changed.add(algo.algo_id)
+        if algo.next_wakeup is None or algo.is_done:
+            self.wheel.cancel(algo.algo_id)
+        else:
+            self.wheel.schedule(algo.algo_id, algo.next_wakeup)
+
+    def fire_timers(self, now: Optional[float] = None) -> int:
+        """处理到期的定时器，返回触发的算法单数"""
+        fired = 0
+        for algo_id in self.wheel.advance(self.clock() if now is None else now):
+            algo = self.algos.get(algo_id)
+            if algo is not None:
+                self._step(algo, timer=True)
+                fired += 1
+        return fired
+
+    def handle_reports(self, reports: List[Dict[str, Any]]) -> int:
+        """子单回报：同一批回报全部应用之后再推进相关的算法单"""
+        touched = {}
+        for report in reports:
+            algo_id = self._children.get(report.get('client_order_id'))
+            algo = self.algos.get(algo_id) if algo_id is not None else None
+            if algo is not None and algo.apply_report(report):
+                touched[algo_id] = algo
+        for algo in touched.values():
+            self._step(algo)
+        return len(touched)
+
+    def reconcile(self, orders: Dict[str, Dict[str, Any]]) -> int:
+        """
+        按数据库中的订单状态补齐子单的成交和结束（回报没有写到本引擎的回报流时）
+
+        成交回报带累计数量，之后真正的回报到达时不会重复计入。
+        """
+        reports = []
+        for client_order_id, order in orders.items():
+            algo = self.algos.get(self._children.get(client_order_id))
+            child = algo.active.get(client_order_id) if algo is not None else None
+            if child is None:
+                continue
+            filled, avg_price = float(order['filled']), float(order['avg_price'])
+            if filled > child.filled + EPS:
+                amount = filled - child.filled
+                price = (filled * avg_price - child.cost) / amount
+                reports.append({'type': REPORT_FILL, 'client_order_id': client_order_id, 'amount': amount,
+                                'price': price if price > 0 else avg_price, 'filled': filled})
+            if order['status'] == ORDER_CANCELLED:
+                reports.append({'type': REPORT_CANCELLED, 'client_order_id': client_order_id})
+            elif order['status'] == ORDER_REJECTED:
+                reports.append({'type': REPORT_REJECTED, 'client_order_id': client_order_id,
+                                'error': order['error_message'] or '子单被拒绝'})
+        if reports:
+            logger.info(f"按订单状态补齐子单回报: {len(reports)}条")
+        return self.handle_reports(reports)
+
+    def handle_events(self, events) -> int:
+        for event in events:
+            self.market.apply_event(event)
+        return len(events)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'algos': len(self.algos),
+            'timers': len(self.wheel),
+            'children': len(self._children),
+            'orders_sent': self.orders_sent,
+        }
+
+    # -- 数据库同步（在线程池中执行）----------------------------------------
+
+    def snapshot(self) -> Dict[int, Dict[str, Any]]:
+        """自上次同步以来有变化的算法单进度"""
+        changed, self._changed = self._changed, set()
+        return {algo_id: self.algos[algo_id].progress() for algo_id in changed if algo_id in self.algos}
+
+    @staticmethod
+    def save_progress(progress: Dict[int, Dict[str, Any]]):
+        """保存算法单进度，只有结束状态才覆盖 status，不会冲掉运行期间用户发起的撤销"""
+        from .models import AlgoOrder
+
+        if not progress:
+            return
+        now = timezone.now()
+        instances = list(AlgoOrder.all_objects.filter(pk__in=list(progress)))
+        finished = []
+        for instance in instances:
+            data = progress[instance.pk]
+            instance.filled = data['filled']
+            instance.avg_price = data['avg_price']
+            instance.child_count = data['child_count']
+            instance.error_message = data['error_message'][:2000]
+            if data['status'] in FINISHED_STATUSES:
+                instance.status = data['status']
+                instance.finished_at = now
+                finished.append(instance)
+        AlgoOrder.all_objects.bulk_update(instances, ['filled', 'avg_price', 'child_count', 'error_message'])
+        AlgoOrder.all_objects.bulk_update(finished, ['status', 'finished_at'])
+
+    def load_changes(self, running_ids, progress: Dict[int, Dict[str, Any]], known_quotes, children=()):
+        """
+        保存进度，读取新的和被撤销的算法单，以及未结束子单（children）中已有成交或已经结束的订单
+
+        子单的回报写入本引擎的回报流，但网关重启后恢复跟踪的订单、账户同步校正的订单不会推送回报，
+        这些变化只在数据库中，由 reconcile 补齐。
+
+        Returns:
+            (新算法单列表, 需要撤销的ID列表, 新交易对的报价, 子单号 -> 数据库中的订单)
+        """
+        from .models import AlgoOrder, Order
+
+        self.save_progress(progress)
+        children = list(children)
+        orders = {order['client_order_id']: order for order in Order.all_objects.filter(
+            client_order_id__in=children,
+        ).exclude(status__in=(ORDER_NEW, ORDER_SUBMITTED)).values(
+            'client_order_id', 'status', 'filled', 'avg_price', 'error_message',
+        )} if children else {}
+        cancelled = list(
+            AlgoOrder.all_objects.filter(pk__in=list(running_ids), status=ALGO_CANCELLING).values_list('pk', flat=True)
+        )
+        instances = list(
+            AlgoOrder.all_objects.filter(status__in=LIVE_STATUSES).exclude(pk__in=list(running_ids))
+            .select_related('exchange_account')
+        )
+        if not instances:
+            return [], cancelled, {}, orders
+
+        # 智能路由的子单分布在租户的多个账户上
+        restored: Dict[str, List[Dict[str, Any]]] = {}
+        for order in Order.all_objects.filter(
+            tenant_id__in={instance.tenant_id for instance in instances},
+            tag__in=[f'algo:{instance.pk}' for instance in instances],
+        ).values('client_order_id', 'exchange_account_id', 'amount', 'price', 'order_type', 'filled', 'avg_price',
+                 'status', 'tag'):
+            restored.setdefault(order['tag'], []).append(order)
+
+        now = self.clock()
+        added = []
+        for instance in instances:
+            try:
+                added.append(self._build(instance, now, restored.get(f'algo:{instance.pk}', [])))
+            except Exception as e:
+                logger.error(f"算法单 {instance.pk} 启动失败: {e}")
+                AlgoOrder.all_objects.filter(pk=instance.pk).update(
+                    status=ALGO_FAILED, error_message=str(e)[:2000], finished_at=timezone.now(),
+                )
+        pairs = {(exchange, algo.symbol) for algo, _ in added for exchange in algo.exchanges} - set(known_quotes)
+        return added, cancelled, self._load_quotes(pairs), orders
+
+    def _build(self, instance, now: float, children: List[Dict[str, Any]]) -> Tuple[ExecutionAlgo, bool]:
+        from .models import AlgoOrder
+
+        parameters = instance.parameters or {}
+        if instance.start_time is None:
+            instance.start_time = _datetime(now)
+        if instance.end_time is None and parameters.get('duration'):
+            instance.end_time = _datetime(instance.start_time.timestamp() * 1000 + float(parameters['duration']) * 1000)
+        weights = None
+        if instance.algorithm == 'vwap' and instance.end_time is not None:
+            weights = load_volume_profile(
+                instance.tenant_id, instance.exchange_account.exchange, instance.symbol,
+                instance.start_time.timestamp() * 1000, instance.end_time.timestamp() * 1000,
+                int(parameters.get('slices') or 10), parameters.get('timeframe'), parameters.get('lookback_days'),
+            )
+        venues = None
+        if instance.algorithm == 'sor':
+            # 主账户总是参与路由
+            accounts = parameters.get('accounts')
+            venues = load_venues(
+                instance.tenant_id, instance.symbol,
+                sorted({*map(int, accounts), instance.exchange_account_id}) if accounts else None, parameters.get('fees'),
+            )
+        identity = {
+            'tenant_id': instance.tenant_id,
+            'exchange_account_id': instance.exchange_account_id,
+            'exchange': instance.exchange_account.exchange,
+            'reply_to': self.report_stream,
+        }
+        algo = build_algo(instance, identity, now, weights, venues)
+        algo.restore(instance.child_count, children)
+        # 固定开始和结束时间，重启后按原计划继续
+        fields = {'start_time': instance.start_time, 'end_time': instance.end_time}
+        if instance.status == ALGO_PENDING:
+            fields['status'] = ALGO_RUNNING
+        AlgoOrder.all_objects.filter(pk=instance.pk).update(**fields)
+        return algo, instance.status == ALGO_CANCELLING
+
+    def _load_quotes(self, pairs) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """新交易对的报价由 Ticker 和 OrderBook 表预热"""
+        from apps.market.models import OrderBook, Ticker
+
+        quotes = {}
+        for exchange, symbol in pairs:
+            ticker = Ticker.objects.filter(
+                symbol__exchange__code=exchange, symbol__symbol=symbol,
+            ).order_by('-timestamp').first()
+            book = OrderBook.objects.filter(
+                symbol__exchange__code=exchange, symbol__symbol=symbol,
+            ).order_by('-timestamp').first()
+            quote = {}
+            if ticker is not None:
+                quote.update(bid=ticker.bid_price, ask=ticker.ask_price, last=ticker.last_price,
+                             ts=ticker.timestamp.timestamp() * 1000)
+            if book is not None and (not quote or book.timestamp.timestamp() * 1000 >= quote['ts']):
+                quote.update(bid=book.bids[0][0] if book.bids else quote.get('bid'),
+                             ask=book.asks[0][0] if book.asks else quote.get('ask'),
+                             ts=book.timestamp.timestamp() * 1000)
+            if book is not None:
+                quote['book'] = (book.bids or [], book.asks or [], book.timestamp.timestamp() * 1000)
+            if quote:
+                quotes[(exchange, symbol)] = quote
+        return quotes
+
+    def apply_changes(self, added, cancelled, quotes, orders=None):
+        for algo_id in [algo_id for algo_id, algo in self.algos.items() if algo.is_done]:
+            # 结束状态已经保存
+            if algo_id not in self._changed:
+                self.remove(algo_id)
+        for (exchange, symbol), quote in quotes.items():
+            if self.market.get(exchange, symbol) is None:
+                book = quote.pop('book', None)
+                self.market.update(exchange, symbol, **quote)
+                if book is not None:
+                    self.market.update_book(exchange, symbol, *book)
+        for algo, cancelling in added:
+            self.add(algo)
+            if cancelling:
+                self.cancel(algo.algo_id)
+            logger.info(f"算法单 {algo.algo_id} 开始执行: {algo.algorithm} {algo.side} {algo.amount} {algo.symbol}")
+        for algo_id in cancelled:
+            self.cancel(algo_id)
+        if orders:
+            self.reconcile(orders)
+
+    async def reload(self):
+        progress = self.snapshot()
+        children = [client_order_id for algo in self.algos.values() for client_order_id in algo.active]
+        changes = await asyncio.to_thread(
+            self.load_changes, set(self.algos), progress, set(self.market.quotes), children,
+        )
+        self.apply_changes(*changes)
+        for exchange in self.exchanges:
+            if exchange not in self._known_exchanges:
+                await asyncio.to_thread(self.event_log.ensure_group, exchange, self.group, '$')
+                self._known_exchanges.add(exchange)
+
+    # -- 事件循环 ----------------------------------------------------------
+
+    async def _timer_loop(self, stop: asyncio.Event):
+        while not stop.is_set():
+            now = self.clock()
+            delay = (self.tick_ms - now % self.tick_ms) / 1000
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self.fire_timers()
+
+    async def _consume_loop(self, stop: asyncio.Event):
+        last_reload = 0.0
+        while not stop.is_set():
+            if time.monotonic() - last_reload >= self.reload_interval:
+                await self.reload()
+                last_reload = time.monotonic()
+            exchanges = self.exchanges
+            if not exchanges:
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=self.reload_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            events = await asyncio.to_thread(
+                self.event_log.consume, self.group, self.consumer, exchanges, self.batch_size,
+                min(self.block_ms, int(self.reload_interval * 1000)),
+            )
+            if events:
+                self.handle_events(events)
+                await asyncio.to_thread(self.event_log.ack, self.group, events)
+
+    async def _report_loop(self, stop: asyncio.Event):
+        while not stop.is_set():
+            entries = await asyncio.to_thread(
+                self.report_channel.read, self.report_stream, self.group, self.consumer,
+                self.batch_size, self.block_ms,
+            )
+            if entries:
+                self.handle_reports([report for _, report in entries])
+                await asyncio.to_thread(
+                    self.report_channel.ack, self.report_stream, self.group, [entry_id for entry_id, _ in entries],
+                )
+
+    async def run(self, stop: Optional[asyncio.Event] = None):
+        """运行直到 stop 被设置，退出前保存进度"""
+        stop = stop or asyncio.Event()
+        logger.info(f"算法执行引擎启动: 消费者 {self.consumer}")
+        try:
+            await asyncio.gather(self._consume_loop(stop), self._timer_loop(stop), self._report_loop(stop))
+        finally:
+            await asyncio.to_thread(self.save_progress, self.snapshot())
+            logger.info("算法执行引擎已停止")
@@ -0,0 +1,321 @@
+"""
+执行质量统计
+
+订单结束后，把它的执行结果累加到 ExecutionQuality 汇总表（小时 × 交易账户 × 实盘策略 × 交易对）：
+
+- 成交率：成交数量 / 下单数量（不含被拒绝的订单），以及完全成交、部分成交、撤销、拒绝的订单数；
+- 滑点：成交均价相对到达价格（决策时的市场价格，由策略引擎和算法引擎写入订单请求）的差，
+  买单 (均价 - 到达价) × 数量、卖单相反，正数表示比到达价格差；
+- 延迟：订单发出 -> 交易所确认、订单发出 -> 首笔成交，按分桶计数估算分位数。
+
+汇总由 rollup_execution_quality 任务增量维护：每次只读取尚未计入的已结束订单（Order.quality_rolled），
+在一个事务中更新汇总行并标记订单，重复执行不会重复计入。报表只读汇总表，与成交笔数无关。
+订单结束前不计入，长时间挂单的成交在撤销或完全成交后才出现在报表中。
+"""
+import bisect
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+
+from apps.monitoring.latency import LATENCY_BUCKETS_MS, estimate_percentile
+from .orders import ORDER_FILLED, ORDER_REJECTED, TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# 首笔成交延迟的分桶上界（毫秒）：限价单可能挂单数分钟到数小时
+FILL_LATENCY_BUCKETS_MS = LATENCY_BUCKETS_MS + (60000, 300000, 900000, 3600000, 14400000)
+
+# 报表可以按这些维度分组
+GROUP_FIELDS = ('bucket', 'exchange', 'exchange_account_id', 'live_strategy_id', 'symbol')
+
+# 汇总表中的 DecimalField
+DECIMAL_FIELDS = frozenset((
+    'ordered_amount', 'filled_amount', 'filled_notional', 'fees', 'arrival_amount', 'arrival_notional',
+    'slippage_cost',
+))
+
+# 汇总行的键：(租户, 小时, 交易账户, 实盘策略, 交易对)
+RollupKey = Tuple[int, datetime, int, int, str]
+
+
+def _bucket(buckets: Sequence[float], value_ms: float) -> int:
+    return bisect.bisect_left(buckets, value_ms)
+
+
+@dataclass
+class QualityStats:
+    """可以相加的执行质量统计，对应 ExecutionQuality 的统计字段"""
+    orders: int = 0
+    filled_orders: int = 0
+    partial_orders: int = 0
+    cancelled_orders: int = 0
+    rejected_orders: int = 0
+    ordered_amount: float = 0.0
+    filled_amount: float = 0.0
+    filled_notional: float = 0.0
+    fees: float = 0.0
+    arrival_amount: float = 0.0
+    arrival_notional: float = 0.0
+    slippage_cost: float = 0.0
+    ack_count: int = 0
+    ack_total_ms: float = 0.0
+    ack_buckets: List[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+    fill_count: int = 0
+    fill_total_ms: float = 0.0
+    fill_buckets: List[int] = field(default_factory=lambda: [0] * (len(FILL_LATENCY_BUCKETS_MS) + 1))
+
+    def add_order(self, status: str, side: str, amount: float, filled: float, avg_price: float, fee: float,
+                  arrival_price: Optional[float] = None, sent_at: Optional[datetime] = None,
+                  submitted_at: Optional[datetime] = None, first_fill_at: Optional[datetime] = None):
+        """计入一个已结束的订单"""
+        self.orders += 1
+        if status == ORDER_REJECTED:
+            self.rejected_orders += 1
+        else:
+            self.ordered_amount += amount
+            if status == ORDER_FILLED:
+                self.filled_orders += 1
+            elif filled > 0:
+                self.partial_orders += 1
+            else:
+                self.cancelled_orders += 1
+        if filled > 0:
+            self.filled_amount += filled
+            self.filled_notional += filled * avg_price
+            self.fees += fee
+            if arrival_price:
+                sign = 1.0 if side == 'buy' else -1.0
+                self.arrival_amount += filled
+                self.arrival_notional += filled * arrival_price
+                self.slippage_cost += sign * (avg_price - arrival_price) * filled
+        if sent_at is not None and submitted_at is not None:
+            latency = max((submitted_at - sent_at).total_seconds() * 1000, 0.0)
+            self.ack_count += 1
+            self.ack_total_ms += latency
+            self.ack_buckets[_bucket(LATENCY_BUCKETS_MS, latency)] += 1
+        if sent_at is not None and first_fill_at is not None:
+            latency = max((first_fill_at - sent_at).total_seconds() * 1000, 0.0)
+            self.fill_count += 1
+            self.fill_total_ms += latency
+            self.fill_buckets[_bucket(FILL_LATENCY_BUCKETS_MS, latency)] += 1
+
+    def merge(self, other: 'QualityStats'):
+        for item in fields(self):
+            value = getattr(other, item.name)
+            if isinstance(value, list):
+                mine = getattr(self, item.name)
+                for index, count in enumerate(value[:len(mine)]):
+                    mine[index] += count
+            else:
+                setattr(self, item.name, getattr(self, item.name) + value)
+
+    @classmethod
+    def from_row(cls, row) -> 'QualityStats':
+        """由汇总行（模型或 values() 字典）创建"""
+        get = row.get if isinstance(row, dict) else lambda name: getattr(row, name)
+        stats = cls()
+        for item in fields(stats):
+            value = get(item.name)
+            if isinstance(value, list):
+                buckets = getattr(stats, item.name)
+                buckets[:len(value)] = value[:len(buckets)]
+            else:
+                setattr(stats, item.name, type(getattr(stats, item.name))(value or 0))
+        return stats
+
+    def apply_to(self, rollup):
+        """写入汇总行的字段"""
+        for item in fields(self):
+            value = getattr(self, item.name)
+            setattr(rollup, item.name, Decimal(str(round(value, 12))) if item.name in DECIMAL_FIELDS else value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """报表指标"""
+        return {
+            'orders': self.orders,
+            'filled_orders': self.filled_orders,
+            'partial_orders': self.partial_orders,
+            'cancelled_orders': self.cancelled_orders,
+            'rejected_orders': self.rejected_orders,
+            'ordered_amount': self.ordered_amount,
+            'filled_amount': self.filled_amount,
+            'fill_ratio': self.filled_amount / self.ordered_amount if self.ordered_amount > 0 else None,
+            'avg_price': self.filled_notional / self.filled_amount if self.filled_amount > 0 else None,
+            'filled_notional': self.filled_notional,
+            'fees': self.fees,
+            'slippage_cost': self.slippage_cost,
+            'slippage_bps': (
+                self.slippage_cost / self.arrival_notional * 10000 if self.arrival_notional > 0 else None
+            ),
+            'ack_latency_ms': {
+                'count': self.ack_count,
+                'mean': round(self.ack_total_ms / self.ack_count, 3) if self.ack_count else None,
+                'p50': estimate_percentile(self.ack_buckets, 50),
+                'p99': estimate_percentile(self.ack_buckets, 99),
+            },
+            'fill_latency_ms': {
+                'count': self.fill_count,
+                'mean': round(self.fill_total_ms / self.fill_count, 3) if self.fill_count else None,
+                'p50': estimate_percentile(self.fill_buckets, 50, FILL_LATENCY_BUCKETS_MS),
+                'p99': estimate_percentile(self.fill_buckets, 99, FILL_LATENCY_BUCKETS_MS),
+            },
+        }
+
+
+def bucket_start(ts: datetime) -> datetime:
+    """所在小时的开始时间"""
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+class ExecutionQualityRollup:
+    """
+    执行质量汇总器
+
+    用法：
+        ExecutionQualityRollup().run()  # 计入全部尚未计入的已结束订单
+    """
+
+    ORDER_FIELDS = (
+        'pk', 'tenant_id', 'exchange_account_id', 'exchange_account__exchange', 'live_strategy_id', 'symbol',
+        'side', 'status', 'amount', 'filled', 'avg_price', 'fee', 'arrival_price', 'sent_at', 'submitted_at',
+        'closed_at', 'created_at',
+    )
+
+    def __init__(self, batch_size: Optional[int] = None):
+        self.batch_size = batch_size or getattr(settings, 'EXECUTION_QUALITY_BATCH_SIZE', 1000)
+
+    def run(self, max_batches: Optional[int] = None) -> int:
+        """按批计入，返回计入的订单数"""
+        total, batches = 0, 0
+        while max_batches is None or batches < max_batches:
+            count = self.process_batch()
+            total += count
+            batches += 1
+            if count < self.batch_size:
+                break
+        return total
+
+    def process_batch(self) -> int:
+        """
+        计入一批订单
+
+        订单行加锁并跳过其他汇总器已锁定的行，多个任务同时执行时各自处理不同的订单。
+        汇总行的更新和订单的标记在同一个事务中。
+        """
+        from .models import ExecutionQuality, Order, OrderFill
+
+        with transaction.atomic():
+            orders = list(
+                Order.all_objects.select_for_update(skip_locked=True, of=('self',))
+                .filter(quality_rolled=False, status__in=TERMINAL_STATUSES)
+                .order_by('pk').values(*self.ORDER_FIELDS)[:self.batch_size]
+            )
+            if not orders:
+                return 0
+            ids = [order['pk'] for order in orders]
+            first_fills = dict(OrderFill.all_objects.filter(order_id__in=ids).values('order_id').annotate(
+                first=Min('timestamp')).values_list('order_id', 'first'))
+
+            changes: Dict[RollupKey, QualityStats] = defaultdict(QualityStats)
+            exchanges: Dict[int, str] = {}
+            for order in orders:
+                key = (
+                    order['tenant_id'], bucket_start(order['closed_at'] or order['created_at']),
+                    order['exchange_account_id'], order['live_strategy_id'] or 0, order['symbol'],
+                )
+                exchanges[order['exchange_account_id']] = order['exchange_account__exchange']
+                changes[key].add_order(
+                    order['status'], order['side'], float(order['amount']), float(order['filled']),
+                    float(order['avg_price']), float(order['fee']),
+                    float(order['arrival_price']) if order['arrival_price'] is not None else None,
+                    order['sent_at'], order['submitted_at'], first_fills.get(order['pk']),
+                )
+
+            existing = {
+                (row.tenant_id, row.bucket, row.exchange_account_id, row.live_strategy_id, row.symbol): row
+                for row in ExecutionQuality.all_objects.select_for_update().filter(
+                    bucket__in={key[1] for key in changes},
+                    exchange_account_id__in={key[2] for key in changes},
+                    symbol__in={key[4] for key in changes},
+                )
+            }
+            updated, created = [], []
+            for key, stats in changes.items():
+                row = existing.get(key)
+                if row is None:
+                    tenant_id, bucket, account_id, live_strategy_id, symbol = key
+                    row = ExecutionQuality(
+                        tenant_id=tenant_id, bucket=bucket, exchange_account_id=account_id,
+                        exchange=exchanges[account_id], live_strategy_id=live_strategy_id, symbol=symbol,
+                    )
+                    created.append(row)
+                else:
+                    merged = QualityStats.from_row(row)
+                    merged.merge(stats)
+                    stats = merged
+                    updated.append(row)
+                stats.apply_to(row)
+            ExecutionQuality.all_objects.bulk_create(created)
+            if updated:
+                ExecutionQuality.all_objects.bulk_update(
+                    updated, [item.name for item in fields(QualityStats)] + ['updated_at'],
+                )
+            Order.all_objects.filter(pk__in=ids).update(quality_rolled=True)
+        return len(orders)
+
+
+def execution_quality_report(tenant_id, group_by: Sequence[str] = ('live_strategy_id',),
+                             start: Optional[datetime] = None, end: Optional[datetime] = None,
+                             exchange_account_ids: Optional[Iterable[int]] = None,
+                             live_strategy_ids: Optional[Iterable[int]] = None,
+                             exchanges: Optional[Iterable[str]] = None,
+                             symbols: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """
+    执行质量报表
+
+    Args:
+        group_by: 分组维度，取自 GROUP_FIELDS；为空时返回一行合计
+        start / end: 统计小时的范围（按订单结束时间，end 不含）
+
+    Returns:
+        每组一项：分组字段的值加 QualityStats.to_dict() 的指标
+    """
+    from .models import ExecutionQuality
+
+    unknown = set(group_by) - set(GROUP_FIELDS)
+    if unknown:
+        raise ValueError(f"不支持的分组维度: {', '.join(sorted(unknown))}")
+    rows = ExecutionQuality.all_objects.filter(tenant_id=tenant_id)
+    if start is not None:
+        rows = rows.filter(bucket__gte=bucket_start(start))
+    if end is not None:
+        rows = rows.filter(bucket__lt=end)
+    if exchange_account_ids is not None:
+        rows = rows.filter(exchange_account_id__in=list(exchange_account_ids))
+    if live_strategy_ids is not None:
+        rows = rows.filter(live_strategy_id__in=list(live_strategy_ids))
+    if exchanges is not None:
+        rows = rows.filter(exchange__in=list(exchanges))
+    if symbols is not None:
+        rows = rows.filter(symbol__in=list(symbols))
+
+    groups: Dict[Tuple, QualityStats] = {}
+    for row in rows.values(*GROUP_FIELDS, *(item.name for item in fields(QualityStats))).iterator():
+        key = tuple(row[name] for name in group_by)
+        stats = groups.get(key)
+        if stats is None:
+            groups[key] = QualityStats.from_row(row)
+        else:
+            stats.merge(QualityStats.from_row(row))
+    return [
+        {**dict(zip(group_by, key)), **groups[key].to_dict()}
+        for key in sorted(groups, key=lambda key: tuple(str(value) for value in key))
+    ]
+
@@ -0,0 +1,1334 @@
+"""
+订单网关
+
+每个交易所一个常驻的 asyncio 进程（run_order_gateway 命令），替代逐单经过 Celery 的 execute_order：
+
+- 策略引擎把订单请求写入本机 Redis 的订单流 ``trading:orders:{交易所}``，网关以消费者组读取，
+  没有任务队列的排队和 worker 冷启动；
+- 网关为每个交易账户保持一个已认证、已加载市场信息的 ccxt 异步实例，HTTP 连接常驻；
+- 订单并发提交，每个账户一个令牌桶限速，总并发受 max_inflight 限制；
+- 确认、成交、撤单和拒单回报写入请求指定的回报流（reply_to），策略引擎消费后回调策略；
+- 未完成的订单按间隔查询状态，新增成交作为回报推送；
+- 网关定期写入心跳键，OrderDispatcher 只在心跳存在时使用网关，否则回退到 execute_order 任务。
+
+订单以客户端订单号（clientOrderId）提交，同一请求重复投递时网关直接忽略，交易所也会拒绝重复的订单号。
+订单状态和成交由 OrderStore 维护，按批量写入 trading_order / trading_order_fill。
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+
+from apps.monitoring.latency import ORDER_GATEWAY, get_latency_recorder, now_ms
+
+from .orders import ORDER_NEW, OrderStore, make_client_order_id
+
+logger = logging.getLogger(__name__)
+
+# 订单流键前缀：trading:orders:{exchange}
+ORDER_STREAM_PREFIX = 'trading:orders'
+# 回报流键前缀：trading:reports:{接收方}
+REPORT_STREAM_PREFIX = 'trading:reports'
+# 网关心跳键前缀：trading:gateway:{exchange}
+HEARTBEAT_KEY_PREFIX = 'trading:gateway'
+# 订单流上网关使用的消费者组
+GATEWAY_GROUP = 'order-gateway'
+
+# 回报类型
+REPORT_ACK = 'ack'
+REPORT_FILL = 'fill'
+REPORT_CANCELLED = 'cancelled'
+REPORT_REJECTED = 'rejected'
+# 批量下单、全部撤单的汇总回报，results 为每个订单的结果
+REPORT_BATCH = 'batch'
+
+# 请求类型（action），未指定时为下单
+ACTION_CANCEL = 'cancel'
+ACTION_BATCH = 'batch'
+ACTION_CANCEL_ALL = 'cancel_all'
+
+# 各交易所批量下单接口每次最多的订单数，可用 ORDER_BATCH_LIMITS 覆盖，未列出的按 ORDER_BATCH_MAX_SIZE
+BATCH_LIMITS = {'binance': 5, 'binanceusdm': 5, 'binancecoinm': 5, 'bybit': 10, 'okx': 20}
+
+# 汇总回报中订单结果的状态
+RESULT_STATUS = {REPORT_ACK: 'submitted', REPORT_REJECTED: 'rejected', REPORT_CANCELLED: 'cancelled'}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_gateway_client():
+    """获取订单流使用的Redis客户端（进程内单例）"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = redis.from_url(
+                    getattr(settings, 'ORDER_GATEWAY_REDIS_URL', 'redis://localhost:6379/0'),
+                    decode_responses=True,
+                )
+    return _client
+
+
+def report_stream(name: str) -> str:
+    return f"{REPORT_STREAM_PREFIX}:{name}"
+
+
+# 没有指定 reply_to 的请求（手工下单、其他调用方）的回报流
+DEFAULT_REPORT_STREAM = report_stream('default')
+
+
+class OrderRejected(Exception):
+    """订单请求无效或被交易所拒绝"""
+    pass
+
+
+class RiskRejected(OrderRejected):
+    """订单未通过下单前风控检查"""
+
+    def __init__(self, result):
+        super().__init__(result.error)
+        self.reasons = result.to_dict()['reasons']
+
+
+class OrderPending(Exception):
+    """下单或撤单请求的结果未知（网络错误、超时），需要稍后按客户端订单号确认"""
+    pass
+
+
+class OrderChannel:
+    """订单流和回报流的读写"""
+
+    def __init__(self, client=None, maxlen: Optional[int] = None):
+        self.client = client or get_gateway_client()
+        self.maxlen = maxlen if maxlen is not None else getattr(settings, 'ORDER_GATEWAY_STREAM_MAXLEN', 100000)
+        self._drained = set()
+        self._groups = set()
+
+    @staticmethod
+    def order_stream(exchange: str) -> str:
+        return f"{ORDER_STREAM_PREFIX}:{exchange}"
+
+    @staticmethod
+    def heartbeat_key(exchange: str) -> str:
+        return f"{HEARTBEAT_KEY_PREFIX}:{exchange}"
+
+    def _encode(self, payload: Dict[str, Any]) -> Dict[str, str]:
+        return {'d': json.dumps(payload, separators=(',', ':'), default=str)}
+
+    def submit(self, exchange: str, request: Dict[str, Any]) -> str:
+        """写入订单请求"""
+        return self.client.xadd(self.order_stream(exchange), self._encode(request), maxlen=self.maxlen, approximate=True)
+
+    def ensure_group(self, stream: str, group: str, start_id: str = '0'):
+        if (stream, group) in self._groups:
+            return
+        try:
+            self.client.xgroup_create(stream, group, id=start_id, mkstream=True)
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._groups.add((stream, group))
+
+    def read(self, stream: str, group: str, consumer: str, count: int = 100,
+             block: Optional[int] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        以消费者组读取 (流ID, 内容)
+
+        首次调用先取回该消费者已投递未确认的消息（重启前没处理完的部分）。
+        """
+        self.ensure_group(stream, group)
+        key = (stream, group, consumer)
+        if key not in self._drained:
+            entries = self._parse(self.client.xreadgroup(group, consumer, {stream: '0'}, count=count))
+            if entries:
+                return entries
+            self._drained.add(key)
+        return self._parse(self.client.xreadgroup(group, consumer, {stream: '>'}, count=count, block=block))
+
+    @staticmethod
+    def _parse(response) -> List[Tuple[str, Dict[str, Any]]]:
+        entries = []
+        for _, items in response or []:
+            for entry_id, fields in items:
+                if fields:
+                    entries.append((entry_id, json.loads(fields['d'])))
+        return entries
+
+    def ack(self, stream: str, group: str, entry_ids: Iterable[str]) -> int:
+        entry_ids = list(entry_ids)
+        return self.client.xack(stream, group, *entry_ids) if entry_ids else 0
+
+    def publish(self, reports: Iterable[Dict[str, Any]], ack: Optional[Tuple[str, str, str]] = None):
+        """
+        写入回报，可同时确认订单流中的消息（同一管道一次往返）
+
+        Args:
+            ack: (流, 消费者组, 流ID)
+        """
+        pipe = self.client.pipeline(transaction=False)
+        for report in reports:
+            stream = report.pop('reply_to', None) or DEFAULT_REPORT_STREAM
+            pipe.xadd(stream, self._encode(report), maxlen=self.maxlen, approximate=True)
+        if ack is not None:
+            pipe.xack(*ack)
+        pipe.execute()
+
+    def heartbeat(self, exchange: str, consumer: str, ttl: float):
+        self.client.set(self.heartbeat_key(exchange), consumer, px=int(ttl * 1000))
+
+    def clear_heartbeat(self, exchange: str, consumer: str):
+        key = self.heartbeat_key(exchange)
+        if self.client.get(key) == consumer:
+            self.client.delete(key)
+
+    def gateway_alive(self, exchange: str) -> bool:
+        return bool(self.client.exists(self.heartbeat_key(exchange)))
+
+
+class OrderDispatcher:
+    """
+    订单出口
+
+    请求中交易所的网关在线时写入订单流，否则（或写入失败时）提交 execute_order 任务。
+    网关是否在线按 check_interval 秒缓存，不会每单查询一次心跳。
+    """
+
+    def __init__(self, channel: Optional[OrderChannel] = None, check_interval: Optional[float] = None):
+        self._channel = channel
+        self.check_interval = check_interval if check_interval is not None else getattr(
+            settings, 'ORDER_GATEWAY_CHECK_INTERVAL', 1.0)
+        self._alive: Dict[str, Tuple[float, bool]] = {}
+
+    @property
+    def channel(self) -> OrderChannel:
+        if self._channel is None:
+            self._channel = OrderChannel()
+        return self._channel
+
+    def _gateway_alive(self, exchange: str) -> bool:
+        cached = self._alive.get(exchange)
+        now = time.monotonic()
+        if cached is None or now - cached[0] >= self.check_interval:
+            try:
+                alive = self.channel.gateway_alive(exchange)
+            except redis.RedisError as e:
+                logger.warning(f"查询订单网关心跳失败 {exchange}: {e}")
+                alive = False
+            cached = self._alive[exchange] = (now, alive)
+        return cached[1]
+
+    def __call__(self, request: Dict[str, Any]) -> str:
+        """
+        发送订单请求
+
+        Returns:
+            'gateway' 或 'celery'
+        """
+        request = {**request, 'sent_ts': now_ms()}
+        exchange = request.get('exchange')
+        if exchange and self._gateway_alive(exchange):
+            try:
+                self.channel.submit(exchange, request)
+                return 'gateway'
+            except redis.RedisError as e:
+                logger.warning(f"写入订单流失败，回退到任务队列 {request.get('client_order_id')}: {e}")
+                self._alive.pop(exchange, None)
+        from .tasks import execute_order
+        execute_order.delay(request['client_order_id'], request)
+        return 'celery'
+
+    def submit_batch(self, exchange: str, exchange_account_id: int, orders: List[Dict[str, Any]],
+                     reply_to: Optional[str] = None, batch_id: Optional[str] = None) -> str:
+        """
+        批量下单：同一账户的多个订单作为一个请求发送
+
+        每个订单的回报与单独下单相同，另有一条汇总回报（REPORT_BATCH）写入 reply_to。
+        """
+        return self({
+            'action': ACTION_BATCH, 'exchange': exchange, 'exchange_account_id': exchange_account_id,
+            'client_order_id': batch_id or make_client_order_id('batch', *(order['client_order_id'] for order in orders)),
+            'orders': orders, 'reply_to': reply_to,
+        })
+
+    def cancel_all(self, exchange: str, exchange_account_id: int, symbols: Optional[Iterable[str]] = None,
+                   reply_to: Optional[str] = None) -> str:
+        """撤销账户（指定交易对）的全部挂单"""
+        return self({
+            'action': ACTION_CANCEL_ALL, 'exchange': exchange, 'exchange_account_id': exchange_account_id,
+            'client_order_id': make_client_order_id('cxall', exchange_account_id, time.time_ns()),
+            'symbols': sorted(symbols) if symbols else None, 'reply_to': reply_to,
+        })
+
+
+_dispatcher: Optional[OrderDispatcher] = None
+
+
+def get_order_dispatcher() -> OrderDispatcher:
+    """获取进程内共享的订单出口"""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = OrderDispatcher()
+    return _dispatcher
+
+
+# ---------------------------------------------------------------------------
+# 请求与回报转换（网关和 execute_order 共用）
+# ---------------------------------------------------------------------------
+
+def get_pretrade_checker():
+    """下单前风控检查（PRETRADE_CHECK_ENABLED 关闭时为 None）"""
+    if not getattr(settings, 'PRETRADE_CHECK_ENABLED', False):
+        return None
+    from apps.risk.pretrade import get_pretrade_checker as get_checker
+    return get_checker()
+
+
+def order_params(request: Dict[str, Any]) -> Tuple[str, str, str, float, Optional[float], Dict[str, Any]]:
+    """
+    订单请求转换为 ccxt create_order 的参数
+
+    Returns:
+        (交易对, 类型, 方向, 数量, 价格, params)
+    """
+    order_type = request.get('order_type') or 'market'
+    params: Dict[str, Any] = {'clientOrderId': request['client_order_id']}
+    if request.get('reduce_only'):
+        params['reduceOnly'] = True
+    if request.get('time_in_force'):
+        params['timeInForce'] = request['time_in_force']
+    if order_type in ('stop', 'stop_limit'):
+        if request.get('stop_price') is None:
+            raise OrderRejected('止损单缺少触发价')
+        params['stopPrice'] = float(request['stop_price'])
+    elif order_type not in ('market', 'limit'):
+        raise OrderRejected(f'交易所不支持的订单类型: {order_type}')
+    ccxt_type = 'limit' if order_type in ('limit', 'stop_limit') else 'market'
+    price = request.get('price') if ccxt_type == 'limit' else None
+    if ccxt_type == 'limit' and price is None:
+        raise OrderRejected('限价单缺少价格')
+    amount = float(request['amount'])
+    if amount <= 0:
+        raise OrderRejected('订单数量必须大于0')
+    return request['symbol'], ccxt_type, request['side'], amount, float(price) if price is not None else None, params
+
+
+@dataclass
+class TrackedOrder:
+    """已提交、尚未结束的订单，记录已推送的累计成交，用于计算增量回报"""
+    request: Dict[str, Any]
+    exchange_order_id: Optional[str] = None
+    filled: float = 0.0
+    cost: float = 0.0
+    fee: float = 0.0
+    done: bool = False
+    submitted_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def client_order_id(self) -> str:
+        return self.request['client_order_id']
+
+    def report(self, report_type: str, **fields) -> Dict[str, Any]:
+        request = self.request
+        return {
+            'type': report_type,
+            'client_order_id': request['client_order_id'],
+            'live_strategy_id': request.get('live_strategy_id'),
+            'exchange_account_id': request.get('exchange_account_id'),
+            'exchange_order_id': self.exchange_order_id,
+            'sent_ts': request.get('sent_ts'),
+            'ts': int(now_ms()),
+            'reply_to': request.get('reply_to'),
+            **fields,
+        }
+
+    def update(self, order: Dict[str, Any], ack: bool = False) -> List[Dict[str, Any]]:
+        """
+        根据 ccxt 返回的订单生成回报：确认（ack=True 时）、新增成交、撤销或拒绝
+
+        ccxt 的 filled、cost、fee 都是累计值，增量成交价由累计成交额之差推出。
+        """
+        reports = []
+        self.exchange_order_id = str(order.get('id') or self.exchange_order_id or '') or None
+        status = order.get('status')
+        if ack:
+            reports.append(self.report(REPORT_ACK, status=status))
+        filled = float(order.get('filled') or 0.0)
+        if filled > self.filled + 1e-12:
+            average = order.get('average') or order.get('price') or 0.0
+            cost = float(order.get('cost') or average * filled)
+            fee = float((order.get('fee') or {}).get('cost') or 0.0)
+            amount = filled - self.filled
+            reports.append(self.report(
+                REPORT_FILL, price=(cost - self.cost) / amount, amount=amount, fee=max(fee - self.fee, 0.0),
+                filled=filled,
+            ))
+            self.filled, self.cost, self.fee = filled, cost, max(fee, self.fee)
+        if status in ('canceled', 'cancelled', 'expired'):
+            reports.append(self.report(REPORT_CANCELLED))
+            self.done = True
+        elif status == 'rejected':
+            reports.append(self.report(REPORT_REJECTED, error='交易所拒绝'))
+            self.done = True
+        elif status == 'closed':
+            self.done = True
+        return reports
+
+
+def confirm_order(exchange, tracked: TrackedOrder) -> List[Dict[str, Any]]:
+    """
+    下单结果未知时按客户端订单号向交易所查询（同步 ccxt 实例）
+
+    交易所有该订单时返回确认和成交回报；没有时请求没有到达交易所，返回拒绝回报；
+    查询仍然失败时抛出 OrderPending。
+    """
+    import ccxt
+
+    request = tracked.request
+    try:
+        order = exchange.fetch_order(None, request['symbol'], {'clientOrderId': request['client_order_id']})
+    except ccxt.OrderNotFound:
+        return [tracked.report(REPORT_REJECTED, error='下单请求没有到达交易所')]
+    except ccxt.NetworkError as e:
+        raise OrderPending(str(e)) from e
+    return tracked.update(order, ack=True)
+
+
+# ---------------------------------------------------------------------------
+# 批量下单与全部撤单（网关和 execute_order 共用）
+# ---------------------------------------------------------------------------
+
+def batch_limit(exchange: str) -> int:
+    limits = {**BATCH_LIMITS, **getattr(settings, 'ORDER_BATCH_LIMITS', {})}
+    return limits.get(exchange) or getattr(settings, 'ORDER_BATCH_MAX_SIZE', 5)
+
+
+def chunked(items: List[Any], size: int) -> List[List[Any]]:
+    return [items[i:i + size] for i in range(0, len(items), max(size, 1))]
+
+
+def batch_children(request: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """批量请求展开为单个订单请求，账户、交易所和发送时间取批量请求的值"""
+    shared = {key: request.get(key) for key in ('exchange_account_id', 'exchange', 'sent_ts')}
+    return [
+        {'action': 'place', **order, **shared, 'reply_to': order.get('reply_to') or request.get('reply_to')}
+        for order in request.get('orders') or []
+    ]
+
+
+def order_spec(request: Dict[str, Any]) -> Dict[str, Any]:
+    """订单请求转换为 ccxt create_orders 的一项"""
+    symbol, order_type, side, amount, price, params = order_params(request)
+    return {'symbol': symbol, 'type': order_type, 'side': side, 'amount': amount, 'price': price, 'params': params}
+
+
+def batch_order_reports(tracked_orders: List[TrackedOrder], orders: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """批量下单接口按顺序返回的订单转换为回报，没有订单ID或状态为 rejected 的视为被拒绝"""
+    reports = []
+    for i, tracked in enumerate(tracked_orders):
+        order = orders[i] if i < len(orders or []) else None
+        if not order or not order.get('id') or order.get('status') == 'rejected':
+            error = (order or {}).get('info') or '批量下单没有返回该订单'
+            reports.append(tracked.report(REPORT_REJECTED, error=str(error)[:500]))
+            tracked.done = True
+        else:
+            reports.extend(tracked.update(order, ack=True))
+    return reports
+
+
+def cancelled_reports(tracked_orders: List[TrackedOrder], response) -> Tuple[List[Dict[str, Any]], List[TrackedOrder]]:
+    """
+    按撤单接口的返回生成撤单回报
+
+    返回订单列表时，只有列表中的订单视为已撤销，其余（可能已经成交）留待查询确认；
+    没有返回订单时视为全部撤销。
+
+    Returns:
+        (回报, 待确认的订单)
+    """
+    returned = {
+        str(order['id']): order for order in (response if isinstance(response, list) else [])
+        if isinstance(order, dict) and order.get('id')
+    }
+    reports, unconfirmed = [], []
+    for tracked in tracked_orders:
+        order = returned.get(tracked.exchange_order_id)
+        if returned and order is None:
+            unconfirmed.append(tracked)
+            continue
+        reports.extend(tracked.update({**(order or {}), 'status': 'canceled'}))
+    return reports, unconfirmed
+
+
+def batch_summary(request: Dict[str, Any], reports: List[Dict[str, Any]],
+                  extra: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    批量请求的汇总回报
+
+    results 中每个订单的 status：submitted、rejected、pending（结果未知，待确认）（下单），
+    cancelled、cancelling、failed（撤单），duplicate（重复投递，已经处理过）。
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    for report in reports:
+        status = RESULT_STATUS.get(report.get('type'))
+        if status is not None:
+            results[report['client_order_id']] = {'status': status, 'error': report.get('error')}
+    results.update(extra or {})
+    return {
+        'type': REPORT_BATCH,
+        'action': request.get('action'),
+        'client_order_id': request['client_order_id'],
+        'exchange_account_id': request.get('exchange_account_id'),
+        'sent_ts': request.get('sent_ts'),
+        'ts': int(now_ms()),
+        'reply_to': request.get('reply_to'),
+        'results': [{'client_order_id': client_order_id, **result} for client_order_id, result in results.items()],
+    }
+
+
+def cancel_targets(store: OrderStore, request: Dict[str, Any],
+                   open_orders: Optional[Dict[str, TrackedOrder]] = None) -> List[TrackedOrder]:
+    """全部撤单请求涉及的未完成订单（优先使用网关正在跟踪的实例）"""
+    open_orders = open_orders or {}
+    targets = []
+    for state in store.active_orders(int(request['exchange_account_id']), request.get('symbols')):
+        tracked = open_orders.get(state.client_order_id) or TrackedOrder(
+            {**state.request(), 'reply_to': request.get('reply_to')},
+            state.exchange_order_id or None, state.filled, state.filled * state.avg_price, state.fee,
+        )
+        targets.append(tracked)
+    return targets
+
+
+def sync_exchange(account):
+    """execute_order 使用的同步 ccxt 实例（连接器池）；模拟盘账户的状态在订单网关进程中，不能在这里执行"""
+    from apps.market.connector_pool import get_connector_pool
+    from .simulator import is_paper_account
+
+    if is_paper_account(account):
+        raise OrderRejected('模拟盘账户的订单需要由订单网关执行')
+    return get_connector_pool().get(account).exchange
+
+
+def execute_bulk_request(request: Dict[str, Any], channel: Optional[OrderChannel] = None,
+                         order_store: Optional[OrderStore] = None) -> List[Dict[str, Any]]:
+    """
+    同步执行批量下单或全部撤单（execute_order 任务的实现）
+
+    交易所提供批量接口（createOrders、cancelAllOrders、cancelOrders）时使用批量接口，否则逐个提交。
+    批量下单遇到网络错误时，结果未知的订单保持未提交状态，推送回报后抛出 OrderPending，
+    任务重试时（请求带 unconfirmed）按客户端订单号确认这些订单，不会重复下单。
+    """
+    import ccxt
+    from .models import ExchangeAccount
+
+    store = order_store or OrderStore()
+    account_id = int(request['exchange_account_id'])
+    account = ExchangeAccount.all_objects.filter(pk=account_id, is_active=True).first()
+    exchange, rejection = None, f'交易账户 {account_id} 不存在或未启用'
+    if account is not None:
+        try:
+            exchange = sync_exchange(account)
+        except OrderRejected as e:
+            rejection = str(e)
+    has = getattr(exchange, 'has', None) or {}
+    reports, extra, unknown = [], {}, []
+
+    if request['action'] == ACTION_BATCH:
+        children = batch_children(request)
+        store.load([child['client_order_id'] for child in children])
+        checker = get_pretrade_checker()
+        pending = []
+        for child in children:
+            state, created = store.create(child)
+            if not created and state.status != ORDER_NEW:
+                extra[child['client_order_id']] = {'status': 'duplicate', 'error': None}
+                continue
+            tracked = TrackedOrder(child)
+            if request.get('unconfirmed') and exchange is not None:
+                # 上次执行结果未知的订单：先确认，不重新检查、不重新提交
+                try:
+                    reports.extend(confirm_order(exchange, tracked))
+                except OrderPending:
+                    unknown.append(tracked)
+                continue
+            try:
+                if exchange is None:
+                    raise OrderRejected(rejection)
+                if checker is not None:
+                    result = checker.check(child)
+                    if not result.accepted:
+                        raise RiskRejected(result)
+                order_spec(child)
+                pending.append(tracked)
+            except RiskRejected as e:
+                reports.append(tracked.report(REPORT_REJECTED, error=str(e)[:500], risk=e.reasons))
+            except OrderRejected as e:
+                reports.append(tracked.report(REPORT_REJECTED, error=str(e)[:500]))
+
+        def place_each(tracked_orders):
+            for tracked in tracked_orders:
+                try:
+                    symbol, order_type, side, amount, price, params = order_params(tracked.request)
+                    reports.extend(tracked.update(
+                        exchange.create_order(symbol, order_type, side, amount, price, params), ack=True,
+                    ))
+                except ccxt.NetworkError as e:
+                    logger.warning(f"下单结果未知，稍后确认 {tracked.client_order_id}: {e}")
+                    unknown.append(tracked)
+                except ccxt.BaseError as e:
+                    reports.append(tracked.report(REPORT_REJECTED, error=str(e)[:500]))
+
+        if pending and has.get('createOrders'):
+            for chunk in chunked(pending, batch_limit(account.exchange)):
+                try:
+                    orders = exchange.create_orders([order_spec(tracked.request) for tracked in chunk])
+                except ccxt.NotSupported:
+                    # 部分市场类型（例如现货）没有批量接口
+                    place_each(chunk)
+                    continue
+                except ccxt.NetworkError as e:
+                    logger.warning(f"批量下单结果未知，稍后确认 {request['client_order_id']}: {e}")
+                    unknown.extend(chunk)
+                    continue
+                except ccxt.BaseError as e:
+                    reports.extend(tracked.report(REPORT_REJECTED, error=str(e)[:500]) for tracked in chunk)
+                    continue
+                reports.extend(batch_order_reports(chunk, orders))
+        else:
+            place_each(pending)
+        for tracked in unknown:
+            extra[tracked.client_order_id] = {'status': 'pending', 'error': None}
+    else:
+        store.load(active_only=True, exchange_account_ids=[account_id])
+        targets = cancel_targets(store, request)
+        by_symbol: Dict[str, List[TrackedOrder]] = {}
+        for tracked in targets:
+            if tracked.exchange_order_id is None:
+                extra[tracked.client_order_id] = {'status': 'failed', 'error': '订单尚未提交到交易所'}
+            else:
+                by_symbol.setdefault(tracked.request['symbol'], []).append(tracked)
+        for symbol in sorted(set(request.get('symbols') or ()) | set(by_symbol)):
+            tracked_orders = by_symbol.get(symbol, [])
+            try:
+                if exchange is None:
+                    raise OrderRejected(rejection)
+                if has.get('cancelAllOrders'):
+                    responses = [exchange.cancel_all_orders(symbol)]
+                elif has.get('cancelOrders'):
+                    responses = [exchange.cancel_orders([tracked.exchange_order_id for tracked in chunk], symbol)
+                                 for chunk in chunked(tracked_orders, batch_limit(account.exchange))]
+                else:
+                    responses = []
+                    for tracked in tracked_orders:
+                        try:
+                            responses.append([{'id': tracked.exchange_order_id,
+                                               **(exchange.cancel_order(tracked.exchange_order_id, symbol) or {})}])
+                        except ccxt.BaseError as e:
+                            extra[tracked.client_order_id] = {'status': 'failed', 'error': str(e)[:500]}
+            except (OrderRejected, ccxt.BaseError) as e:
+                for tracked in tracked_orders:
+                    extra[tracked.client_order_id] = {'status': 'failed', 'error': str(e)[:500]}
+                continue
+            response = [order for item in responses for order in (item if isinstance(item, list) else [])]
+            tracked_orders = [tracked for tracked in tracked_orders if tracked.client_order_id not in extra]
+            cancelled, unconfirmed = cancelled_reports(tracked_orders, response)
+            reports.extend(cancelled)
+            for tracked in unconfirmed:
+                extra[tracked.client_order_id] = {'status': 'cancelling', 'error': None}
+
+    for report in reports:
+        store.apply_report(report)
+    reports.append(batch_summary(request, reports, extra))
+    (channel or OrderChannel()).publish([dict(report) for report in reports])
+    store.flush()
+    if unknown:
+        raise OrderPending(f"{len(unknown)} 个订单的下单结果未知")
+    return reports
+
+
+def execute_order_request(request: Dict[str, Any], channel: Optional[OrderChannel] = None,
+                          order_store: Optional[OrderStore] = None) -> List[Dict[str, Any]]:
+    """
+    同步执行订单请求并推送回报（execute_order 任务的实现）
+
+    使用连接器池中预热的同步 ccxt 实例。撤单请求按客户端订单号撤销。
+    任务重试时，已经提交过的订单号直接跳过，不会重复下单。批量下单和全部撤单见 execute_bulk_request。
+
+    网络错误（超时、交易所不可用）时请求可能已经到达交易所，不作为拒绝：订单保持未提交状态并抛出
+    OrderPending，由任务稍后重试。重试的下单请求带 unconfirmed，先按客户端订单号确认，不重新提交。
+    """
+    if request.get('action') in (ACTION_BATCH, ACTION_CANCEL_ALL):
+        return execute_bulk_request(request, channel, order_store)
+    import ccxt
+    from .models import ExchangeAccount
+
+    store = order_store or OrderStore()
+    client_order_id = request['client_order_id']
+    existing = store.get(client_order_id) or next(iter(store.load([client_order_id])), None)
+    if request.get('action') != ACTION_CANCEL:
+        if existing is not None and existing.status != ORDER_NEW:
+            logger.info(f"订单已提交过，跳过 {client_order_id}: {existing.status}")
+            return []
+        if existing is None and 'symbol' in request:
+            store.create(request)
+    tracked = TrackedOrder(request, exchange_order_id=(existing.exchange_order_id or None) if existing else None)
+    checker = get_pretrade_checker()
+    unconfirmed = request.get('unconfirmed') and request.get('action') != ACTION_CANCEL
+    try:
+        if checker is not None and request.get('action') != ACTION_CANCEL and not unconfirmed:
+            result = checker.check(request)
+            if not result.accepted:
+                raise RiskRejected(result)
+        account = ExchangeAccount.all_objects.get(pk=request['exchange_account_id'], is_active=True)
+        exchange = sync_exchange(account)
+        if request.get('action') == ACTION_CANCEL:
+            order = exchange.cancel_order(
+                request.get('exchange_order_id') or tracked.exchange_order_id,
+                request.get('symbol') or (existing.symbol if existing else None),
+                {'clientOrderId': request['client_order_id']},
+            )
+            reports = tracked.update({**(order or {}), 'status': 'canceled'})
+        elif unconfirmed:
+            reports = confirm_order(exchange, tracked)
+        else:
+            symbol, order_type, side, amount, price, params = order_params(request)
+            reports = tracked.update(exchange.create_order(symbol, order_type, side, amount, price, params), ack=True)
+    except OrderPending:
+        store.flush()
+        raise
+    except ccxt.NetworkError as e:
+        store.flush()
+        raise OrderPending(str(e)) from e
+    except RiskRejected as e:
+        reports = [tracked.report(REPORT_REJECTED, error=str(e)[:500], risk=e.reasons)]
+    except (OrderRejected, ExchangeAccount.DoesNotExist, ccxt.InvalidOrder, ccxt.InsufficientFunds,
+            ccxt.BadSymbol, ccxt.AuthenticationError, ccxt.OrderNotFound) as e:
+        reports = [tracked.report(REPORT_REJECTED, error=str(e)[:500])]
+    for report in reports:
+        store.apply_report(report)
+    (channel or OrderChannel()).publish(reports)
+    store.flush()
+    return reports
+
+
+# ---------------------------------------------------------------------------
+# 网关进程
+# ---------------------------------------------------------------------------
+
+class AsyncRateLimiter:
+    """令牌桶：每 interval_ms 毫秒补充一个令牌，最多积累 burst 个"""
+
+    def __init__(self, interval_ms: float, burst: int = 1):
+        self.interval = max(interval_ms, 0.0) / 1000
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, cost: float = 1.0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if self.interval > 0:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) / self.interval)
+                else:
+                    self._tokens = self.burst
+                self._updated = now
+                if self._tokens >= cost:
+                    self._tokens -= cost
+                    return
+                await asyncio.sleep((cost - self._tokens) * self.interval)
+
+    def consume(self, cost: float = 1.0):
+        """立即扣除令牌，不等待（可以透支，之后的请求等待补足），用于不能排在下单之后的撤单"""
+        now = time.monotonic()
+        if self.interval > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) / self.interval)
+        else:
+            self._tokens = self.burst
+        self._updated = now
+        self._tokens -= cost
+
+
+def create_async_exchange(account):
+    """为交易账户创建 ccxt 异步实例（限速由网关的令牌桶负责）"""
+    import ccxt.async_support as ccxt_async
+
+    api_key, secret_key, passphrase = account.get_api_credentials()
+    config = {
+        'apiKey': api_key,
+        'secret': secret_key,
+        'sandbox': account.is_testnet,
+        'enableRateLimit': False,
+        'timeout': 10000,
+    }
+    if passphrase:
+        config['password'] = passphrase
+    return getattr(ccxt_async, account.exchange)(config)
+
+
+@dataclass
+class AccountSession:
+    """账户的常驻 ccxt 异步实例和限速器"""
+    account_id: int
+    exchange: Any
+    limiter: AsyncRateLimiter
+    orders: int = 0
+    errors: int = 0
+
+
+class OrderGateway:
+    """
+    单个交易所的订单网关
+
+    用法：
+        gateway = OrderGateway('binance')
+        asyncio.run(gateway.run(stop))
+    """
+
+    def __init__(self, exchange: str, channel: Optional[OrderChannel] = None, consumer: Optional[str] = None,
+                 exchange_factory: Optional[Callable[[Any], Any]] = None, account_loader: Optional[Callable] = None,
+                 max_inflight: Optional[int] = None, batch_size: Optional[int] = None,
+                 block_ms: Optional[int] = None, poll_interval: Optional[float] = None,
+                 heartbeat_interval: Optional[float] = None, max_age: Optional[float] = None,
+                 burst: Optional[int] = None, recorder=None, order_store: Optional[OrderStore] = None,
+                 pretrade=None, venue=None):
+        from .simulator import PaperTrading, get_simulated_venue, paper_exchange_factory, paper_trading_enabled
+
+        self.exchange = exchange
+        self._channel = channel
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        # venue 为模拟交易所时全部账户都在模拟交易所下单（压测）；开启模拟盘时测试网账户使用模拟交易所
+        self.paper = None
+        if venue is not None:
+            exchange_factory = exchange_factory or paper_exchange_factory(venue, paper_only=False)
+        elif exchange_factory is None and paper_trading_enabled():
+            self.paper = PaperTrading(get_simulated_venue(exchange))
+            exchange_factory = paper_exchange_factory(self.paper.venue, create_async_exchange)
+        self.exchange_factory = exchange_factory or create_async_exchange
+        self.account_loader = account_loader or self.load_accounts
+        self.max_inflight = max_inflight or getattr(settings, 'ORDER_GATEWAY_MAX_INFLIGHT', 50)
+        self.batch_size = batch_size or getattr(settings, 'ORDER_GATEWAY_BATCH_SIZE', 100)
+        self.block_ms = block_ms or getattr(settings, 'ORDER_GATEWAY_BLOCK_MS', 1000)
+        self.poll_interval = poll_interval or getattr(settings, 'ORDER_GATEWAY_POLL_INTERVAL', 2.0)
+        self.heartbeat_interval = heartbeat_interval or getattr(settings, 'ORDER_GATEWAY_HEARTBEAT_INTERVAL', 2.0)
+        self.max_age = max_age or getattr(settings, 'ORDER_GATEWAY_MAX_AGE', 10.0)
+        self.burst = burst or getattr(settings, 'ORDER_GATEWAY_BURST', 10)
+        self.recorder = recorder or get_latency_recorder(ORDER_GATEWAY)
+        self.orders = order_store or OrderStore()
+        self.pretrade = pretrade if pretrade is not None else get_pretrade_checker()
+
+        self.sessions: Dict[int, AccountSession] = {}
+        self.open_orders: Dict[str, TrackedOrder] = {}
+        self._session_locks: Dict[int, asyncio.Lock] = {}
+        self._submitting: set = set()
+        self._flush_wakeup: Optional[asyncio.Event] = None
+        self._inflight: set = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.processed = 0
+        self.rejected = 0
+
+    @property
+    def channel(self) -> OrderChannel:
+        if self._channel is None:
+            self._channel = OrderChannel()
+        return self._channel
+
+    @property
+    def stream(self) -> str:
+        return OrderChannel.order_stream(self.exchange)
+
+    # -- 账户会话 ------------------------------------------------------------
+
+    def load_accounts(self, account_ids: Optional[List[int]] = None) -> list:
+        from .models import ExchangeAccount
+
+        accounts = ExchangeAccount.all_objects.filter(exchange=self.exchange, is_active=True)
+        if account_ids is not None:
+            accounts = accounts.filter(pk__in=account_ids)
+        return list(accounts)
+
+    async def _open_session(self, account) -> AccountSession:
+        started = time.perf_counter()
+        exchange = self.exchange_factory(account)
+        try:
+            await exchange.load_markets()
+        except Exception as e:
+            # 预热失败不影响下单，ccxt 会在首次调用时再次加载
+            logger.warning(f"订单网关预加载市场信息失败 {self.exchange}#{account.pk}: {e}")
+        session = AccountSession(
+            account.pk, exchange, AsyncRateLimiter(getattr(exchange, 'rateLimit', 0) or 0, self.burst),
+        )
+        logger.info(f"订单网关账户会话就绪 {self.exchange}#{account.pk}: {(time.perf_counter() - started) * 1000:.1f}ms")
+        return session
+
+    async def warm_up(self):
+        """
+        启动时为全部启用的账户建立会话，并继续跟踪上次退出时未完成的订单
+
+        没有交易所订单号、发出时间已超过 max_age 的订单（下单结果未知，或者已经不会再被处理）
+        也加入跟踪，由轮询按客户端订单号确认。
+        """
+        accounts = await asyncio.to_thread(self.account_loader)
+        sessions = await asyncio.gather(*(self._open_session(account) for account in accounts))
+        for session in sessions:
+            self.sessions[session.account_id] = session
+        now = timezone.now()
+        for state in await asyncio.to_thread(self.orders.load, None, self.exchange, True):
+            if state.exchange_order_id:
+                self.open_orders[state.client_order_id] = TrackedOrder(
+                    state.request(), state.exchange_order_id, state.filled, state.filled * state.avg_price, state.fee,
+                )
+            elif state.sent_at is not None and (now - state.sent_at).total_seconds() > self.max_age:
+                self.open_orders[state.client_order_id] = TrackedOrder(state.request())
+
+    async def session(self, account_id: int) -> AccountSession:
+        session = self.sessions.get(account_id)
+        if session is not None:
+            return session
+        lock = self._session_locks.setdefault(account_id, asyncio.Lock())
+        async with lock:
+            session = self.sessions.get(account_id)
+            if session is None:
+                accounts = await asyncio.to_thread(self.account_loader, [account_id])
+                if not accounts:
+                    raise OrderRejected(f'交易账户 {account_id} 不存在或未启用')
+                session = self.sessions[account_id] = await self._open_session(accounts[0])
+        return session
+
+    async def close(self):
+        for session in self.sessions.values():
+            try:
+                await session.exchange.close()
+            except Exception as e:
+                logger.warning(f"关闭账户会话失败 {self.exchange}#{session.account_id}: {e}")
+        self.sessions.clear()
+
+    # -- 订单处理 ------------------------------------------------------------
+
+    def record(self, reports: List[Dict[str, Any]]):
+        """回报更新订单状态，缓冲区满时唤醒写入协程"""
+        for report in reports:
+            self.orders.apply_report(report)
+        if self._flush_wakeup is not None and self.orders.pending >= self.orders.batch_size:
+            self._flush_wakeup.set()
+
+    async def handle(self, request: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """处理一个订单请求，返回需要推送的回报"""
+        action = request.get('action')
+        if action == ACTION_CANCEL:
+            return await self.cancel(request)
+        if action == ACTION_BATCH:
+            return await self.place_batch(request)
+        if action == ACTION_CANCEL_ALL:
+            return await self.cancel_all(request)
+        client_order_id = request['client_order_id']
+        if client_order_id in self._submitting or client_order_id in self.open_orders:
+            # 正在提交，或者已在跟踪（包括下单结果未知、等待确认的订单）
+            return []
+        state, created = self.orders.create(request)
+        if not created and state.status != ORDER_NEW:
+            # 重复投递的请求
+            return []
+        self._submitting.add(client_order_id)
+        try:
+            reports = await self._submit(TrackedOrder(request))
+        finally:
+            self._submitting.discard(client_order_id)
+        self.record(reports)
+        return reports
+
+    async def _precheck(self, tracked: TrackedOrder) -> Optional[List[Dict[str, Any]]]:
+        """过期和风控检查，不通过时返回拒绝回报"""
+        request = tracked.request
+        sent_ts = request.get('sent_ts')
+        if sent_ts and now_ms() - sent_ts > self.max_age * 1000:
+            self.rejected += 1
+            return [tracked.report(REPORT_REJECTED, error='订单请求已过期')]
+        if self.pretrade is not None:
+            if self.pretrade.needs_refresh(request):
+                await asyncio.to_thread(self.pretrade.refresh, request)
+            result = self.pretrade.check(request)
+            if not result.accepted:
+                self.rejected += 1
+                logger.warning(f"订单未通过风控 {tracked.client_order_id}: {result.error}")
+                return [tracked.report(REPORT_REJECTED, error=result.error[:500], risk=result.to_dict()['reasons'])]
+        return None
+
+    async def _submit(self, tracked: TrackedOrder) -> List[Dict[str, Any]]:
+        rejected = await self._precheck(tracked)
+        if rejected is not None:
+            return rejected
+        return await self._place(tracked)
+
+    async def _place(self, tracked: TrackedOrder) -> List[Dict[str, Any]]:
+        """
+        提交单个订单
+
+        网络错误（超时、交易所不可用）时请求可能已经到达交易所，不作为拒绝：订单以没有交易所订单号的状态
+        加入跟踪，由轮询按客户端订单号确认。
+        """
+        import ccxt
+
+        request = tracked.request
+        try:
+            symbol, order_type, side, amount, price, params = order_params(request)
+            session = await self.session(int(request['exchange_account_id']))
+            await session.limiter.acquire()
+            started = time.perf_counter()
+            order = await session.exchange.create_order(symbol, order_type, side, amount, price, params)
+            self.recorder.observe('exchange', (time.perf_counter() - started) * 1000, self.exchange)
+            session.orders += 1
+        except ccxt.NetworkError as e:
+            self._unconfirmed(tracked, e)
+            return []
+        except Exception as e:
+            return self._reject(tracked, e)
+        reports = tracked.update(order, ack=True)
+        if not tracked.done:
+            self.open_orders[tracked.client_order_id] = tracked
+        return reports
+
+    def _unconfirmed(self, tracked: TrackedOrder, error: Exception):
+        logger.warning(f"下单结果未知，按客户端订单号确认 {tracked.client_order_id}: {error}")
+        tracked.submitted_at = time.monotonic()
+        self.open_orders[tracked.client_order_id] = tracked
+
+    def _track(self, tracked_orders: List[TrackedOrder]):
+        for tracked in tracked_orders:
+            if not tracked.done and tracked.exchange_order_id:
+                self.open_orders[tracked.client_order_id] = tracked
+
+    async def place_batch(self, request: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        批量下单
+
+        逐个检查后，交易所有 createOrders 时按 batch_limit 分组并发调用批量接口，否则并发逐个提交。
+        返回每个订单的回报和一条汇总回报。
+        """
+        import ccxt
+
+        pending, reports, extra = [], [], {}
+        for child in batch_children(request):
+            client_order_id = child['client_order_id']
+            state, created = self.orders.create(child)
+            if (client_order_id in self._submitting or client_order_id in self.open_orders
+                    or (not created and state.status != ORDER_NEW)):
+                extra[client_order_id] = {'status': 'duplicate', 'error': None}
+                continue
+            self._submitting.add(client_order_id)
+            pending.append(TrackedOrder(child))
+        try:
+            ready = []
+            for tracked in pending:
+                rejected = await self._precheck(tracked)
+                if rejected is None:
+                    try:
+                        order_spec(tracked.request)
+                        ready.append(tracked)
+                        continue
+                    except OrderRejected as e:
+                        rejected = self._reject(tracked, e)
+                reports.extend(rejected)
+            session = None
+            if ready:
+                try:
+                    session = await self.session(int(request['exchange_account_id']))
+                except Exception as e:
+                    for tracked in ready:
+                        reports.extend(self._reject(tracked, e))
+            if session is not None and (getattr(session.exchange, 'has', None) or {}).get('createOrders'):
+
+                async def place_chunk(chunk: List[TrackedOrder]) -> List[Dict[str, Any]]:
+                    await session.limiter.acquire()
+                    try:
+                        started = time.perf_counter()
+                        orders = await session.exchange.create_orders([order_spec(t.request) for t in chunk])
+                        self.recorder.observe('exchange', (time.perf_counter() - started) * 1000, self.exchange)
+                    except ccxt.NotSupported:
+                        # 部分市场类型（例如现货）没有批量接口
+                        results = await asyncio.gather(*(self._place(tracked) for tracked in chunk))
+                        return [report for result in results for report in result]
+                    except ccxt.NetworkError as e:
+                        for tracked in chunk:
+                            self._unconfirmed(tracked, e)
+                        return []
+                    except Exception as e:
+                        return [report for tracked in chunk for report in self._reject(tracked, e)]
+                    session.orders += len(chunk)
+                    chunk_reports = batch_order_reports(chunk, orders)
+                    self.rejected += sum(1 for report in chunk_reports if report['type'] == REPORT_REJECTED)
+                    self._track(chunk)
+                    return chunk_reports
+
+                results = await asyncio.gather(
+                    *(place_chunk(chunk) for chunk in chunked(ready, batch_limit(self.exchange)))
+                )
+            elif session is not None:
+                results = await asyncio.gather(*(self._place(tracked) for tracked in ready))
+            else:
+                results = []
+            for result in results:
+                reports.extend(result)
+            for tracked in ready:
+                if tracked.exchange_order_id is None and self.open_orders.get(tracked.client_order_id) is tracked:
+                    extra[tracked.client_order_id] = {'status': 'pending', 'error': None}
+        finally:
+            for tracked in pending:
+                self._submitting.discard(tracked.client_order_id)
+        self.record(reports)
+        return reports + [batch_summary(request, reports, extra)]
+
+    async def cancel_all(self, request: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        撤销账户（指定交易对）的全部挂单
+
+        每个交易对一次 cancelAllOrders（或按 batch_limit 分组的 cancelOrders，或逐个撤单），全部并发发出。
+        撤单不排在下单之后：直接扣除令牌桶（可以透支），整个撤单在一个限速窗口内完成。
+        """
+        account_id = int(request['exchange_account_id'])
+        targets = cancel_targets(self.orders, request, self.open_orders)
+        extra: Dict[str, Dict[str, Any]] = {}
+        by_symbol: Dict[str, List[TrackedOrder]] = {}
+        for tracked in targets:
+            if tracked.exchange_order_id is None:
+                extra[tracked.client_order_id] = {'status': 'failed', 'error': '订单尚未提交到交易所'}
+            else:
+                by_symbol.setdefault(tracked.request['symbol'], []).append(tracked)
+        symbols = sorted(set(request.get('symbols') or ()) | set(by_symbol))
+        try:
+            session = await self.session(account_id) if symbols else None
+        except Exception as e:
+            for tracked_orders in by_symbol.values():
+                for tracked in tracked_orders:
+                    extra[tracked.client_order_id] = {'status': 'failed', 'error': str(e)[:500]}
+            return [batch_summary(request, [], extra)]
+        reports = []
+        if session is not None:
+            exchange, has = session.exchange, getattr(session.exchange, 'has', None) or {}
+
+            async def cancel_one(tracked: TrackedOrder, symbol: str):
+                order = await exchange.cancel_order(tracked.exchange_order_id, symbol)
+                return [{'id': tracked.exchange_order_id, **(order or {})}]
+
+            async def cancel_symbol(symbol: str):
+                tracked_orders = by_symbol.get(symbol, [])
+                if has.get('cancelAllOrders'):
+                    calls = [exchange.cancel_all_orders(symbol)]
+                elif has.get('cancelOrders'):
+                    calls = [exchange.cancel_orders([t.exchange_order_id for t in chunk], symbol)
+                             for chunk in chunked(tracked_orders, batch_limit(self.exchange))]
+                else:
+                    calls = [cancel_one(tracked, symbol) for tracked in tracked_orders]
+                session.limiter.consume(len(calls))
+                responses = await asyncio.gather(*calls, return_exceptions=True)
+                if has.get('cancelAllOrders') and isinstance(responses[0], Exception):
+                    for tracked in tracked_orders:
+                        extra[tracked.client_order_id] = {'status': 'failed', 'error': str(responses[0])[:500]}
+                    return
+                if not has.get('cancelAllOrders') and not has.get('cancelOrders'):
+                    for tracked, response in zip(tracked_orders, responses):
+                        if isinstance(response, Exception):
+                            extra[tracked.client_order_id] = {'status': 'failed', 'error': str(response)[:500]}
+                elif any(isinstance(response, Exception) for response in responses):
+                    for chunk, response in zip(chunked(tracked_orders, batch_limit(self.exchange)), responses):
+                        if isinstance(response, Exception):
+                            for tracked in chunk:
+                                extra[tracked.client_order_id] = {'status': 'failed', 'error': str(response)[:500]}
+                response = [
+                    order for item in responses if isinstance(item, list) for order in item
+                ]
+                cancelled, unconfirmed = cancelled_reports(
+                    [t for t in tracked_orders if t.client_order_id not in extra], response,
+                )
+                reports.extend(cancelled)
+                for tracked in unconfirmed:
+                    # 没有出现在撤单结果中，可能已经成交，继续查询确认
+                    extra[tracked.client_order_id] = {'status': 'cancelling', 'error': None}
+                    self.open_orders[tracked.client_order_id] = tracked
+
+            await asyncio.gather(*(cancel_symbol(symbol) for symbol in symbols))
+        for report in reports:
+            self.open_orders.pop(report['client_order_id'], None)
+        self.record(reports)
+        logger.info(f"全部撤单 {self.exchange}#{account_id}: 撤销 {len(reports)} 个订单, {len(extra)} 个未完成")
+        return reports + [batch_summary(request, reports, extra)]
+
+    def _reject(self, tracked: TrackedOrder, error: Exception) -> List[Dict[str, Any]]:
+        self.rejected += 1
+        session = self.sessions.get(tracked.request.get('exchange_account_id'))
+        if session is not None:
+            session.errors += 1
+        logger.warning(f"订单被拒绝 {tracked.client_order_id}: {error}")
+        return [tracked.report(REPORT_REJECTED, error=str(error)[:500])]
+
+    async def cancel(self, request: Dict[str, Any]) -> List[Dict[str, Any]]:
+        tracked = self.open_orders.get(request['client_order_id'])
+        if tracked is None:
+            state = self.orders.get(request['client_order_id'])
+            tracked = TrackedOrder(
+                {**state.request(), 'reply_to': request.get('reply_to')} if state else request,
+                exchange_order_id=(state.exchange_order_id or None) if state else None,
+            )
+        symbol = tracked.request.get('symbol') or request.get('symbol')
+        try:
+            session = await self.session(int(request['exchange_account_id']))
+            await session.limiter.acquire()
+            order = await session.exchange.cancel_order(
+                tracked.exchange_order_id, symbol, {'clientOrderId': request['client_order_id']},
+            )
+        except Exception as e:
+            logger.warning(f"撤单失败 {request['client_order_id']}: {e}")
+            return []
+        reports = tracked.update({**(order or {}), 'status': 'canceled'})
+        self.open_orders.pop(tracked.client_order_id, None)
+        self.record(reports)
+        return reports
+
+    async def poll_open_orders(self) -> List[Dict[str, Any]]:
+        """
+        查询未完成订单的状态，返回新增成交和结束回报
+
+        下单结果未知（没有交易所订单号）的订单在提交 poll_interval 之后按客户端订单号查询：
+        交易所有该订单时推送确认回报并继续跟踪，没有时推送拒绝回报。
+        """
+        import ccxt
+
+        reports = []
+
+        async def poll(tracked: TrackedOrder):
+            session = self.sessions.get(int(tracked.request['exchange_account_id']))
+            confirming = tracked.exchange_order_id is None
+            if session is None or (confirming and time.monotonic() - tracked.submitted_at < self.poll_interval):
+                return
+            try:
+                await session.limiter.acquire()
+                if confirming:
+                    order = await session.exchange.fetch_order(
+                        None, tracked.request['symbol'], {'clientOrderId': tracked.client_order_id},
+                    )
+                else:
+                    order = await session.exchange.fetch_order(tracked.exchange_order_id, tracked.request['symbol'])
+            except ccxt.OrderNotFound as e:
+                if not confirming:
+                    logger.warning(f"查询订单失败 {tracked.client_order_id}: {e}")
+                    return
+                tracked.done = True
+                reports.extend(self._reject(tracked, OrderRejected('下单请求没有到达交易所')))
+                self.open_orders.pop(tracked.client_order_id, None)
+                return
+            except Exception as e:
+                logger.warning(f"查询订单失败 {tracked.client_order_id}: {e}")
+                return
+            reports.extend(tracked.update(order, ack=confirming))
+            if tracked.done:
+                self.open_orders.pop(tracked.client_order_id, None)
+
+        await asyncio.gather(*(poll(tracked) for tracked in list(self.open_orders.values())))
+        self.record(reports)
+        return reports
+
+    async def _process(self, entry_id: str, request: Dict[str, Any]):
+        picked = now_ms()
+        try:
+            reports = await self.handle(request)
+        except Exception as e:
+            logger.error(f"订单请求处理失败 {request.get('client_order_id')}: {e}")
+            reports = []
+        finally:
+            self._semaphore.release()
+        await asyncio.to_thread(self.channel.publish, reports, (self.stream, GATEWAY_GROUP, entry_id))
+        self.processed += 1
+        sent_ts = request.get('sent_ts')
+        if sent_ts:
+            self.recorder.observe('queue', picked - sent_ts, self.exchange)
+            self.recorder.observe('ack', now_ms() - sent_ts, self.exchange)
+
+    # -- 事件循环 ------------------------------------------------------------
+
+    async def _consume_loop(self, stop: asyncio.Event):
+        while not stop.is_set():
+            entries = await asyncio.to_thread(
+                self.channel.read, self.stream, GATEWAY_GROUP, self.consumer, self.batch_size, self.block_ms,
+            )
+            for entry_id, request in entries:
+                await self._semaphore.acquire()
+                task = asyncio.create_task(self._process(entry_id, request))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+
+    async def _poll_loop(self, stop: asyncio.Event):
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self.open_orders:
+                reports = await self.poll_open_orders()
+                if reports:
+                    await asyncio.to_thread(self.channel.publish, reports)
+
+    async def _flush_loop(self, stop: asyncio.Event):
+        """按间隔（或缓冲区满时）把订单状态写入数据库"""
+        while not stop.is_set():
+            self._flush_wakeup.clear()
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), timeout=self.orders.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self.orders.pending:
+                await asyncio.to_thread(self.orders.flush)
+
+    async def _heartbeat_loop(self, stop: asyncio.Event):
+        while not stop.is_set():
+            await asyncio.to_thread(self.channel.heartbeat, self.exchange, self.consumer, self.heartbeat_interval * 3)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.heartbeat_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, stop: Optional[asyncio.Event] = None):
+        """预热账户会话后运行直到 stop 被设置"""
+        stop = stop or asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.max_inflight)
+        self._flush_wakeup = asyncio.Event()
+        await self.warm_up()
+        await asyncio.to_thread(self.channel.ensure_group, self.stream, GATEWAY_GROUP)
+        logger.info(f"订单网关启动 {self.exchange}: {len(self.sessions)}个账户, 消费者 {self.consumer}")
+        try:
+            loops = [self._consume_loop(stop), self._poll_loop(stop), self._heartbeat_loop(stop), self._flush_loop(stop)]
+            if self.paper is not None:
+                loops.append(self.paper.run(stop))
+            await asyncio.gather(*loops)
+        finally:
+            if self._inflight:
+                await asyncio.gather(*self._inflight, return_exceptions=True)
+            await asyncio.to_thread(self.orders.flush)
+            await asyncio.to_thread(self.channel.clear_heartbeat, self.exchange, self.consumer)
+            await self.close()
+            self.recorder.flush()
+            logger.info(f"订单网关已停止 {self.exchange}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'exchange': self.exchange,
+            'processed': self.processed,
+            'rejected': self.rejected,
+            'open_orders': len(self.open_orders),
+            'inflight': len(self._inflight),
+            'orders': self.orders.stats(),
+            'accounts': {
+                session.account_id: {'orders': session.orders, 'errors': session.errors}
+                for session in self.sessions.values()
+            },
+        }
@@ -0,0 +1,34 @@
+"""
+运行算法执行引擎的管理命令
+"""
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from apps.trading.algos import AlgoEngine
+
+
+class Command(BaseCommand):
+    help = '运行算法执行引擎，把 TWAP/VWAP/冰山算法单拆分为子单经订单网关执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--consumer',
+            type=str,
+            default=None,
+            help='消费者名称，决定回报流，重启时应保持不变 (默认: 主机名)'
+        )
+
+    def handle(self, *args, **options):
+        engine = AlgoEngine(consumer=options['consumer'])
+        self.stdout.write(f'算法执行引擎启动: 消费者 {engine.consumer}')
+        asyncio.run(self._run(engine))
+        self.stdout.write(self.style.SUCCESS('算法执行引擎已停止'))
+
+    async def _run(self, engine: AlgoEngine):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await engine.run(stop)
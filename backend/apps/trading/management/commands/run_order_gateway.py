@@ -0,0 +1,40 @@
+"""
+运行订单网关的管理命令
+"""
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from apps.trading.gateway import OrderGateway
+
+
+class Command(BaseCommand):
+    help = '运行单个交易所的订单网关，消费订单流并推送执行回报'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--exchange',
+            type=str,
+            required=True,
+            help='交易所代码，例如 binance'
+        )
+        parser.add_argument(
+            '--consumer',
+            type=str,
+            default=None,
+            help='消费者名称 (默认: 主机名-进程号)'
+        )
+
+    def handle(self, *args, **options):
+        gateway = OrderGateway(options['exchange'], consumer=options['consumer'])
+        self.stdout.write(f'订单网关启动: {gateway.exchange}, 消费者 {gateway.consumer}')
+        asyncio.run(self._run(gateway))
+        self.stdout.write(self.style.SUCCESS('订单网关已停止'))
+
+    async def _run(self, gateway: OrderGateway):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await gateway.run(stop)
@@ -0,0 +1,34 @@
+"""
+运行持仓引擎的管理命令
+"""
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from apps.trading.positions import PositionEngine
+
+
+class Command(BaseCommand):
+    help = '运行持仓引擎，按成交和行情实时计算持仓和盈亏'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--consumer',
+            type=str,
+            default=None,
+            help='消费者名称 (默认: 主机名)'
+        )
+
+    def handle(self, *args, **options):
+        engine = PositionEngine(consumer=options['consumer'])
+        self.stdout.write(f'持仓引擎启动: 消费者 {engine.consumer}')
+        asyncio.run(self._run(engine))
+        self.stdout.write(self.style.SUCCESS('持仓引擎已停止'))
+
+    async def _run(self, engine: PositionEngine):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await engine.run(stop)
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+交易管理数据模型
+"""
+import base64
+import hashlib
+
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from django.db import models
+from django.contrib.auth import get_user_model
+from apps.core.models import TenantModel
+
+User = get_user_model()
+
+
+def _get_fernet() -> Fernet:
+    """由 ENCRYPTION_KEY 派生对称加密密钥"""
+    digest = hashlib.sha256(settings.ENCRYPTION_KEY.encode('utf-8')).digest()
+    return Fernet(base64.urlsafe_b64encode(digest))
+
+
+def encrypt_secret(value: str) -> str:
+    """加密敏感字段"""
+    if not value:
+        return ''
+    return _get_fernet().encrypt(value.encode('utf-8')).decode('ascii')
+
+
+def decrypt_secret(value: str) -> str:
+    """解密敏感字段"""
+    if not value:
+        return ''
+    try:
+        return _get_fernet().decrypt(value.encode('ascii')).decode('utf-8')
+    except InvalidToken:
+        raise ValueError('API密钥解密失败，请检查 ENCRYPTION_KEY 配置')
+
+
+class ExchangeAccount(TenantModel):
+    """交易所账户模型"""
+
+    EXCHANGE_CHOICES = [
+        ('binance', 'Binance'),
+        ('okx', 'OKX'),
+        ('huobi', 'Huobi'),
+        ('bybit', 'Bybit'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='exchange_accounts', verbose_name='所属用户')
+    name = models.CharField(max_length=100, verbose_name='账户名称')
+    exchange = models.CharField(max_length=20, choices=EXCHANGE_CHOICES, verbose_name='交易所')  # ccxt交易所ID
+
+    # API凭证（加密存储）
+    api_key = models.TextField(verbose_name='API Key')
+    secret_key = models.TextField(verbose_name='Secret Key')
+    passphrase = models.TextField(blank=True, default='', verbose_name='Passphrase')
+
+    is_testnet = models.BooleanField(default=False, verbose_name='是否测试网')
+    is_active = models.BooleanField(default=True, verbose_name='是否激活')
+
+    class Meta:
+        verbose_name = '交易所账户'
+        verbose_name_plural = '交易所账户'
+        db_table = 'trading_exchange_account'
+        unique_together = ['tenant', 'name']
+        indexes = [
+            models.Index(fields=['tenant', 'exchange', 'is_active']),
+        ]
+
+    def __str__(self):
+        return f"{self.name}({self.exchange})"
+
+    def set_api_credentials(self, api_key: str, secret_key: str, passphrase: str = ''):
+        """加密并设置API凭证"""
+        self.api_key = encrypt_secret(api_key)
+        self.secret_key = encrypt_secret(secret_key)
+        self.passphrase = encrypt_secret(passphrase)
+
+    def get_api_credentials(self) -> tuple:
+        """
+        解密API凭证
+
+        Returns:
+            (api_key, secret_key, passphrase)
+        """
+        return (
+            decrypt_secret(self.api_key),
+            decrypt_secret(self.secret_key),
+            decrypt_secret(self.passphrase) or None,
+        )
+
+
+class Order(TenantModel):
+    """
+    订单模型
+
+    以客户端订单号唯一标识，状态由 apps.trading.orders 的状态机维护并批量写入。
+    """
+
+    STATUS_CHOICES = [
+        ('new', '新建'),
+        ('submitted', '已提交'),
+        ('partial', '部分成交'),
+        ('filled', '完全成交'),
+        ('cancelled', '已撤销'),
+        ('rejected', '已拒绝'),
+    ]
+    SIDE_CHOICES = [
+        ('buy', '买入'),
+        ('sell', '卖出'),
+    ]
+    TYPE_CHOICES = [
+        ('market', '市价'),
+        ('limit', '限价'),
+        ('stop', '止损'),
+        ('stop_limit', '止损限价'),
+        ('trailing_stop', '跟踪止损'),
+    ]
+
+    exchange_account = models.ForeignKey(
+        ExchangeAccount, on_delete=models.CASCADE, related_name='orders', verbose_name='交易账户'
+    )
+    live_strategy = models.ForeignKey(
+        'strategies.LiveStrategy', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='orders', verbose_name='实盘策略'
+    )
+    client_order_id = models.CharField(max_length=64, unique=True, verbose_name='客户端订单号')
+    exchange_order_id = models.CharField(max_length=64, blank=True, default='', verbose_name='交易所订单号')
+    symbol = models.CharField(max_length=20, verbose_name='交易对')
+    side = models.CharField(max_length=4, choices=SIDE_CHOICES, verbose_name='方向')
+    order_type = models.CharField(max_length=20, choices=TYPE_CHOICES, default='market', verbose_name='订单类型')
+    amount = models.DecimalField(max_digits=20, decimal_places=8, verbose_name='数量')
+    price = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True, verbose_name='价格')
+    stop_price = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True, verbose_name='触发价')
+    reduce_only = models.BooleanField(default=False, verbose_name='只减仓')
+    tag = models.CharField(max_length=50, blank=True, default='', verbose_name='标签')
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='new', verbose_name='状态')
+    filled = models.DecimalField(max_digits=20, decimal_places=8, default=0, verbose_name='已成交数量')
+    avg_price = models.DecimalField(max_digits=20, decimal_places=8, default=0, verbose_name='成交均价')
+    fee = models.DecimalField(max_digits=20, decimal_places=8, default=0, verbose_name='手续费')
+    error_message = models.TextField(blank=True, default='', verbose_name='错误信息')
+    submitted_at = models.DateTimeField(null=True, blank=True, verbose_name='提交时间')
+    closed_at = models.DateTimeField(null=True, blank=True, verbose_name='结束时间')
+    # 执行质量统计：决策时的市场价格、订单发出时间，结束后计入 ExecutionQuality
+    arrival_price = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True, blank=True, verbose_name='到达价格'
+    )
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name='发出时间')
+    quality_rolled = models.BooleanField(default=False, verbose_name='已计入执行质量')
+
+    class Meta:
+        verbose_name = '订单'
+        verbose_name_plural = '订单'
+        db_table = 'trading_order'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['tenant', 'status']),
+            models.Index(fields=['exchange_account', 'status']),
+            models.Index(fields=['live_strategy', 'created_at']),
+            models.Index(fields=['quality_rolled', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.client_order_id}({self.status})"
+
+
+class OrderFill(TenantModel):
+    """
+    成交记录
+
+    同一订单的成交按 trade_id 去重，重复推送的回报不会重复入库。
+    """
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='fills', verbose_name='订单')
+    trade_id = models.CharField(max_length=64, verbose_name='成交ID')
+    price = models.DecimalField(max_digits=20, decimal_places=8, verbose_name='成交价')
+    amount = models.DecimalField(max_digits=20, decimal_places=8, verbose_name='成交数量')
+    fee = models.DecimalField(max_digits=20, decimal_places=8, default=0, verbose_name='手续费')
+    liquidity = models.CharField(max_length=10, default='taker', verbose_name='流动性')  # maker / taker
+    timestamp = models.DateTimeField(verbose_name='成交时间')
+
+    class Meta:
+        verbose_name = '成交记录'
+        verbose_name_plural = '成交记录'
+        db_table = 'trading_order_fill'
+        ordering = ['-timestamp']
+        unique_together = ['order', 'trade_id']
+        indexes = [
+            models.Index(fields=['tenant', 'timestamp']),
+        ]
+
+    def __str__(self):
+        return f"{self.order_id}:{self.trade_id}"
+
+
+class AccountBalance(TenantModel):
+    """
+    账户余额
+
+    由账户同步按资产写入，只有变化的资产才会更新。
+    """
+
+    exchange_account = models.ForeignKey(
+        ExchangeAccount, on_delete=models.CASCADE, related_name='balances', verbose_name='交易账户'
+    )
+    asset = models.CharField(max_length=20, verbose_name='资产')
+    free = models.DecimalField(max_digits=30, decimal_places=12, default=0, verbose_name='可用')
+    used = models.DecimalField(max_digits=30, decimal_places=12, default=0, verbose_name='冻结')
+    total = models.DecimalField(max_digits=30, decimal_places=12, default=0, verbose_name='总额')
+
+    class Meta:
+        verbose_name = '账户余额'
+        verbose_name_plural = '账户余额'
+        db_table = 'trading_account_balance'
+        unique_together = ['exchange_account', 'asset']
+
+    def __str__(self):
+        return f"{self.exchange_account_id}:{self.asset}={self.total}"
+
+
+class AccountSyncState(TenantModel):
+    """
+    账户同步进度
+
+    trade_cursors 记录每个交易对（交易所支持不指定交易对时为 '*'）已同步到的成交时间，
+    下次同步只拉取该时间之后的成交。
+    """
+
+    exchange_account = models.OneToOneField(
+        ExchangeAccount, on_delete=models.CASCADE, related_name='sync_state', verbose_name='交易账户'
+    )
+    trade_cursors = models.JSONField(default=dict, verbose_name='成交游标')  # {交易对: 毫秒时间戳}
+    last_synced_at = models.DateTimeField(null=True, blank=True, verbose_name='最后同步时间')
+    last_error = models.TextField(blank=True, default='', verbose_name='最后错误')
+    stats = models.JSONField(default=dict, verbose_name='同步统计')  # 请求数、变化数、耗时
+
+    class Meta:
+        verbose_name = '账户同步状态'
+        verbose_name_plural = '账户同步状态'
+        db_table = 'trading_account_sync_state'
+
+    def __str__(self):
+        return f"{self.exchange_account_id}@{self.last_synced_at}"
+
+
+class AccountPosition(TenantModel):
+    """
+    账户持仓
+
+    由持仓引擎（apps.trading.positions）按成交增量计算，定期批量写入。
+    last_fill_id 为已计入的最后一笔成交在成交流中的ID，重启后重放成交流时跳过已计入的部分。
+    """
+
+    exchange_account = models.ForeignKey(
+        ExchangeAccount, on_delete=models.CASCADE, related_name='positions', verbose_name='交易账户'
+    )
+    symbol = models.CharField(max_length=20, verbose_name='交易对')
+    amount = models.DecimalField(max_digits=30, decimal_places=12, default=0, verbose_name='持仓数量')  # 负数为空头
+    avg_price = models.DecimalField(max_digits=20, decimal_places=8, default=0, verbose_name='持仓均价')
+    mark_price = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True, verbose_name='标记价格')
+    realized_pnl = models.DecimalField(max_digits=20, decimal_places=8, default=0, verbose_name='已实现盈亏')
+    unrealized_pnl = models.DecimalField(max_digits=20, decimal_places=8, default=0, verbose_name='未实现盈亏')
+    fees = models.DecimalField(max_digits=20, decimal_places=8, default=0, verbose_name='累计手续费')
+    last_fill_id = models.CharField(max_length=32, blank=True, default='', verbose_name='最后成交ID')
+
+    class Meta:
+        verbose_name = '账户持仓'
+        verbose_name_plural = '账户持仓'
+        db_table = 'trading_account_position'
+        unique_together = ['exchange_account', 'symbol']
+
+    def __str__(self):
+        return f"{self.exchange_account_id}:{self.symbol}={self.amount}"
+
+
+class ExecutionQuality(TenantModel):
+    """
+    执行质量汇总
+
+    已结束的订单按 小时 × 交易账户 × 实盘策略 × 交易对 累加，由 apps.trading.execution_quality 增量维护。
+    各字段都是可以直接相加的和与计数，任意时间范围和维度的报表由这些行合并得到。
+    """
+
+    bucket = models.DateTimeField(verbose_name='统计小时')
+    exchange_account = models.ForeignKey(
+        ExchangeAccount, on_delete=models.CASCADE, related_name='execution_quality', verbose_name='交易账户'
+    )
+    exchange = models.CharField(max_length=20, verbose_name='交易所')
+    live_strategy_id = models.PositiveIntegerField(default=0, verbose_name='实盘策略ID')  # 0 表示非策略订单
+    symbol = models.CharField(max_length=20, verbose_name='交易对')
+
+    orders = models.IntegerField(default=0, verbose_name='订单数')
+    filled_orders = models.IntegerField(default=0, verbose_name='完全成交')
+    partial_orders = models.IntegerField(default=0, verbose_name='部分成交后撤销')
+    cancelled_orders = models.IntegerField(default=0, verbose_name='未成交撤销')
+    rejected_orders = models.IntegerField(default=0, verbose_name='拒绝')
+    ordered_amount = models.DecimalField(max_digits=30, decimal_places=12, default=0, verbose_name='下单数量')
+    filled_amount = models.DecimalField(max_digits=30, decimal_places=12, default=0, verbose_name='成交数量')
+    filled_notional = models.DecimalField(max_digits=30, decimal_places=12, default=0, verbose_name='成交金额')
+    fees = models.DecimalField(max_digits=30, decimal_places=12, default=0, verbose_name='手续费')
+    # 有到达价格的订单：成交数量、按到达价格计的金额、滑点成本（买单 (均价 - 到达价) × 数量，卖单相反）
+    arrival_amount = models.DecimalField(max_digits=30, decimal_places=12, default=0, verbose_name='滑点统计数量')
+    arrival_notional = models.DecimalField(max_digits=30, decimal_places=12, default=0, verbose_name='到达价格金额')
+    slippage_cost = models.DecimalField(max_digits=30, decimal_places=12, default=0, verbose_name='滑点成本')
+    # 延迟：发出 -> 交易所确认、发出 -> 首笔成交，分桶计数用于估算分位数
+    ack_count = models.IntegerField(default=0, verbose_name='确认延迟样本数')
+    ack_total_ms = models.FloatField(default=0, verbose_name='确认延迟合计(毫秒)')
+    ack_buckets = models.JSONField(default=list, verbose_name='确认延迟分桶')
+    fill_count = models.IntegerField(default=0, verbose_name='成交延迟样本数')
+    fill_total_ms = models.FloatField(default=0, verbose_name='成交延迟合计(毫秒)')
+    fill_buckets = models.JSONField(default=list, verbose_name='成交延迟分桶')
+
+    class Meta:
+        verbose_name = '执行质量'
+        verbose_name_plural = '执行质量'
+        db_table = 'trading_execution_quality'
+        unique_together = ['bucket', 'exchange_account', 'live_strategy_id', 'symbol']
+        indexes = [
+            models.Index(fields=['tenant', 'bucket']),
+        ]
+
+    def __str__(self):
+        return f"{self.exchange_account_id}:{self.symbol}@{self.bucket}"
+
+
+class AlgoOrder(TenantModel):
+    """
+    算法单
+
+    母单由 apps.trading.algos 的执行引擎按时间或成交量计划拆分为子单，通过订单网关下单。
+    子单的标签为 ``algo:{算法单ID}``，进度可以由子单汇总恢复。
+    """
+
+    ALGORITHM_CHOICES = [
+        ('twap', 'TWAP'),
+        ('vwap', 'VWAP'),
+        ('iceberg', '冰山'),
+        ('sor', '智能路由'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', '等待执行'),
+        ('running', '执行中'),
+        ('cancelling', '撤销中'),
+        ('completed', '已完成'),
+        ('cancelled', '已撤销'),
+        ('failed', '失败'),
+    ]
+
+    exchange_account = models.ForeignKey(
+        ExchangeAccount, on_delete=models.CASCADE, related_name='algo_orders', verbose_name='交易账户'
+    )
+    algorithm = models.CharField(max_length=10, choices=ALGORITHM_CHOICES, verbose_name='算法')
+    symbol = models.CharField(max_length=20, verbose_name='交易对')
+    side = models.CharField(max_length=4, choices=Order.SIDE_CHOICES, verbose_name='方向')
+    amount = models.DecimalField(max_digits=20, decimal_places=8, verbose_name='总数量')
+    limit_price = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True, blank=True, verbose_name='限价'
+    )  # 买入不高于、卖出不低于该价格
+    parameters = models.JSONField(default=dict, blank=True, verbose_name='算法参数')
+    start_time = models.DateTimeField(null=True, blank=True, verbose_name='开始时间')
+    end_time = models.DateTimeField(null=True, blank=True, verbose_name='结束时间')
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='状态')
+    filled = models.DecimalField(max_digits=20, decimal_places=8, default=0, verbose_name='已成交数量')
+    avg_price = models.DecimalField(max_digits=20, decimal_places=8, default=0, verbose_name='成交均价')
+    child_count = models.IntegerField(default=0, verbose_name='子单数')
+    error_message = models.TextField(blank=True, default='', verbose_name='错误信息')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='完成时间')
+
+    class Meta:
+        verbose_name = '算法单'
+        verbose_name_plural = '算法单'
+        db_table = 'trading_algo_order'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status']),
+            models.Index(fields=['tenant', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.algorithm}:{self.side} {self.amount} {self.symbol}({self.status})"
@@ -0,0 +1,653 @@
+"""
+订单状态机与批量持久化
+
+订单以客户端订单号唯一标识，状态只能按以下方向变化：
+
+    new → submitted → partial → filled
+      │       │          └────→ cancelled
+      │       ├────────────────→ cancelled / rejected
+      └────────────────────────→ partial / filled / cancelled / rejected
+
+成交回报可能先于确认到达，所以 new 可以直接进入成交状态；结束状态（filled、cancelled、rejected）不再变化，
+迟到或重复的回报被忽略。
+
+OrderStore 在内存中维护订单状态，状态变化和成交先写入缓冲区，按批量或时间间隔一次写入数据库：
+新订单 bulk_create，状态变化 bulk_update（同一订单多次变化只写最后的状态），成交 bulk_create。
+高频策略的下单和成交不会因为每次状态变化一次数据库写入而受限。
+订单网关、execute_order 和账户同步各自的 OrderStore 可能写入同一订单：写入前锁定数据库中的行并与内存状态合并
+（累计成交取较大的一方，状态不回退），不会用过时的状态覆盖其他进程的写入。
+写入成功的成交再发布到成交流（apps.trading.positions.FillFeed），由持仓引擎实时计算持仓和盈亏。
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ORDER_NEW = 'new'
+ORDER_SUBMITTED = 'submitted'
+ORDER_PARTIAL = 'partial'
+ORDER_FILLED = 'filled'
+ORDER_CANCELLED = 'cancelled'
+ORDER_REJECTED = 'rejected'
+
+ACTIVE_STATUSES = (ORDER_NEW, ORDER_SUBMITTED, ORDER_PARTIAL)
+TERMINAL_STATUSES = (ORDER_FILLED, ORDER_CANCELLED, ORDER_REJECTED)
+
+# 允许的状态变化
+TRANSITIONS = {
+    ORDER_NEW: {ORDER_SUBMITTED, ORDER_PARTIAL, ORDER_FILLED, ORDER_CANCELLED, ORDER_REJECTED},
+    ORDER_SUBMITTED: {ORDER_PARTIAL, ORDER_FILLED, ORDER_CANCELLED, ORDER_REJECTED},
+    ORDER_PARTIAL: {ORDER_PARTIAL, ORDER_FILLED, ORDER_CANCELLED},
+}
+
+# 状态的先后，合并其他进程写入的同一订单时状态不回退
+STATUS_RANK = {
+    ORDER_NEW: 0, ORDER_SUBMITTED: 1, ORDER_PARTIAL: 2, ORDER_FILLED: 3, ORDER_CANCELLED: 3, ORDER_REJECTED: 3,
+}
+
+# bulk_update 写入的字段
+UPDATE_FIELDS = (
+    'status', 'exchange_order_id', 'filled', 'avg_price', 'fee', 'error_message',
+    'submitted_at', 'closed_at', 'updated_at',
+)
+
+
+def make_client_order_id(prefix: str, *parts) -> str:
+    """
+    由业务键生成确定的客户端订单号
+
+    相同的 (prefix, parts) 总是得到相同的订单号，重试时交易所和 OrderStore 都能识别为同一订单。
+    结果只包含字母和数字，不超过 32 个字符，满足各交易所对 clientOrderId 的限制。
+
+    Args:
+        prefix: 以字母开头的短前缀（不超过 8 个字符），区分订单来源
+        parts: 业务键，例如 (算法单ID, 子单序号)
+    """
+    if not prefix or not prefix.isalnum() or not prefix[0].isalpha() or len(prefix) > 8:
+        raise ValueError(f'无效的订单号前缀: {prefix}')
+    key = '|'.join(str(part) for part in parts)
+    return prefix + hashlib.blake2b(key.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def _decimal(value) -> Optional[Decimal]:
+    return None if value is None else Decimal(str(value))
+
+
+def _datetime(ts_ms: Optional[float]) -> datetime:
+    return datetime.fromtimestamp(ts_ms / 1000, tz=dt_timezone.utc) if ts_ms else timezone.now()
+
+
+@dataclass
+class OrderState:
+    """订单在内存中的状态"""
+    client_order_id: str
+    exchange_account_id: int
+    symbol: str
+    side: str
+    amount: float
+    order_type: str = 'market'
+    price: Optional[float] = None
+    stop_price: Optional[float] = None
+    reduce_only: bool = False
+    tag: str = ''
+    tenant_id: Optional[int] = None
+    live_strategy_id: Optional[int] = None
+    status: str = ORDER_NEW
+    exchange_order_id: str = ''
+    filled: float = 0.0
+    avg_price: float = 0.0
+    fee: float = 0.0
+    error_message: str = ''
+    submitted_at: Optional[datetime] = None
+    closed_at: Optional[datetime] = None
+    arrival_price: Optional[float] = None
+    sent_at: Optional[datetime] = None
+    pk: Optional[int] = None
+
+    @classmethod
+    def from_request(cls, request: Dict[str, Any]) -> 'OrderState':
+        return cls(
+            client_order_id=request['client_order_id'],
+            exchange_account_id=int(request['exchange_account_id']),
+            symbol=request['symbol'],
+            side=request['side'],
+            amount=float(request['amount']),
+            order_type=request.get('order_type') or 'market',
+            price=request.get('price'),
+            stop_price=request.get('stop_price'),
+            reduce_only=bool(request.get('reduce_only')),
+            tag=request.get('tag') or '',
+            tenant_id=request.get('tenant_id'),
+            live_strategy_id=request.get('live_strategy_id'),
+            arrival_price=request.get('arrival_price'),
+            sent_at=_datetime(request['sent_ts']) if request.get('sent_ts') else None,
+        )
+
+    @classmethod
+    def from_model(cls, order) -> 'OrderState':
+        return cls(
+            client_order_id=order.client_order_id,
+            exchange_account_id=order.exchange_account_id,
+            symbol=order.symbol,
+            side=order.side,
+            amount=float(order.amount),
+            order_type=order.order_type,
+            price=float(order.price) if order.price is not None else None,
+            stop_price=float(order.stop_price) if order.stop_price is not None else None,
+            reduce_only=order.reduce_only,
+            tag=order.tag,
+            tenant_id=order.tenant_id,
+            live_strategy_id=order.live_strategy_id,
+            status=order.status,
+            exchange_order_id=order.exchange_order_id,
+            filled=float(order.filled),
+            avg_price=float(order.avg_price),
+            fee=float(order.fee),
+            error_message=order.error_message,
+            submitted_at=order.submitted_at,
+            closed_at=order.closed_at,
+            arrival_price=float(order.arrival_price) if order.arrival_price is not None else None,
+            sent_at=order.sent_at,
+            pk=order.pk,
+        )
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+    @property
+    def remaining(self) -> float:
+        return max(self.amount - self.filled, 0.0)
+
+    def can_transition(self, status: str) -> bool:
+        return status in TRANSITIONS.get(self.status, ())
+
+    def merge(self, order) -> bool:
+        """
+        合并数据库中同一订单的状态（其他进程可能已经写入更新的状态）
+
+        累计成交取较大的一方；数据库中已结束或更靠后的状态优先，状态不回退。
+        数值按数据库的精度（8位小数）比较。
+
+        Returns:
+            合并后是否与数据库不同（需要写入）
+        """
+        if float(order.filled) > self.filled + 1e-8:
+            self.filled, self.avg_price, self.fee = float(order.filled), float(order.avg_price), float(order.fee)
+        if order.exchange_order_id and not self.exchange_order_id:
+            self.exchange_order_id = order.exchange_order_id
+        if order.submitted_at is not None:
+            self.submitted_at = min(self.submitted_at or order.submitted_at, order.submitted_at)
+        if order.status != self.status and (
+                order.status in TERMINAL_STATUSES or STATUS_RANK[order.status] > STATUS_RANK[self.status]):
+            self.status, self.closed_at = order.status, order.closed_at
+            self.error_message = order.error_message or self.error_message
+        if self.status not in TERMINAL_STATUSES and self.filled > 0:
+            self.status = ORDER_FILLED if self.amount - self.filled <= 1e-12 else ORDER_PARTIAL
+            if self.status == ORDER_FILLED:
+                self.closed_at = self.closed_at or order.closed_at or timezone.now()
+        return (
+            self.status != order.status or self.exchange_order_id != order.exchange_order_id
+            or abs(self.filled - float(order.filled)) > 1e-8 or abs(self.fee - float(order.fee)) > 1e-8
+            or self.error_message != order.error_message or self.submitted_at != order.submitted_at
+            or self.closed_at != order.closed_at
+        )
+
+    def request(self) -> Dict[str, Any]:
+        """还原为订单请求（网关重启后继续跟踪未完成的订单）"""
+        return {
+            'action': 'place',
+            'client_order_id': self.client_order_id,
+            'exchange_account_id': self.exchange_account_id,
+            'tenant_id': self.tenant_id,
+            'live_strategy_id': self.live_strategy_id,
+            'symbol': self.symbol,
+            'side': self.side,
+            'order_type': self.order_type,
+            'amount': self.amount,
+            'price': self.price,
+            'stop_price': self.stop_price,
+            'reduce_only': self.reduce_only,
+            'tag': self.tag,
+        }
+
+    def to_model(self):
+        from .models import Order
+
+        return Order(
+            pk=self.pk,
+            tenant_id=self.tenant_id,
+            exchange_account_id=self.exchange_account_id,
+            live_strategy_id=self.live_strategy_id,
+            client_order_id=self.client_order_id,
+            exchange_order_id=self.exchange_order_id,
+            symbol=self.symbol,
+            side=self.side,
+            order_type=self.order_type,
+            amount=_decimal(self.amount),
+            price=_decimal(self.price),
+            stop_price=_decimal(self.stop_price),
+            reduce_only=self.reduce_only,
+            tag=self.tag,
+            status=self.status,
+            filled=_decimal(self.filled),
+            avg_price=_decimal(self.avg_price),
+            fee=_decimal(self.fee),
+            error_message=self.error_message,
+            submitted_at=self.submitted_at,
+            closed_at=self.closed_at,
+            arrival_price=_decimal(self.arrival_price),
+            sent_at=self.sent_at,
+            updated_at=timezone.now(),
+        )
+
+
+@dataclass
+class PendingFill:
+    """等待写入的成交"""
+    client_order_id: str
+    trade_id: str
+    price: float
+    amount: float
+    fee: float
+    liquidity: str
+    timestamp: datetime = field(default_factory=timezone.now)
+
+
+class OrderStore:
+    """
+    订单状态机和写缓冲
+
+    所有方法线程安全：事件循环中调用状态变化（只操作内存），flush 可以放到线程池中执行。
+    已结束且已写入的订单移到最近订单缓存（默认保留 10000 个），重复的请求和迟到的回报仍能识别。
+
+    fill_feed 为空且 ORDER_FILL_FEED_ENABLED 打开时，使用进程内共享的成交流。
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, flush_interval: Optional[float] = None,
+                 recent_size: int = 10000, fill_feed=None):
+        self._fill_feed = fill_feed
+        self.batch_size = batch_size or getattr(settings, 'ORDER_STORE_BATCH_SIZE', 500)
+        self.flush_interval = flush_interval or getattr(settings, 'ORDER_STORE_FLUSH_INTERVAL', 0.5)
+        self.recent_size = recent_size
+        self.orders: Dict[str, OrderState] = {}
+        self._recent: 'OrderedDict[str, OrderState]' = OrderedDict()
+        self._created: Dict[str, OrderState] = {}
+        self._dirty: Dict[str, OrderState] = {}
+        self._fills: List[PendingFill] = []
+        self._unresolved: set = set()
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self.ignored = 0
+
+    @property
+    def fill_feed(self):
+        if self._fill_feed is None and getattr(settings, 'ORDER_FILL_FEED_ENABLED', False):
+            from .positions import get_fill_feed
+            self._fill_feed = get_fill_feed()
+        return self._fill_feed
+
+    def get(self, client_order_id: str) -> Optional[OrderState]:
+        with self._lock:
+            return self.orders.get(client_order_id) or self._recent.get(client_order_id)
+
+    def active_orders(self, exchange_account_id: int, symbols: Optional[Iterable[str]] = None) -> List[OrderState]:
+        """内存中账户（指定交易对）未结束的订单"""
+        symbols = set(symbols) if symbols else None
+        with self._lock:
+            return [
+                state for state in self.orders.values()
+                if state.exchange_account_id == exchange_account_id and state.is_active
+                and (symbols is None or state.symbol in symbols)
+            ]
+
+    @property
+    def pending(self) -> int:
+        return len(self._created) + len(self._dirty) + len(self._fills)
+
+    def flush_due(self) -> bool:
+        return self.pending >= self.batch_size or (
+            self.pending > 0 and time.monotonic() - self._last_flush >= self.flush_interval
+        )
+
+    # -- 状态变化（只操作内存）-------------------------------------------------
+
+    def create(self, request: Dict[str, Any]) -> Tuple[OrderState, bool]:
+        """
+        登记订单请求
+
+        Returns:
+            (订单状态, 是否新建)。同一客户端订单号重复登记时返回已有的订单。
+        """
+        with self._lock:
+            existing = self.get(request['client_order_id'])
+            if existing is not None:
+                return existing, False
+            state = OrderState.from_request(request)
+            self.orders[state.client_order_id] = state
+            self._created[state.client_order_id] = state
+            return state, True
+
+    def _mark(self, state: OrderState):
+        if state.client_order_id not in self._created:
+            self._dirty[state.client_order_id] = state
+
+    def transition(self, client_order_id: str, status: str, exchange_order_id: Optional[str] = None,
+                   error: str = '', ts: Optional[float] = None) -> bool:
+        """
+        变更订单状态
+
+        不允许的变化（例如已成交后收到撤单回报）被忽略，返回 False。
+        """
+        with self._lock:
+            state = self.orders.get(client_order_id)
+            if state is None:
+                self.ignored += 1
+                return False
+            if exchange_order_id and not state.exchange_order_id:
+                state.exchange_order_id = str(exchange_order_id)
+                self._mark(state)
+            if not state.can_transition(status):
+                if state.status != status:
+                    self.ignored += 1
+                    logger.debug(f"忽略订单状态变化 {client_order_id}: {state.status} → {status}")
+                return False
+            now = _datetime(ts)
+            state.status = status
+            if status == ORDER_SUBMITTED:
+                state.submitted_at = now
+            elif status in TERMINAL_STATUSES:
+                state.closed_at = now
+            if error:
+                state.error_message = error[:2000]
+            self._mark(state)
+            return True
+
+    def apply_fill(self, client_order_id: str, price: float, amount: float, fee: float = 0.0,
+                   trade_id: Optional[str] = None, ts: Optional[float] = None, liquidity: str = 'taker') -> bool:
+        """
+        记录一笔成交，并按累计成交数量变更为 partial 或 filled
+
+        trade_id 为空时使用成交后的累计数量，同一笔增量成交重复推送时得到相同的ID。
+        """
+        with self._lock:
+            state = self.orders.get(client_order_id)
+            if state is None or amount <= 0 or not state.is_active:
+                self.ignored += 1
+                return False
+            amount = min(float(amount), state.remaining)
+            if amount <= 0:
+                self.ignored += 1
+                return False
+            filled = state.filled + amount
+            state.avg_price = (state.avg_price * state.filled + float(price) * amount) / filled
+            state.filled = filled
+            state.fee += float(fee or 0.0)
+            if state.submitted_at is None:
+                state.submitted_at = _datetime(ts)
+            status = ORDER_FILLED if state.amount - filled <= 1e-12 else ORDER_PARTIAL
+            state.status = status
+            if status == ORDER_FILLED:
+                state.closed_at = _datetime(ts)
+            self._mark(state)
+            self._fills.append(PendingFill(
+                client_order_id, str(trade_id or f"f{filled:.12g}"), float(price), amount,
+                float(fee or 0.0), liquidity, _datetime(ts),
+            ))
+            return True
+
+    def apply_report(self, report: Dict[str, Any]) -> bool:
+        """按订单网关 / execute_order 的回报变更状态"""
+        from .gateway import REPORT_ACK, REPORT_CANCELLED, REPORT_FILL, REPORT_REJECTED
+
+        report_type = report.get('type')
+        client_order_id = report['client_order_id']
+        ts = report.get('ts')
+        if report_type == REPORT_ACK:
+            return self.transition(client_order_id, ORDER_SUBMITTED, report.get('exchange_order_id'), ts=ts)
+        if report_type == REPORT_FILL:
+            cumulative = report.get('filled')
+            state = self.get(client_order_id)
+            if cumulative is not None and state is not None and float(cumulative) <= state.filled + 1e-12:
+                # 重复推送的增量成交
+                self.ignored += 1
+                return False
+            if state is not None and report.get('exchange_order_id') and not state.exchange_order_id:
+                with self._lock:
+                    state.exchange_order_id = str(report['exchange_order_id'])
+                    self._mark(state)
+            return self.apply_fill(
+                client_order_id, report['price'], report['amount'], report.get('fee') or 0.0,
+                trade_id=report.get('trade_id'), ts=ts, liquidity=report.get('liquidity') or 'taker',
+            )
+        if report_type == REPORT_CANCELLED:
+            return self.transition(client_order_id, ORDER_CANCELLED, report.get('exchange_order_id'), ts=ts)
+        if report_type == REPORT_REJECTED:
+            return self.transition(
+                client_order_id, ORDER_REJECTED, report.get('exchange_order_id'), error=report.get('error') or '', ts=ts,
+            )
+        return False
+
+    def apply_exchange_order(self, client_order_id: str, order: Dict[str, Any]) -> bool:
+        """
+        按交易所返回的订单（ccxt 格式）校正状态（账户同步时使用）
+
+        累计成交数量超过本地记录的部分作为一笔成交写入，trade_id 与订单网关的增量成交相同，
+        同一部分成交不会因为网关和同步都推送而重复入库。
+        """
+        state = self.get(client_order_id)
+        if state is None or not state.is_active:
+            return False
+        changed = False
+        ts = order.get('lastTradeTimestamp') or order.get('timestamp')
+        if order.get('id') and not state.exchange_order_id:
+            with self._lock:
+                state.exchange_order_id = str(order['id'])
+                self._mark(state)
+            changed = True
+        if state.status == ORDER_NEW and order.get('status') == 'open':
+            changed = self.transition(client_order_id, ORDER_SUBMITTED, ts=ts) or changed
+        filled = float(order.get('filled') or 0.0)
+        if filled > state.filled + 1e-12:
+            amount = filled - state.filled
+            average = float(order.get('average') or order.get('price') or 0.0)
+            cost = float(order.get('cost') or average * filled)
+            fee = float((order.get('fee') or {}).get('cost') or 0.0)
+            price = (cost - state.avg_price * state.filled) / amount
+            changed = self.apply_fill(
+                client_order_id, price if price > 0 else average, amount, max(fee - state.fee, 0.0),
+                trade_id=f"f{filled:.12g}", ts=ts,
+            ) or changed
+        status = order.get('status')
+        if status in ('canceled', 'cancelled', 'expired'):
+            changed = self.transition(client_order_id, ORDER_CANCELLED, ts=ts) or changed
+        elif status == 'rejected':
+            changed = self.transition(client_order_id, ORDER_REJECTED, error='交易所拒绝', ts=ts) or changed
+        return changed
+
+    # -- 加载与写入 ------------------------------------------------------------
+
+    def load(self, client_order_ids: Iterable[str] = None, exchange: Optional[str] = None,
+             active_only: bool = False, exchange_account_ids: Iterable[int] = None) -> List[OrderState]:
+        """
+        从数据库加载订单到内存（网关重启、execute_order 处理撤单、账户同步时使用）
+
+        Args:
+            client_order_ids: 只加载指定的订单
+            exchange: 只加载该交易所账户的订单
+            active_only: 只加载未结束的订单
+            exchange_account_ids: 只加载这些账户的订单
+        """
+        from .models import Order
+
+        orders = Order.all_objects.all()
+        if client_order_ids is not None:
+            orders = orders.filter(client_order_id__in=list(client_order_ids))
+        if exchange is not None:
+            orders = orders.filter(exchange_account__exchange=exchange)
+        if exchange_account_ids is not None:
+            orders = orders.filter(exchange_account_id__in=list(exchange_account_ids))
+        if active_only:
+            orders = orders.filter(status__in=ACTIVE_STATUSES)
+        loaded = []
+        with self._lock:
+            for order in orders.iterator():
+                if self.get(order.client_order_id) is None:
+                    state = OrderState.from_model(order)
+                    if state.is_active:
+                        self.orders[state.client_order_id] = state
+                    else:
+                        self._remember(state)
+                    loaded.append(state)
+        return loaded
+
+    def _remember(self, state: OrderState):
+        self._recent[state.client_order_id] = state
+        self._recent.move_to_end(state.client_order_id)
+        while len(self._recent) > self.recent_size:
+            self._recent.popitem(last=False)
+
+    def _resolve_relations(self, states: List[OrderState]):
+        """补全租户，去掉已删除的实盘策略引用（避免外键错误导致整批写入失败）"""
+        from apps.strategies.models import LiveStrategy
+        from .models import ExchangeAccount
+
+        account_ids = {state.exchange_account_id for state in states if state.tenant_id is None}
+        if account_ids:
+            tenants = dict(ExchangeAccount.all_objects.filter(pk__in=account_ids).values_list('pk', 'tenant_id'))
+            for state in states:
+                if state.tenant_id is None:
+                    state.tenant_id = tenants.get(state.exchange_account_id)
+        live_ids = {state.live_strategy_id for state in states if state.live_strategy_id is not None}
+        if live_ids:
+            existing = set(LiveStrategy.all_objects.filter(pk__in=live_ids).values_list('pk', flat=True))
+            for state in states:
+                if state.live_strategy_id not in existing:
+                    state.live_strategy_id = None
+
+    def flush(self) -> int:
+        """
+        把缓冲的新订单、状态变化和成交写入数据库
+
+        同一订单在两次写入之间的多次状态变化只写一次。写入前锁定订单行并与内存状态合并（见 OrderState.merge），
+        与数据库一致的订单不再写入。写入失败时缓冲区保留，下次重试；找不到租户（交易账户不存在）的新订单
+        及其成交也保留在缓冲区，记录错误日志。
+
+        Returns:
+            写入的行数
+        """
+        from .models import Order, OrderFill
+
+        with self._flush_lock:
+            with self._lock:
+                created, self._created = self._created, {}
+                dirty, self._dirty = self._dirty, {}
+                fills, self._fills = self._fills, []
+                self._last_flush = time.monotonic()
+                if not (created or dirty or fills):
+                    return 0
+                self._resolve_relations(list(created.values()))
+                unresolved = {cid: state for cid, state in created.items() if state.tenant_id is None}
+                created = {cid: state for cid, state in created.items() if state.tenant_id is not None}
+                new_orders = [state.to_model() for state in created.values()]
+                updates = [state for cid, state in dirty.items() if cid not in created]
+            try:
+                with transaction.atomic():
+                    Order.all_objects.bulk_create(new_orders, batch_size=self.batch_size, ignore_conflicts=True)
+                    targets = [*created.values(), *updates]
+                    rows = {order.client_order_id: order for order in Order.all_objects.select_for_update().filter(
+                        client_order_id__in=[state.client_order_id for state in targets],
+                    ).only('client_order_id', *UPDATE_FIELDS)} if targets else {}
+                    with self._lock:
+                        update_models = []
+                        for state in targets:
+                            row = rows.get(state.client_order_id)
+                            if row is None:
+                                continue
+                            state.pk = row.pk
+                            # 新建时订单已存在（其他进程先写入），或者数据库中的状态已被其他进程更新
+                            if state.merge(row):
+                                update_models.append(state.to_model())
+                        fill_models, fill_events, waiting = [], [], []
+                        for fill in fills:
+                            if fill.client_order_id in unresolved:
+                                waiting.append(fill)
+                                continue
+                            state = self.get(fill.client_order_id)
+                            if state is None or state.pk is None:
+                                continue
+                            fill_models.append(OrderFill(
+                                tenant_id=state.tenant_id, order_id=state.pk, trade_id=fill.trade_id,
+                                price=_decimal(fill.price), amount=_decimal(fill.amount), fee=_decimal(fill.fee),
+                                liquidity=fill.liquidity, timestamp=fill.timestamp,
+                            ))
+                            fill_events.append({
+                                'client_order_id': fill.client_order_id, 'trade_id': fill.trade_id,
+                                'tenant_id': state.tenant_id, 'exchange_account_id': state.exchange_account_id,
+                                'symbol': state.symbol, 'side': state.side, 'price': fill.price,
+                                'amount': fill.amount, 'fee': fill.fee, 'ts': int(fill.timestamp.timestamp() * 1000),
+                            })
+                    if update_models:
+                        Order.all_objects.bulk_update(update_models, UPDATE_FIELDS, batch_size=self.batch_size)
+                    OrderFill.all_objects.bulk_create(fill_models, batch_size=self.batch_size, ignore_conflicts=True)
+            except Exception as e:
+                logger.error(f"订单写入失败，稍后重试: {e}")
+                with self._lock:
+                    for cid, state in (*created.items(), *unresolved.items()):
+                        self._created.setdefault(cid, state)
+                    for cid, state in dirty.items():
+                        if cid not in self._created:
+                            self._dirty.setdefault(cid, state)
+                    self._fills[:0] = fills
+                return 0
+
+            self._publish_fills(fill_events)
+            with self._lock:
+                for cid, state in unresolved.items():
+                    self._created.setdefault(cid, state)
+                self._fills[:0] = waiting
+                reported = set(unresolved) - self._unresolved
+                if reported:
+                    logger.error(
+                        f"订单的交易账户不存在，无法确定租户，保留在缓冲区: "
+                        f"{sorted(reported)} 账户 {sorted({unresolved[cid].exchange_account_id for cid in reported})}"
+                    )
+                self._unresolved = set(unresolved)
+                for state in (*created.values(), *dirty.values()):
+                    cid = state.client_order_id
+                    if not state.is_active and cid not in self._dirty and cid not in self._created:
+                        self.orders.pop(cid, None)
+                        self._remember(state)
+            return len(new_orders) + len(update_models) + len(fill_models)
+
+    def _publish_fills(self, events: List[Dict[str, Any]]):
+        """发布已写入的成交；失败时只记录日志，成交已经在数据库中"""
+        feed = self.fill_feed if events else None
+        if feed is None:
+            return
+        try:
+            feed.publish(events)
+        except Exception as e:
+            logger.warning(f"发布成交失败 ({len(events)}笔): {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'active': sum(state.is_active for state in self.orders.values()),
+                'pending_orders': len(self._created) + len(self._dirty),
+                'pending_fills': len(self._fills),
+                'recent': len(self._recent),
+                'ignored': self.ignored,
+            }
@@ -0,0 +1,572 @@
+"""
+实时持仓与盈亏
+
+常驻的 asyncio 进程（run_position_engine 命令）在内存中维护持仓簿，由成交和行情增量驱动：
+
+- OrderStore 写入成交后发布到成交流 ``trading:fills``。订单网关、execute_order 和账户同步可能各自记录同一笔成交，
+  发布前按 (客户端订单号, 成交ID) 在 Redis 中去重，每笔成交只进入成交流一次；
+- 引擎以消费者组读取成交流，按平均成本法更新 (账户, 交易对) 的持仓、已实现盈亏和手续费；
+- 市场事件日志中的 ticker / trade 更新标记价格，只重新估值该交易对上的持仓，
+  账户汇总按差值更新，每个事件对每个受影响的持仓都是 O(1)；
+- 有变化的持仓每 POSITION_SNAPSHOT_INTERVAL 秒写入 Redis，供接口、风控和看板读取
+  （get_account_positions / get_account_pnl）；每 POSITION_PERSIST_INTERVAL 秒批量写入 trading_account_position。
+
+成交流的消息在持仓写入数据库之后才确认。重启时从数据库恢复持仓，未确认的成交重新投递，
+持仓上记录的 last_fill_id 保证已经计入的成交不会重复计入。
+"""
+import asyncio
+import json
+import logging
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+
+from apps.market.event_log import parse_event_id
+from apps.monitoring.latency import now_ms
+from apps.strategies.strategy import Position
+
+from .gateway import OrderChannel, get_gateway_client
+
+logger = logging.getLogger(__name__)
+
+# 成交流
+FILL_STREAM = 'trading:fills'
+# 成交去重键前缀：trading:fills:seen:{客户端订单号}:{成交ID}
+FILL_SEEN_PREFIX = 'trading:fills:seen'
+# 持仓快照：trading:positions:{账户ID}，哈希 交易对 -> JSON
+POSITIONS_KEY_PREFIX = 'trading:positions'
+# 账户盈亏汇总：哈希 账户ID -> JSON
+PNL_KEY = 'trading:pnl'
+# 成交流和市场事件日志上持仓引擎使用的消费者组
+POSITION_GROUP = 'position-engine'
+
+EPS = 1e-12
+
+
+def positions_key(account_id: int) -> str:
+    return f"{POSITIONS_KEY_PREFIX}:{account_id}"
+
+
+class FillFeed:
+    """成交流的发布和消费"""
+
+    def __init__(self, client=None, maxlen: Optional[int] = None, dedupe_ttl: Optional[int] = None):
+        self.channel = OrderChannel(
+            client, maxlen if maxlen is not None else getattr(settings, 'POSITION_FILL_STREAM_MAXLEN', 1000000),
+        )
+        self.dedupe_ttl = dedupe_ttl or getattr(settings, 'POSITION_FILL_DEDUPE_TTL', 7 * 86400)
+
+    @property
+    def client(self):
+        return self.channel.client
+
+    def publish(self, fills: Iterable[Dict[str, Any]]) -> int:
+        """
+        发布成交，已经发布过的 (订单号, 成交ID) 跳过
+
+        Returns:
+            新发布的笔数
+        """
+        fills = list(fills)
+        if not fills:
+            return 0
+        keys = [f"{FILL_SEEN_PREFIX}:{fill['client_order_id']}:{fill['trade_id']}" for fill in fills]
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(key, 1, nx=True, ex=self.dedupe_ttl)
+        claimed = pipe.execute()
+        fresh = [(key, fill) for key, fill, added in zip(keys, fills, claimed) if added]
+        if not fresh:
+            return 0
+        pipe = self.client.pipeline(transaction=False)
+        for _, fill in fresh:
+            pipe.xadd(FILL_STREAM, self.channel._encode(fill), maxlen=self.channel.maxlen, approximate=True)
+        try:
+            pipe.execute()
+        except redis.RedisError:
+            # 写入失败时释放去重键，其他进程或下次发布仍可写入
+            self.client.delete(*[key for key, _ in fresh])
+            raise
+        return len(fresh)
+
+    def read(self, group: str, consumer: str, count: int = 100,
+             block: Optional[int] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        return self.channel.read(FILL_STREAM, group, consumer, count, block)
+
+    def ack(self, group: str, entry_ids: Iterable[str]) -> int:
+        return self.channel.ack(FILL_STREAM, group, entry_ids)
+
+
+_feed: Optional[FillFeed] = None
+_feed_lock = threading.Lock()
+
+
+def get_fill_feed() -> FillFeed:
+    """获取进程内共享的成交流"""
+    global _feed
+    if _feed is None:
+        with _feed_lock:
+            if _feed is None:
+                _feed = FillFeed()
+    return _feed
+
+
+def get_account_positions(account_id: int, client=None) -> Dict[str, Dict[str, Any]]:
+    """读取账户的实时持仓（交易对 -> 持仓），持仓引擎没有写入过时为空"""
+    client = client or get_gateway_client()
+    return {symbol: json.loads(value) for symbol, value in client.hgetall(positions_key(account_id)).items()}
+
+
+def get_account_pnl(account_id: int, client=None) -> Optional[Dict[str, Any]]:
+    """读取账户的实时盈亏汇总"""
+    value = (client or get_gateway_client()).hget(PNL_KEY, str(account_id))
+    return json.loads(value) if value else None
+
+
+class PositionState:
+    """(账户, 交易对) 的持仓"""
+    __slots__ = ('account_id', 'symbol', 'exchange', 'position', 'fees', 'mark_price', 'unrealized',
+                 'exposure', 'last_fill_id', 'updated_ts')
+
+    def __init__(self, account_id: int, symbol: str, exchange: Optional[str] = None):
+        self.account_id = account_id
+        self.symbol = symbol
+        self.exchange = exchange
+        self.position = Position(symbol)
+        self.fees = 0.0
+        self.mark_price: Optional[float] = None
+        self.unrealized = 0.0
+        self.exposure = 0.0  # |数量| × 标记价格
+        self.last_fill_id = ''
+        self.updated_ts: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        position = self.position
+        return {
+            'symbol': self.symbol,
+            'amount': position.amount,
+            'avg_price': position.avg_price,
+            'mark_price': self.mark_price,
+            'realized_pnl': position.realized_pnl,
+            'unrealized_pnl': self.unrealized,
+            'fees': self.fees,
+            'exposure': self.exposure,
+            'updated_ts': self.updated_ts,
+        }
+
+
+class AccountTotals:
+    """账户汇总，随持仓变化按差值更新"""
+    __slots__ = ('realized', 'unrealized', 'fees', 'exposure', 'updated_ts')
+
+    def __init__(self):
+        self.realized = 0.0
+        self.unrealized = 0.0
+        self.fees = 0.0
+        self.exposure = 0.0
+        self.updated_ts: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'realized_pnl': self.realized,
+            'unrealized_pnl': self.unrealized,
+            'fees': self.fees,
+            'net_pnl': self.realized + self.unrealized - self.fees,
+            'exposure': self.exposure,
+            'updated_ts': self.updated_ts,
+        }
+
+
+def _fill_id_key(fill_id: str) -> Tuple[int, int]:
+    return parse_event_id(fill_id) if fill_id else (0, -1)
+
+
+class PositionBook:
+    """
+    内存持仓簿
+
+    成交只更新对应的持仓；标记价格只更新该 (交易所, 交易对) 上的持仓。账户汇总按差值更新，不重新求和。
+    """
+
+    def __init__(self):
+        self.positions: Dict[Tuple[int, str], PositionState] = {}
+        self.accounts: Dict[int, AccountTotals] = {}
+        self.account_exchanges: Dict[int, str] = {}
+        self.marks: Dict[Tuple[str, str], float] = {}
+        self.dirty: Set[Tuple[int, str]] = set()
+        self._markets: Dict[Tuple[str, str], Set[Tuple[int, str]]] = {}
+
+    def get(self, account_id: int, symbol: str) -> Optional[PositionState]:
+        return self.positions.get((account_id, symbol))
+
+    def totals(self, account_id: int) -> AccountTotals:
+        totals = self.accounts.get(account_id)
+        if totals is None:
+            totals = self.accounts[account_id] = AccountTotals()
+        return totals
+
+    @property
+    def exchanges(self) -> List[str]:
+        return sorted({exchange for exchange, _ in self._markets})
+
+    def _state(self, account_id: int, symbol: str) -> PositionState:
+        key = (account_id, symbol)
+        state = self.positions.get(key)
+        if state is None:
+            exchange = self.account_exchanges.get(account_id)
+            state = self.positions[key] = PositionState(account_id, symbol, exchange)
+            if exchange is not None:
+                self._markets.setdefault((exchange, symbol), set()).add(key)
+                state.mark_price = self.marks.get((exchange, symbol))
+        return state
+
+    def _revalue(self, state: PositionState, ts: Optional[float] = None):
+        position = state.position
+        mark = state.mark_price
+        unrealized = position.unrealized_pnl(mark) if mark is not None else 0.0
+        exposure = abs(position.amount) * mark if mark is not None else 0.0
+        totals = self.totals(state.account_id)
+        totals.unrealized += unrealized - state.unrealized
+        totals.exposure += exposure - state.exposure
+        state.unrealized, state.exposure = unrealized, exposure
+        if ts is not None:
+            state.updated_ts = totals.updated_ts = ts
+        self.dirty.add((state.account_id, state.symbol))
+
+    def restore(self, account_id: int, symbol: str, amount: float, avg_price: float, realized_pnl: float,
+                fees: float, mark_price: Optional[float] = None, last_fill_id: str = ''):
+        """由数据库中的持仓恢复"""
+        state = self._state(account_id, symbol)
+        state.position = Position(symbol, float(amount), float(avg_price), float(realized_pnl))
+        state.fees = float(fees)
+        state.last_fill_id = last_fill_id
+        if state.mark_price is None and mark_price is not None:
+            state.mark_price = float(mark_price)
+        totals = self.totals(account_id)
+        totals.realized += state.position.realized_pnl
+        totals.fees += state.fees
+        self._revalue(state)
+        self.dirty.discard((account_id, symbol))
+
+    def apply_fill(self, fill: Dict[str, Any], fill_id: str = '') -> bool:
+        """
+        应用一笔成交
+
+        Args:
+            fill_id: 成交流中的ID，不大于持仓 last_fill_id 的成交已经计入，直接跳过
+        """
+        state = self._state(int(fill['exchange_account_id']), fill['symbol'])
+        if fill_id and state.last_fill_id and _fill_id_key(fill_id) <= _fill_id_key(state.last_fill_id):
+            return False
+        amount, price = float(fill['amount']), float(fill['price'])
+        if amount <= EPS:
+            return False
+        fee = float(fill.get('fee') or 0.0)
+        realized = state.position.apply_fill(fill['side'], amount, price)
+        state.fees += fee
+        totals = self.totals(state.account_id)
+        totals.realized += realized
+        totals.fees += fee
+        if fill_id:
+            state.last_fill_id = fill_id
+        if (state.exchange, state.symbol) not in self.marks:
+            # 还没有行情时以最新成交价估值
+            state.mark_price = price
+        self._revalue(state, fill.get('ts') or now_ms())
+        return True
+
+    def mark(self, exchange: str, symbol: str, price: float, ts: Optional[float] = None) -> int:
+        """更新标记价格，返回重新估值的持仓数"""
+        price = float(price)
+        self.marks[(exchange, symbol)] = price
+        keys = self._markets.get((exchange, symbol))
+        if not keys:
+            return 0
+        ts = ts or now_ms()
+        for key in keys:
+            state = self.positions[key]
+            state.mark_price = price
+            self._revalue(state, ts)
+        return len(keys)
+
+
+class PositionEngine:
+    """
+    持仓引擎
+
+    用法：
+        engine = PositionEngine()
+        asyncio.run(engine.run())
+
+    测试或嵌入时可以直接调用 handle_fills / handle_events / publish_snapshot / persist，不需要事件循环。
+    """
+
+    def __init__(self, feed: Optional[FillFeed] = None, event_log=None, client=None, group: str = POSITION_GROUP,
+                 consumer: Optional[str] = None, batch_size: Optional[int] = None, block_ms: Optional[int] = None,
+                 snapshot_interval: Optional[float] = None, persist_interval: Optional[float] = None,
+                 clock: Callable[[], float] = now_ms):
+        self._feed = feed
+        self._event_log = event_log
+        self._client = client
+        self.group = group
+        # 固定的消费者名称，重启后能取回自己未确认的成交
+        self.consumer = consumer or socket.gethostname()
+        self.batch_size = batch_size or getattr(settings, 'POSITION_ENGINE_BATCH_SIZE', 500)
+        self.block_ms = block_ms or getattr(settings, 'POSITION_ENGINE_BLOCK_MS', 1000)
+        self.snapshot_interval = snapshot_interval or getattr(settings, 'POSITION_SNAPSHOT_INTERVAL', 0.5)
+        self.persist_interval = persist_interval or getattr(settings, 'POSITION_PERSIST_INTERVAL', 10.0)
+        self.clock = clock
+
+        self.book = PositionBook()
+        self.account_tenants: Dict[int, Optional[int]] = {}
+        self._unacked: List[str] = []
+        self._persist_dirty: Set[Tuple[int, str]] = set()
+        self._known_exchanges = set()
+        self.fills = 0
+        self.marks = 0
+
+    @property
+    def feed(self) -> FillFeed:
+        if self._feed is None:
+            self._feed = get_fill_feed()
+        return self._feed
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self.feed.client
+        return self._client
+
+    @property
+    def event_log(self):
+        if self._event_log is None:
+            from apps.market.event_log import MarketEventLog
+            self._event_log = MarketEventLog()
+        return self._event_log
+
+    # -- 内存状态 ----------------------------------------------------------
+
+    def unknown_accounts(self, entries: List[Tuple[str, Dict[str, Any]]]) -> Set[int]:
+        return {int(fill['exchange_account_id']) for _, fill in entries} - set(self.account_tenants)
+
+    def handle_fills(self, entries: List[Tuple[str, Dict[str, Any]]]) -> int:
+        """应用成交流中的一批成交，返回计入的笔数"""
+        applied = 0
+        for entry_id, fill in entries:
+            try:
+                applied += self.book.apply_fill(fill, entry_id)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f"无效的成交 {entry_id}: {e}")
+            self._unacked.append(entry_id)
+        self.fills += applied
+        return applied
+
+    def handle_events(self, events) -> int:
+        """行情事件更新标记价格，返回重新估值的持仓数"""
+        revalued = 0
+        for event in events:
+            if event.event_type == 'ticker':
+                price = event.data.get('last')
+            elif event.event_type == 'trade':
+                price = event.data.get('price')
+            else:
+                continue
+            if price:
+                revalued += self.book.mark(event.exchange, event.symbol, price, event.timestamp)
+        self.marks += revalued
+        return revalued
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'positions': len(self.book.positions),
+            'accounts': len(self.book.accounts),
+            'fills': self.fills,
+            'revaluations': self.marks,
+            'unacked': len(self._unacked),
+        }
+
+    # -- Redis 快照 --------------------------------------------------------
+
+    def collect_snapshot(self) -> Tuple[Dict[int, Dict[str, str]], Dict[str, str]]:
+        """取出自上次快照以来有变化的持仓和账户汇总（序列化后交给线程池写入）"""
+        dirty, self.book.dirty = self.book.dirty, set()
+        self._persist_dirty |= dirty
+        positions: Dict[int, Dict[str, str]] = {}
+        for account_id, symbol in dirty:
+            positions.setdefault(account_id, {})[symbol] = json.dumps(
+                self.book.positions[(account_id, symbol)].to_dict(), separators=(',', ':'))
+        totals = {str(account_id): json.dumps(self.book.totals(account_id).to_dict(), separators=(',', ':'))
+                  for account_id in positions}
+        return positions, totals
+
+    def write_snapshot(self, positions: Dict[int, Dict[str, str]], totals: Dict[str, str]):
+        if not positions:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for account_id, mapping in positions.items():
+            pipe.hset(positions_key(account_id), mapping=mapping)
+        pipe.hset(PNL_KEY, mapping=totals)
+        pipe.execute()
+
+    def publish_snapshot(self) -> int:
+        positions, totals = self.collect_snapshot()
+        self.write_snapshot(positions, totals)
+        return sum(len(mapping) for mapping in positions.values())
+
+    # -- 数据库（在线程池中执行）--------------------------------------------
+
+    def load(self):
+        """从数据库恢复持仓和账户信息"""
+        from .models import AccountPosition, ExchangeAccount
+
+        accounts = ExchangeAccount.all_objects.filter(
+            pk__in=AccountPosition.all_objects.values('exchange_account_id'),
+        ).values_list('pk', 'exchange', 'tenant_id')
+        for account_id, exchange, tenant_id in accounts:
+            self.book.account_exchanges[account_id] = exchange
+            self.account_tenants[account_id] = tenant_id
+        for row in AccountPosition.all_objects.iterator():
+            self.book.restore(
+                row.exchange_account_id, row.symbol, row.amount, row.avg_price, row.realized_pnl, row.fees,
+                row.mark_price, row.last_fill_id,
+            )
+        return len(self.book.positions)
+
+    def resolve_accounts(self, account_ids: Iterable[int]):
+        from .models import ExchangeAccount
+
+        account_ids = set(account_ids)
+        for account_id, exchange, tenant_id in ExchangeAccount.all_objects.filter(
+                pk__in=account_ids).values_list('pk', 'exchange', 'tenant_id'):
+            self.book.account_exchanges[account_id] = exchange
+            self.account_tenants[account_id] = tenant_id
+        for account_id in account_ids:
+            # 已删除的账户仍然记账，但不写入数据库
+            self.account_tenants.setdefault(account_id, None)
+
+    def collect_persist(self) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """取出需要写入数据库的持仓，以及写入后可以确认的成交"""
+        keys = self._persist_dirty | self.book.dirty
+        self._persist_dirty = set()
+        entry_ids, self._unacked = self._unacked, []
+        rows = []
+        for key in keys:
+            state = self.book.positions[key]
+            tenant_id = self.account_tenants.get(state.account_id)
+            if tenant_id is None:
+                continue
+            position = state.position
+            rows.append({
+                'tenant_id': tenant_id, 'exchange_account_id': state.account_id, 'symbol': state.symbol,
+                'amount': round(position.amount, 12), 'avg_price': round(position.avg_price, 8),
+                'mark_price': round(state.mark_price, 8) if state.mark_price is not None else None,
+                'realized_pnl': round(position.realized_pnl, 8), 'unrealized_pnl': round(state.unrealized, 8),
+                'fees': round(state.fees, 8), 'last_fill_id': state.last_fill_id,
+            })
+        return rows, entry_ids
+
+    def write_positions(self, rows: List[Dict[str, Any]], entry_ids: List[str]) -> int:
+        """按 (账户, 交易对) 批量写入持仓，成功后确认对应的成交"""
+        from .models import AccountPosition
+
+        if rows:
+            now = timezone.now()
+            AccountPosition.all_objects.bulk_create(
+                [AccountPosition(**row, updated_at=now) for row in rows],
+                update_conflicts=True, unique_fields=['exchange_account', 'symbol'],
+                update_fields=['amount', 'avg_price', 'mark_price', 'realized_pnl', 'unrealized_pnl', 'fees',
+                               'last_fill_id', 'updated_at'],
+                batch_size=self.batch_size,
+            )
+        if entry_ids:
+            self.feed.ack(self.group, entry_ids)
+        return len(rows)
+
+    def persist(self) -> int:
+        rows, entry_ids = self.collect_persist()
+        try:
+            return self.write_positions(rows, entry_ids)
+        except Exception:
+            self._restore_persist(rows, entry_ids)
+            raise
+
+    def _restore_persist(self, rows: List[Dict[str, Any]], entry_ids: List[str]):
+        self._persist_dirty |= {(row['exchange_account_id'], row['symbol']) for row in rows}
+        self._unacked[:0] = entry_ids
+
+    # -- 事件循环 ----------------------------------------------------------
+
+    async def _fill_loop(self, stop: asyncio.Event):
+        while not stop.is_set():
+            entries = await asyncio.to_thread(self.feed.read, self.group, self.consumer, self.batch_size, self.block_ms)
+            if not entries:
+                continue
+            unknown = self.unknown_accounts(entries)
+            if unknown:
+                await asyncio.to_thread(self.resolve_accounts, unknown)
+            self.handle_fills(entries)
+
+    async def _market_loop(self, stop: asyncio.Event):
+        while not stop.is_set():
+            exchanges = self.book.exchanges
+            for exchange in exchanges:
+                if exchange not in self._known_exchanges:
+                    await asyncio.to_thread(self.event_log.ensure_group, exchange, self.group, '$')
+                    self._known_exchanges.add(exchange)
+            if not exchanges:
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=self.snapshot_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            events = await asyncio.to_thread(
+                self.event_log.consume, self.group, self.consumer, exchanges, self.batch_size, self.block_ms,
+            )
+            if events:
+                self.handle_events(events)
+                await asyncio.to_thread(self.event_log.ack, self.group, events)
+
+    async def _flush(self):
+        positions, totals = self.collect_snapshot()
+        try:
+            await asyncio.to_thread(self.write_snapshot, positions, totals)
+        except redis.RedisError as e:
+            logger.warning(f"持仓快照写入失败: {e}")
+            self.book.dirty |= {(account_id, symbol) for account_id, mapping in positions.items() for symbol in mapping}
+
+    async def _persist(self):
+        rows, entry_ids = self.collect_persist()
+        try:
+            await asyncio.to_thread(self.write_positions, rows, entry_ids)
+        except Exception as e:
+            logger.error(f"持仓写入失败，稍后重试: {e}")
+            self._restore_persist(rows, entry_ids)
+
+    async def _snapshot_loop(self, stop: asyncio.Event):
+        last_persist = time.monotonic()
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.snapshot_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self._flush()
+            if time.monotonic() - last_persist >= self.persist_interval:
+                await self._persist()
+                last_persist = time.monotonic()
+
+    async def run(self, stop: Optional[asyncio.Event] = None):
+        """运行直到 stop 被设置，退出前写入快照和持仓"""
+        stop = stop or asyncio.Event()
+        count = await asyncio.to_thread(self.load)
+        logger.info(f"持仓引擎启动: 消费者 {self.consumer}, 恢复 {count} 个持仓")
+        try:
+            await asyncio.gather(self._fill_loop(stop), self._market_loop(stop), self._snapshot_loop(stop))
+        finally:
+            await self._flush()
+            await self._persist()
+            logger.info("持仓引擎已停止")
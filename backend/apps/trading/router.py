@@ -0,0 +1,217 @@
+"""
+智能订单路由
+
+租户可以在多个交易所账户上交易同一个交易对。路由器按内存中缓存的各交易所订单簿（MarketState），
+把一笔可立即成交的订单拆分到多个账户，使扣除手续费后的成交价最优：
+
+- 买单按 价格 × (1 + 吃单费率) 从低到高、卖单按 价格 × (1 - 吃单费率) 从高到低依次吃掉各档；
+- 每个账户受可用余额限制（买单为计价资产，卖单为基础资产）；
+- 同一交易所的多个账户共享该交易所的深度，同一档不会被重复分配；
+- 设置了 limit_price 时，越过限价的档位不参与路由。
+
+路由只读内存，不访问数据库和 Redis；各账户的子单以 IOC 限价单发出，价格为该账户吃到的最差一档，
+订单簿过期导致的未成交部分由交易所直接撤销，不会挂在盘口上。
+"""
+import heapq
+import math
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+EPS = 1e-12
+
+# 订单簿档位：(价格, 数量)
+Level = Tuple[float, float]
+
+
+@dataclass
+class Venue:
+    """可路由的交易账户，余额为 None 表示不限制"""
+    account_id: int
+    exchange: str
+    taker_fee: float = 0.0
+    base_free: Optional[float] = None
+    quote_free: Optional[float] = None
+
+    def budget(self, side: str) -> float:
+        """买单可花费的计价资产，卖单可卖出的基础资产"""
+        value = self.quote_free if side == 'buy' else self.base_free
+        return math.inf if value is None else max(value, 0.0)
+
+    def effective_price(self, side: str, price: float) -> float:
+        return price * (1 + self.taker_fee) if side == 'buy' else price * (1 - self.taker_fee)
+
+
+@dataclass
+class RouteSlice:
+    """分配给一个账户的数量"""
+    venue: Venue
+    amount: float = 0.0
+    price: float = 0.0  # 吃到的最差一档，作为 IOC 限价
+    cost: float = 0.0  # 不含手续费的成交金额
+
+    @property
+    def avg_price(self) -> float:
+        return self.cost / self.amount if self.amount > EPS else 0.0
+
+    @property
+    def fee(self) -> float:
+        return self.cost * self.venue.taker_fee
+
+
+@dataclass
+class Route:
+    """路由结果"""
+    side: str
+    amount: float
+    slices: List[RouteSlice] = field(default_factory=list)
+
+    @property
+    def filled(self) -> float:
+        return sum(item.amount for item in self.slices)
+
+    @property
+    def effective_price(self) -> float:
+        """含手续费的平均成交价"""
+        filled = self.filled
+        if filled <= EPS:
+            return 0.0
+        fees = sum(item.fee for item in self.slices)
+        cost = sum(item.cost for item in self.slices)
+        return (cost + fees if self.side == 'buy' else cost - fees) / filled
+
+    def to_dict(self) -> Dict:
+        return {
+            'side': self.side,
+            'amount': self.amount,
+            'filled': self.filled,
+            'effective_price': self.effective_price,
+            'slices': [
+                {'account_id': item.venue.account_id, 'exchange': item.venue.exchange, 'amount': item.amount,
+                 'price': item.price, 'avg_price': item.avg_price, 'fee': item.fee}
+                for item in self.slices
+            ],
+        }
+
+
+def book_levels(quote, side: str) -> Sequence[Level]:
+    """订单的对手盘：买单吃卖盘，卖单吃买盘"""
+    if quote is None:
+        return ()
+    return quote.asks if side == 'buy' else quote.bids
+
+
+def route_order(side: str, amount: float, venues: Iterable[Venue], books: Dict[str, Sequence[Level]],
+                limit_price: Optional[float] = None, lot_size: float = 0.0, min_amount: float = 0.0) -> Route:
+    """
+    按有效价格合并各账户的对手盘档位，贪心分配数量
+
+    Args:
+        venues: 可路由的账户
+        books: 交易所 -> 对手盘档位（已按从优到劣排序）
+        lot_size: 数量精度，各账户的数量向下取整
+        min_amount: 小于该数量的分配被丢弃
+
+    Returns:
+        Route，slices 按分配数量从大到小排序；流动性或余额不足时 filled 小于 amount
+    """
+    route = Route(side, float(amount))
+    sign = 1.0 if side == 'buy' else -1.0
+    remaining = float(amount)
+    # 同一交易所的账户共享档位的剩余数量
+    depth: Dict[str, List[float]] = {}
+    slices: Dict[int, RouteSlice] = {}
+    budgets: Dict[int, float] = {}
+    heap = []
+
+    def push(venue: Venue, index: int):
+        levels = books.get(venue.exchange) or ()
+        if index >= len(levels):
+            return
+        price = levels[index][0]
+        if limit_price is not None and sign * (price - limit_price) > 0:
+            return
+        heapq.heappush(heap, (sign * venue.effective_price(side, price), index, id(venue), venue))
+
+    for venue in venues:
+        budget = venue.budget(side)
+        if budget <= EPS:
+            continue
+        budgets[id(venue)] = budget
+        if venue.exchange not in depth:
+            depth[venue.exchange] = [size for _, size in books.get(venue.exchange) or ()]
+        push(venue, 0)
+
+    while heap and remaining > EPS:
+        _, index, key, venue = heapq.heappop(heap)
+        price = books[venue.exchange][index][0]
+        available = depth[venue.exchange]
+        take = min(remaining, available[index])
+        if side == 'buy':
+            take = min(take, budgets[key] / venue.effective_price(side, price))
+        else:
+            take = min(take, budgets[key])
+        if take > EPS:
+            available[index] -= take
+            budgets[key] -= take * venue.effective_price(side, price) if side == 'buy' else take
+            remaining -= take
+            item = slices.get(key)
+            if item is None:
+                item = slices[key] = RouteSlice(venue)
+            item.amount += take
+            item.cost += take * price
+            item.price = price
+        if budgets[key] > EPS:
+            push(venue, index + 1)
+
+    for item in slices.values():
+        if lot_size:
+            rounded = math.floor(item.amount / lot_size + 1e-9) * lot_size
+            if item.amount > EPS:
+                item.cost *= rounded / item.amount
+            item.amount = rounded
+        item.amount = round(item.amount, 12)
+        if item.amount >= max(min_amount, EPS):
+            route.slices.append(item)
+    route.slices.sort(key=lambda item: -item.amount)
+    return route
+
+
+def taker_fee(exchange: str, account_id: int, overrides: Optional[Dict] = None) -> float:
+    """吃单费率：算法单参数按账户ID覆盖，其次 ROUTER_TAKER_FEES 按交易所配置"""
+    overrides = overrides or {}
+    if str(account_id) in overrides:
+        return float(overrides[str(account_id)])
+    fees = getattr(settings, 'ROUTER_TAKER_FEES', {})
+    return float(fees.get(exchange, getattr(settings, 'ROUTER_DEFAULT_TAKER_FEE', 0.001)))
+
+
+def load_venues(tenant_id, symbol: str, account_ids: Optional[Sequence[int]] = None,
+                fees: Optional[Dict] = None) -> List[Venue]:
+    """
+    读取租户可用于该交易对的账户和余额（账户同步写入的 AccountBalance）
+
+    Args:
+        account_ids: 限定的账户，为空时使用租户全部启用的账户
+        fees: 账户ID -> 吃单费率
+    """
+    from .models import AccountBalance, ExchangeAccount
+
+    base, _, quote = symbol.partition('/')
+    quote = quote.split(':')[0]
+    accounts = ExchangeAccount.all_objects.filter(tenant_id=tenant_id, is_active=True)
+    if account_ids:
+        accounts = accounts.filter(pk__in=list(account_ids))
+    venues = {
+        pk: Venue(pk, exchange, taker_fee(exchange, pk, fees), base_free=0.0, quote_free=0.0)
+        for pk, exchange in accounts.values_list('pk', 'exchange')
+    }
+    for account_id, asset, free in AccountBalance.all_objects.filter(
+        exchange_account_id__in=list(venues), asset__in=[base, quote],
+    ).values_list('exchange_account_id', 'asset', 'free'):
+        if asset == base:
+            venues[account_id].base_free = float(free)
+        else:
+            venues[account_id].quote_free = float(free)
+    return [venues[pk] for pk in sorted(venues)]
@@ -0,0 +1,937 @@
+"""
+模拟交易所
+
+本地撮合的交易所，用作模拟盘和订单链路压测的目标，不依赖交易所的测试网：
+
+- 每个交易对一个价格优先、时间优先的撮合簿（MatchingBook）；
+- 盘口流动性来自录制的市场数据：orderbook 事件更新各档的挂单量，trade 事件作为主动单与簿中的挂单撮合，
+  模拟单在价位上排在已有的挂单之后，按真实的排队位置成交；
+- 多个账户共享同一个撮合簿，账户之间的订单也会撮合；
+- SimulatedExchange（同步）、AsyncSimulatedExchange（异步）提供网关和账户同步使用的 ccxt 方法，
+  可配置延迟、错误率和超时率（超时表示订单已被接受、只是响应丢失）。
+
+模拟交易所的状态在进程内。PAPER_TRADING_ENABLED 打开时，测试网账户是模拟盘账户，
+由订单网关进程持有模拟交易所（PaperTrading）：跟随市场事件日志更新盘口，并定期把账户同步到数据库。
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+import ccxt
+from django.conf import settings
+
+from apps.monitoring.latency import now_ms
+
+logger = logging.getLogger(__name__)
+
+EPS = 1e-12
+
+TIME_IN_FORCE = ('GTC', 'IOC', 'FOK', 'PO')
+
+
+def paper_trading_enabled() -> bool:
+    return getattr(settings, 'PAPER_TRADING_ENABLED', False)
+
+
+def is_paper_account(account) -> bool:
+    """模拟盘账户：开启模拟盘时的测试网账户"""
+    return paper_trading_enabled() and bool(getattr(account, 'is_testnet', False))
+
+
+@dataclass
+class SimulationConfig:
+    """延迟、故障注入和费率"""
+    latency_ms: float = 0.0  # 往返延迟，请求和响应各占一半
+    jitter_ms: float = 0.0  # 延迟的随机浮动（均匀分布）
+    error_rate: float = 0.0  # 请求在到达撮合前失败的概率（ExchangeNotAvailable）
+    timeout_rate: float = 0.0  # 请求已处理、响应丢失的概率（RequestTimeout）
+    maker_fee: float = 0.001
+    taker_fee: float = 0.001
+    ticker_liquidity: float = 1e6  # 只有 ticker 没有订单簿时，买一/卖一的挂单量
+    initial_balances: Dict[str, float] = field(default_factory=lambda: {'USDT': 100000.0})
+    history: int = 100000  # 保留的已结束订单数
+    seed: Optional[int] = None
+
+    @classmethod
+    def from_settings(cls, **overrides) -> 'SimulationConfig':
+        values = {
+            'latency_ms': getattr(settings, 'SIMULATOR_LATENCY_MS', 0.0),
+            'jitter_ms': getattr(settings, 'SIMULATOR_JITTER_MS', 0.0),
+            'error_rate': getattr(settings, 'SIMULATOR_ERROR_RATE', 0.0),
+            'timeout_rate': getattr(settings, 'SIMULATOR_TIMEOUT_RATE', 0.0),
+            'maker_fee': getattr(settings, 'SIMULATOR_MAKER_FEE', 0.001),
+            'taker_fee': getattr(settings, 'SIMULATOR_TAKER_FEE', 0.001),
+            'initial_balances': dict(getattr(settings, 'SIMULATOR_INITIAL_BALANCES', {'USDT': 100000.0})),
+        }
+        values.update(overrides)
+        return cls(**values)
+
+
+@dataclass(eq=False)
+class SimOrder:
+    """撮合簿中的订单，account_id 为 None 的是录制的盘口流动性"""
+    id: str
+    symbol: str
+    side: str
+    price: Optional[float]
+    amount: float
+    account_id: Optional[int] = None
+    client_order_id: Optional[str] = None
+    order_type: str = 'limit'
+    time_in_force: str = 'GTC'
+    filled: float = 0.0
+    cost: float = 0.0
+    fee: float = 0.0
+    status: str = 'open'
+    timestamp: int = 0
+    last_trade_ts: Optional[int] = None
+    unit_reserve: float = 0.0  # 每单位未成交数量冻结的资产（买单为计价资产，卖单为基础资产）
+
+    @property
+    def remaining(self) -> float:
+        return max(self.amount - self.filled, 0.0)
+
+    @property
+    def live(self) -> bool:
+        return self.status == 'open' and self.amount - self.filled > EPS
+
+    def to_ccxt(self, fee_currency: str) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'clientOrderId': self.client_order_id,
+            'timestamp': self.timestamp,
+            'datetime': ccxt.Exchange.iso8601(self.timestamp),
+            'lastTradeTimestamp': self.last_trade_ts,
+            'symbol': self.symbol,
+            'type': self.order_type,
+            'timeInForce': self.time_in_force,
+            'postOnly': self.time_in_force == 'PO',
+            'side': self.side,
+            'price': self.price,
+            'amount': self.amount,
+            'filled': self.filled,
+            'remaining': self.remaining,
+            'cost': self.cost,
+            'average': self.cost / self.filled if self.filled > EPS else None,
+            'status': self.status,
+            'fee': {'cost': self.fee, 'currency': fee_currency},
+            'trades': [],
+            'info': {},
+        }
+
+
+class BookSide:
+    """
+    撮合簿的一侧
+
+    价格 -> 按到达顺序排队的订单。最优价由堆维护，空价位和已结束的订单都是惰性删除：
+    撤单只改状态，订单排到队首时才移出。
+    """
+
+    def __init__(self, side: str):
+        self.side = side
+        self._sign = -1.0 if side == 'buy' else 1.0
+        self.levels: Dict[float, Deque[SimOrder]] = {}
+        self._heap: List[float] = []
+
+    def add(self, order: SimOrder):
+        level = self.levels.get(order.price)
+        if level is None:
+            level = self.levels[order.price] = deque()
+            heapq.heappush(self._heap, self._sign * order.price)
+            if len(self._heap) > 2 * len(self.levels) + 64:
+                self._heap = [self._sign * price for price in self.levels]
+                heapq.heapify(self._heap)
+        level.append(order)
+
+    def best(self) -> Optional[float]:
+        heap = self._heap
+        while heap:
+            price = self._sign * heap[0]
+            level = self.levels.get(price)
+            if level is not None:
+                while level and not level[0].live:
+                    level.popleft()
+                if level:
+                    return price
+                del self.levels[price]
+            heapq.heappop(heap)
+        return None
+
+    def crosses(self, price: float, limit: Optional[float]) -> bool:
+        """本侧的 price 是否满足对手方的限价"""
+        return limit is None or self._sign * (price - limit) <= 0
+
+    def prune(self, price: float):
+        """价位上没有有效订单时删除（堆中的价格留到堆顶时再删除）"""
+        level = self.levels.get(price)
+        if level is not None and not any(order.live for order in level):
+            del self.levels[price]
+
+    def take(self, amount: float, limit: Optional[float],
+             on_fill: Callable[[SimOrder, float, float], None]) -> float:
+        """按价格、时间优先吃掉满足 limit 的挂单，返回未成交的数量"""
+        while amount > EPS:
+            price = self.best()
+            if price is None or not self.crosses(price, limit):
+                break
+            level = self.levels[price]
+            while level and amount > EPS:
+                maker = level[0]
+                if not maker.live:
+                    level.popleft()
+                    continue
+                quantity = min(amount, maker.remaining)
+                on_fill(maker, price, quantity)
+                amount -= quantity
+                if not maker.live:
+                    level.popleft()
+        return amount
+
+    def sorted_levels(self, limit: Optional[float] = None) -> List[Tuple[float, float]]:
+        """从优到劣的 (价格, 有效挂单量)，只包含满足 limit 的价位"""
+        levels = []
+        for price in sorted(self.levels, key=lambda price: self._sign * price):
+            if not self.crosses(price, limit):
+                break
+            size = sum(order.remaining for order in self.levels[price] if order.live)
+            if size > EPS:
+                levels.append((price, size))
+        return levels
+
+
+class MatchingBook:
+    """单个交易对的撮合簿"""
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.bids = BookSide('buy')
+        self.asks = BookSide('sell')
+        # 录制的盘口流动性：方向 -> 价格 -> 订单
+        self.recorded: Dict[str, Dict[float, SimOrder]] = {'buy': {}, 'sell': {}}
+        self.has_depth = False
+        self.last: Optional[float] = None
+        self.ts = 0
+
+    def side(self, side: str) -> BookSide:
+        return self.bids if side == 'buy' else self.asks
+
+    def opposite(self, side: str) -> BookSide:
+        return self.asks if side == 'buy' else self.bids
+
+    def set_recorded(self, side: str, levels: Iterable, new_id: Callable[[], str]):
+        """
+        用录制的档位替换一侧的盘口流动性
+
+        仍然存在的价位只修改挂单量，保持排队位置；新的价位排在已有的模拟单之后；消失的价位撤掉。
+        """
+        book = self.side(side)
+        current = self.recorded[side]
+        fresh = {}
+        for level in levels:
+            price, size = float(level[0]), float(level[1])
+            if size <= EPS or price in fresh:
+                continue
+            order = current.pop(price, None)
+            if order is not None and order.live:
+                order.amount = order.filled + size
+            else:
+                order = SimOrder(new_id(), self.symbol, side, price, size)
+                book.add(order)
+            fresh[price] = order
+        for price, order in current.items():
+            order.status = 'canceled'
+            book.prune(price)
+        self.recorded[side] = fresh
+
+
+class SimulatedVenue:
+    """
+    模拟交易所
+
+    所有方法线程安全：订单网关在事件循环中调用，行情回放可以在其他线程中进行。
+    账户按交易账户ID区分，首次使用时按 initial_balances 入金。
+    """
+
+    def __init__(self, exchange: str = 'simulator', config: Optional[SimulationConfig] = None,
+                 clock: Callable[[], float] = now_ms):
+        self.exchange = exchange
+        self.config = config or SimulationConfig.from_settings()
+        self.clock = clock
+        self.books: Dict[str, MatchingBook] = {}
+        self.markets: Dict[str, Dict[str, Any]] = {}
+        self.balances: Dict[int, Dict[str, List[float]]] = {}  # 账户 -> 资产 -> [可用, 冻结]
+        self.orders: Dict[str, SimOrder] = {}
+        self.open_orders: Dict[int, Dict[str, SimOrder]] = {}
+        self.my_trades: Dict[int, Deque[Dict[str, Any]]] = {}
+        self.public_trades: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._closed: Deque[str] = deque()
+        self._ids = itertools.count(1)
+        self._trade_ids = itertools.count(1)
+        self._random = random.Random(self.config.seed)
+        self.lock = threading.RLock()
+        self.counters = {'orders': 0, 'fills': 0, 'rejected': 0, 'errors': 0, 'timeouts': 0, 'events': 0}
+
+    # -- 市场和行情 --------------------------------------------------------
+
+    def _next_id(self) -> str:
+        return str(next(self._ids))
+
+    def add_market(self, symbol: str) -> MatchingBook:
+        with self.lock:
+            book = self.books.get(symbol)
+            if book is None:
+                base, _, quote = symbol.partition('/')
+                book = self.books[symbol] = MatchingBook(symbol)
+                self.public_trades[symbol] = deque(maxlen=1000)
+                self.markets[symbol] = {
+                    'id': symbol.replace('/', ''), 'symbol': symbol, 'base': base, 'quote': quote,
+                    'baseId': base, 'quoteId': quote, 'type': 'spot', 'spot': True, 'active': True,
+                    'maker': self.config.maker_fee, 'taker': self.config.taker_fee,
+                    'precision': {'amount': 1e-8, 'price': 1e-8},
+                    'limits': {'amount': {'min': None, 'max': None}, 'price': {'min': None, 'max': None}},
+                    'info': {},
+                }
+            return book
+
+    def book(self, symbol: str) -> MatchingBook:
+        book = self.books.get(symbol)
+        if book is None:
+            raise ccxt.BadSymbol(f'{self.exchange} 模拟交易所没有交易对 {symbol}')
+        return book
+
+    def apply_event(self, event) -> bool:
+        """应用一个录制的市场事件（ticker / orderbook / trade），返回是否使用"""
+        data = event.data
+        with self.lock:
+            book = self.add_market(event.symbol)
+            ts = event.timestamp or int(self.clock())
+            if event.event_type == 'orderbook':
+                book.has_depth = True
+                book.set_recorded('buy', data.get('bids') or (), self._next_id)
+                book.set_recorded('sell', data.get('asks') or (), self._next_id)
+            elif event.event_type == 'ticker':
+                if data.get('last'):
+                    book.last = float(data['last'])
+                if not book.has_depth:
+                    size = self.config.ticker_liquidity
+                    book.set_recorded('buy', [(data['bid'], size)] if data.get('bid') else (), self._next_id)
+                    book.set_recorded('sell', [(data['ask'], size)] if data.get('ask') else (), self._next_id)
+            elif event.event_type == 'trade':
+                price, amount = float(data['price']), float(data['amount'])
+                side = data.get('side')
+                if side in ('buy', 'sell'):
+                    # 录制的成交作为主动单，吃掉价格不差于成交价的挂单（包括排在前面的录制挂单）
+                    book.opposite(side).take(amount, price, lambda maker, px, qty: self._fill(book, maker, None, px, qty, ts))
+                book.last = price
+            else:
+                return False
+            book.ts = max(book.ts, ts)
+            self._uncross(book, ts)
+            self.counters['events'] += 1
+            return True
+
+    def _uncross(self, book: MatchingBook, ts: int):
+        """盘口更新后与模拟单交叉的部分按模拟单的价格成交"""
+        while True:
+            bid, ask = book.bids.best(), book.asks.best()
+            if bid is None or ask is None or bid < ask:
+                return
+            buy, sell = book.bids.levels[bid][0], book.asks.levels[ask][0]
+            if buy.account_id is None and sell.account_id is None:
+                return
+            # 模拟单是挂单方，录制的流动性是主动方
+            maker, taker = (buy, sell) if sell.account_id is None else (sell, buy)
+            self._fill(book, maker, taker, maker.price, min(buy.remaining, sell.remaining), ts)
+
+    # -- 账户 --------------------------------------------------------------
+
+    def account(self, account_id: int) -> Dict[str, List[float]]:
+        balances = self.balances.get(account_id)
+        if balances is None:
+            balances = self.balances[account_id] = {
+                asset: [float(amount), 0.0] for asset, amount in self.config.initial_balances.items()
+            }
+            self.open_orders[account_id] = {}
+            self.my_trades[account_id] = deque(maxlen=self.config.history)
+        return balances
+
+    def deposit(self, account_id: int, asset: str, amount: float):
+        with self.lock:
+            self.account(account_id).setdefault(asset, [0.0, 0.0])[0] += float(amount)
+
+    def _reserve(self, balances, asset: str, amount: float):
+        balance = balances.setdefault(asset, [0.0, 0.0])
+        if balance[0] < amount - EPS:
+            raise ccxt.InsufficientFunds(f'{asset} 可用余额不足: {balance[0]} < {amount}')
+        balance[0] -= amount
+        balance[1] += amount
+
+    @staticmethod
+    def _release(balances, asset: str, amount: float):
+        balance = balances.setdefault(asset, [0.0, 0.0])
+        amount = min(amount, balance[1])
+        balance[1] -= amount
+        balance[0] += amount
+
+    # -- 撮合 --------------------------------------------------------------
+
+    def _fill(self, book: MatchingBook, maker: SimOrder, taker: Optional[SimOrder], price: float, quantity: float,
+              ts: int):
+        self._settle(maker, price, quantity, self.config.maker_fee, 'maker', ts)
+        if taker is not None:
+            self._settle(taker, price, quantity, self.config.taker_fee, 'taker', ts)
+        book.last = price
+        self.public_trades[book.symbol].append({
+            'id': str(next(self._trade_ids)), 'timestamp': ts, 'symbol': book.symbol,
+            'side': 'sell' if maker.side == 'buy' else 'buy', 'price': price, 'amount': quantity,
+        })
+
+    def _settle(self, order: SimOrder, price: float, quantity: float, fee_rate: float, role: str, ts: int):
+        order.filled += quantity
+        if order.account_id is None:
+            return
+        value = price * quantity
+        fee = value * fee_rate
+        market = self.markets[order.symbol]
+        balances = self.balances[order.account_id]
+        if order.side == 'buy':
+            self._release(balances, market['quote'], quantity * order.unit_reserve)
+            balances[market['quote']][0] -= value + fee
+            balances.setdefault(market['base'], [0.0, 0.0])[0] += quantity
+        else:
+            self._release(balances, market['base'], quantity * order.unit_reserve)
+            balances[market['base']][0] -= quantity
+            balances.setdefault(market['quote'], [0.0, 0.0])[0] += value - fee
+        order.cost += value
+        order.fee += fee
+        order.last_trade_ts = ts
+        self.counters['fills'] += 1
+        self.my_trades[order.account_id].append({
+            'id': str(next(self._trade_ids)), 'order': order.id, 'clientOrderId': order.client_order_id,
+            'timestamp': ts, 'datetime': ccxt.Exchange.iso8601(ts), 'symbol': order.symbol, 'side': order.side,
+            'type': order.order_type, 'takerOrMaker': role, 'price': price, 'amount': quantity, 'cost': value,
+            'fee': {'cost': fee, 'currency': market['quote']}, 'info': {},
+        })
+        if order.remaining <= EPS:
+            self._finish(order, 'closed')
+
+    def _finish(self, order: SimOrder, status: str):
+        order.status = status
+        market = self.markets[order.symbol]
+        balances = self.balances[order.account_id]
+        self._release(balances, market['quote'] if order.side == 'buy' else market['base'],
+                      order.remaining * order.unit_reserve)
+        self.open_orders[order.account_id].pop(order.id, None)
+        self._closed.append(order.id)
+        while len(self._closed) > self.config.history:
+            self.orders.pop(self._closed.popleft(), None)
+
+    def create_order(self, account_id: int, symbol: str, order_type: str, side: str, amount: float,
+                     price: Optional[float] = None, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        params = params or {}
+        with self.lock:
+            try:
+                return self._create_order(account_id, symbol, order_type, side, amount, price, params)
+            except ccxt.BaseError:
+                self.counters['rejected'] += 1
+                raise
+
+    def _create_order(self, account_id, symbol, order_type, side, amount, price, params) -> Dict[str, Any]:
+        book = self.book(symbol)
+        market = self.markets[symbol]
+        balances = self.account(account_id)
+        amount = float(amount)
+        if side not in ('buy', 'sell') or order_type not in ('market', 'limit'):
+            raise ccxt.InvalidOrder(f'不支持的订单: {order_type} {side}')
+        if amount <= EPS:
+            raise ccxt.InvalidOrder('订单数量必须大于0')
+        if order_type == 'limit' and (price is None or float(price) <= 0):
+            raise ccxt.InvalidOrder('限价单缺少价格')
+        time_in_force = 'PO' if params.get('postOnly') else str(params.get('timeInForce') or 'GTC').upper()
+        if time_in_force not in TIME_IN_FORCE:
+            raise ccxt.InvalidOrder(f'不支持的 timeInForce: {time_in_force}')
+        if params.get('stopPrice') is not None:
+            raise ccxt.InvalidOrder('模拟交易所不支持止损单')
+        limit = float(price) if order_type == 'limit' else None
+        opposite = book.opposite(side)
+        best = opposite.best()
+        if time_in_force == 'PO' and best is not None and opposite.crosses(best, limit):
+            raise ccxt.OrderImmediatelyFillable('只挂单（post only）的订单会立即成交')
+
+        now = int(self.clock())
+        order = SimOrder(
+            self._next_id(), symbol, side, limit, amount, account_id, params.get('clientOrderId'), order_type,
+            time_in_force if order_type == 'limit' else 'IOC', timestamp=now,
+        )
+        # 冻结资金：限价买单按限价和吃单费率，市价买单按当前盘口估算的花费，卖单按数量
+        if side == 'buy':
+            if limit is not None:
+                order.unit_reserve = limit * (1 + self.config.taker_fee)
+                self._reserve(balances, market['quote'], amount * order.unit_reserve)
+            else:
+                cost, size = 0.0, 0.0
+                for level_price, level_size in opposite.sorted_levels():
+                    take = min(level_size, amount - size)
+                    cost, size = cost + take * level_price, size + take
+                    if size >= amount - EPS:
+                        break
+                if balances.get(market['quote'], [0.0])[0] < cost * (1 + self.config.taker_fee) - EPS:
+                    raise ccxt.InsufficientFunds(f"{market['quote']} 可用余额不足")
+        else:
+            order.unit_reserve = 1.0
+            self._reserve(balances, market['base'], amount)
+
+        self.orders[order.id] = order
+        self.open_orders[account_id][order.id] = order
+        self.counters['orders'] += 1
+        if time_in_force == 'FOK' and sum(size for _, size in opposite.sorted_levels(limit)) < amount - EPS:
+            self._finish(order, 'expired')
+            return order.to_ccxt(market['quote'])
+        opposite.take(amount, limit, lambda maker, px, qty: self._fill(book, maker, order, px, qty, now))
+        if order.live:
+            if order_type == 'market' or time_in_force in ('IOC', 'FOK'):
+                self._finish(order, 'expired')
+            else:
+                book.side(side).add(order)
+        return order.to_ccxt(market['quote'])
+
+    def _owned(self, account_id: int, order_id) -> SimOrder:
+        order = self.orders.get(str(order_id))
+        if order is None or order.account_id != account_id:
+            raise ccxt.OrderNotFound(f'订单不存在: {order_id}')
+        return order
+
+    def cancel_order(self, account_id: int, order_id, symbol: Optional[str] = None) -> Dict[str, Any]:
+        with self.lock:
+            order = self._owned(account_id, order_id)
+            if order.status != 'open':
+                raise ccxt.OrderNotFound(f'订单已结束: {order_id}')
+            self._finish(order, 'canceled')
+            self.books[order.symbol].side(order.side).prune(order.price)
+            return order.to_ccxt(self.markets[order.symbol]['quote'])
+
+    def fetch_order(self, account_id: int, order_id, symbol: Optional[str] = None,
+                    client_order_id: Optional[str] = None) -> Dict[str, Any]:
+        """按订单ID查询；没有订单ID时按客户端订单号查询（下单响应丢失后的确认）"""
+        with self.lock:
+            if order_id is None and client_order_id:
+                order_id = next((order.id for order in self.orders.values()
+                                 if order.account_id == account_id and order.client_order_id == client_order_id), None)
+            order = self._owned(account_id, order_id)
+            return order.to_ccxt(self.markets[order.symbol]['quote'])
+
+    def fetch_open_orders(self, account_id: int, symbol: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self.lock:
+            self.account(account_id)
+            return [order.to_ccxt(self.markets[order.symbol]['quote'])
+                    for order in self.open_orders[account_id].values() if symbol is None or order.symbol == symbol]
+
+    def fetch_my_trades(self, account_id: int, symbol: Optional[str] = None, since: Optional[int] = None,
+                        limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        with self.lock:
+            self.account(account_id)
+            trades = [dict(trade) for trade in self.my_trades[account_id]
+                      if (symbol is None or trade['symbol'] == symbol) and (since is None or trade['timestamp'] >= since)]
+        return trades[:limit] if limit else trades
+
+    def fetch_balance(self, account_id: int) -> Dict[str, Any]:
+        with self.lock:
+            balances = self.account(account_id)
+            free = {asset: balance[0] for asset, balance in balances.items()}
+            used = {asset: balance[1] for asset, balance in balances.items()}
+        total = {asset: free[asset] + used[asset] for asset in free}
+        result = {asset: {'free': free[asset], 'used': used[asset], 'total': total[asset]} for asset in free}
+        result.update(free=free, used=used, total=total, info={})
+        return result
+
+    def fetch_ticker(self, symbol: str) -> Dict[str, Any]:
+        with self.lock:
+            book = self.book(symbol)
+            bids, asks = book.bids.sorted_levels()[:1], book.asks.sorted_levels()[:1]
+            since = book.ts - 86400000
+            prices = [trade['price'] for trade in self.public_trades[symbol] if trade['timestamp'] >= since]
+            volume = sum(trade['amount'] for trade in self.public_trades[symbol] if trade['timestamp'] >= since)
+        return {
+            'symbol': symbol, 'timestamp': book.ts, 'datetime': ccxt.Exchange.iso8601(book.ts),
+            'bid': bids[0][0] if bids else None, 'bidVolume': bids[0][1] if bids else None,
+            'ask': asks[0][0] if asks else None, 'askVolume': asks[0][1] if asks else None,
+            'last': book.last, 'close': book.last, 'open': prices[0] if prices else None,
+            'high': max(prices) if prices else None, 'low': min(prices) if prices else None,
+            'baseVolume': volume or None, 'percentage': None, 'info': {},
+        }
+
+    def fetch_order_book(self, symbol: str, limit: Optional[int] = None) -> Dict[str, Any]:
+        with self.lock:
+            book = self.book(symbol)
+            bids, asks = book.bids.sorted_levels(), book.asks.sorted_levels()
+        limit = limit or len(bids) + len(asks)
+        return {
+            'symbol': symbol, 'bids': [list(level) for level in bids[:limit]],
+            'asks': [list(level) for level in asks[:limit]], 'timestamp': book.ts,
+            'datetime': ccxt.Exchange.iso8601(book.ts), 'nonce': None,
+        }
+
+    def fetch_trades(self, symbol: str, since: Optional[int] = None, limit: Optional[int] = None) -> List[Dict]:
+        with self.lock:
+            self.book(symbol)
+            trades = [dict(trade) for trade in self.public_trades[symbol] if since is None or trade['timestamp'] >= since]
+        return trades[-limit:] if limit else trades
+
+    def fetch_ohlcv(self, symbol: str, timeframe: str = '1m', since: Optional[int] = None,
+                    limit: Optional[int] = None) -> List[List[float]]:
+        """由最近的成交（最多 1000 笔）聚合K线"""
+        step = ccxt.Exchange.parse_timeframe(timeframe) * 1000
+        candles: Dict[int, List[float]] = {}
+        for trade in self.fetch_trades(symbol, since):
+            start = trade['timestamp'] // step * step
+            price, amount = trade['price'], trade['amount']
+            candle = candles.get(start)
+            if candle is None:
+                candles[start] = [start, price, price, price, price, amount]
+            else:
+                candle[2], candle[3] = max(candle[2], price), min(candle[3], price)
+                candle[4] = price
+                candle[5] += amount
+        rows = [candles[start] for start in sorted(candles)]
+        return rows[-limit:] if limit else rows
+
+    # -- 延迟和故障注入 ----------------------------------------------------
+
+    def delay(self) -> float:
+        """单程延迟（秒）"""
+        config = self.config
+        if not config.latency_ms and not config.jitter_ms:
+            return 0.0
+        with self.lock:
+            jitter = self._random.uniform(-config.jitter_ms, config.jitter_ms) if config.jitter_ms else 0.0
+        return max(config.latency_ms + jitter, 0.0) / 2000
+
+    def inject(self, method: str, processed: bool):
+        """按概率抛出注入的错误：processed=False 在处理前（请求失败），True 在处理后（响应丢失）"""
+        rate = self.config.timeout_rate if processed else self.config.error_rate
+        if not rate:
+            return
+        with self.lock:
+            hit = self._random.random() < rate
+            if hit:
+                self.counters['timeouts' if processed else 'errors'] += 1
+        if hit and processed:
+            raise ccxt.RequestTimeout(f'{self.exchange} {method} 请求超时（模拟）')
+        if hit:
+            raise ccxt.ExchangeNotAvailable(f'{self.exchange} {method} 服务不可用（模拟）')
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                **self.counters,
+                'symbols': len(self.books),
+                'accounts': len(self.balances),
+                'open_orders': sum(len(orders) for orders in self.open_orders.values()),
+            }
+
+
+# 交易所接口中由账户调用的方法（第一个参数为账户ID）
+ACCOUNT_METHODS = ('create_order', 'cancel_order', 'fetch_order', 'fetch_open_orders', 'fetch_my_trades',
+                   'fetch_balance')
+MARKET_METHODS = ('fetch_ticker', 'fetch_order_book', 'fetch_trades', 'fetch_ohlcv')
+
+
+class SimulatedExchange:
+    """
+    模拟交易所的 ccxt 兼容接口（同步），每个交易账户一个实例
+
+    id 为模拟的交易所代码，批量接口上限、是否需要交易对等按该交易所处理。
+    """
+    rateLimit = 0
+
+    def __init__(self, venue: SimulatedVenue, account_id: int):
+        self.venue = venue
+        self.account_id = account_id
+        self.id = venue.exchange
+        self.options: Dict[str, Any] = {}
+        self.markets: Dict[str, Dict[str, Any]] = {}
+        self.currencies: Dict[str, Any] = {}
+        self.markets_loaded = False
+        self.has = {
+            'createOrders': True, 'cancelOrders': True, 'cancelAllOrders': True, 'fetchMyTrades': True,
+            'fetchOpenOrders': True, 'fetchOrder': True, 'fetchOHLCV': True,
+        }
+
+    def _invoke(self, method: str, *args):
+        venue = self.venue
+        venue.inject(method, processed=False)
+        if method in ACCOUNT_METHODS:
+            result = getattr(venue, method)(self.account_id, *args)
+        else:
+            result = getattr(venue, method)(*args)
+        venue.inject(method, processed=True)
+        return result
+
+    def _call(self, method: str, *args):
+        delay = self.venue.delay()
+        if delay:
+            time.sleep(delay)
+        result = self._invoke(method, *args)
+        if delay:
+            time.sleep(delay)
+        return result
+
+    def _markets(self) -> Dict[str, Dict[str, Any]]:
+        with self.venue.lock:
+            self.markets = {symbol: dict(market) for symbol, market in self.venue.markets.items()}
+        self.currencies = {code: {'id': code, 'code': code} for market in self.markets.values()
+                           for code in (market['base'], market['quote'])}
+        self.markets_loaded = True
+        return self.markets
+
+    def load_markets(self, reload: bool = False, params=None):
+        return self._markets()
+
+    def set_markets(self, markets, currencies=None):
+        self.markets = {market['symbol']: market for market in markets} if isinstance(markets, list) else dict(markets)
+        self.currencies = currencies or self.currencies
+        self.markets_loaded = True
+        return self.markets
+
+    def close(self):
+        pass
+
+    def create_order(self, symbol, type, side, amount, price=None, params=None):
+        return self._call('create_order', symbol, type, side, amount, price, params or {})
+
+    def create_orders(self, orders: List[Dict[str, Any]], params=None):
+        return [self.create_order(order['symbol'], order['type'], order['side'], order['amount'],
+                                  order.get('price'), order.get('params')) for order in orders]
+
+    def cancel_order(self, id, symbol=None, params=None):
+        return self._call('cancel_order', id, symbol)
+
+    def cancel_orders(self, ids, symbol=None, params=None):
+        return [self.cancel_order(order_id, symbol) for order_id in ids]
+
+    def cancel_all_orders(self, symbol=None, params=None):
+        open_orders = self.venue.fetch_open_orders(self.account_id, symbol)
+        return [self.cancel_order(order['id'], order['symbol']) for order in open_orders]
+
+    def fetch_order(self, id, symbol=None, params=None):
+        return self._call('fetch_order', id, symbol, (params or {}).get('clientOrderId'))
+
+    def fetch_open_orders(self, symbol=None, since=None, limit=None, params=None):
+        return self._call('fetch_open_orders', symbol)
+
+    def fetch_my_trades(self, symbol=None, since=None, limit=None, params=None):
+        return self._call('fetch_my_trades', symbol, since, limit)
+
+    def fetch_balance(self, params=None):
+        return self._call('fetch_balance')
+
+    def fetch_ticker(self, symbol, params=None):
+        return self._call('fetch_ticker', symbol)
+
+    def fetch_tickers(self, symbols=None, params=None):
+        return {symbol: self.fetch_ticker(symbol) for symbol in (symbols or list(self.venue.books))}
+
+    def fetch_order_book(self, symbol, limit=None, params=None):
+        return self._call('fetch_order_book', symbol, limit)
+
+    def fetch_trades(self, symbol, since=None, limit=None, params=None):
+        return self._call('fetch_trades', symbol, since, limit)
+
+    def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=None, params=None):
+        return self._call('fetch_ohlcv', symbol, timeframe, since, limit)
+
+
+class AsyncSimulatedExchange(SimulatedExchange):
+    """模拟交易所的 ccxt.async_support 兼容接口，延迟用 asyncio.sleep，不阻塞事件循环"""
+
+    async def _call(self, method: str, *args):
+        delay = self.venue.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        result = self._invoke(method, *args)
+        if delay:
+            await asyncio.sleep(delay)
+        return result
+
+    async def load_markets(self, reload: bool = False, params=None):
+        return self._markets()
+
+    async def close(self):
+        pass
+
+    async def create_orders(self, orders: List[Dict[str, Any]], params=None):
+        return list(await asyncio.gather(*(
+            self.create_order(order['symbol'], order['type'], order['side'], order['amount'], order.get('price'),
+                              order.get('params'))
+            for order in orders
+        )))
+
+    async def cancel_orders(self, ids, symbol=None, params=None):
+        return list(await asyncio.gather(*(self.cancel_order(order_id, symbol) for order_id in ids)))
+
+    async def cancel_all_orders(self, symbol=None, params=None):
+        open_orders = self.venue.fetch_open_orders(self.account_id, symbol)
+        return list(await asyncio.gather(*(self.cancel_order(order['id'], order['symbol']) for order in open_orders)))
+
+    async def fetch_tickers(self, symbols=None, params=None):
+        symbols = symbols or list(self.venue.books)
+        tickers = await asyncio.gather(*(self.fetch_ticker(symbol) for symbol in symbols))
+        return dict(zip(symbols, tickers))
+
+
+def paper_exchange_factory(venue: SimulatedVenue, fallback: Optional[Callable[[Any], Any]] = None,
+                           paper_only: bool = True) -> Callable[[Any], Any]:
+    """
+    订单网关和账户同步使用的 exchange_factory
+
+    paper_only=True 时只有模拟盘账户使用模拟交易所，其他账户仍由 fallback 创建；False 时全部账户都使用模拟交易所。
+    """
+    def factory(account):
+        if paper_only and not is_paper_account(account):
+            if fallback is None:
+                from .gateway import create_async_exchange
+                return create_async_exchange(account)
+            return fallback(account)
+        return AsyncSimulatedExchange(venue, account.pk)
+    return factory
+
+
+_venues: Dict[str, SimulatedVenue] = {}
+_venues_lock = threading.Lock()
+
+
+def get_simulated_venue(exchange: str) -> SimulatedVenue:
+    """进程内共享的模拟交易所（按交易所代码）"""
+    venue = _venues.get(exchange)
+    if venue is None:
+        with _venues_lock:
+            venue = _venues.get(exchange)
+            if venue is None:
+                venue = _venues[exchange] = SimulatedVenue(exchange)
+    return venue
+
+
+class MarketFeed:
+    """
+    把录制的市场数据送入模拟交易所
+
+    - replay：回放一段时间范围内的事件（先读归档分段，再读流），speed 为回放倍速，0 表示不等待；
+    - poll：跟随事件日志读取新事件，用于模拟盘。
+    """
+
+    def __init__(self, venue: SimulatedVenue, event_log=None, archive=None, source: Optional[str] = None,
+                 batch_size: Optional[int] = None):
+        self.venue = venue
+        self._event_log = event_log
+        self._archive = archive
+        self.source = source or venue.exchange
+        self.batch_size = batch_size or getattr(settings, 'PAPER_TRADING_FEED_BATCH_SIZE', 1000)
+        self.last_event_id: Optional[str] = None
+
+    @property
+    def event_log(self):
+        if self._event_log is None:
+            from apps.market.event_log import MarketEventLog
+            self._event_log = MarketEventLog()
+        return self._event_log
+
+    @property
+    def archive(self):
+        if self._archive is None:
+            from apps.market.event_log import MarketEventArchive
+            self._archive = MarketEventArchive(self.event_log)
+        return self._archive
+
+    def replay(self, start_id: str = '0-0', end_id: Optional[str] = None, symbols: Optional[Iterable[str]] = None,
+               speed: float = 0.0, stop: Optional[threading.Event] = None) -> int:
+        applied = 0
+        first_ts = started = None
+        for event in self.archive.replay(self.source, start_id, end_id, symbols,
+                                         event_types=('ticker', 'orderbook', 'trade')):
+            if stop is not None and stop.is_set():
+                break
+            if speed and event.timestamp:
+                if first_ts is None:
+                    first_ts, started = event.timestamp, time.monotonic()
+                wait = (event.timestamp - first_ts) / 1000 / speed - (time.monotonic() - started)
+                if wait > 0:
+                    time.sleep(wait)
+            applied += self.venue.apply_event(event)
+            self.last_event_id = event.event_id
+        return applied
+
+    def poll(self) -> int:
+        """读取并应用上次之后的新事件，首次调用从最新位置开始"""
+        if self.last_event_id is None:
+            self.last_event_id = self.event_log.latest_event_id(self.source) or '0-0'
+            return 0
+        events = self.event_log.read_after(self.source, self.last_event_id, self.batch_size)
+        for event in events:
+            self.venue.apply_event(event)
+        if events:
+            self.last_event_id = events[-1].event_id
+        return len(events)
+
+
+class PaperTrading:
+    """
+    订单网关进程中的模拟盘服务
+
+    跟随市场事件日志更新模拟交易所的盘口，并按 PAPER_TRADING_SYNC_INTERVAL 把模拟盘账户的余额、订单和成交
+    经账户同步（AccountSyncer）写入数据库。
+    """
+
+    def __init__(self, venue: SimulatedVenue, feed: Optional[MarketFeed] = None,
+                 poll_interval: Optional[float] = None, sync_interval: Optional[float] = None):
+        self.venue = venue
+        self.feed = feed or MarketFeed(venue)
+        self.poll_interval = poll_interval or getattr(settings, 'PAPER_TRADING_POLL_INTERVAL', 0.2)
+        self.sync_interval = sync_interval or getattr(settings, 'PAPER_TRADING_SYNC_INTERVAL', 10.0)
+
+    def paper_account_ids(self) -> List[int]:
+        from .models import ExchangeAccount
+
+        return list(ExchangeAccount.all_objects.filter(
+            exchange=self.venue.exchange, is_active=True, is_testnet=True,
+        ).values_list('pk', flat=True))
+
+    async def _feed_loop(self, stop: asyncio.Event):
+        while not stop.is_set():
+            try:
+                count = await asyncio.to_thread(self.feed.poll)
+            except Exception as e:
+                logger.warning(f"模拟交易所读取市场事件失败 {self.venue.exchange}: {e}")
+                count = 0
+            if count < self.feed.batch_size:
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _sync_loop(self, stop: asyncio.Event):
+        from .account_sync import AccountSyncer
+
+        syncer = AccountSyncer(exchange_factory=paper_exchange_factory(self.venue), paper=True)
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.sync_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                account_ids = await asyncio.to_thread(self.paper_account_ids)
+                if account_ids:
+                    await syncer.run(account_ids)
+            except Exception as e:
+                logger.warning(f"模拟盘账户同步失败 {self.venue.exchange}: {e}")
+
+    async def run(self, stop: asyncio.Event):
+        logger.info(f"模拟盘启动 {self.venue.exchange}")
+        await asyncio.gather(self._feed_loop(stop), self._sync_loop(stop))
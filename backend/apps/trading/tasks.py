@@ -2,6 +2,7 @@
 交易相关任务
 """
 from celery import shared_task
+from django.conf import settings
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,42 +12,93 @@ logger = logging.getLogger(__name__)
 def sync_exchange_data(exchange_account_id):
     """
     同步交易所数据任务
+
+    增量同步单个账户的余额、挂单和成交，见 apps.trading.account_sync。
     """
     try:
-        # 这里将实现具体的交易所数据同步逻辑
         logger.info(f"开始同步交易所数据: {exchange_account_id}")
-        
-        # 示例逻辑
-        # from apps.trading.services import ExchangeService
-        # service = ExchangeService(exchange_account_id)
-        # service.sync_balance()
-        # service.sync_orders()
-        
-        logger.info(f"交易所数据同步完成: {exchange_account_id}")
-        return True
+
+        from apps.trading.account_sync import get_account_syncer
+        result = get_account_syncer().sync([exchange_account_id]).get(exchange_account_id)
+        if result is None:
+            logger.warning(f"交易账户不存在或未启用: {exchange_account_id}")
+            return False
+
+        logger.info(f"交易所数据同步完成: {exchange_account_id} {result}")
+        return not result['error']
     except Exception as e:
         logger.error(f"交易所数据同步失败: {e}")
         return False
 
 
 @shared_task
-def execute_order(order_id):
+def sync_all_exchange_accounts():
+    """
+    同步全部启用的交易账户
+
+    所有账户在一个事件循环中并发同步，变化在最后一次批量写入。
+    """
+    try:
+        from apps.trading.account_sync import get_account_syncer
+        results = get_account_syncer().sync()
+        failed = sum(1 for result in results.values() if result['error'])
+        logger.info(f"交易账户同步完成: {len(results)}个账户, {failed}个失败")
+        return {'accounts': len(results), 'failed': failed}
+    except Exception as e:
+        logger.error(f"交易账户同步失败: {e}")
+        return {'error': str(e)}
+
+
+@shared_task(bind=True)
+def execute_order(self, order_id, order=None):
     """
     执行订单任务
+
+    订单网关不在线时的回退路径，使用连接器池中的同步ccxt实例提交，回报写入请求指定的回报流。
+    网络错误导致结果未知时，按 ORDER_CONFIRM_RETRY_DELAY 重试，重试时先按客户端订单号确认，不重复下单。
+
+    Args:
+        order_id: 客户端订单号
+        order: 策略引擎生成的订单请求（action、账户、交易对、方向、数量、价格等）
     """
+    from apps.trading.gateway import OrderPending, execute_order_request
+
+    request = order or {'client_order_id': order_id}
     try:
         logger.info(f"开始执行订单: {order_id}")
-        
-        # 这里将实现具体的订单执行逻辑
-        # from apps.trading.services import OrderService
-        # service = OrderService()
-        # result = service.execute_order(order_id)
-        
-        logger.info(f"订单执行完成: {order_id}")
+
+        reports = execute_order_request(request)
+
+        logger.info(f"订单执行完成: {order_id} {[report['type'] for report in reports]}")
         return True
+    except OrderPending as e:
+        logger.warning(f"订单结果未知，稍后确认: {order_id} {e}")
     except Exception as e:
         logger.error(f"订单执行失败: {e}")
         return False
+    raise self.retry(
+        args=[order_id, {**request, 'unconfirmed': True}],
+        countdown=getattr(settings, 'ORDER_CONFIRM_RETRY_DELAY', 5),
+        max_retries=getattr(settings, 'ORDER_CONFIRM_MAX_RETRIES', 12),
+    )
+
+
+@shared_task
+def rollup_execution_quality():
+    """
+    执行质量汇总任务
+
+    把尚未计入的已结束订单累加到 ExecutionQuality 汇总表，见 apps.trading.execution_quality。
+    """
+    try:
+        from apps.trading.execution_quality import ExecutionQualityRollup
+        count = ExecutionQualityRollup().run()
+        if count:
+            logger.info(f"执行质量汇总完成: {count}个订单")
+        return {'orders': count}
+    except Exception as e:
+        logger.error(f"执行质量汇总失败: {e}")
+        return {'error': str(e)}
 
 
 @shared_task
@@ -0,0 +1,1422 @@
+"""
+交易模块测试
+"""
+import asyncio
+import socket
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import ccxt
+import fakeredis
+from celery.exceptions import Retry
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from apps.core.models import Tenant
+from apps.market.event_log import MarketEvent, MarketEventArchive, MarketEventLog
+from apps.monitoring.latency import LatencyRecorder, now_ms
+from .account_sync import ALL_SYMBOLS, AccountSyncer
+from .algos import AlgoEngine, IcebergAlgo, MarketState, SmartRouteAlgo, TimerWheel, TWAPAlgo, volume_profile
+from .gateway import (
+    DEFAULT_REPORT_STREAM, GATEWAY_GROUP, OrderChannel, OrderDispatcher, OrderGateway, OrderPending, OrderRejected,
+    TrackedOrder, execute_order_request, report_stream, sync_exchange,
+)
+from .execution_quality import ExecutionQualityRollup, bucket_start, execution_quality_report
+from .models import (
+    AccountBalance, AccountPosition, AccountSyncState, AlgoOrder, ExchangeAccount, ExecutionQuality, Order,
+    OrderFill,
+)
+from .orders import OrderStore, make_client_order_id
+from .positions import (
+    FILL_STREAM, FillFeed, PositionBook, PositionEngine, get_account_pnl, get_account_positions,
+)
+from .router import Venue, route_order
+from .simulator import AsyncSimulatedExchange, MarketFeed, SimulatedVenue, SimulationConfig, paper_exchange_factory
+from .tasks import execute_order, rollup_execution_quality, sync_exchange_data
+
+User = get_user_model()
+
+
+def order_request(client_order_id='ls1-1', **fields):
+    return {
+        'action': 'place', 'client_order_id': client_order_id, 'live_strategy_id': 1,
+        'exchange_account_id': 1, 'exchange': 'binance', 'symbol': 'BTC/USDT', 'side': 'buy',
+        'order_type': 'limit', 'amount': 2.0, 'price': 100.0, 'reply_to': report_stream('engine'),
+        **fields,
+    }
+
+
+def read_reports(channel, stream):
+    return [report for _, report in channel.read(stream, 'test', 'reader', count=100)]
+
+
+class FakeAsyncExchange:
+    """模拟 ccxt 异步实例：限价单先挂单，fetch_order 时成交"""
+
+    rateLimit = 0
+    has = {}
+
+    def __init__(self):
+        self.orders = {}
+        self.markets_loaded = False
+        self.closed = False
+        self.fail = None
+        self.lose_response = None
+
+    async def load_markets(self):
+        self.markets_loaded = True
+
+    async def create_order(self, symbol, order_type, side, amount, price=None, params=None):
+        if self.fail:
+            raise self.fail
+        order_id = str(len(self.orders) + 1)
+        self.orders[order_id] = {
+            'id': order_id, 'symbol': symbol, 'status': 'open', 'amount': amount,
+            'filled': 0.0, 'cost': 0.0, 'price': price, 'clientOrderId': params['clientOrderId'],
+        }
+        if self.lose_response:
+            # 订单已经到达交易所，响应丢失
+            raise self.lose_response
+        return dict(self.orders[order_id])
+
+    async def fetch_order(self, order_id, symbol=None, params=None):
+        if order_id is None:
+            client_order_id = (params or {}).get('clientOrderId')
+            order_id = next((order['id'] for order in self.orders.values()
+                             if order['clientOrderId'] == client_order_id), None)
+            if order_id is None:
+                raise ccxt.OrderNotFound(f'订单不存在: {client_order_id}')
+        order = self.orders[order_id]
+        order.update(status='closed', filled=order['amount'], cost=order['amount'] * order['price'],
+                     fee={'cost': 0.2})
+        return dict(order)
+
+    async def cancel_order(self, order_id, symbol=None, params=None):
+        order = self.orders[order_id]
+        order['status'] = 'canceled'
+        return dict(order)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeBatchExchange(FakeAsyncExchange):
+    """带批量下单和全部撤单接口的模拟实例"""
+
+    has = {'createOrders': True, 'cancelAllOrders': True}
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+        self.cancel_all_calls = []
+
+    async def create_orders(self, orders, params=None):
+        self.batches.append(len(orders))
+        results = []
+        for spec in orders:
+            if spec['amount'] > 100:
+                results.append({'info': {'code': -2019, 'msg': 'Margin is insufficient'}, 'status': 'rejected'})
+            else:
+                results.append(await self.create_order(
+                    spec['symbol'], spec['type'], spec['side'], spec['amount'], spec['price'], spec['params'],
+                ))
+        return results
+
+    async def cancel_all_orders(self, symbol=None, params=None):
+        self.cancel_all_calls.append(symbol)
+        cancelled = []
+        for order in self.orders.values():
+            # 第一笔订单已经成交，不在撤单结果中
+            if order['symbol'] == symbol and order['status'] == 'open' and order['id'] != '1':
+                order['status'] = 'canceled'
+                cancelled.append(dict(order))
+        return cancelled
+
+
+class OrderChannelTest(SimpleTestCase):
+    """订单出口和订单流测试"""
+
+    def setUp(self):
+        self.channel = OrderChannel(client=fakeredis.FakeRedis(decode_responses=True))
+        self.dispatcher = OrderDispatcher(channel=self.channel, check_interval=0)
+
+    def test_dispatcher_falls_back_to_celery_without_gateway(self):
+        with patch('apps.trading.tasks.execute_order.delay') as delay:
+            self.assertEqual(self.dispatcher(order_request()), 'celery')
+        client_order_id, request = delay.call_args[0]
+        self.assertEqual(client_order_id, 'ls1-1')
+        self.assertIn('sent_ts', request)
+
+    def test_dispatcher_uses_live_gateway(self):
+        self.channel.heartbeat('binance', 'gw-1', ttl=5)
+        with patch('apps.trading.tasks.execute_order.delay') as delay:
+            self.assertEqual(self.dispatcher(order_request()), 'gateway')
+            self.assertEqual(self.dispatcher(order_request('ls1-2', exchange='okx')), 'celery')
+        self.assertEqual(delay.call_count, 1)
+        entries = self.channel.read(OrderChannel.order_stream('binance'), GATEWAY_GROUP, 'gw-1')
+        self.assertEqual([request['client_order_id'] for _, request in entries], ['ls1-1'])
+
+        self.channel.clear_heartbeat('binance', 'other')
+        self.assertTrue(self.channel.gateway_alive('binance'))
+        self.channel.clear_heartbeat('binance', 'gw-1')
+        self.assertFalse(self.channel.gateway_alive('binance'))
+
+    def test_read_redelivers_unacked_entries_after_restart(self):
+        stream = OrderChannel.order_stream('binance')
+        self.channel.submit('binance', order_request('ls1-1'))
+        self.channel.submit('binance', order_request('ls1-2'))
+        first = self.channel.read(stream, GATEWAY_GROUP, 'gw-1')
+        self.channel.ack(stream, GATEWAY_GROUP, [first[0][0]])
+
+        restarted = OrderChannel(client=self.channel.client)
+        pending = restarted.read(stream, GATEWAY_GROUP, 'gw-1')
+        self.assertEqual([request['client_order_id'] for _, request in pending], ['ls1-2'])
+
+    def test_tracked_order_reports_incremental_fills(self):
+        tracked = TrackedOrder(order_request())
+        reports = tracked.update({'id': 7, 'status': 'open', 'filled': 0.5, 'cost': 50.0}, ack=True)
+        self.assertEqual([r['type'] for r in reports], ['ack', 'fill'])
+        self.assertEqual(reports[0]['exchange_order_id'], '7')
+        self.assertEqual((reports[1]['price'], reports[1]['amount']), (100.0, 0.5))
+
+        reports = tracked.update({'id': 7, 'status': 'closed', 'filled': 2.0, 'cost': 206.0,
+                                  'fee': {'cost': 0.3}})
+        self.assertEqual(len(reports), 1)
+        self.assertAlmostEqual(reports[0]['price'], 104.0)
+        self.assertAlmostEqual(reports[0]['amount'], 1.5)
+        self.assertAlmostEqual(reports[0]['fee'], 0.3)
+        self.assertTrue(tracked.done)
+        self.assertEqual(tracked.update({'id': 7, 'status': 'closed', 'filled': 2.0, 'cost': 206.0}), [])
+
+
+class OrderGatewayTest(SimpleTestCase):
+    """订单网关测试"""
+
+    def setUp(self):
+        self.channel = OrderChannel(client=fakeredis.FakeRedis(decode_responses=True))
+        self.exchange = FakeAsyncExchange()
+        # 订单状态只在内存中验证，写入数据库由 OrderStoreTest 覆盖
+        self.store = OrderStore()
+        for method, value in (('load', []), ('flush', 0)):
+            patcher = patch.object(self.store, method, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.gateway = OrderGateway(
+            'binance', channel=self.channel, consumer='gw-1',
+            exchange_factory=lambda account: self.exchange,
+            account_loader=lambda ids=None: [SimpleNamespace(pk=1)],
+            block_ms=10, poll_interval=0.05, heartbeat_interval=0.05,
+            recorder=LatencyRecorder('test', client=fakeredis.FakeRedis(decode_responses=True)),
+            order_store=self.store,
+        )
+
+    def test_handle_place_poll_and_cancel(self):
+        async def scenario():
+            placed = await self.gateway.handle(order_request('ls1-1', sent_ts=now_ms()))
+            duplicate = await self.gateway.handle(order_request('ls1-1', sent_ts=now_ms()))
+            expired = await self.gateway.handle(order_request('ls1-2', sent_ts=now_ms() - 60000))
+            await self.gateway.handle(order_request('ls1-3'))
+            cancelled = await self.gateway.cancel({**order_request('ls1-3'), 'action': 'cancel'})
+            polled = await self.gateway.poll_open_orders()
+            return placed, duplicate, expired, cancelled, polled
+
+        placed, duplicate, expired, cancelled, polled = asyncio.run(scenario())
+        self.assertTrue(self.exchange.markets_loaded)
+        self.assertEqual([r['type'] for r in placed], ['ack'])
+        self.assertEqual(placed[0]['exchange_order_id'], '1')
+        self.assertEqual(duplicate, [])
+        self.assertEqual(expired[0]['type'], 'rejected')
+        self.assertEqual([r['type'] for r in cancelled], ['cancelled'])
+        self.assertEqual([(r['type'], r['client_order_id'], r['amount']) for r in polled], [('fill', 'ls1-1', 2.0)])
+        self.assertEqual(self.gateway.open_orders, {})
+
+        statuses = {cid: self.store.get(cid).status for cid in ('ls1-1', 'ls1-2', 'ls1-3')}
+        self.assertEqual(statuses, {'ls1-1': 'filled', 'ls1-2': 'rejected', 'ls1-3': 'cancelled'})
+        # 订单结束后重复投递仍被识别
+        self.assertEqual(asyncio.run(self.gateway.handle(order_request('ls1-1'))), [])
+
+    def test_exchange_errors_become_rejections(self):
+        self.exchange.fail = ccxt.InsufficientFunds('余额不足')
+
+        async def scenario():
+            return (
+                await self.gateway.handle(order_request('ls1-1')),
+                await self.gateway.handle(order_request('ls1-2', order_type='trailing_stop')),
+            )
+
+        insufficient, unsupported = asyncio.run(scenario())
+        self.assertIn('余额不足', insufficient[0]['error'])
+        self.assertEqual(unsupported[0]['type'], 'rejected')
+        self.assertEqual(self.gateway.rejected, 2)
+
+    def test_network_errors_keep_orders_pending_until_confirmed(self):
+        async def scenario():
+            self.exchange.lose_response = ccxt.RequestTimeout('响应超时')
+            lost = await self.gateway.handle(order_request('ls1-1'))
+            self.exchange.lose_response = None
+            self.exchange.fail = ccxt.ExchangeNotAvailable('服务不可用')
+            unreached = await self.gateway.handle(order_request('ls1-2'))
+            self.exchange.fail = None
+            redelivered = await self.gateway.handle(order_request('ls1-1'))
+            # 提交后 poll_interval 之内不查询
+            early = await self.gateway.poll_open_orders()
+            await asyncio.sleep(0.06)
+            return lost, unreached, redelivered, early, await self.gateway.poll_open_orders()
+
+        lost, unreached, redelivered, early, confirmed = asyncio.run(scenario())
+        self.assertEqual((lost, unreached, redelivered, early), ([], [], [], []))
+        self.assertEqual(len(self.exchange.orders), 1)
+        self.assertEqual(sorted((r['client_order_id'], r['type']) for r in confirmed),
+                         [('ls1-1', 'ack'), ('ls1-1', 'fill'), ('ls1-2', 'rejected')])
+        self.assertEqual(confirmed[0]['exchange_order_id'], '1')
+        self.assertEqual(self.store.get('ls1-1').status, 'filled')
+        self.assertEqual(self.store.get('ls1-2').status, 'rejected')
+        self.assertEqual(self.gateway.open_orders, {})
+
+    def test_batch_and_cancel_all_without_batch_endpoints(self):
+        orders = [order_request(f'b{i}', symbol=symbol, reply_to=None)
+                  for i, symbol in enumerate(('BTC/USDT', 'ETH/USDT', 'BTC/USDT'))]
+        orders.append(order_request('b3', order_type='limit', price=None))
+        batch = {'action': 'batch', 'client_order_id': 'batch1', 'exchange_account_id': 1, 'exchange': 'binance',
+                 'orders': orders, 'reply_to': report_stream('rebalance'), 'sent_ts': now_ms()}
+
+        async def scenario():
+            placed = await self.gateway.handle(batch)
+            duplicate = await self.gateway.handle(batch)
+            cancelled = await self.gateway.handle({
+                'action': 'cancel_all', 'client_order_id': 'cx1', 'exchange_account_id': 1, 'symbols': ['BTC/USDT'],
+            })
+            return placed, duplicate, cancelled
+
+        placed, duplicate, cancelled = asyncio.run(scenario())
+        self.assertEqual([(r['type'], r['client_order_id']) for r in placed[:-1]],
+                         [('rejected', 'b3'), ('ack', 'b0'), ('ack', 'b1'), ('ack', 'b2')])
+        summary = placed[-1]
+        self.assertEqual((summary['type'], summary['client_order_id']), ('batch', 'batch1'))
+        self.assertEqual({r['client_order_id']: r['status'] for r in summary['results']},
+                         {'b0': 'submitted', 'b1': 'submitted', 'b2': 'submitted', 'b3': 'rejected'})
+        self.assertEqual({r['status'] for r in duplicate[-1]['results']}, {'duplicate'})
+        # 子订单的回报默认写入批量请求的回报流
+        self.assertEqual(placed[1]['reply_to'], report_stream('rebalance'))
+
+        self.assertEqual(sorted(r['client_order_id'] for r in cancelled if r['type'] == 'cancelled'), ['b0', 'b2'])
+        self.assertEqual(self.store.get('b1').status, 'submitted')
+        self.assertEqual(list(self.gateway.open_orders), ['b1'])
+
+    def test_batch_endpoints_and_cancel_all_in_one_window(self):
+        self.exchange = FakeBatchExchange()
+        self.gateway.burst = 1
+        orders = [order_request(f'b{i}') for i in range(6)] + [order_request('b6', amount=1000.0)]
+
+        async def scenario():
+            placed = await self.gateway.handle({
+                'action': 'batch', 'client_order_id': 'batch1', 'exchange_account_id': 1, 'exchange': 'binance',
+                'orders': orders,
+            })
+            self.assertEqual(len(self.gateway.open_orders), 6)
+            # 令牌桶只有1个令牌且刚被下单用完，撤单仍立即发出
+            self.gateway.sessions[1].limiter.interval = 60
+            started = time.monotonic()
+            cancelled = await self.gateway.cancel_all({
+                'action': 'cancel_all', 'client_order_id': 'cx1', 'exchange_account_id': 1,
+                'symbols': ['BTC/USDT', 'ETH/USDT'],
+            })
+            return placed, cancelled, time.monotonic() - started
+
+        placed, cancelled, elapsed = asyncio.run(scenario())
+        self.assertEqual(self.exchange.batches, [5, 2])
+        results = {r['client_order_id']: (r['status'], r['error']) for r in placed[-1]['results']}
+        self.assertEqual(results['b6'][0], 'rejected')
+        self.assertIn('Margin is insufficient', results['b6'][1])
+
+        self.assertLess(elapsed, 1)
+        self.assertEqual(sorted(self.exchange.cancel_all_calls), ['BTC/USDT', 'ETH/USDT'])
+        results = {r['client_order_id']: r['status'] for r in cancelled[-1]['results']}
+        self.assertEqual(results, {**{f'b{i}': 'cancelled' for i in range(1, 6)}, 'b0': 'cancelling'})
+        # 不在撤单结果中的订单继续查询确认
+        self.assertEqual(list(self.gateway.open_orders), ['b0'])
+
+    def test_run_consumes_orders_and_publishes_reports(self):
+        async def scenario():
+            stop = asyncio.Event()
+            task = asyncio.create_task(self.gateway.run(stop))
+            await asyncio.sleep(0.05)
+            alive = self.channel.gateway_alive('binance')
+            dispatcher = OrderDispatcher(channel=self.channel, check_interval=0)
+            self.assertEqual(dispatcher(order_request('ls1-1')), 'gateway')
+            await asyncio.sleep(0.3)
+            stop.set()
+            await task
+            return alive
+
+        self.assertTrue(asyncio.run(scenario()))
+        self.assertFalse(self.channel.gateway_alive('binance'))
+        self.assertTrue(self.exchange.closed)
+        reports = read_reports(self.channel, report_stream('engine'))
+        self.assertEqual([r['type'] for r in reports], ['ack', 'fill'])
+        self.assertNotIn('reply_to', reports[0])
+        self.assertEqual(self.gateway.stats()['processed'], 1)
+        self.assertEqual(self.store.get('ls1-1').status, 'filled')
+        self.assertTrue(self.store.flush.called)
+        # 订单流中的消息已确认
+        pending = self.channel.client.xpending(OrderChannel.order_stream('binance'), GATEWAY_GROUP)
+        self.assertEqual(pending['pending'], 0)
+
+
+class ExecuteOrderTest(TestCase):
+    """execute_order 回退路径测试"""
+
+    def setUp(self):
+        tenant = Tenant.objects.create(name='测试租户', schema_name='test_tenant')
+        user = User.objects.create_user(username='trader', password='testpass123', tenant=tenant)
+        self.account = ExchangeAccount(tenant=tenant, user=user, name='主账户', exchange='binance')
+        self.account.set_api_credentials('key', 'secret')
+        self.account.save()
+        self.channel = OrderChannel(client=fakeredis.FakeRedis(decode_responses=True))
+        self.exchange = MagicMock()
+        pool = MagicMock()
+        pool.get.return_value.exchange = self.exchange
+        patcher = patch('apps.market.connector_pool.get_connector_pool', return_value=pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_places_order_with_client_order_id(self):
+        self.exchange.create_order.return_value = {
+            'id': 'x1', 'status': 'closed', 'filled': 2.0, 'cost': 200.0, 'fee': {'cost': 0.1},
+        }
+        request = order_request(exchange_account_id=self.account.pk, live_strategy_id=None, reply_to=None)
+        reports = execute_order_request(request, channel=self.channel)
+
+        self.exchange.create_order.assert_called_once_with(
+            'BTC/USDT', 'limit', 'buy', 2.0, 100.0, {'clientOrderId': 'ls1-1'},
+        )
+        self.assertEqual([r['type'] for r in reports], ['ack', 'fill'])
+        self.assertEqual(len(read_reports(self.channel, DEFAULT_REPORT_STREAM)), 2)
+        order = Order.objects.get(client_order_id='ls1-1')
+        self.assertEqual((order.status, order.exchange_order_id), ('filled', 'x1'))
+        self.assertEqual(order.fills.count(), 1)
+
+        # 任务重试不会重复下单
+        self.assertEqual(execute_order_request(request, channel=self.channel), [])
+        self.exchange.create_order.assert_called_once()
+
+    def test_rejects_invalid_requests(self):
+        self.exchange.create_order.side_effect = ccxt.InvalidOrder('数量低于最小值')
+        request = order_request(exchange_account_id=self.account.pk, live_strategy_id=None)
+        reports = execute_order_request(request, channel=self.channel)
+        self.assertEqual(reports[0]['type'], 'rejected')
+        self.assertIn('最小值', reports[0]['error'])
+
+        reports = execute_order_request(order_request('ls1-2', exchange_account_id=0), channel=self.channel)
+        self.assertEqual(reports[0]['type'], 'rejected')
+        self.assertEqual(len(read_reports(self.channel, report_stream('engine'))), 2)
+
+    def test_network_error_is_confirmed_by_client_order_id(self):
+        self.exchange.create_order.side_effect = ccxt.RequestTimeout('响应超时')
+        request = order_request(exchange_account_id=self.account.pk, live_strategy_id=None)
+        with self.assertRaises(OrderPending):
+            execute_order_request(request, channel=self.channel)
+        self.assertEqual(Order.objects.get(client_order_id='ls1-1').status, 'new')
+        self.assertEqual(read_reports(self.channel, report_stream('engine')), [])
+
+        # 重试时先确认，不重新下单
+        self.exchange.fetch_order.return_value = {'id': 'x1', 'status': 'open', 'filled': 0.0}
+        reports = execute_order_request({**request, 'unconfirmed': True}, channel=self.channel)
+        self.exchange.fetch_order.assert_called_once_with(None, 'BTC/USDT', {'clientOrderId': 'ls1-1'})
+        self.exchange.create_order.assert_called_once()
+        self.assertEqual([r['type'] for r in reports], ['ack'])
+        self.assertEqual(Order.objects.get(client_order_id='ls1-1').exchange_order_id, 'x1')
+
+        # 交易所没有该订单：请求没有到达交易所
+        self.exchange.fetch_order.side_effect = ccxt.OrderNotFound('订单不存在')
+        request = order_request('ls1-2', exchange_account_id=self.account.pk, live_strategy_id=None, unconfirmed=True)
+        reports = execute_order_request(request, channel=self.channel)
+        self.assertEqual(reports[0]['type'], 'rejected')
+        self.assertEqual(Order.objects.get(client_order_id='ls1-2').status, 'rejected')
+
+    def test_task_retries_pending_orders_as_unconfirmed(self):
+        request = order_request(exchange_account_id=self.account.pk)
+        with patch('apps.trading.gateway.execute_order_request', side_effect=OrderPending('响应超时')) as run:
+            with self.assertRaises(Retry) as raised:
+                execute_order.apply(args=['ls1-1', request])
+        run.assert_called_once()
+        self.assertNotIn('unconfirmed', run.call_args.args[0])
+        self.assertEqual(raised.exception.sig.args[0], 'ls1-1')
+        self.assertTrue(raised.exception.sig.args[1]['unconfirmed'])
+
+
+class ExecuteBulkOrderTest(ExecuteOrderTest):
+    """execute_order 的批量下单和全部撤单"""
+
+    def test_batch_and_cancel_all(self):
+        self.exchange.has = {'createOrders': True, 'cancelAllOrders': True}
+        self.exchange.create_orders.side_effect = lambda specs: [
+            {'id': f"x{i}", 'status': 'open', 'filled': 0.0} for i, _ in enumerate(specs)
+        ]
+        orders = [order_request(f'b{i}', live_strategy_id=None, reply_to=None) for i in range(3)]
+        reports = execute_order_request({
+            'action': 'batch', 'client_order_id': 'batch1', 'exchange_account_id': self.account.pk,
+            'exchange': 'binance', 'orders': orders, 'reply_to': report_stream('rebalance'),
+        }, channel=self.channel)
+        self.assertEqual(self.exchange.create_orders.call_count, 1)
+        self.assertEqual([r['type'] for r in reports], ['ack', 'ack', 'ack', 'batch'])
+        self.assertEqual(len(read_reports(self.channel, report_stream('rebalance'))), 4)
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'submitted'})
+
+        self.exchange.cancel_all_orders.return_value = {'code': 200}
+        reports = execute_order_request({
+            'action': 'cancel_all', 'client_order_id': 'cx1', 'exchange_account_id': self.account.pk,
+            'exchange': 'binance',
+        }, channel=self.channel)
+        self.exchange.cancel_all_orders.assert_called_once_with('BTC/USDT')
+        self.assertEqual({r['status'] for r in reports[-1]['results']}, {'cancelled'})
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'cancelled'})
+
+
+class OrderStoreTest(TestCase):
+    """订单状态机和批量写入测试"""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name='测试租户', schema_name='test_tenant')
+        user = User.objects.create_user(username='trader', password='testpass123', tenant=self.tenant)
+        self.account = ExchangeAccount(tenant=self.tenant, user=user, name='主账户', exchange='binance')
+        self.account.set_api_credentials('key', 'secret')
+        self.account.save()
+        self.store = OrderStore(batch_size=100)
+
+    def request(self, client_order_id, **fields):
+        return order_request(client_order_id, exchange_account_id=self.account.pk, live_strategy_id=None, **fields)
+
+    def test_client_order_id_is_deterministic(self):
+        first = make_client_order_id('twap', 42, 3)
+        self.assertEqual(first, make_client_order_id('twap', 42, 3))
+        self.assertNotEqual(first, make_client_order_id('twap', 42, 4))
+        self.assertTrue(first.isalnum())
+        self.assertLessEqual(len(first), 32)
+        with self.assertRaises(ValueError):
+            make_client_order_id('1-bad', 1)
+
+    def test_state_machine(self):
+        state, created = self.store.create(self.request('a'))
+        self.assertTrue(created)
+        self.assertEqual(self.store.create(self.request('a')), (state, False))
+
+        self.assertTrue(self.store.transition('a', 'submitted', exchange_order_id='x1'))
+        self.assertTrue(self.store.apply_fill('a', 100.0, 0.5))
+        self.assertEqual(state.status, 'partial')
+        self.assertTrue(self.store.apply_fill('a', 110.0, 5.0, fee=0.1))
+        self.assertEqual((state.status, state.filled), ('filled', 2.0))
+        self.assertAlmostEqual(state.avg_price, 107.5)
+        # 结束状态不再变化
+        self.assertFalse(self.store.transition('a', 'cancelled'))
+        self.assertFalse(self.store.apply_fill('a', 100.0, 1.0))
+        self.assertEqual(state.status, 'filled')
+
+        # 成交可以先于确认到达，重复推送的增量成交按累计数量忽略
+        self.store.create(self.request('b'))
+        fill = {'type': 'fill', 'client_order_id': 'b', 'exchange_order_id': 'x2', 'price': 100.0,
+                'amount': 1.0, 'filled': 1.0}
+        self.assertTrue(self.store.apply_report(fill))
+        self.assertFalse(self.store.apply_report(fill))
+        self.assertFalse(self.store.apply_report({'type': 'ack', 'client_order_id': 'b'}))
+        self.assertEqual(self.store.get('b').status, 'partial')
+        self.assertEqual(self.store.get('b').exchange_order_id, 'x2')
+
+    def test_flush_batches_transitions(self):
+        for i in range(20):
+            cid = f'o{i}'
+            self.store.create(self.request(cid))
+            self.store.transition(cid, 'submitted', exchange_order_id=f'x{i}')
+            self.store.apply_fill(cid, 100.0, 1.0)
+            self.store.apply_fill(cid, 101.0, 1.0)
+        # 80 次状态变化：查询租户、写入订单、回查主键、写入成交各一次（外加事务的保存点）
+        with self.assertNumQueries(6):
+            self.assertEqual(self.store.flush(), 60)
+        self.assertEqual(Order.objects.count(), 20)
+        self.assertEqual(OrderFill.objects.count(), 40)
+        order = Order.objects.get(client_order_id='o7')
+        self.assertEqual((order.status, order.exchange_order_id, order.tenant_id), ('filled', 'x7', self.tenant.pk))
+        self.assertAlmostEqual(float(order.avg_price), 100.5)
+        # 已结束的订单移出内存，仍可识别重复请求
+        self.assertEqual(self.store.stats()['active'], 0)
+        self.assertFalse(self.store.create(self.request('o7'))[1])
+
+        self.store.create(self.request('p'))
+        self.store.flush()
+        for status in ('submitted', 'cancelled'):
+            self.store.transition('p', status)
+        # 两次状态变化合并为一次更新（先锁定订单行与数据库中的状态合并）
+        with self.assertNumQueries(4):
+            self.assertEqual(self.store.flush(), 1)
+        self.assertEqual(Order.objects.get(client_order_id='p').status, 'cancelled')
+        self.assertEqual(self.store.flush(), 0)
+
+    def test_flush_does_not_overwrite_newer_state_from_other_store(self):
+        self.store.create(self.request('a'))
+        self.store.flush()
+        syncer = OrderStore()
+        syncer.load(['a'])
+        syncer.apply_exchange_order('a', {'id': 'x1', 'status': 'canceled', 'filled': 0.5, 'cost': 50.0})
+        syncer.flush()
+
+        # 网关的内存状态落后于账户同步写入的状态
+        self.store.transition('a', 'submitted', exchange_order_id='x1')
+        self.assertEqual(self.store.flush(), 0)
+        order = Order.objects.get(client_order_id='a')
+        self.assertEqual((order.status, float(order.filled)), ('cancelled', 0.5))
+        self.assertEqual(self.store.get('a').status, 'cancelled')
+        self.assertEqual(self.store.stats()['active'], 0)
+
+        # 另一个进程先写入了同一订单，新建时合并而不是丢弃本地状态
+        other = OrderStore()
+        other.create(self.request('b'))
+        other.flush()
+        self.store.create(self.request('b'))
+        self.store.apply_fill('b', 100.0, 2.0)
+        self.store.flush()
+        order = Order.objects.get(client_order_id='b')
+        self.assertEqual((order.status, float(order.filled), order.fills.count()), ('filled', 2.0, 1))
+
+    def test_flush_keeps_orders_without_tenant(self):
+        self.store.create(order_request('a', exchange_account_id=self.account.pk + 100, live_strategy_id=None))
+        self.store.apply_fill('a', 100.0, 1.0)
+        self.store.create(self.request('b'))
+        with self.assertLogs('apps.trading.orders', 'ERROR') as logs:
+            self.assertEqual(self.store.flush(), 1)
+        self.assertIn("'a'", logs.output[0])
+        self.assertEqual(list(Order.objects.values_list('client_order_id', flat=True)), ['b'])
+        self.assertEqual(self.store.stats()['pending_orders'], 1)
+        self.assertEqual(self.store.stats()['pending_fills'], 1)
+
+        # 账户恢复后写入
+        self.account.pk, self.account.name = self.account.pk + 100, '备用账户'
+        self.account.save(force_insert=True)
+        self.assertEqual(self.store.flush(), 2)
+        order = Order.objects.get(client_order_id='a')
+        self.assertEqual((order.status, order.fills.count()), ('partial', 1))
+
+    def test_load_restores_active_orders(self):
+        self.store.create(self.request('a'))
+        self.store.create(self.request('b'))
+        self.store.apply_fill('a', 100.0, 2.0)
+        self.store.transition('b', 'submitted', exchange_order_id='x2')
+        self.store.flush()
+
+        restarted = OrderStore()
+        loaded = restarted.load(exchange='binance', active_only=True)
+        self.assertEqual([state.client_order_id for state in loaded], ['b'])
+        self.assertEqual(restarted.get('b').exchange_order_id, 'x2')
+        restarted.apply_fill('b', 100.0, 2.0)
+        restarted.flush()
+        self.assertEqual(Order.objects.get(client_order_id='b').status, 'filled')
+
+
+class FakeSyncExchange:
+    """模拟 ccxt 异步实例的账户查询接口"""
+
+    rateLimit = 0
+
+    def __init__(self, needs_symbol=False):
+        self.id = 'binance'
+        self.has = {'fetchMyTrades': True}
+        self.options = {}
+        self.markets = None
+        self.currencies = None
+        self.needs_symbol = needs_symbol
+        self.balance = {'free': {'USDT': 100.0, 'BTC': 0.5}, 'used': {'USDT': 0.0, 'BTC': 0.0},
+                        'total': {'USDT': 100.0, 'BTC': 0.5}}
+        self.open_orders = []
+        self.orders = {}
+        self.trades = []
+        self.calls = []
+
+    async def load_markets(self):
+        self.calls.append(('load_markets',))
+        self.markets = {'BTC/USDT': {'symbol': 'BTC/USDT'}}
+        self.currencies = {}
+        return self.markets
+
+    def set_markets(self, markets, currencies=None):
+        self.markets, self.currencies = markets, currencies
+
+    async def fetch_balance(self):
+        self.calls.append(('fetch_balance',))
+        return self.balance
+
+    async def fetch_open_orders(self, symbol=None):
+        self.calls.append(('fetch_open_orders',))
+        return list(self.open_orders)
+
+    async def fetch_order(self, order_id, symbol=None):
+        self.calls.append(('fetch_order', order_id))
+        return self.orders[order_id]
+
+    async def fetch_my_trades(self, symbol=None, since=None, limit=None):
+        self.calls.append(('fetch_my_trades', symbol, since))
+        if self.needs_symbol and symbol is None:
+            raise ccxt.ArgumentsRequired('binance fetchMyTrades() requires a symbol argument')
+        trades = [t for t in self.trades if t['timestamp'] >= since and symbol in (None, t['symbol'])]
+        return trades[:limit]
+
+    async def close(self):
+        pass
+
+
+class AccountSyncTest(TransactionTestCase):
+    """账户增量同步测试（同步在线程池中访问数据库）"""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name='测试租户', schema_name='test_tenant')
+        self.user = User.objects.create_user(username='trader', password='testpass123', tenant=self.tenant)
+        self.exchanges = {}
+        self.syncer = AccountSyncer(exchange_factory=lambda account: self.exchanges[account.pk], overlap_ms=1000)
+
+    def account(self, name, needs_symbol=False):
+        account = ExchangeAccount(tenant=self.tenant, user=self.user, name=name, exchange='binance')
+        account.set_api_credentials('key', 'secret')
+        account.save()
+        self.exchanges[account.pk] = FakeSyncExchange(needs_symbol)
+        return account
+
+    def calls(self, account, method):
+        return [call for call in self.exchanges[account.pk].calls if call[0] == method]
+
+    def test_incremental_sync(self):
+        account = self.account('主账户')
+        exchange = self.exchanges[account.pk]
+        store = OrderStore()
+        store.create(order_request('a1', exchange_account_id=account.pk, live_strategy_id=None))
+        store.transition('a1', 'submitted', exchange_order_id='x1')
+        store.flush()
+
+        now = int(now_ms())
+        exchange.orders = {
+            'x1': {'id': 'x1', 'status': 'closed', 'filled': 2.0, 'cost': 200.0, 'timestamp': now - 2000},
+            'x8': {'id': 'x8', 'symbol': 'BTC/USDT', 'side': 'sell', 'type': 'market', 'amount': 0.3,
+                   'status': 'closed', 'filled': 0.3, 'cost': 30.0, 'timestamp': now - 600},
+        }
+        exchange.open_orders = [{'id': 'x9', 'symbol': 'BTC/USDT', 'side': 'sell', 'type': 'limit', 'amount': 1.0,
+                                 'price': 200.0, 'status': 'open', 'filled': 0.0}]
+        exchange.trades = [
+            {'id': 't1', 'order': 'x1', 'symbol': 'BTC/USDT', 'timestamp': now - 1000},
+            {'id': 't2', 'order': 'x8', 'symbol': 'BTC/USDT', 'timestamp': now - 500},
+        ]
+
+        result = self.syncer.sync()[account.pk]
+        self.assertEqual(result['error'], '')
+        self.assertEqual((result['balances_changed'], result['external_orders'], result['trades']), (2, 2, 2))
+        self.assertEqual(Order.objects.get(client_order_id='a1').status, 'filled')
+        external = Order.objects.get(exchange_order_id='x8')
+        self.assertEqual(external.client_order_id, make_client_order_id('ext', account.pk, 'x8'))
+        self.assertEqual((external.status, external.tag), ('filled', 'external'))
+        self.assertEqual(Order.objects.get(exchange_order_id='x9').status, 'submitted')
+        self.assertEqual(OrderFill.objects.count(), 2)
+        self.assertEqual(AccountBalance.objects.get(exchange_account=account, asset='BTC').total, Decimal('0.5'))
+        state = AccountSyncState.objects.get(exchange_account=account)
+        self.assertEqual(state.trade_cursors, {ALL_SYMBOLS: now - 500})
+
+        # 没有变化时只发查询，不写余额和订单；成交从游标（减去重叠）开始拉取
+        exchange.calls.clear()
+        result = self.syncer.sync([account.pk])[account.pk]
+        self.assertEqual((result['balances_changed'], result['orders_updated']), (0, 0))
+        self.assertEqual(self.calls(account, 'fetch_my_trades'), [('fetch_my_trades', None, now - 1500)])
+        self.assertEqual(self.calls(account, 'fetch_order'), [])
+        self.assertEqual(self.calls(account, 'load_markets'), [])
+        self.assertEqual(result['requests'], 3)
+
+        exchange.balance['total']['BTC'] = exchange.balance['free']['BTC'] = 0.7
+        exchange.open_orders[0].update(filled=0.4, cost=80.0)
+        result = self.syncer.sync([account.pk])[account.pk]
+        self.assertEqual((result['balances_changed'], result['orders_updated']), (1, 1))
+        self.assertEqual(AccountBalance.objects.get(exchange_account=account, asset='BTC').total, Decimal('0.7'))
+        self.assertEqual(Order.objects.get(exchange_order_id='x9').status, 'partial')
+        self.assertEqual(OrderFill.objects.count(), 3)
+
+    def test_balances_are_compared_with_database_not_process_snapshot(self):
+        account = self.account('主账户')
+        exchange = self.exchanges[account.pk]
+        other_worker = AccountSyncer(exchange_factory=lambda account: self.exchanges[account.pk])
+        self.syncer.sync([account.pk])
+
+        exchange.balance['total']['BTC'] = exchange.balance['free']['BTC'] = 0.7
+        other_worker.sync([account.pk])
+        exchange.balance['total']['BTC'] = exchange.balance['free']['BTC'] = 0.5
+        # 本进程上次写入的也是 0.5，但数据库已被另一个进程改为 0.7
+        result = self.syncer.sync([account.pk])[account.pk]
+        self.assertEqual(result['balances_changed'], 1)
+        self.assertEqual(AccountBalance.objects.get(exchange_account=account, asset='BTC').total, Decimal('0.5'))
+
+    def test_per_symbol_cursors_and_shared_markets(self):
+        accounts = [self.account(f'账户{i}', needs_symbol=True) for i in range(3)]
+        now = int(now_ms())
+        self.exchanges[accounts[0].pk].trades = [{'id': 't1', 'order': 'x1', 'symbol': 'BTC/USDT', 'timestamp': now}]
+        self.exchanges[accounts[0].pk].orders = {'x1': {
+            'id': 'x1', 'symbol': 'BTC/USDT', 'side': 'buy', 'type': 'limit', 'amount': 1.0, 'price': 100.0,
+            'status': 'closed', 'filled': 1.0, 'cost': 100.0,
+        }}
+
+        results = self.syncer.sync()
+        self.assertEqual(len(results), 3)
+        self.assertEqual(sum(len(self.calls(account, 'load_markets')) for account in accounts), 1)
+        # 不指定交易对失败一次后，按持有资产对应的交易对查询
+        self.assertEqual([call[1] for call in self.calls(accounts[0], 'fetch_my_trades')], [None, 'BTC/USDT'])
+        self.assertEqual([call[1] for call in self.calls(accounts[1], 'fetch_my_trades')], ['BTC/USDT'])
+        cursors = AccountSyncState.objects.get(exchange_account=accounts[0]).trade_cursors
+        self.assertEqual(cursors, {'BTC/USDT': now})
+        self.assertEqual(Order.objects.get(exchange_order_id='x1').status, 'filled')
+
+    def test_task_reports_failures(self):
+        account = self.account('主账户')
+        self.exchanges[account.pk].fetch_balance = MagicMock(side_effect=ccxt.NetworkError('timeout'))
+        with patch('apps.trading.account_sync._syncer', self.syncer):
+            self.assertFalse(sync_exchange_data(account.pk))
+            self.assertFalse(sync_exchange_data(0))
+        state = AccountSyncState.objects.get(exchange_account=account)
+        self.assertIn('timeout', state.last_error)
+        self.assertEqual(state.trade_cursors, {})
+
+
+class TimerWheelTest(SimpleTestCase):
+    """时间轮测试"""
+
+    def test_schedule_cancel_and_advance(self):
+        wheel = TimerWheel(tick_ms=10, slots=8)
+        wheel.schedule('a', 25)
+        wheel.schedule('b', 15)
+        wheel.schedule('c', 500)  # 超过一圈
+        wheel.schedule('d', 40)
+        self.assertTrue(wheel.cancel('d'))
+        self.assertFalse(wheel.cancel('d'))
+
+        self.assertEqual(wheel.advance(14), [])
+        self.assertEqual(wheel.advance(30), ['b', 'a'])
+        self.assertEqual(wheel.advance(420), [])  # 'c' 所在的槽已经转过，但圈数未到
+        self.assertEqual(len(wheel), 1)
+        self.assertEqual(wheel.advance(10000), ['c'])
+
+        wheel.schedule('a', 0)  # 已过期的定时器在下一个刻度到期
+        wheel.schedule('a', 10030)  # 替换
+        self.assertEqual(wheel.advance(10020), [])
+        self.assertEqual(wheel.advance(10030), ['a'])
+
+
+class AlgoEngineTest(SimpleTestCase):
+    """算法执行测试（不访问数据库）"""
+
+    def setUp(self):
+        self.now = 0.0
+        self.sent = []
+        self.engine = AlgoEngine(order_sink=self.sent.append, tick_ms=100, slots=64, clock=lambda: self.now)
+        self.engine.market.update('binance', 'BTC/USDT', bid=99.0, ask=101.0, last=100.0)
+        self.identity = {'exchange': 'binance', 'exchange_account_id': 1, 'reply_to': 'r'}
+
+    def placed(self):
+        return [request for request in self.sent if request['action'] == 'place']
+
+    def fill(self, request, amount=None, price=100.0):
+        amount = request['amount'] if amount is None else amount
+        return {'type': 'fill', 'client_order_id': request['client_order_id'], 'price': price,
+                'amount': amount, 'filled': amount}
+
+    def advance(self, now):
+        self.now = now
+        return self.engine.fire_timers()
+
+    def test_twap_slices_and_catches_up(self):
+        algo = TWAPAlgo(7, 'BTC/USDT', 'buy', 10, self.identity, start_ms=0, end_ms=5000, weights=[1] * 5)
+        algo.configure({})
+        self.engine.add(algo)
+        first = self.placed()[0]
+        self.assertEqual((first['amount'], first['order_type'], first['tag']), (2.0, 'market', 'algo:7'))
+        self.engine.handle_reports([self.fill(first)])
+
+        self.advance(999)
+        self.assertEqual(len(self.placed()), 1)
+        self.advance(1000)
+        second = self.placed()[1]
+        self.assertEqual(second['amount'], 2.0)
+        # 第二片只成交一半就被撤销：撤单回报到达后立即补到本片的累计目标 4
+        self.engine.handle_reports([self.fill(second, 1.0)])
+        self.engine.handle_reports([{'type': 'cancelled', 'client_order_id': second['client_order_id']}])
+        self.assertEqual(self.placed()[2]['amount'], 1.0)
+        self.engine.handle_reports([self.fill(self.placed()[2])])
+
+        # 错过的时间片在下一次定时器到期时一起补齐
+        self.advance(3500)
+        self.assertEqual(self.placed()[3]['amount'], 4.0)
+        self.engine.handle_reports([self.fill(self.placed()[3])])
+        self.advance(4000)
+        self.engine.handle_reports([self.fill(self.placed()[4])])
+        self.assertAlmostEqual(algo.filled, 10.0)
+        self.advance(5000)
+        self.assertEqual(algo.status, 'completed')
+        self.assertNotIn(7, self.engine.wheel)
+        self.assertEqual(len({request['client_order_id'] for request in self.placed()}), len(self.placed()))
+
+    def test_passive_slices_cancel_and_replace(self):
+        algo = TWAPAlgo(8, 'BTC/USDT', 'sell', 4, self.identity, start_ms=0, end_ms=2000, weights=[1, 1])
+        algo.configure({'style': 'passive'})
+        self.engine.add(algo)
+        first = self.placed()[0]
+        self.assertEqual((first['order_type'], first['price'], first['amount']), ('limit', 101.0, 2.0))
+
+        self.engine.market.update('binance', 'BTC/USDT', ask=102.0)
+        self.advance(1000)
+        # 撤掉上一片未成交的挂单，按新的价格挂出本片的增量；撤单回报到达后再补上被撤的部分
+        self.assertEqual(self.sent[-2], {**self.identity, 'action': 'cancel',
+                                         'client_order_id': first['client_order_id'], 'symbol': 'BTC/USDT'})
+        self.assertEqual((self.placed()[1]['amount'], self.placed()[1]['price']), (2.0, 102.0))
+        self.engine.handle_reports([{'type': 'cancelled', 'client_order_id': first['client_order_id']}])
+        self.assertEqual((self.placed()[2]['amount'], self.placed()[2]['price']), (2.0, 102.0))
+
+        # 计划结束时撤掉挂单，余量以市价补齐
+        self.engine.handle_reports([self.fill(self.placed()[1]), self.fill(self.placed()[2], 1.0)])
+        self.advance(2000)
+        self.engine.handle_reports([{'type': 'cancelled', 'client_order_id': self.placed()[2]['client_order_id']}])
+        sweep = self.placed()[3]
+        self.assertEqual((sweep['order_type'], sweep['amount']), ('market', 1.0))
+        self.engine.handle_reports([self.fill(sweep)])
+        self.assertEqual(algo.status, 'completed')
+
+    def test_limit_price_defers_slices(self):
+        algo = TWAPAlgo(9, 'BTC/USDT', 'buy', 2, self.identity, limit_price=100.5,
+                        start_ms=0, end_ms=2000, weights=[1, 1])
+        algo.configure({'sweep': False})
+        self.engine.add(algo)
+        self.assertEqual(self.placed(), [])
+        self.engine.market.update('binance', 'BTC/USDT', ask=100.0)
+        self.advance(1000)
+        self.assertEqual(self.placed()[0]['amount'], 2.0)
+
+    def test_iceberg_shows_one_child_at_a_time(self):
+        algo = IcebergAlgo(10, 'BTC/USDT', 'buy', 2.5, self.identity, limit_price=99.5, start_ms=0)
+        algo.configure({'display_amount': 1})
+        self.engine.add(algo)
+        amounts = []
+        while not algo.is_done:
+            requests = self.placed()
+            self.assertEqual(len(algo.active), 1)
+            amounts.append((requests[-1]['amount'], requests[-1]['price']))
+            self.engine.handle_reports([self.fill(requests[-1], price=99.5)])
+        self.assertEqual(amounts, [(1.0, 99.5), (1.0, 99.5), (0.5, 99.5)])
+        self.assertEqual(algo.progress()['avg_price'], 99.5)
+
+    def test_repeated_rejections_fail_the_algo(self):
+        algo = IcebergAlgo(11, 'BTC/USDT', 'buy', 5, self.identity, start_ms=0, parameters={'max_rejects': 2})
+        algo.configure({'display_amount': 1})
+        self.engine.add(algo)
+        self.assertEqual(self.placed()[0]['price'], 99.0)  # 没有限价时挂买一
+        for _ in range(2):
+            self.engine.handle_reports([{'type': 'rejected', 'client_order_id': self.placed()[-1]['client_order_id'],
+                                         'error': '余额不足'}])
+        self.assertEqual((algo.status, algo.error), ('failed', '余额不足'))
+
+    def test_cancel_waits_for_children(self):
+        algo = IcebergAlgo(12, 'BTC/USDT', 'buy', 5, self.identity, limit_price=99.0, start_ms=0)
+        algo.configure({'display_amount': 1})
+        self.engine.add(algo)
+        self.assertTrue(self.engine.cancel(12))
+        self.assertEqual(self.sent[-1]['action'], 'cancel')
+        self.assertEqual(algo.status, 'running')
+        self.engine.handle_reports([{'type': 'cancelled', 'client_order_id': self.placed()[0]['client_order_id']}])
+        self.assertEqual(algo.status, 'cancelled')
+
+    def test_market_state_and_volume_profile(self):
+        market = MarketState()
+        event = SimpleNamespace(exchange='okx', symbol='ETH/USDT', event_type='orderbook', timestamp=2,
+                                data={'bids': [[10, 1]], 'asks': [[11, 1]]})
+        market.apply_event(event)
+        market.apply_event(SimpleNamespace(exchange='okx', symbol='ETH/USDT', event_type='ticker', timestamp=1,
+                                           data={'bid': 9, 'ask': 12, 'last': 10.5}))  # 过期的行情被忽略
+        quote = market.get('okx', 'ETH/USDT')
+        self.assertEqual((quote.bid, quote.ask), (10.0, 11.0))
+        self.assertEqual((quote.bids, quote.asks), (((10.0, 1.0),), ((11.0, 1.0),)))
+
+        day = 86400000
+        # 两天的历史：开始后第一小时成交量是第二小时的3倍，计划区间之外的K线不计入
+        timestamps = [0, 3600000, 7200000, day, day + 3600000]
+        volumes = [30, 10, 500, 30, 10]
+        self.assertEqual(volume_profile(timestamps, volumes, 2 * day, 2 * day + 7200000, 2), [60.0, 20.0])
+        self.assertEqual(volume_profile([], [], 0, 7200000, 3), [1.0, 1.0, 1.0])
+
+
+class SmartOrderRouterTest(SimpleTestCase):
+    """智能订单路由测试"""
+
+    def setUp(self):
+        self.books = {'binance': ((100.0, 1.0), (101.0, 5.0)), 'okx': ((100.05, 2.0),)}
+
+    def test_route_by_effective_price_and_balances(self):
+        # binance 主账户余额只够 0.5；两个 binance 账户共享同一档深度
+        main = Venue(1, 'binance', 0.001, quote_free=50.05)
+        okx = Venue(2, 'okx', 0.0005)
+        other = Venue(3, 'binance', 0.002)
+        route = route_order('buy', 3, [main, okx, other], self.books)
+        self.assertEqual([(item.venue.account_id, item.amount, item.price) for item in route.slices],
+                         [(2, 2.0, 100.05), (1, 0.5, 100.0), (3, 0.5, 100.0)])
+        self.assertAlmostEqual(route.effective_price, (300.1 + 0.10005 + 0.05 + 0.1) / 3)
+
+        # 越过限价的档位不参与，没有基础资产的账户不能卖出
+        route = route_order('buy', 3, [main, okx, other], self.books, limit_price=100.02)
+        self.assertEqual(route.filled, 1.0)
+        route = route_order('sell', 1, [Venue(1, 'binance', base_free=0.0)], {'binance': ((99.0, 5.0),)})
+        self.assertEqual(route.slices, [])
+
+    def test_sor_algo_reroutes_the_remainder(self):
+        now = [0.0]
+        sent = []
+        engine = AlgoEngine(order_sink=sent.append, tick_ms=100, slots=64, clock=lambda: now[0])
+        for exchange, asks in self.books.items():
+            engine.market.update_book(exchange, 'BTC/USDT', [[99.0, 1.0]], asks)
+        main = Venue(1, 'binance', 0.001, quote_free=1000.0)
+        algo = SmartRouteAlgo(20, 'BTC/USDT', 'buy', 3, {'exchange': 'binance', 'exchange_account_id': 1},
+                              start_ms=0, venues=[main, Venue(2, 'okx', 0.0005)])
+        algo.configure({})
+        engine.add(algo)
+        self.assertEqual(engine.exchanges, ['binance', 'okx'])
+        okx_child, main_child = sent
+        self.assertEqual((okx_child['exchange_account_id'], okx_child['exchange'], okx_child['amount'],
+                          okx_child['price'], okx_child['time_in_force']), (2, 'okx', 2.0, 100.05, 'IOC'))
+        self.assertEqual((main_child['exchange_account_id'], main_child['price']), (1, 100.0))
+        self.assertAlmostEqual(main.quote_free, 1000 - 100.1)
+
+        # IOC 子单部分成交后被交易所撤销，退回未成交部分的预留余额
+        engine.handle_reports([
+            {'type': 'fill', 'client_order_id': okx_child['client_order_id'], 'price': 100.05, 'amount': 2.0},
+            {'type': 'fill', 'client_order_id': main_child['client_order_id'], 'price': 100.0, 'amount': 0.4},
+            {'type': 'cancelled', 'client_order_id': main_child['client_order_id']},
+        ])
+        self.assertAlmostEqual(main.quote_free, 1000 - 0.4 * 100.1)
+        self.assertEqual(len(sent), 2)
+
+        # 间隔之后按新的订单簿重新路由余量
+        engine.market.update_book('binance', 'BTC/USDT', [], [[100.5, 3.0]])
+        engine.market.update_book('okx', 'BTC/USDT', [], [])
+        now[0] = 500
+        engine.fire_timers()
+        retry = sent[-1]
+        self.assertEqual((retry['exchange_account_id'], retry['amount'], retry['price']), (1, 0.6, 100.5))
+
+        self.assertTrue(engine.cancel(20))
+        self.assertEqual((sent[-1]['action'], sent[-1]['exchange_account_id'], sent[-1]['exchange']),
+                         ('cancel', 1, 'binance'))
+        engine.handle_reports([{'type': 'cancelled', 'client_order_id': retry['client_order_id']}])
+        self.assertEqual((algo.status, algo.filled, algo.rounds), ('cancelled', 2.4, 2))
+
+
+class AlgoOrderLoadTest(TestCase):
+    """算法单加载、恢复和进度保存测试"""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name='测试租户', schema_name='test_tenant')
+        user = User.objects.create_user(username='trader', password='testpass123', tenant=self.tenant)
+        self.account = ExchangeAccount(tenant=self.tenant, user=user, name='主账户', exchange='binance')
+        self.account.set_api_credentials('key', 'secret')
+        self.account.save()
+        self.now = 1700000000000.0
+        self.sent = []
+        self.engine = AlgoEngine(order_sink=self.sent.append, consumer='algo-test', clock=lambda: self.now)
+
+    def algo_order(self, **fields):
+        return AlgoOrder.objects.create(
+            tenant=self.tenant, exchange_account=self.account, symbol='BTC/USDT', side='buy',
+            **{'algorithm': 'twap', 'amount': Decimal('10'), 'parameters': {'duration': 100, 'slices': 10}, **fields},
+        )
+
+    def load(self):
+        children = [cid for algo in self.engine.algos.values() for cid in algo.active]
+        self.engine.apply_changes(*self.engine.load_changes(
+            set(self.engine.algos), self.engine.snapshot(), set(self.engine.market.quotes), children,
+        ))
+
+    def test_load_restore_and_save_progress(self):
+        twap = self.algo_order()
+        broken = self.algo_order(algorithm='iceberg', parameters={})
+        resumed = self.algo_order(status='running', child_count=2, start_time=timezone.now())
+        Order.objects.create(
+            tenant=self.tenant, exchange_account=self.account, client_order_id='twapdone', symbol='BTC/USDT',
+            side='buy', amount=Decimal('1'), filled=Decimal('1'), avg_price=Decimal('100'), status='filled',
+            tag=f'algo:{resumed.pk}',
+        )
+        Order.objects.create(
+            tenant=self.tenant, exchange_account=self.account, client_order_id='twapopen', symbol='BTC/USDT',
+            side='buy', amount=Decimal('1'), status='submitted', tag=f'algo:{resumed.pk}',
+        )
+
+        self.load()
+        twap.refresh_from_db()
+        broken.refresh_from_db()
+        self.assertEqual(twap.status, 'running')
+        self.assertEqual((twap.end_time - twap.start_time).total_seconds(), 100)
+        self.assertEqual(broken.status, 'failed')
+        self.assertIn('display_amount', broken.error_message)
+
+        algo = self.engine.algos[resumed.pk]
+        self.assertEqual((algo.filled, algo.seq, list(algo.active)), (1.0, 2, ['twapopen']))
+        request = next(r for r in self.sent if r['tag'] == f'algo:{twap.pk}')
+        self.assertEqual(request['reply_to'], self.engine.report_stream)
+        self.assertEqual(request['exchange_account_id'], self.account.pk)
+
+        self.engine.handle_reports([{'type': 'fill', 'client_order_id': request['client_order_id'],
+                                     'price': 100.0, 'amount': 1.0, 'filled': 1.0}])
+        AlgoOrder.objects.filter(pk=resumed.pk).update(status='cancelling')
+        self.load()
+        twap.refresh_from_db()
+        self.assertEqual((twap.filled, twap.avg_price, twap.child_count), (Decimal('1'), Decimal('100'), 1))
+        self.assertEqual(self.sent[-1], {**algo.identity, 'action': 'cancel', 'client_order_id': 'twapopen',
+                                         'symbol': 'BTC/USDT'})
+
+        self.engine.handle_reports([{'type': 'cancelled', 'client_order_id': 'twapopen'}])
+        self.load()
+        resumed.refresh_from_db()
+        self.assertEqual(resumed.status, 'cancelled')
+        self.assertIsNotNone(resumed.finished_at)
+
+    def test_restored_children_are_reconciled_from_orders(self):
+        # 重启后的引擎使用相同的回报流
+        self.assertEqual(AlgoEngine().report_stream, report_stream(f'algo:{socket.gethostname()}'))
+        resumed = self.algo_order(algorithm='iceberg', status='running', child_count=2, start_time=timezone.now(),
+                                  parameters={'display_amount': 1})
+        for cid in ('ice1', 'ice2'):
+            Order.objects.create(
+                tenant=self.tenant, exchange_account=self.account, client_order_id=cid, symbol='BTC/USDT',
+                side='buy', amount=Decimal('1'), status='submitted', tag=f'algo:{resumed.pk}',
+            )
+        self.load()
+        algo = self.engine.algos[resumed.pk]
+        self.assertEqual(sorted(algo.active), ['ice1', 'ice2'])
+
+        # 回报写到了其他流（例如网关重启后恢复跟踪），只有数据库中的订单状态变化
+        Order.objects.filter(client_order_id='ice1').update(status='filled', filled=Decimal('1'),
+                                                            avg_price=Decimal('101'))
+        Order.objects.filter(client_order_id='ice2').update(status='cancelled', filled=Decimal('0.4'),
+                                                            avg_price=Decimal('100'))
+        self.load()
+        self.assertEqual(sorted(algo.active), [])
+        self.assertAlmostEqual(algo.filled, 1.4)
+        self.assertAlmostEqual(algo.avg_price, (101 + 40) / 1.4)
+        # 迟到的回报按累计数量忽略
+        self.engine.handle_reports([{'type': 'fill', 'client_order_id': 'ice1', 'price': 101.0, 'amount': 1.0,
+                                     'filled': 1.0}])
+        self.assertAlmostEqual(algo.filled, 1.4)
+
+    def test_sor_routes_across_accounts(self):
+        okx = ExchangeAccount(tenant=self.tenant, user=self.account.user, name='OKX', exchange='okx')
+        okx.set_api_credentials('key', 'secret')
+        okx.save()
+        AccountBalance.objects.create(tenant=self.tenant, exchange_account=self.account, asset='USDT',
+                                      free=Decimal('1000'), total=Decimal('1000'))
+        AccountBalance.objects.create(tenant=self.tenant, exchange_account=okx, asset='USDT',
+                                      free=Decimal('50.025'), total=Decimal('50.025'))
+        self.engine.market.update_book('binance', 'BTC/USDT', [], [[100.0, 1.0]])
+        self.engine.market.update_book('okx', 'BTC/USDT', [], [[100.05, 2.0]])
+        self.algo_order(algorithm='sor', amount=Decimal('1'),
+                        parameters={'accounts': [okx.pk], 'fees': {str(okx.pk): 0}})
+
+        self.load()
+        self.assertEqual(sorted((r['exchange_account_id'], r['amount'], r['time_in_force']) for r in self.sent),
+                         sorted([(okx.pk, 0.5, 'IOC'), (self.account.pk, 0.5, 'IOC')]))
+        self.assertEqual(self.engine.exchanges, ['binance', 'okx'])
+
+
+def fill_event(client_order_id, side, amount, price, account_id=1, symbol='BTC/USDT', fee=0.0, **fields):
+    return {
+        'client_order_id': client_order_id, 'trade_id': f'f{amount}', 'exchange_account_id': account_id,
+        'symbol': symbol, 'side': side, 'amount': amount, 'price': price, 'fee': fee, 'ts': 1, **fields,
+    }
+
+
+class PositionBookTest(SimpleTestCase):
+    """持仓簿测试"""
+
+    def setUp(self):
+        self.book = PositionBook()
+        self.book.account_exchanges.update({1: 'binance', 2: 'binance'})
+
+    def test_fills_and_marks_update_incrementally(self):
+        book = self.book
+        book.apply_fill(fill_event('a', 'buy', 2, 100, fee=0.2), '1-0')
+        book.apply_fill(fill_event('b', 'buy', 2, 110), '2-0')
+        state = book.get(1, 'BTC/USDT')
+        self.assertEqual((state.position.amount, state.position.avg_price), (4, 105))
+        self.assertEqual(state.unrealized, 4 * (110 - 105))  # 没有行情时以最新成交价估值
+
+        book.apply_fill(fill_event('c', 'sell', 1, 120, account_id=2), '3-0')
+        self.assertEqual(book.mark('binance', 'BTC/USDT', 100), 2)
+        self.assertEqual(book.mark('binance', 'ETH/USDT', 100), 0)
+        self.assertEqual(state.unrealized, -20)
+        self.assertEqual(book.get(2, 'BTC/USDT').unrealized, 20)
+
+        # 反手：平掉 4 个多头实现盈亏，剩余 2 个按成交价开空
+        book.apply_fill(fill_event('d', 'sell', 6, 120), '4-0')
+        self.assertEqual((state.position.amount, state.position.avg_price), (-2, 120))
+        self.assertEqual(state.position.realized_pnl, 60)
+
+        totals = book.totals(1).to_dict()
+        self.assertEqual((totals['realized_pnl'], totals['fees']), (60, 0.2))
+        self.assertAlmostEqual(totals['unrealized_pnl'], -2 * (100 - 120))
+        self.assertAlmostEqual(totals['exposure'], 200)
+        self.assertAlmostEqual(totals['net_pnl'], 60 + 40 - 0.2)
+
+    def test_replayed_fills_are_skipped(self):
+        self.assertTrue(self.book.apply_fill(fill_event('a', 'buy', 1, 100), '5-1'))
+        self.assertFalse(self.book.apply_fill(fill_event('a', 'buy', 1, 100), '5-1'))
+        self.assertFalse(self.book.apply_fill(fill_event('z', 'buy', 1, 100), '5-0'))
+        self.assertTrue(self.book.apply_fill(fill_event('b', 'buy', 1, 100), '10-0'))
+        self.assertEqual(self.book.get(1, 'BTC/USDT').position.amount, 2)
+
+
+class PositionEngineTest(TestCase):
+    """成交流、持仓快照和持久化测试"""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name='测试租户', schema_name='test_tenant')
+        user = User.objects.create_user(username='trader', password='testpass123', tenant=self.tenant)
+        self.account = ExchangeAccount(tenant=self.tenant, user=user, name='主账户', exchange='binance')
+        self.account.set_api_credentials('key', 'secret')
+        self.account.save()
+        self.client = fakeredis.FakeRedis(decode_responses=True)
+        self.feed = FillFeed(self.client)
+
+    def engine(self):
+        # 每个引擎使用新的 FillFeed，模拟重启后的新进程
+        return PositionEngine(feed=FillFeed(self.client), client=self.client, consumer='test')
+
+    def read(self, engine):
+        entries = engine.feed.read(engine.group, engine.consumer, count=100)
+        engine.resolve_accounts(engine.unknown_accounts(entries))
+        return engine.handle_fills(entries)
+
+    def test_order_store_publishes_committed_fills_once(self):
+        requests = [order_request(cid, exchange_account_id=self.account.pk, live_strategy_id=None) for cid in 'ab']
+        gateway_store, sync_store = OrderStore(fill_feed=self.feed), OrderStore(fill_feed=self.feed)
+        for store in (gateway_store, sync_store):
+            for request in requests:
+                store.create(request)
+            store.apply_fill('a', 100.0, 1.0)
+        gateway_store.apply_fill('b', 101.0, 2.0, fee=0.1)
+        gateway_store.flush()
+        sync_store.flush()  # 同一笔成交被另一个进程记录，不重复发布
+
+        fills = [fill for _, fill in self.feed.read('test', 'reader')]
+        self.assertEqual(self.client.xlen(FILL_STREAM), 2)
+        self.assertEqual([(f['client_order_id'], f['trade_id'], f['side'], f['amount']) for f in fills],
+                         [('a', 'f1', 'buy', 1.0), ('b', 'f2', 'buy', 2.0)])
+        self.assertEqual(fills[1]['tenant_id'], str(self.tenant.pk))
+
+    def test_snapshot_persist_and_restart(self):
+        self.feed.publish([
+            fill_event('a', 'buy', 2, 100, account_id=self.account.pk, fee=0.1),
+            fill_event('b', 'sell', 1, 110, account_id=self.account.pk),
+        ])
+        engine = self.engine()
+        self.assertEqual(self.read(engine), 2)
+        engine.handle_events([SimpleNamespace(exchange='binance', symbol='BTC/USDT', event_type='ticker',
+                                              timestamp=5, data={'last': 120})])
+        self.assertEqual(engine.publish_snapshot(), 1)
+
+        position = get_account_positions(self.account.pk, self.client)['BTC/USDT']
+        self.assertEqual((position['amount'], position['realized_pnl'], position['unrealized_pnl']), (1, 10, 20))
+        self.assertAlmostEqual(get_account_pnl(self.account.pk, self.client)['net_pnl'], 29.9)
+
+        # 写入数据库之前成交不确认，重启后重新投递并按持仓恢复
+        self.assertEqual(self.client.xpending(FILL_STREAM, engine.group)['pending'], 2)
+        self.assertEqual(engine.persist(), 1)
+        self.assertEqual(self.client.xpending(FILL_STREAM, engine.group)['pending'], 0)
+        row = AccountPosition.objects.get(exchange_account=self.account, symbol='BTC/USDT')
+        self.assertEqual((row.amount, row.realized_pnl, row.mark_price), (Decimal('1'), Decimal('10'), Decimal('120')))
+
+        self.feed.publish([fill_event('c', 'buy', 1, 120, account_id=self.account.pk)])
+        self.read(engine)  # 未写入数据库就退出
+        restarted = self.engine()
+        self.assertEqual(restarted.load(), 1)
+        self.assertEqual(self.read(restarted), 1)
+        state = restarted.book.get(self.account.pk, 'BTC/USDT')
+        self.assertEqual((state.position.amount, state.position.avg_price, state.fees), (2, 110, 0.1))
+        self.assertEqual(restarted.persist(), 1)
+        self.assertEqual(AccountPosition.objects.get(pk=row.pk).amount, Decimal('2'))
+
+
+class SimulatedVenueTest(SimpleTestCase):
+    """模拟交易所测试"""
+
+    def setUp(self):
+        self.venue = SimulatedVenue('binance', SimulationConfig(
+            maker_fee=0.0, taker_fee=0.001, initial_balances={'USDT': 10000.0, 'BTC': 1.0},
+        ), clock=lambda: 1000)
+        self.apply('orderbook', bids=[[99, 2], [98, 5]], asks=[[101, 1], [102, 3]])
+
+    def apply(self, event_type, **data):
+        self.venue.apply_event(MarketEvent('1-0', 'binance', event_type, 'BTC/USDT', 1000, data))
+
+    def test_matching_follows_recorded_queue(self):
+        venue = self.venue
+        taken = venue.create_order(1, 'BTC/USDT', 'limit', 'buy', 1.5, 102, {'clientOrderId': 'a'})
+        self.assertEqual((taken['status'], taken['filled']), ('closed', 1.5))
+        self.assertAlmostEqual(taken['average'], (101 + 0.5 * 102) / 1.5)
+        self.assertAlmostEqual(taken['fee']['cost'], (101 + 0.5 * 102) * 0.001)
+
+        # 排在录制的 2 个之后：成交 2.5 个时只成交 0.5 个
+        resting = venue.create_order(1, 'BTC/USDT', 'limit', 'buy', 1, 99)
+        self.apply('trade', price=99, amount=2.5, side='sell')
+        self.assertEqual(venue.fetch_order(1, resting['id'])['filled'], 0.5)
+        self.assertEqual(venue.fetch_balance(1)['USDT']['used'], 0.5 * 99 * 1.001)
+
+        # 卖盘移到 98，与挂单交叉的部分按挂单价成交
+        self.apply('orderbook', bids=[[97, 2]], asks=[[98, 10]])
+        order = venue.fetch_order(1, resting['id'])
+        self.assertEqual((order['status'], order['filled'], order['average']), ('closed', 1.0, 99.0))
+        self.assertEqual(venue.fetch_order_book('BTC/USDT')['asks'], [[98.0, 9.5]])
+        balance = venue.fetch_balance(1)
+        self.assertEqual(balance['BTC']['total'], 3.5)
+        self.assertAlmostEqual(balance['USDT']['total'], 10000 - 152 * 1.001 - 99)
+        self.assertEqual(balance['USDT']['used'], 0.0)
+        self.assertEqual([trade['takerOrMaker'] for trade in venue.fetch_my_trades(1)],
+                         ['taker', 'taker', 'maker', 'maker'])
+
+    def test_time_in_force_and_rejections(self):
+        venue = self.venue
+        ioc = venue.create_order(1, 'BTC/USDT', 'limit', 'buy', 2, 101, {'timeInForce': 'IOC'})
+        self.assertEqual((ioc['status'], ioc['filled']), ('expired', 1.0))
+        fok = venue.create_order(1, 'BTC/USDT', 'limit', 'buy', 5, 102, {'timeInForce': 'FOK'})
+        self.assertEqual((fok['status'], fok['filled']), ('expired', 0.0))
+        with self.assertRaises(ccxt.OrderImmediatelyFillable):
+            venue.create_order(1, 'BTC/USDT', 'limit', 'sell', 1, 99, {'postOnly': True})
+        with self.assertRaises(ccxt.InsufficientFunds):
+            venue.create_order(1, 'BTC/USDT', 'limit', 'buy', 1000, 100)
+        with self.assertRaises(ccxt.BadSymbol):
+            venue.create_order(1, 'ETH/USDT', 'market', 'buy', 1)
+
+        maker = venue.create_order(1, 'BTC/USDT', 'limit', 'sell', 1, 110, {'postOnly': True})
+        self.assertEqual(venue.fetch_balance(1)['BTC']['used'], 1.0)
+        self.assertEqual(venue.cancel_order(1, maker['id'])['status'], 'canceled')
+        self.assertEqual(venue.fetch_balance(1)['BTC']['used'], 0.0)
+        with self.assertRaises(ccxt.OrderNotFound):
+            venue.cancel_order(1, maker['id'])
+        with self.assertRaises(ccxt.OrderNotFound):
+            venue.fetch_order(2, ioc['id'])
+        self.assertEqual(venue.fetch_open_orders(1), [])
+        self.assertEqual(venue.stats()['rejected'], 3)
+
+    def test_gateway_and_failure_injection(self):
+        store = OrderStore()
+        for method, value in (('load', []), ('flush', 0)):
+            patcher = patch.object(store, method, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        gateway = OrderGateway(
+            'binance', channel=OrderChannel(client=fakeredis.FakeRedis(decode_responses=True)),
+            account_loader=lambda ids=None: [SimpleNamespace(pk=1)], venue=self.venue,
+            recorder=LatencyRecorder('test', client=fakeredis.FakeRedis(decode_responses=True)), order_store=store,
+            poll_interval=0.01,
+        )
+
+        async def scenario():
+            placed = await gateway.handle(order_request('ls1-1', amount=1.5, price=102.0))
+            self.venue.config.error_rate = 1.0
+            failed = await gateway.handle(order_request('ls1-2'))
+            self.venue.config.error_rate, self.venue.config.timeout_rate = 0.0, 1.0
+            lost = await gateway.handle(order_request('ls1-3', amount=0.1, price=90.0))
+            self.venue.config.timeout_rate = 0.0
+            await asyncio.sleep(0.02)
+            return placed, failed, lost, await gateway.poll_open_orders()
+
+        placed, failed, lost, confirmed = asyncio.run(scenario())
+        self.assertEqual([report['type'] for report in placed], ['ack', 'fill'])
+        self.assertEqual(placed[1]['amount'], 1.5)
+        # 网络错误不作为拒绝，按客户端订单号确认：请求失败的被拒绝，响应丢失的订单得到确认
+        self.assertEqual((failed, lost), ([], []))
+        self.assertEqual(sorted((report['client_order_id'], report['type']) for report in confirmed),
+                         [('ls1-2', 'rejected'), ('ls1-3', 'ack')])
+        self.assertEqual(list(gateway.open_orders), ['ls1-3'])
+        self.assertEqual((self.venue.stats()['errors'], self.venue.stats()['timeouts']), (1, 1))
+
+    def test_paper_accounts_and_feed(self):
+        paper, live = SimpleNamespace(pk=2, is_testnet=True), SimpleNamespace(pk=3, is_testnet=False)
+        factory = paper_exchange_factory(self.venue, fallback=lambda account: 'live')
+        with self.settings(PAPER_TRADING_ENABLED=True):
+            self.assertIsInstance(factory(paper), AsyncSimulatedExchange)
+            self.assertEqual(factory(live), 'live')
+            with self.assertRaises(OrderRejected):
+                sync_exchange(paper)
+        self.assertEqual(factory(paper), 'live')
+
+        event_log = MarketEventLog(client=fakeredis.FakeRedis(decode_responses=True))
+        event_log.append('binance', 'ticker', 'ETH/USDT', {'bid': 1999, 'ask': 2001, 'last': 2000}, 1000)
+        feed = MarketFeed(self.venue, event_log, MarketEventArchive(event_log, base_dir='/nonexistent'))
+        self.assertEqual(feed.replay(), 1)
+        self.assertEqual(self.venue.fetch_ticker('ETH/USDT')['ask'], 2001)
+        event_log.append('binance', 'orderbook', 'ETH/USDT', {'bids': [[1998, 1]], 'asks': [[2002, 2]]}, 2000)
+        self.assertEqual(feed.poll(), 1)
+        self.assertEqual(self.venue.fetch_order_book('ETH/USDT')['asks'], [[2002.0, 2.0]])
+
+
+class ExecutionQualityTest(TestCase):
+    """执行质量汇总和报表测试"""
+
+    def setUp(self):
+        self.tenant = Tenant.objects.create(name='测试租户', schema_name='test_tenant')
+        user = User.objects.create_user(username='trader', password='testpass123', tenant=self.tenant)
+        self.account = ExchangeAccount(tenant=self.tenant, user=user, name='主账户', exchange='binance')
+        self.account.set_api_credentials('key', 'secret')
+        self.account.save()
+        self.store = OrderStore()
+        self.t0 = 1718000000000.0
+
+    def place(self, client_order_id, **fields):
+        request = order_request(client_order_id, exchange_account_id=self.account.pk, live_strategy_id=None,
+                                sent_ts=self.t0, **fields)
+        return self.store.create(request)[0]
+
+    def test_rollup_is_incremental_and_report_merges(self):
+        a = self.place('a', arrival_price=100.0)
+        self.store.transition('a', 'submitted', ts=self.t0 + 20)
+        self.store.apply_fill('a', 100.5, 1.0, fee=0.1, ts=self.t0 + 50)
+        self.store.apply_fill('a', 100.7, 1.0, fee=0.1, ts=self.t0 + 100)
+        self.place('b', side='sell', arrival_price=100.0)
+        self.store.transition('b', 'submitted', ts=self.t0 + 40)
+        self.store.apply_fill('b', 99.9, 1.0, ts=self.t0 + 1000)
+        self.store.transition('b', 'cancelled', ts=self.t0 + 2000)
+        self.place('c', symbol='ETH/USDT')
+        self.store.transition('c', 'rejected', error='余额不足', ts=self.t0 + 30)
+        self.place('open')  # 未结束的订单不计入
+        self.store.flush()
+        self.assertEqual((a.arrival_price, a.sent_at.timestamp() * 1000), (100.0, self.t0))
+
+        self.assertEqual(rollup_execution_quality(), {'orders': 3})
+        self.assertEqual(ExecutionQualityRollup().run(), 0)
+        self.assertEqual(ExecutionQuality.objects.count(), 2)
+
+        report = execution_quality_report(self.tenant.pk, group_by=('symbol',))
+        self.assertEqual([row['symbol'] for row in report], ['BTC/USDT', 'ETH/USDT'])
+        btc, eth = report
+        self.assertEqual((btc['orders'], btc['filled_orders'], btc['partial_orders']), (2, 1, 1))
+        self.assertAlmostEqual(btc['fill_ratio'], 0.75)
+        self.assertAlmostEqual(btc['fees'], 0.2)
+        # 买单均价 100.6 高于到达价 0.6，卖单 99.9 低于到达价 0.1，都是不利滑点
+        self.assertAlmostEqual(btc['slippage_cost'], 1.3)
+        self.assertAlmostEqual(btc['slippage_bps'], 1.3 / 300 * 10000)
+        self.assertEqual((btc['ack_latency_ms']['count'], btc['ack_latency_ms']['mean']), (2, 30.0))
+        self.assertEqual((btc['fill_latency_ms']['count'], btc['fill_latency_ms']['mean']), (2, 525.0))
+        self.assertLessEqual(btc['ack_latency_ms']['p50'], 50)
+        self.assertEqual((eth['rejected_orders'], eth['fill_ratio'], eth['slippage_bps']), (1, None, None))
+
+        # 后结束的订单累加到已有的汇总行
+        self.store.apply_fill('open', 101.0, 2.0, ts=self.t0 + 500)
+        self.store.flush()
+        self.assertEqual(ExecutionQualityRollup(batch_size=1).run(), 1)
+        self.assertEqual(ExecutionQuality.objects.count(), 2)
+        total, = execution_quality_report(self.tenant.pk, group_by=())
+        self.assertEqual((total['orders'], total['filled_orders'], total['rejected_orders']), (4, 2, 1))
+        self.assertAlmostEqual(total['fill_ratio'], 5 / 6)
+        # 没有到达价格的订单不计入滑点
+        self.assertAlmostEqual(total['slippage_bps'], 1.3 / 300 * 10000)
+
+        hour = bucket_start(a.closed_at)
+        self.assertEqual(execution_quality_report(self.tenant.pk, start=hour, end=hour), [])
+        self.assertEqual(execution_quality_report(self.tenant.pk, exchanges=['okx']), [])
+        with self.assertRaises(ValueError):
+            execution_quality_report(self.tenant.pk, group_by=('side',))
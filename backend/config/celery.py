@@ -54,6 +54,21 @@ app.conf.beat_schedule = {
         'task': 'apps.monitoring.tasks.collect_celery_stats',
         'schedule': crontab(minute='*/2'),  # 每2分钟执行
     },
+    # 每5分钟归档市场事件日志
+    'archive-market-events': {
+        'task': 'apps.market.tasks.archive_market_events',
+        'schedule': crontab(minute='*/5'),  # 每5分钟执行
+    },
+    # 每分钟增量同步交易账户
+    'sync-exchange-accounts': {
+        'task': 'apps.trading.tasks.sync_all_exchange_accounts',
+        'schedule': crontab(minute='*'),  # 每分钟执行
+    },
+    # 每分钟汇总执行质量
+    'rollup-execution-quality': {
+        'task': 'apps.trading.tasks.rollup_execution_quality',
+        'schedule': crontab(minute='*'),  # 每分钟执行
+    },
     # 每天凌晨3点清理Celery历史数据
     'cleanup-celery-data': {
         'task': 'apps.monitoring.tasks.cleanup_celery_data',
@@ -167,6 +167,110 @@ CHANNEL_LAYERS = {
     },
 }
 
+# 市场事件日志配置（Redis Streams + 磁盘归档分段）
+MARKET_EVENT_LOG_REDIS_URL = os.getenv('MARKET_EVENT_LOG_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+MARKET_EVENT_LOG_MAXLEN = int(os.getenv('MARKET_EVENT_LOG_MAXLEN', '1000000'))  # 每个交易所流保留的最大事件数
+MARKET_EVENT_ARCHIVE_DIR = os.getenv('MARKET_EVENT_ARCHIVE_DIR', str(BASE_DIR / 'data' / 'market_events'))
+MARKET_EVENT_SEGMENT_SIZE = 50000  # 每个归档分段的事件数
+MARKET_EVENT_STREAM_RETENTION = 86400  # 归档后流中继续保留的秒数
+
+# 回测结果存储（权益曲线、交易明细的列式压缩文件）
+BACKTEST_RESULT_DIR = os.getenv('BACKTEST_RESULT_DIR', str(BASE_DIR / 'data' / 'backtest_results'))
+BACKTEST_EQUITY_CURVE_POINTS = 1000  # 回测记录中保存的权益曲线预览点数
+
+# 用户策略沙箱（常驻受限子进程）
+STRATEGY_SANDBOX_WORKERS = int(os.getenv('STRATEGY_SANDBOX_WORKERS', '2'))  # 每个进程的沙箱子进程数
+STRATEGY_SANDBOX_MEMORY_MB = 2048  # 子进程虚拟内存上限
+STRATEGY_SANDBOX_CPU_SECONDS = 300  # 每次调用（加载代码、计算信号、处理一批事件）的CPU时间预算
+STRATEGY_SANDBOX_TIME_LIMIT = 120  # 加载代码和计算向量化信号的超时（秒）
+STRATEGY_SANDBOX_CALL_TIMEOUT = 5  # 事件驱动单批事件的超时（秒）
+STRATEGY_SANDBOX_USER = 'nobody'  # 主进程为 root 时子进程切换到的用户
+STRATEGY_SANDBOX_ENFORCE_ISOLATION = True  # 无法启用系统调用过滤时拒绝运行用户代码
+STRATEGY_SANDBOX_WRAPPER = []  # 启动子进程的外层命令，如 ['nsjail', '--config', '/etc/nsjail/strategy.cfg', '--']
+
+# 实盘策略引擎（run_strategy_engine 命令）
+STRATEGY_ENGINE_BATCH_SIZE = 500  # 每次从事件日志读取的最大事件数
+STRATEGY_ENGINE_BLOCK_MS = 1000  # 没有新事件时阻塞等待的毫秒数
+STRATEGY_ENGINE_RELOAD_INTERVAL = 5  # 重新加载运行中策略的间隔（秒）
+STRATEGY_ENGINE_HISTORY_SIZE = 1000  # 每个K线流保留的历史K线数
+
+# 订单网关（run_order_gateway 命令，每个交易所一个进程）
+ORDER_GATEWAY_REDIS_URL = os.getenv('ORDER_GATEWAY_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+ORDER_GATEWAY_STREAM_MAXLEN = 100000  # 订单流和回报流保留的最大消息数
+ORDER_GATEWAY_MAX_INFLIGHT = 50  # 每个网关同时提交中的订单数
+ORDER_GATEWAY_BURST = 10  # 每个账户令牌桶的突发容量
+ORDER_GATEWAY_POLL_INTERVAL = 2  # 查询未完成订单状态的间隔（秒）
+ORDER_GATEWAY_HEARTBEAT_INTERVAL = 2  # 心跳间隔（秒），心跳键有效期为3倍
+ORDER_GATEWAY_MAX_AGE = 10  # 超过该秒数仍未处理的订单请求直接拒绝
+ORDER_GATEWAY_CHECK_INTERVAL = 1  # 下单方缓存网关在线状态的秒数
+ORDER_CONFIRM_RETRY_DELAY = 5  # execute_order 下单结果未知时，重试确认的间隔（秒）
+ORDER_CONFIRM_MAX_RETRIES = 12  # execute_order 确认下单结果的最多重试次数
+ORDER_BATCH_MAX_SIZE = 5  # 批量下单接口每次最多的订单数（ORDER_BATCH_LIMITS 未列出的交易所）
+ORDER_BATCH_LIMITS = {}  # 按交易所覆盖批量下单接口的订单数上限，例如 {'okx': 20}
+ORDER_STORE_BATCH_SIZE = 500  # 订单状态缓冲达到该数量时立即写入数据库
+ORDER_STORE_FLUSH_INTERVAL = 0.5  # 订单状态缓冲的最长写入间隔（秒）
+ORDER_FILL_FEED_ENABLED = True  # 成交写入后发布到成交流，供持仓引擎使用
+
+# 交易账户增量同步（sync_all_exchange_accounts 任务）
+ACCOUNT_SYNC_CONCURRENCY = 20  # 同时同步的账户数
+ACCOUNT_SYNC_BURST = 5  # 每个交易所令牌桶的突发容量
+ACCOUNT_SYNC_PAGE_SIZE = 500  # 每次拉取的成交数
+ACCOUNT_SYNC_OVERLAP_MS = 5000  # 成交游标向前重叠的毫秒数
+ACCOUNT_SYNC_LOOKBACK_MS = 86400000  # 首次同步拉取的成交时间范围（毫秒）
+
+# 算法执行引擎（run_algo_engine 命令）
+ALGO_ENGINE_TICK_MS = 100  # 时间轮刻度（毫秒），子单最多晚这么久发出
+ALGO_ENGINE_WHEEL_SLOTS = 1024  # 时间轮槽数
+ALGO_ENGINE_BATCH_SIZE = 500  # 每次读取的市场事件和回报数
+ALGO_ENGINE_BLOCK_MS = 1000  # 没有新消息时阻塞等待的毫秒数
+ALGO_ENGINE_RELOAD_INTERVAL = 2  # 保存进度、加载新算法单的间隔（秒）
+ALGO_VWAP_TIMEFRAME = '5m'  # VWAP 成交量分布使用的K线周期
+ALGO_VWAP_LOOKBACK_DAYS = 7  # VWAP 成交量分布统计的天数
+
+# 智能订单路由（算法单 algorithm='sor'）
+ROUTER_BOOK_DEPTH = 10  # 内存中每个交易对保留的订单簿档数
+ROUTER_DEFAULT_TAKER_FEE = 0.001  # 未单独配置的交易所的吃单费率
+ROUTER_TAKER_FEES = {}  # 交易所 -> 吃单费率，如 {'binance': 0.001, 'okx': 0.0008}
+
+# 模拟交易所与模拟盘
+PAPER_TRADING_ENABLED = False  # 开启后测试网账户在订单网关进程内的模拟交易所成交
+PAPER_TRADING_POLL_INTERVAL = 0.2  # 读取市场事件日志的间隔（秒）
+PAPER_TRADING_SYNC_INTERVAL = 10  # 模拟盘账户同步到数据库的间隔（秒）
+PAPER_TRADING_FEED_BATCH_SIZE = 1000  # 每次读取的市场事件数
+SIMULATOR_LATENCY_MS = 0  # 模拟的往返延迟（毫秒）
+SIMULATOR_JITTER_MS = 0  # 延迟的随机浮动（毫秒）
+SIMULATOR_ERROR_RATE = 0.0  # 请求失败（ExchangeNotAvailable）的概率
+SIMULATOR_TIMEOUT_RATE = 0.0  # 请求已处理、响应超时（RequestTimeout）的概率
+SIMULATOR_MAKER_FEE = 0.001
+SIMULATOR_TAKER_FEE = 0.001
+SIMULATOR_INITIAL_BALANCES = {'USDT': 100000}  # 新账户的初始余额
+
+# 执行质量统计（rollup_execution_quality 任务）
+EXECUTION_QUALITY_BATCH_SIZE = 1000  # 每个事务计入的订单数
+
+# 持仓引擎（run_position_engine 命令）
+POSITION_FILL_STREAM_MAXLEN = 1000000  # 成交流保留的最大消息数
+POSITION_FILL_DEDUPE_TTL = 604800  # 成交去重键的有效期（秒）
+POSITION_ENGINE_BATCH_SIZE = 500  # 每次读取的成交和市场事件数
+POSITION_ENGINE_BLOCK_MS = 1000  # 没有新消息时阻塞等待的毫秒数
+POSITION_SNAPSHOT_INTERVAL = 0.5  # 持仓快照写入 Redis 的间隔（秒）
+POSITION_PERSIST_INTERVAL = 10  # 持仓写入数据库的间隔（秒）
+
+# 下单前风控检查（订单网关和 execute_order）
+PRETRADE_CHECK_ENABLED = True
+PRETRADE_STATE_TTL = 0.5  # 持仓和盈亏缓存的有效期（秒）
+PRETRADE_BALANCE_TTL = 30  # 余额缓存的有效期（秒）
+PRETRADE_VERSION_CHECK_INTERVAL = 1.0  # 检查规则版本号的间隔（秒），规则变化最多这么久后在其他进程生效
+
+# 交易所连接器池配置（进程内复用ccxt实例）
+EXCHANGE_CONNECTOR_IDLE_TIMEOUT = 600  # 空闲多少秒后关闭连接器
+EXCHANGE_MARKETS_TTL = 3600  # 市场信息在账户间共享的有效期（秒）
+EXCHANGE_HTTP_POOL_SIZE = 10  # 每个连接器的HTTP连接池大小
+
+# 延迟直方图配置（各进程累积后按间隔合并到Redis）
+LATENCY_METRICS_REDIS_URL = os.getenv('LATENCY_METRICS_REDIS_URL', os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+LATENCY_METRICS_FLUSH_INTERVAL = 1.0  # 秒
+
 # Celery配置
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
@@ -2,6 +2,7 @@
 测试环境设置
 """
 import os
+import tempfile
 from pathlib import Path
 
 # 构建路径
@@ -118,4 +119,17 @@ EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
 AUTH_PASSWORD_VALIDATORS = []
 
 # 调试模式
-DEBUG = True
\ No newline at end of file
+DEBUG = True
+
+# 测试使用内存通道层
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+
+# 加密密钥
+ENCRYPTION_KEY = 'test-encryption-key'
+
+# 回测结果文件写入临时目录
+BACKTEST_RESULT_DIR = os.path.join(tempfile.gettempdir(), 'qt_test_backtest_results')
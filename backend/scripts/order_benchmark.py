@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""
+订单链路压测脚本
+
+在进程内启动订单网关（OrderGateway），交易所为本地的模拟交易所（apps/trading/simulator.py），
+合成的订单簿按固定速率更新。并发提交限价单（一部分越过盘口立即成交）并撤销一部分挂单，输出：
+
+- 下单和撤单的延迟分位数（网关 handle 调用到返回回报）
+- 每秒处理的订单数
+- 成交、撤销、拒绝的数量和模拟交易所的统计
+
+可以设置交易所的往返延迟、错误率和超时率，观察网关在交易所变慢或出错时的表现。
+
+用法:
+    python scripts/order_benchmark.py --orders 20000 --concurrency 100
+    python scripts/order_benchmark.py --latency-ms 30 --jitter-ms 10 --error-rate 0.01
+    python scripts/order_benchmark.py --output result.json --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.testing')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+
+from apps.market.event_log import MarketEvent  # noqa: E402
+from apps.monitoring.latency import LatencyRecorder, now_ms  # noqa: E402
+from apps.trading.gateway import OrderGateway  # noqa: E402
+from apps.trading.simulator import SimulatedVenue, SimulationConfig  # noqa: E402
+
+
+def percentile(sorted_values, pct):
+    """计算分位数（输入需已排序）"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def latency_summary(values):
+    values = sorted(values)
+    return {
+        'p50': round(percentile(values, 50) * 1000, 3),
+        'p90': round(percentile(values, 90) * 1000, 3),
+        'p99': round(percentile(values, 99) * 1000, 3),
+        'max': round(values[-1] * 1000, 3) if values else 0.0,
+        'mean': round(statistics.fmean(values) * 1000, 3) if values else 0.0,
+    }
+
+
+def synthetic_book(mid, depth, rng):
+    """以 mid 为中心、档距 0.01% 的合成订单簿"""
+    tick = mid * 0.0001
+    bids = [[round(mid - tick * (i + 1), 6), round(rng.uniform(0.5, 5), 4)] for i in range(depth)]
+    asks = [[round(mid + tick * (i + 1), 6), round(rng.uniform(0.5, 5), 4)] for i in range(depth)]
+    return {'bids': bids, 'asks': asks}
+
+
+async def feed_books(venue, symbols, mids, args, stop_event):
+    """按固定速率更新合成订单簿（中间价随机游走），返回更新次数"""
+    rng = random.Random(args.seed + 1)
+    interval = 1.0 / args.book_rate
+    updates = 0
+    start = time.perf_counter()
+    while not stop_event.is_set():
+        symbol = rng.choice(symbols)
+        mids[symbol] *= 1 + rng.gauss(0, 0.0002)
+        venue.apply_event(MarketEvent(
+            f'{updates}-0', venue.exchange, 'orderbook', symbol, int(now_ms()),
+            synthetic_book(mids[symbol], args.depth, rng),
+        ))
+        updates += 1
+        delay = start + updates * interval - time.perf_counter()
+        await asyncio.sleep(max(delay, 0))
+    return updates
+
+
+async def run_benchmark(args):
+    """执行一次压测并返回结果字典"""
+    settings.PRETRADE_CHECK_ENABLED = False
+    # 已成交订单的撤单失败、注入的错误都计入结果，不逐条打印
+    logging.getLogger('apps.trading').setLevel(logging.ERROR)
+    rng = random.Random(args.seed)
+    symbols = [f'SYM{i:04d}/USDT' for i in range(args.symbols)]
+    balances = {'USDT': 1e12, **{symbol.split('/')[0]: 1e9 for symbol in symbols}}
+    venue = SimulatedVenue(args.exchange, SimulationConfig(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate, initial_balances=balances, seed=args.seed,
+    ))
+    mids = {symbol: 100.0 for symbol in symbols}
+    for symbol in symbols:
+        venue.apply_event(MarketEvent('0-0', args.exchange, 'orderbook', symbol, int(now_ms()),
+                                      synthetic_book(mids[symbol], args.depth, rng)))
+
+    accounts = [SimpleNamespace(pk=pk, exchange=args.exchange, is_testnet=True) for pk in range(1, args.accounts + 1)]
+    gateway = OrderGateway(
+        args.exchange, consumer='order-benchmark', venue=venue, burst=args.orders,
+        account_loader=lambda ids=None: [account for account in accounts if ids is None or account.pk in ids],
+        recorder=LatencyRecorder('order_benchmark', flush_interval=float('inf')),
+    )
+    # 只建立账户会话，不读取数据库中的未完成订单
+    await asyncio.gather(*(gateway.session(account.pk) for account in accounts))
+
+    place_latencies, cancel_latencies = [], []
+    reports = Counter()
+    sequence = iter(range(args.orders))
+
+    async def worker():
+        for index in sequence:
+            symbol = rng.choice(symbols)
+            side = rng.choice(('buy', 'sell'))
+            aggressive = rng.random() < args.aggressive_ratio
+            offset = 0.001 if aggressive else -rng.uniform(0.0002, 0.002)
+            price = mids[symbol] * (1 + offset if side == 'buy' else 1 - offset)
+            request = {
+                'action': 'place', 'client_order_id': f'bench-{index}', 'exchange_account_id': rng.choice(accounts).pk,
+                'exchange': args.exchange, 'symbol': symbol, 'side': side, 'order_type': 'limit',
+                'amount': round(rng.uniform(0.01, 1), 4), 'price': round(price, 6), 'sent_ts': now_ms(),
+            }
+            started = time.perf_counter()
+            placed = await gateway.handle(request)
+            place_latencies.append(time.perf_counter() - started)
+            reports.update(report['type'] for report in placed)
+            if not aggressive and rng.random() < args.cancel_ratio:
+                started = time.perf_counter()
+                cancelled = await gateway.handle({**request, 'action': 'cancel'})
+                cancel_latencies.append(time.perf_counter() - started)
+                reports.update(report['type'] for report in cancelled)
+            # 模拟交易所没有延迟时请求不会挂起，主动让出事件循环给订单簿更新
+            await asyncio.sleep(0)
+
+    stop_event = asyncio.Event()
+    feeder = asyncio.ensure_future(feed_books(venue, symbols, mids, args, stop_event))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    stop_event.set()
+    book_updates = await feeder
+    await gateway.close()
+
+    return {
+        'config': {
+            'exchange': args.exchange,
+            'orders': args.orders,
+            'concurrency': args.concurrency,
+            'accounts': args.accounts,
+            'symbols': args.symbols,
+            'aggressive_ratio': args.aggressive_ratio,
+            'cancel_ratio': args.cancel_ratio,
+            'latency_ms': args.latency_ms,
+            'jitter_ms': args.jitter_ms,
+            'error_rate': args.error_rate,
+            'timeout_rate': args.timeout_rate,
+            'book_rate': args.book_rate,
+            'seed': args.seed,
+        },
+        'seconds': round(elapsed, 4),
+        'orders_per_second': round(args.orders / elapsed, 2) if elapsed else 0.0,
+        'book_updates': book_updates,
+        'reports': dict(reports),
+        'place_latency_ms': latency_summary(place_latencies),
+        'cancel_latency_ms': latency_summary(cancel_latencies),
+        'venue': venue.stats(),
+    }
+
+
+def compare_with_baseline(result, baseline, tolerance):
+    """
+    与基线结果比较，返回回归项列表
+
+    延迟越低越好，吞吐越高越好。
+    """
+    regressions = []
+    for key in ('p50', 'p99'):
+        base = baseline['place_latency_ms'][key]
+        if base and result['place_latency_ms'][key] > base * (1 + tolerance):
+            regressions.append(f"下单延迟{key}: {base}ms -> {result['place_latency_ms'][key]}ms")
+    base_rate = baseline['orders_per_second']
+    if base_rate and result['orders_per_second'] < base_rate * (1 - tolerance):
+        regressions.append(f"吞吐: {base_rate}/s -> {result['orders_per_second']}/s")
+    return regressions
+
+
+def print_report(result):
+    """打印压测报告"""
+    config = result['config']
+    place, cancel = result['place_latency_ms'], result['cancel_latency_ms']
+    print("=== 订单链路压测结果 ===")
+    print(f"交易所: {config['exchange']}（模拟）  账户: {config['accounts']}  交易对: {config['symbols']}  "
+          f"并发: {config['concurrency']}")
+    print(f"模拟延迟: {config['latency_ms']}±{config['jitter_ms']}ms  错误率: {config['error_rate']}  "
+          f"超时率: {config['timeout_rate']}")
+    print(f"订单: {config['orders']}  耗时: {result['seconds']}s  吞吐: {result['orders_per_second']} 单/s  "
+          f"订单簿更新: {result['book_updates']}")
+    print(f"回报: {result['reports']}")
+    print(f"下单延迟(ms): p50={place['p50']} p90={place['p90']} p99={place['p99']} "
+          f"max={place['max']} mean={place['mean']}")
+    print(f"撤单延迟(ms): p50={cancel['p50']} p90={cancel['p90']} p99={cancel['p99']} "
+          f"max={cancel['max']} mean={cancel['mean']}")
+    print(f"模拟交易所: {result['venue']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='订单链路压测（模拟交易所）')
+    parser.add_argument('--exchange', default='binance', help='模拟的交易所代码')
+    parser.add_argument('--orders', type=int, default=10000, help='下单数量')
+    parser.add_argument('--concurrency', type=int, default=50, help='并发提交的协程数')
+    parser.add_argument('--accounts', type=int, default=10, help='交易账户数量')
+    parser.add_argument('--symbols', type=int, default=5, help='交易对数量')
+    parser.add_argument('--depth', type=int, default=20, help='合成订单簿档位数')
+    parser.add_argument('--aggressive-ratio', type=float, default=0.3, help='越过盘口立即成交的订单占比')
+    parser.add_argument('--cancel-ratio', type=float, default=0.5, help='挂单中随后撤销的占比')
+    parser.add_argument('--book-rate', type=float, default=200, help='每秒订单簿更新数')
+    parser.add_argument('--latency-ms', type=float, default=0, help='模拟交易所的往返延迟（毫秒）')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='延迟的随机浮动（毫秒）')
+    parser.add_argument('--error-rate', type=float, default=0, help='请求失败的概率')
+    parser.add_argument('--timeout-rate', type=float, default=0, help='响应超时的概率')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子，保证结果可复现')
+    parser.add_argument('--output', help='将结果写入JSON文件')
+    parser.add_argument('--baseline', help='基线结果JSON文件，用于回归检测')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='回归容忍比例')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """主函数"""
+    args = parse_args(argv)
+    result = asyncio.run(run_benchmark(args))
+    print_report(result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(result, baseline, args.tolerance)
+        if regressions:
+            print("\n检测到性能回归:")
+            for item in regressions:
+                print(f"  - {item}")
+            return 1
+        print("\n未检测到性能回归")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+"""
+WebSocket行情网关压测脚本
+
+在进程内启动 ASGI 应用（websocket 路由 + MarketDataConsumer），
+使用内存或本地 Redis 通道层，模拟 N 个客户端各订阅 M 个交易对，
+按固定速率广播合成的 ticker/orderbook 消息，输出：
+
+- 端到端延迟分位数（group_send -> 客户端收到）
+- 每秒投递消息数
+- 每连接内存占用
+- 丢弃消息数（应投递数 - 实际收到数）
+
+用法:
+    python scripts/ws_benchmark.py --clients 200 --symbols 20 --rate 500 --duration 10
+    python scripts/ws_benchmark.py --layer redis --redis-url redis://localhost:6379/3
+    python scripts/ws_benchmark.py --output result.json --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+
+import psutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.testing')
+
+import django  # noqa: E402
+
+django.setup()
+
+from channels.layers import get_channel_layer  # noqa: E402
+from channels.routing import URLRouter  # noqa: E402
+from channels.testing import WebsocketCommunicator  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+from apps.market.groups import get_symbol_group_name  # noqa: E402
+from apps.market.routing import websocket_urlpatterns  # noqa: E402
+
+
+class BenchmarkTenant:
+    """压测使用的虚拟租户"""
+    id = 'benchmark'
+
+
+class BenchmarkUser:
+    """压测使用的已认证用户，避免依赖数据库和会话"""
+    is_authenticated = True
+    tenant = BenchmarkTenant()
+
+    def __eq__(self, other):
+        return other is self
+
+
+class BenchmarkAuthMiddleware:
+    """将压测用户注入scope，替代生产环境的AuthMiddlewareStack"""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.user = BenchmarkUser()
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope, user=self.user)
+        return await self.inner(scope, receive, send)
+
+
+def configure_channel_layer(args):
+    """根据参数配置通道层"""
+    if args.layer == 'redis':
+        settings.CHANNEL_LAYERS = {
+            'default': {
+                'BACKEND': 'channels_redis.core.RedisChannelLayer',
+                'CONFIG': {
+                    'hosts': [args.redis_url],
+                    'capacity': args.capacity,
+                },
+            },
+        }
+    else:
+        settings.CHANNEL_LAYERS = {
+            'default': {
+                'BACKEND': 'channels.layers.InMemoryChannelLayer',
+                'CONFIG': {'capacity': args.capacity},
+            },
+        }
+
+
+def percentile(sorted_values, pct):
+    """计算分位数（输入需已排序）"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class BenchmarkClient:
+    """模拟的WebSocket客户端"""
+
+    def __init__(self, application, symbols):
+        self.communicator = WebsocketCommunicator(application, '/ws/market/')
+        self.symbols = symbols
+        self.latencies = []
+        self.received = Counter()
+        self.errors = 0
+
+    async def connect(self):
+        """建立连接并批量订阅"""
+        connected, _ = await self.communicator.connect(timeout=10)
+        if not connected:
+            raise RuntimeError('WebSocket连接失败')
+        await self.communicator.receive_from(timeout=10)  # connection_established
+        await self.communicator.send_json_to({'action': 'subscribe', 'symbols': self.symbols})
+        await self.communicator.receive_from(timeout=10)  # subscribed
+
+    async def consume(self, stop_event):
+        """
+        持续接收消息直到压测结束且队列排空
+
+        直接读取通信器的输出队列：receive_from 超时会取消整个应用，
+        不适合长时间的轮询接收。
+        """
+        queue = self.communicator.output_queue
+        while True:
+            try:
+                output = await asyncio.wait_for(queue.get(), timeout=0.5)
+            except asyncio.TimeoutError:
+                if stop_event.is_set():
+                    return
+                continue
+
+            if output.get('type') != 'websocket.send':
+                self.errors += 1
+                return
+            text = output.get('text')
+            now = time.perf_counter()
+            message = json.loads(text)
+            data = message.get('data') or {}
+            sent_at = data.get('bench_ts')
+            if sent_at is not None:
+                self.latencies.append(now - sent_at)
+                self.received[message['type']] += 1
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+async def broadcast(layer, symbols, subscribers, args, stop_event):
+    """
+    按固定速率广播合成行情
+
+    Returns:
+        (已广播消息数, 应投递消息数, 广播耗时秒数)
+    """
+    rng = random.Random(args.seed + 1)
+    interval = 1.0 / args.rate
+    sent = 0
+    expected = 0
+    depth = [[100.0 + i, 1.0] for i in range(args.depth)]
+    start = time.perf_counter()
+    deadline = start + args.duration
+
+    while time.perf_counter() < deadline:
+        symbol = rng.choice(symbols)
+        is_orderbook = rng.random() < args.orderbook_ratio
+        payload = {'symbol': symbol, 'bench_ts': time.perf_counter()}
+        if is_orderbook:
+            event = {'type': 'orderbook_update', 'data': dict(payload, bids=depth, asks=depth)}
+        else:
+            event = {'type': 'ticker_update', 'data': dict(payload, last=rng.uniform(100, 200), bid=None, ask=None)}
+
+        await layer.group_send(get_symbol_group_name(symbol), event)
+        sent += 1
+        expected += subscribers[symbol]
+
+        # 按照目标速率节流
+        next_at = start + sent * interval
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif sent % 100 == 0:
+            await asyncio.sleep(0)
+
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(args.drain)
+    stop_event.set()
+    return sent, expected, elapsed
+
+
+async def run_benchmark(args):
+    """执行一次压测并返回结果字典"""
+    configure_channel_layer(args)
+    layer = get_channel_layer()
+    application = BenchmarkAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    rng = random.Random(args.seed)
+    universe = [f'SYM{i:04d}/USDT' for i in range(args.universe)]
+    process = psutil.Process()
+
+    gc.collect()
+    rss_before = process.memory_info().rss
+
+    clients = []
+    subscribers = Counter()
+    connect_start = time.perf_counter()
+    for _ in range(args.clients):
+        symbols = rng.sample(universe, args.symbols)
+        subscribers.update(symbols)
+        clients.append(BenchmarkClient(application, symbols))
+    for offset in range(0, len(clients), args.connect_batch):
+        await asyncio.gather(*(c.connect() for c in clients[offset:offset + args.connect_batch]))
+    connect_elapsed = time.perf_counter() - connect_start
+
+    gc.collect()
+    rss_after = process.memory_info().rss
+
+    stop_event = asyncio.Event()
+    consumers = [asyncio.ensure_future(c.consume(stop_event)) for c in clients]
+    sent, expected, elapsed = await broadcast(layer, universe, subscribers, args, stop_event)
+    await asyncio.gather(*consumers)
+    await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+
+    latencies = sorted(lat for c in clients for lat in c.latencies)
+    received = sum(len(c.latencies) for c in clients)
+    by_type = Counter()
+    for c in clients:
+        by_type.update(c.received)
+
+    return {
+        'config': {
+            'layer': args.layer,
+            'clients': args.clients,
+            'symbols_per_client': args.symbols,
+            'universe': args.universe,
+            'rate': args.rate,
+            'duration': args.duration,
+            'orderbook_ratio': args.orderbook_ratio,
+            'capacity': args.capacity,
+            'seed': args.seed,
+        },
+        'connect_seconds': round(connect_elapsed, 4),
+        'broadcasts': sent,
+        'expected_deliveries': expected,
+        'delivered': received,
+        'delivered_by_type': dict(by_type),
+        'dropped': max(expected - received, 0),
+        'drop_rate': round((expected - received) / expected, 6) if expected else 0.0,
+        'client_errors': sum(c.errors for c in clients),
+        'messages_per_second': round(received / elapsed, 2) if elapsed else 0.0,
+        'broadcasts_per_second': round(sent / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 3),
+            'p90': round(percentile(latencies, 90) * 1000, 3),
+            'p99': round(percentile(latencies, 99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+            'mean': round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        },
+        'memory_per_connection_kb': round((rss_after - rss_before) / 1024 / max(args.clients, 1), 2),
+    }
+
+
+def compare_with_baseline(result, baseline, tolerance):
+    """
+    与基线结果比较，返回回归项列表
+
+    延迟和丢弃率越低越好，吞吐越高越好。
+    """
+    regressions = []
+    for key in ('p50', 'p99'):
+        base = baseline['latency_ms'][key]
+        if base and result['latency_ms'][key] > base * (1 + tolerance):
+            regressions.append(f"延迟{key}: {base}ms -> {result['latency_ms'][key]}ms")
+    base_rate = baseline['messages_per_second']
+    if base_rate and result['messages_per_second'] < base_rate * (1 - tolerance):
+        regressions.append(f"吞吐: {base_rate}/s -> {result['messages_per_second']}/s")
+    if result['drop_rate'] > baseline['drop_rate'] + tolerance / 100:
+        regressions.append(f"丢弃率: {baseline['drop_rate']} -> {result['drop_rate']}")
+    return regressions
+
+
+def print_report(result):
+    """打印压测报告"""
+    config = result['config']
+    latency = result['latency_ms']
+    print("=== WebSocket网关压测结果 ===")
+    print(f"通道层: {config['layer']}  客户端: {config['clients']}  "
+          f"每客户端交易对: {config['symbols_per_client']}/{config['universe']}")
+    print(f"目标广播速率: {config['rate']}/s  持续: {config['duration']}s")
+    print(f"建立连接耗时: {result['connect_seconds']}s")
+    print(f"广播: {result['broadcasts']}  应投递: {result['expected_deliveries']}  "
+          f"实际投递: {result['delivered']}  丢弃: {result['dropped']} ({result['drop_rate']:.4%})")
+    print(f"投递吞吐: {result['messages_per_second']} msg/s")
+    print(f"延迟(ms): p50={latency['p50']} p90={latency['p90']} p99={latency['p99']} "
+          f"max={latency['max']} mean={latency['mean']}")
+    print(f"每连接内存: {result['memory_per_connection_kb']} KB")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='WebSocket行情网关压测')
+    parser.add_argument('--clients', type=int, default=100, help='模拟客户端数量')
+    parser.add_argument('--symbols', type=int, default=10, help='每个客户端订阅的交易对数量')
+    parser.add_argument('--universe', type=int, default=50, help='交易对总数')
+    parser.add_argument('--rate', type=float, default=200, help='每秒广播消息数')
+    parser.add_argument('--duration', type=float, default=5, help='广播持续时间（秒）')
+    parser.add_argument('--orderbook-ratio', type=float, default=0.2, help='订单簿消息占比')
+    parser.add_argument('--depth', type=int, default=10, help='订单簿档位数')
+    parser.add_argument('--layer', choices=['memory', 'redis'], default='memory', help='通道层类型')
+    parser.add_argument('--redis-url', default=os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+    parser.add_argument('--capacity', type=int, default=1000, help='每个频道的消息队列容量')
+    parser.add_argument('--connect-batch', type=int, default=50, help='并发建立连接的批大小')
+    parser.add_argument('--drain', type=float, default=1.0, help='广播结束后等待排空的时间（秒）')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子，保证结果可复现')
+    parser.add_argument('--output', help='将结果写入JSON文件')
+    parser.add_argument('--baseline', help='基线结果JSON文件，用于回归检测')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='回归容忍比例')
+    args = parser.parse_args(argv)
+    if args.symbols > args.universe:
+        parser.error('--symbols 不能大于 --universe')
+    return args
+
+
+def main(argv=None):
+    """主函数"""
+    args = parse_args(argv)
+    result = asyncio.run(run_benchmark(args))
+    print_report(result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(result, baseline, args.tolerance)
+        if regressions:
+            print("\n检测到性能回归:")
+            for item in regressions:
+                print(f"  - {item}")
+            return 1
+        print("\n未检测到性能回归")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())